@@ -1,13 +1,17 @@
 from .calc_image_cell_size import calc_image_cell_size
+from .calc_imaging_chunks import calc_imaging_chunks
 from .mosaic_rotate_uvw import mosaic_rotate_uvw
 
 from .make_grid import make_grid
 from .make_gridding_convolution_function import make_gridding_convolution_function
 from .make_image import make_image
+from .make_image_and_psf import make_image_and_psf
 from .make_imaging_weight import make_imaging_weight
 
 from .make_pb import make_pb
 from .make_psf import make_psf
+from .make_uv_index import make_uv_index
+from .update_grid import update_grid
 
 from .predict_modelvis_component import predict_modelvis_component
 from .predict_modelvis_image import predict_modelvis_image
@@ -0,0 +1,152 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+
+def _calc_bda_factors(uvw, freq_chan, grid_parms):
+    """
+    Calculates the time and frequency averaging factors (powers of 2) of every baseline of a chunk.
+    The uv track of a baseline moves at most (n_time_avg - 1) * uv_rate grid cells in a time bin and the channels of a frequency bin span
+    at most (n_chan_avg - 1) * max_chan_spacing * |uv| grid cells. The factors with the largest n_time_avg * n_chan_avg are chosen
+    for which the sum of the two spans is at most 2 * grid_parms['bda_tolerance'], so no visibility is moved by more than grid_parms['bda_tolerance'] grid cells.
+    Frequency averaging is only done if grid_parms['chan_mode'] is 'continuum'.
+
+    Parameters
+    ----------
+    uvw  : float array
+        (n_time, n_baseline, 3)
+    freq_chan : float array
+        (n_chan)
+
+    Returns
+    -------
+    n_time_avg : int array
+        (n_baseline)
+    n_chan_avg : int array
+        (n_baseline)
+    """
+    c = 299792458.0
+    n_time = uvw.shape[0]
+    n_baseline = uvw.shape[1]
+    n_chan = len(freq_chan)
+
+    #Grid cells per meter along u and v at the highest frequency.
+    cells_per_m = np.abs(grid_parms['cell'] * grid_parms['imsize_padded']) * np.max(freq_chan) / c
+
+    with np.errstate(invalid='ignore'):
+        if n_time > 1:
+            uv_rate = np.nan_to_num(np.nanmax(np.max(np.abs(np.diff(uvw[:, :, 0:2], axis=0)) * cells_per_m, axis=2), axis=0), nan=np.inf)
+        else:
+            uv_rate = np.zeros(n_baseline)
+        uv_length = np.nan_to_num(np.nanmax(np.max(np.abs(uvw[:, :, 0:2]) * cells_per_m, axis=2), axis=0)) / np.max(freq_chan)
+
+    if (grid_parms['chan_mode'] == 'continuum') and (n_chan > 1):
+        max_chan_spacing = np.max(np.abs(np.diff(freq_chan)))
+    else:
+        max_chan_spacing = np.inf
+
+    max_span = 2.0 * grid_parms['bda_tolerance']
+    time_factors = 2 ** np.arange(int(np.log2(max(n_time, 1))) + 1)
+    chan_factors = 2 ** np.arange(int(np.log2(max(n_chan, 1))) + 1)
+
+    n_time_avg = np.ones(n_baseline, dtype=int)
+    n_chan_avg = np.ones(n_baseline, dtype=int)
+    for time_factor in time_factors:
+        time_span = (time_factor - 1) * uv_rate
+        for chan_factor in chan_factors:
+            if chan_factor > 1:
+                chan_span = (chan_factor - 1) * max_chan_spacing * uv_length
+            else:
+                chan_span = np.zeros(n_baseline)
+            better = (time_span + chan_span <= max_span) & (time_factor * chan_factor > n_time_avg * n_chan_avg)
+            n_time_avg[better] = time_factor
+            n_chan_avg[better] = chan_factor
+
+    return n_time_avg, n_chan_avg
+
+
+def _bda_average(vis_data, uvw, weight, freq_chan, chan_map, n_time_avg, n_chan_avg, do_psf):
+    """
+    Averages the visibilities of a group of baselines in blocks of n_time_avg time samples and n_chan_avg channels.
+    The visibilities are weighted averages, the weights are summed, the uvw values are averaged and the frequencies are the mean frequency of each block.
+    Flagged (nan) visibilities and nan uvw values do not contribute.
+
+    Returns
+    -------
+    vis_data, uvw, weight, freq_chan, chan_map
+        The averaged arrays with (n_time/n_time_avg, n_baseline, n_chan/n_chan_avg, n_pol) visibilities.
+    """
+    n_time = uvw.shape[0]
+    n_chan = len(freq_chan)
+    time_starts = np.arange(0, n_time, n_time_avg)
+    chan_starts = np.arange(0, n_chan, n_chan_avg)
+
+    weight_dtype = weight.dtype
+    uvw_valid = ~np.isnan(uvw[:, :, 0])
+    if do_psf:
+        valid = uvw_valid[:, :, None, None] & ~np.isnan(weight)
+    else:
+        valid = uvw_valid[:, :, None, None] & ~np.isnan(vis_data) & ~np.isnan(weight)
+    weight = np.where(valid, weight, 0.0)
+
+    sum_weight = np.add.reduceat(np.add.reduceat(weight, time_starts, axis=0), chan_starts, axis=2)
+    if not do_psf:
+        weighted_vis = np.add.reduceat(np.add.reduceat(np.where(valid, vis_data, 0.0) * weight, time_starts, axis=0), chan_starts, axis=2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            vis_data = np.where(sum_weight != 0, weighted_vis / sum_weight, 0.0).astype(vis_data.dtype)
+
+    n_valid_uvw = np.add.reduceat(uvw_valid.astype(int), time_starts, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        uvw = np.add.reduceat(np.where(uvw_valid[:, :, None], uvw, 0.0), time_starts, axis=0) / n_valid_uvw[:, :, None]
+    uvw[n_valid_uvw == 0, :] = np.nan
+
+    freq_chan = np.add.reduceat(freq_chan, chan_starts) / np.diff(np.append(chan_starts, n_chan))
+    chan_map = chan_map[chan_starts]
+
+    return vis_data, uvw, sum_weight.astype(weight_dtype), freq_chan, chan_map
+
+
+def _baseline_dependent_average(vis_data, uvw, weight, freq_chan, chan_map, do_psf, grid_parms):
+    """
+    Baseline dependent averaging of a chunk of visibilities. The baselines are grouped by their averaging factors (see _calc_bda_factors)
+    and each group is averaged with _bda_average. Short baselines, which move slowly through the uv plane, are averaged the most.
+
+    Parameters
+    ----------
+    vis_data : complex array
+        (n_time, n_baseline, n_chan, n_pol) Not used if do_psf is True.
+    uvw  : float array
+        (n_time, n_baseline, 3)
+    weight : float array
+        (n_time, n_baseline, n_chan, n_pol)
+    freq_chan : float array
+        (n_chan)
+    chan_map : int array
+        (n_chan)
+
+    Returns
+    -------
+    list_of_vis_streams : list of tuple
+        (vis_data, uvw, weight, freq_chan, chan_map) of every baseline group, these can be passed directly to the gridders.
+    """
+    n_time_avg, n_chan_avg = _calc_bda_factors(uvw, freq_chan, grid_parms)
+
+    list_of_vis_streams = []
+    for factors in np.unique(np.stack([n_time_avg, n_chan_avg], axis=1), axis=0):
+        baselines = np.nonzero((n_time_avg == factors[0]) & (n_chan_avg == factors[1]))[0]
+        if do_psf:
+            group_vis_data = vis_data
+        else:
+            group_vis_data = vis_data[:, baselines, :, :]
+        list_of_vis_streams.append(_bda_average(group_vis_data, uvw[:, baselines, :], weight[:, baselines, :, :], freq_chan, chan_map, factors[0], factors[1], do_psf))
+    return list_of_vis_streams
@@ -0,0 +1,169 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+
+def _graph_batched_grid(vis_dataset, cgk_1D, grid_parms):
+    """
+      Builds the gridding graph for grid_parms['grid_accumulation'] = 'batched'.
+
+      Every grid_parms['n_chunks_per_task'] adjacent time chunks are merged into a batch (a rechunk along time) and each batch of every baseline and channel chunk
+      is gridded by one task of a single da.blockwise layer, so the graph is built without a Python loop over the chunks. The gridding convolutional kernel and
+      grid_parms are wrapped in dask.delayed once and all the gridding tasks depend on the same two keys. The grids are summed by a da.reduction over the
+      batch and baseline axes (and the channel chunks for continuum) that sums the blocks into new arrays, two per axis at a time.
+
+      Parameters
+      ----------
+      vis_dataset : xarray.core.dataset.Dataset
+      cgk_1D : float array
+          (oversampling*(support//2 + 1))
+      grid_parms : dictionary
+          As checked by _check_grid_params.
+
+      Returns
+      -------
+      list_of_grids_and_sum_weights : list of dask.array
+          [grid, sum_weight] as returned by _graph_standard_grid.
+      """
+    import dask
+    import dask.array as da
+    import operator
+    from ._standard_grid import _grid_dtype
+
+    weight = vis_dataset[grid_parms['imaging_weight_name']].data
+    time_chunks = weight.chunks[0]
+    n_chunks_per_task = grid_parms['n_chunks_per_task']
+    batch_time_chunks = tuple([int(np.sum(time_chunks[i:i + n_chunks_per_task])) for i in range(0, len(time_chunks), n_chunks_per_task)])
+
+    def batch(data):
+        return data.rechunk({0: batch_time_chunks})
+
+    freq_chan = da.from_array(vis_dataset.coords['chan'].values, chunks=(weight.chunks[2],))
+
+    if grid_parms['do_psf']:
+        vis_data_args = [None, None]
+    else:
+        vis_data_args = [batch(vis_dataset[grid_parms['data_name']].data), 'tbcp']
+    if grid_parms['uv_index_name'] != '':
+        uvw_args = [None, None]
+        uv_index_args = [batch(vis_dataset[grid_parms['uv_index_name']].data), 'tbcx',
+                         batch(vis_dataset[vis_dataset[grid_parms['uv_index_name']].attrs['uv_offset_name']].data), 'tbcx']
+    else:
+        uvw_args = [batch(vis_dataset[grid_parms['uvw_name']].data), 'tbw']
+        uv_index_args = [None, None, None, None]
+
+    n_img_pol = weight.shape[3]
+    if grid_parms['do_image_and_psf']:
+        n_img_pol = 2*n_img_pol #The psf is gridded as extra polarizations, see _append_psf_pols.
+    adjust_chunks = {'t': 1, 'b': 1, 'p': n_img_pol}
+    if grid_parms['chan_mode'] == 'continuum':
+        adjust_chunks['c'] = 1
+
+    if grid_parms['grid_layout'] == 'u_v_chan_pol':
+        grid_index = 'tbuvcp'
+        chan_axis = 4
+    else:
+        grid_index = 'tbcpuv'
+        chan_axis = 2
+    grid_dtype = _grid_dtype(grid_parms)
+
+    sub_grids_and_sum_weights = da.blockwise(_batched_grid_numpy_wrap, grid_index,
+                                             *vis_data_args, *uvw_args, batch(weight), 'tbcp', freq_chan, 'c',
+                                             dask.delayed(cgk_1D), None, dask.delayed(grid_parms), None, *uv_index_args,
+                                             new_axes={'u': grid_parms['imsize_padded'][0], 'v': grid_parms['imsize_padded'][1]},
+                                             adjust_chunks=adjust_chunks, concatenate=True, dtype=grid_dtype, meta=np.empty((0,)*6, dtype=grid_dtype))
+    #The sums of weights keep the u and v axes with length 1 (dropping them would make dask concatenate the (grid, sum_weight) tuples).
+    sum_weight_chunks = [(1,)*len(dim_chunks) if dim in 'uv' else dim_chunks for dim, dim_chunks in zip(grid_index, sub_grids_and_sum_weights.chunks)]
+    sub_grids = sub_grids_and_sum_weights.map_blocks(operator.getitem, 0, dtype=grid_dtype, meta=np.empty((0,)*6, dtype=grid_dtype))
+    sub_sum_weights = sub_grids_and_sum_weights.map_blocks(operator.getitem, 1, chunks=sum_weight_chunks, dtype=np.float64, meta=np.empty((0,)*6, dtype=np.float64))
+
+    grid = _sum_batches(sub_grids, (0, 1), 1, grid_dtype)
+    sum_weight = _sum_batches(sub_sum_weights, (0, 1), 1, np.float64)
+    if grid_parms['chan_mode'] == 'continuum':
+        #The continuum grids of the channel chunks are summed separately.
+        grid = _sum_batches(grid, (chan_axis,), 1, grid_dtype)
+        sum_weight = _sum_batches(sum_weight, (chan_axis,), 1, np.float64)
+    grid = grid[0, 0]
+    sum_weight = sum_weight[0, 0]
+
+    # Put axes in image orientation (see _graph_standard_grid).
+    if grid_parms['grid_layout'] == 'u_v_chan_pol':
+        sum_weight = sum_weight[0, 0]
+    else:
+        grid = da.moveaxis(grid, [0, 1], [-2, -1])
+        sum_weight = sum_weight[:, :, 0, 0]
+    sum_weight = da.moveaxis(sum_weight, [0, 1], [-2, -1])
+
+    return [grid, sum_weight]
+
+
+def _batched_grid_numpy_wrap(vis_data, uvw, weight, freq_chan, cgk_1D, grid_parms, uv_index=None, uv_offset=None):
+    """
+      Grids a batch of chunks with _standard_grid_numpy_wrap (or _standard_grid_psf_numpy_wrap if grid_parms['do_psf']).
+
+      Returns
+      -------
+      (grid, sum_weight) : tuple of complex array, float array
+          (1,1,n_imag_chan,n_imag_pol,n_u,n_v) and (1,1,n_imag_chan,n_imag_pol,1,1) or (1,1,n_u,n_v,n_imag_chan,n_imag_pol) and (1,1,1,1,n_imag_chan,n_imag_pol)
+          if grid_parms['grid_layout'] is 'u_v_chan_pol'.
+      """
+    from ._standard_grid import _standard_grid_numpy_wrap, _standard_grid_psf_numpy_wrap
+
+    if grid_parms['do_psf']:
+        grid, sum_weight = _standard_grid_psf_numpy_wrap(uvw, weight, freq_chan, cgk_1D, grid_parms, uv_index=uv_index, uv_offset=uv_offset)
+    else:
+        grid, sum_weight = _standard_grid_numpy_wrap(vis_data, uvw, weight, freq_chan, cgk_1D, grid_parms, uv_index=uv_index, uv_offset=uv_offset)
+    if grid_parms['grid_layout'] == 'u_v_chan_pol':
+        return grid[None, None], sum_weight[None, None, None, None]
+    return grid[None, None], sum_weight[None, None, :, :, None, None]
+
+
+def _sum_batches(sub_grids, sum_axes, output_size, dtype):
+    """
+      Sums the blocks of sub_grids along sum_axes (keeping them with length output_size) into new arrays, two per axis at a time.
+      """
+    import dask.array as da
+    return da.reduction(sub_grids, _identity_blocks, _sum_blocks, axis=sum_axes, keepdims=True, concatenate=False, output_size=output_size,
+                        split_every={axis: 2 for axis in sum_axes}, dtype=dtype, meta=np.empty((0,)*6, dtype=dtype))
+
+
+def _identity_blocks(block, axis=None, keepdims=None, computing_meta=False):
+    #The summed axes of the blocks already have length 1.
+    return block
+
+
+def _sum_blocks(blocks, axis=None, keepdims=None, computing_meta=False):
+    """
+      Sums the nested list of blocks that da.reduction(concatenate=False) gives to its combine and aggregate functions into a new array.
+      The blocks are not changed, dask can hold a block in its cache or give it to more than one task.
+      """
+    if not isinstance(blocks, list):
+        return blocks
+
+    list_of_blocks = []
+    list_to_flatten = [blocks]
+    while len(list_to_flatten) > 0:
+        item = list_to_flatten.pop()
+        if isinstance(item, list):
+            list_to_flatten.extend(item)
+        else:
+            list_of_blocks.append(item)
+
+    if len(list_of_blocks) == 1:
+        return list_of_blocks[0]
+
+    #Only the new array is added to in place.
+    sum_of_blocks = list_of_blocks[0] + list_of_blocks[1]
+    for block in list_of_blocks[2:]:
+        sum_of_blocks += block
+    return sum_of_blocks
@@ -0,0 +1,159 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+from numba import jit
+import numpy as np
+import math
+
+#When jit is used round is repolaced by standard c++ round that is different to python round
+@jit(nopython=True, cache=True, nogil=True)
+def _chan_group_grid_jit(grid, sum_weight, do_psf, vis_data, uvw, freq_chan, pol_map, weight, cgk_1D,
+                         n_uv, delta_lm, support, oversampling, chan_grouping_tolerance):
+    """
+      Continuum gridder that grids groups of adjacent channels as one sample. The uv position of a visibility scales with frequency,
+      so for every (time, baseline) consecutive channels are added to a group while the uv positions of the group span at most
+      2*chan_grouping_tolerance grid cells. The weighted visibilities and the weights of the group are summed and gridded once at the
+      uv position of the center frequency of the group, so no channel is moved by more than chan_grouping_tolerance grid cells.
+      Short baselines, where the channels land in the same cell, are gridded with few samples while long baselines keep more groups.
+
+      Parameters
+      ----------
+      grid : complex array
+          (1, n_pol, n_u, n_v)
+      sum_weight : float array
+          (1, n_pol)
+      vis_data : complex array
+          (n_time, n_baseline, n_vis_chan, n_pol)
+      uvw  : float array
+          (n_time, n_baseline, 3)
+      freq_chan : float array
+          (n_chan)
+      pol_map : int array
+          (n_pol)
+      weight : float array
+          (n_time, n_baseline, n_vis_chan, n_pol)
+      cgk_1D : float array
+          (oversampling*(support//2 + 1))
+      chan_grouping_tolerance : float
+          The largest uv displacement of a channel in grid cells.
+
+      Returns
+      -------
+      """
+    c = 299792458.0
+    uv_scale_u = -(delta_lm[0] * n_uv[0]) / c
+    uv_scale_v = -(delta_lm[1] * n_uv[1]) / c
+
+    support_center = int(support // 2)
+    uv_center = n_uv // 2
+    start_support = - support_center
+
+    n_time = uvw.shape[0]
+    n_baseline = uvw.shape[1]
+    n_chan = len(freq_chan)
+    n_pol = len(pol_map)
+
+    n_u = n_uv[0]
+    n_v = n_uv[1]
+
+    conv_u = np.zeros(support, dtype=np.double)
+    conv_v = np.zeros(support, dtype=np.double)
+    group_weighted_data = np.zeros(n_pol, dtype=grid.dtype)
+    group_weight = np.zeros(n_pol, dtype=np.double)
+
+    for i_time in range(n_time):
+        for i_baseline in range(n_baseline):
+            u_m = uvw[i_time, i_baseline, 0]
+            v_m = uvw[i_time, i_baseline, 1]
+
+            if np.isnan(u_m) or np.isnan(v_m):
+                continue
+
+            #Grid cells per Hz along the faster moving uv axis.
+            cells_per_hz = max(np.abs(u_m * uv_scale_u), np.abs(v_m * uv_scale_v))
+
+            i_chan = 0
+            while i_chan < n_chan:
+                #Find the group of channels that starts at i_chan.
+                freq_min = freq_chan[i_chan]
+                freq_max = freq_chan[i_chan]
+                end_chan = i_chan + 1
+                while end_chan < n_chan:
+                    new_freq_min = min(freq_min, freq_chan[end_chan])
+                    new_freq_max = max(freq_max, freq_chan[end_chan])
+                    if (new_freq_max - new_freq_min) * cells_per_hz > 2.0 * chan_grouping_tolerance:
+                        break
+                    freq_min = new_freq_min
+                    freq_max = new_freq_max
+                    end_chan = end_chan + 1
+
+                #Sum the weighted visibilities and weights of the group.
+                group_weighted_data[:] = 0
+                group_weight[:] = 0
+                n_valid = 0
+                for j_chan in range(i_chan, end_chan):
+                    for i_pol in range(n_pol):
+                        if do_psf:
+                            weighted_data = weight[i_time, i_baseline, j_chan, i_pol]
+                        else:
+                            weighted_data = vis_data[i_time, i_baseline, j_chan, i_pol] * weight[i_time, i_baseline, j_chan, i_pol]
+
+                        if ~np.isnan(weighted_data) and (weighted_data != 0.0):
+                            group_weighted_data[i_pol] = group_weighted_data[i_pol] + weighted_data
+                            group_weight[i_pol] = group_weight[i_pol] + weight[i_time, i_baseline, j_chan, i_pol]
+                            n_valid = n_valid + 1
+
+                group_freq = 0.5 * (freq_min + freq_max)
+                i_chan = end_chan
+
+                if n_valid == 0:
+                    continue
+
+                u_pos = u_m * uv_scale_u * group_freq + uv_center[0]
+                v_pos = v_m * uv_scale_v * group_freq + uv_center[1]
+
+                #Do not use numpy round
+                u_center_indx = int(u_pos + 0.5)
+                v_center_indx = int(v_pos + 0.5)
+
+                if (u_center_indx+support_center < n_u) and (v_center_indx+support_center < n_v) and (u_center_indx-support_center >= 0) and (v_center_indx-support_center >= 0):
+                    u_offset = u_center_indx - u_pos
+                    u_center_offset_indx = math.floor(u_offset * oversampling + 0.5)
+                    v_offset = v_center_indx - v_pos
+                    v_center_offset_indx = math.floor(v_offset * oversampling + 0.5)
+
+                    norm_u = 0.0
+                    norm_v = 0.0
+                    for i_support in range(support):
+                        conv_u[i_support] = cgk_1D[np.abs(oversampling * (i_support + start_support) + u_center_offset_indx)]
+                        conv_v[i_support] = cgk_1D[np.abs(oversampling * (i_support + start_support) + v_center_offset_indx)]
+                        norm_u = norm_u + conv_u[i_support]
+                        norm_v = norm_v + conv_v[i_support]
+                    norm = norm_u * norm_v
+
+                    u_start_indx = u_center_indx + start_support
+                    v_start_indx = v_center_indx + start_support
+
+                    for i_pol in range(n_pol):
+                        if group_weight[i_pol] != 0.0:
+                            a_pol = pol_map[i_pol]
+                            weighted_data = group_weighted_data[i_pol]
+                            for i_u in range(support):
+                                weighted_data_u = conv_u[i_u] * weighted_data
+                                grid_row = grid[0, a_pol, u_start_indx + i_u, v_start_indx:v_start_indx + support]
+                                for i_v in range(support):
+                                    grid_row[i_v] = grid_row[i_v] + conv_v[i_v] * weighted_data_u
+
+                            sum_weight[0, a_pol] = sum_weight[0, a_pol] + group_weight[i_pol] * norm
+
+    return
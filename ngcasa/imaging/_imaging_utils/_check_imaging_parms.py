@@ -15,7 +15,11 @@
 #ducting - code is complex and might fail after some time if parameters is wrong. Sensable values are also checked. Gives printout of all wrong parameters. Dirty images alone has 14 parameters.
 
 import numpy as np
+import os
 from ngcasa._ngcasa_utils._check_parms import _check_parms, _check_dataset, _check_storage_parms
+from ._fft import _fft_friendly_size
+from ._uv_index import _check_uv_index
+from ._grid_dataset import grid_attrs_names, _grid_attrs, _imaging_weighting
 
 def _check_grid_params(vis_dataset, grid_parms, default_image_name='DIRTY_IMAGE', default_sum_weight_name='SUM_WEIGHT'):
     import numbers
@@ -41,6 +45,10 @@ def _check_grid_params(vis_dataset, grid_parms, default_image_name='DIRTY_IMAGE'
     
     if not(_check_parms(grid_parms, 'sum_weight_name', [str], default=default_sum_weight_name)): parms_passed = False
     
+    if grid_parms.get('do_image_and_psf', False):
+        if not(_check_parms(grid_parms, 'psf_name', [str], default='PSF')): parms_passed = False
+        if not(_check_parms(grid_parms, 'psf_sum_weight_name', [str], default='PSF_SUM_WEIGHT')): parms_passed = False
+    
     if not(_check_parms(grid_parms, 'chan_mode', [str], acceptable_data=['cube','continuum'], default='cube')): parms_passed = False
     
     if not(_check_parms(grid_parms, 'imsize', [list], list_acceptable_data_types=[np.int], list_len=2)): parms_passed = False
@@ -53,9 +61,98 @@ def _check_grid_params(vis_dataset, grid_parms, default_image_name='DIRTY_IMAGE'
     
     if not(_check_parms(grid_parms, 'fft_padding', [numbers.Number], default=1.2,acceptable_range=[1,100])): parms_passed = False
     
+    if not(_check_parms(grid_parms, 'optimize_fft_size', [bool], default=False)): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'gcf_cache_dir', [str], default='')): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'gridder', [str], acceptable_data=['standard','tiled','parallel'], default='standard')): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'tile_size', [int], default=64, acceptable_range=[1,100000])): parms_passed = False
+    
+    #The parallel gridder grids a chunk with all the numba threads into the grid of its task, chained accumulation keeps that grid for the next chunk of the chain.
+    #A single chain keeps one grid in memory and does not run several chains, each using all the numba threads, at the same time.
+    if grid_parms.get('gridder') == 'parallel':
+        default_grid_accumulation = 'chained'
+        default_n_accumulators = 1
+    else:
+        default_grid_accumulation = 'tree'
+        default_n_accumulators = 4
+    if not(_check_parms(grid_parms, 'grid_accumulation', [str], acceptable_data=['tree','chained','bounding_box','batched','streaming'], default=default_grid_accumulation)): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'n_accumulators', [int], default=default_n_accumulators, acceptable_range=[1,100000])): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'n_chunks_per_task', [int], default=8, acceptable_range=[1,100000])): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'n_stream_threads', [int], default=os.cpu_count(), acceptable_range=[1,100000])): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'n_prefetch_chunks', [int], default=2, acceptable_range=[1,100000])): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'n_prefetch_threads', [int], default=2, acceptable_range=[1,100000])): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'precision', [str], acceptable_data=['double','single'], default='double')): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'grid_layout', [str], acceptable_data=['chan_pol_u_v','u_v_chan_pol'], default='chan_pol_u_v')): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'n_fft_slabs', [int], default=1, acceptable_range=[1,100000])): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'bda_tolerance', [numbers.Number], default=0.0, acceptable_range=[0,1])): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'chan_grouping_tolerance', [numbers.Number], default=0.0, acceptable_range=[0,1])): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'wterm', [str], acceptable_data=['none','wstacking','wprojection'], default='none')): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'n_wplanes', [int], default=16, acceptable_range=[1,100000])): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'w_max', [numbers.Number], default=0.0, acceptable_range=[0,1e15])): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'w_support', [int], default=31, acceptable_range=[1,100000])): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'w_oversampling', [int], default=8, acceptable_range=[1,100000])): parms_passed = False
+    
+    if parms_passed and (grid_parms['wterm'] == 'wprojection') and ((grid_parms['gridder'] != 'standard') or (grid_parms['grid_accumulation'] == 'bounding_box')):
+        print('######### ERROR: wterm wprojection is only supported with the standard gridder and tree, chained or batched grid accumulation.')
+        parms_passed = False
+    
+    if parms_passed and (grid_parms['grid_layout'] == 'u_v_chan_pol') and ((grid_parms['gridder'] != 'standard') or (grid_parms['grid_accumulation'] == 'bounding_box') or (grid_parms['wterm'] == 'wprojection')):
+        print('######### ERROR: grid_layout u_v_chan_pol is only supported with the standard gridder, tree, chained or batched grid accumulation and wterm none or wstacking.')
+        parms_passed = False
+    
+    if parms_passed and (grid_parms['chan_grouping_tolerance'] > 0) and (grid_parms['chan_mode'] == 'continuum') and ((grid_parms['gridder'] != 'standard') or (grid_parms['grid_accumulation'] == 'bounding_box') or (grid_parms['wterm'] == 'wprojection') or (grid_parms['grid_layout'] != 'chan_pol_u_v')):
+        print('######### ERROR: chan_grouping_tolerance is only supported with the standard gridder, tree, chained or batched grid accumulation, wterm none or wstacking and grid_layout chan_pol_u_v.')
+        parms_passed = False
+    
+    if parms_passed and (grid_parms['bda_tolerance'] > 0) and (grid_parms['grid_accumulation'] == 'bounding_box'):
+        print('######### ERROR: bda_tolerance is not supported with bounding_box grid accumulation.')
+        parms_passed = False
+    
+    if parms_passed and (grid_parms['n_fft_slabs'] > 1) and ((grid_parms['grid_accumulation'] != 'tree') or (grid_parms['grid_layout'] != 'chan_pol_u_v') or (grid_parms['wterm'] != 'none') or (grid_parms['chan_grouping_tolerance'] > 0)):
+        print('######### ERROR: n_fft_slabs > 1 is only supported with tree grid accumulation, grid_layout chan_pol_u_v, wterm none and no chan_grouping_tolerance.')
+        parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'uv_index_name', [str], default='')): parms_passed = False
+    
+    if parms_passed and (grid_parms['uv_index_name'] != '') and ((grid_parms['gridder'] != 'standard') or (grid_parms['grid_accumulation'] == 'bounding_box') or (grid_parms['grid_layout'] != 'chan_pol_u_v') or (grid_parms['wterm'] != 'none') or (grid_parms['chan_grouping_tolerance'] > 0) or (grid_parms['bda_tolerance'] > 0) or (grid_parms['n_fft_slabs'] > 1)):
+        print('######### ERROR: uv_index_name is only supported with the standard gridder, tree, chained or batched grid accumulation, grid_layout chan_pol_u_v, wterm none, no chan_grouping_tolerance, no bda_tolerance and n_fft_slabs 1.')
+        parms_passed = False
+    
+    if parms_passed and (grid_parms['grid_accumulation'] == 'streaming') and ((grid_parms['grid_layout'] != 'chan_pol_u_v') or (grid_parms['wterm'] != 'none') or (grid_parms['chan_grouping_tolerance'] > 0) or (grid_parms['uv_index_name'] != '')):
+        print('######### ERROR: streaming grid accumulation is only supported with grid_layout chan_pol_u_v, wterm none, no chan_grouping_tolerance and no uv_index_name.')
+        parms_passed = False
+    
+    if parms_passed and (grid_parms['gridder'] == 'parallel') and (grid_parms['grid_accumulation'] not in ['chained','streaming']):
+        print('######### ERROR: the parallel gridder is only supported with chained or streaming grid accumulation.')
+        parms_passed = False
+    
+    if parms_passed and (grid_parms['gridder'] == 'parallel') and (grid_parms['tile_size'] < grid_parms['support'] - 1):
+        print('######### ERROR: tile_size must be at least support - 1 when the parallel gridder is used.')
+        parms_passed = False
+    
     if parms_passed == True:
         grid_parms['imsize'] = np.array(grid_parms['imsize']).astype(int)
-        grid_parms['imsize_padded'] = (grid_parms['fft_padding']* grid_parms['imsize']).astype(int)
+        grid_parms['imsize_padded'] = _calc_imsize_padded(grid_parms)
+        
+        if (grid_parms['uv_index_name'] != '') and not(_check_uv_index(vis_dataset, grid_parms['uv_index_name'], grid_parms['uvw_name'], grid_parms['cell'], grid_parms['imsize_padded'], grid_parms['oversampling'], [grid_parms['data_name'], grid_parms['imaging_weight_name']])):
+            return False
 
         grid_parms['cell'] = arc_sec_to_rad * np.array(grid_parms['cell'])
         grid_parms['cell'][0] = -grid_parms['cell'][0]
@@ -64,6 +161,176 @@ def _check_grid_params(vis_dataset, grid_parms, default_image_name='DIRTY_IMAGE'
     
     return parms_passed
 
+#########################################################################################################################################################################################
+def _check_make_grid_parms(vis_dataset, grid_parms):
+    parms_passed = True
+    
+    if not(_check_parms(grid_parms, 'grid_name', [str], default='GRID')): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'gridded_time_name', [str], default='GRIDDED_TIME')): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'gridded_baseline_name', [str], default='GRIDDED_BASELINE')): parms_passed = False
+    
+    cell = grid_parms.get('cell') #In arcseconds, _check_grid_params converts it to radians.
+    if not(_check_grid_params(vis_dataset, grid_parms)): parms_passed = False
+    
+    if parms_passed and (grid_parms['wterm'] != 'none'):
+        print('######### ERROR: make_grid and update_grid only support wterm none.')
+        parms_passed = False
+    
+    if parms_passed == True:
+        grid_parms['grid_attrs'] = _grid_attrs(grid_parms, cell)
+        grid_parms['grid_attrs']['weighting'] = _imaging_weighting(vis_dataset, grid_parms)
+    
+    return parms_passed
+
+#########################################################################################################################################################################################
+def _check_update_grid_parms(grid_dataset, vis_dataset, grid_parms):
+    parms_passed = True
+    
+    if not(_check_parms(grid_parms, 'grid_name', [str], default='GRID')): parms_passed = False
+    if not(_check_dataset(grid_dataset,grid_parms['grid_name'])): return False
+    
+    grid_attrs = grid_dataset[grid_parms['grid_name']].attrs
+    if not all([name in grid_attrs for name in grid_attrs_names]):
+        print('######### ERROR:', grid_parms['grid_name'], 'is not a grid made by make_grid.')
+        return False
+    
+    #The new visibilities are gridded with the grid_parms the grid was made with.
+    for name in grid_attrs_names:
+        if name == 'imsize_padded':
+            continue
+        if (name in grid_parms) and not(np.array_equal(np.array(grid_parms[name]), np.array(grid_attrs[name]))):
+            print('######### ERROR: grid_parms[\'' + name + '\'] is', grid_parms[name], 'but', grid_parms['grid_name'], 'was made with', grid_attrs[name])
+            parms_passed = False
+        grid_parms[name] = grid_attrs[name]
+    
+    if not(parms_passed) or not(_check_make_grid_parms(vis_dataset, grid_parms)):
+        return False
+    
+    if not(_check_dataset(grid_dataset,grid_parms['sum_weight_name'])): parms_passed = False
+    if not(_check_dataset(grid_dataset,grid_parms['gridded_time_name'])): parms_passed = False
+    if not(_check_dataset(grid_dataset,grid_parms['gridded_baseline_name'])): return False
+    
+    #Only the visibilities of the times that are not gridded yet are gridded, so all the times have to be gridded for the same baselines.
+    if not(np.array_equal(vis_dataset.coords['baseline'].values, grid_dataset[grid_parms['gridded_baseline_name']].values)):
+        print('######### ERROR: the baselines of the vis_dataset are not the gridded baselines of', grid_parms['grid_name'] + ', update_grid only adds new times of the same baselines.')
+        parms_passed = False
+    
+    #Weights that depend on the density of all the visibilities would have to be remade for the gridded visibilities as well.
+    for weighting_name, weighting in [(grid_parms['grid_name'], grid_attrs.get('weighting', 'natural')), (grid_parms['imaging_weight_name'], _imaging_weighting(vis_dataset, grid_parms))]:
+        if weighting != 'natural':
+            print('######### ERROR: update_grid only supports natural imaging weights,', weighting_name, 'has', weighting, 'weighting. Remake the imaging weights of all the times and use make_grid.')
+            parms_passed = False
+    
+    if list(grid_parms['imsize_padded']) != list(grid_attrs['imsize_padded']):
+        print('######### ERROR: the padded image size', list(grid_parms['imsize_padded']), 'is not the size of', grid_parms['grid_name'], list(grid_attrs['imsize_padded']))
+        parms_passed = False
+    
+    if (grid_parms['chan_mode'] == 'cube') and not(np.array_equal(vis_dataset.coords['chan'].values, grid_dataset.coords['chan'].values)):
+        print('######### ERROR: the channels of the vis_dataset are not the channels of', grid_parms['grid_name'])
+        parms_passed = False
+    
+    if vis_dataset[grid_parms['data_name']].shape[3] != grid_dataset[grid_parms['grid_name']].shape[3]:
+        print('######### ERROR: the number of polarizations of the vis_dataset is not that of', grid_parms['grid_name'])
+        parms_passed = False
+    
+    return parms_passed
+
+#########################################################################################################################################################################################
+def _check_degrid_parms(vis_dataset, img_dataset, grid_parms):
+    import numbers
+    parms_passed = True
+    arc_sec_to_rad = np.pi / (3600 * 180)
+    
+    if not(_check_parms(grid_parms, 'data_name', [str], default='DATA')): parms_passed = False
+    if not(_check_dataset(vis_dataset,grid_parms['data_name'])): parms_passed = False
+    
+    if parms_passed and (vis_dataset[grid_parms['data_name']].data.numblocks[3] != 1):
+        print('######### ERROR chunking along polarization is not supported')
+        return False
+    
+    if not(_check_parms(grid_parms, 'uvw_name', [str], default='UVW')): parms_passed = False
+    if not(_check_dataset(vis_dataset,grid_parms['uvw_name'])): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'model_image_name', [str], default='MODEL_IMAGE')): parms_passed = False
+    if not(_check_dataset(img_dataset,grid_parms['model_image_name'])): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'model_data_name', [str], default='MODEL')): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'incremental', [bool], default=False)): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'chan_mode', [str], acceptable_data=['cube','continuum'], default='cube')): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'cell', [list], list_acceptable_data_types=[numbers.Number], list_len=2)): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'oversampling', [np.int], default=100)): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'support', [np.int], default=7)): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'fft_padding', [numbers.Number], default=1.2,acceptable_range=[1,100])): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'optimize_fft_size', [bool], default=False)): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'gcf_cache_dir', [str], default='')): parms_passed = False
+    
+    if not(_check_parms(grid_parms, 'uv_index_name', [str], default='')): parms_passed = False
+    
+    if parms_passed and (grid_parms['chan_mode'] == 'continuum') and (img_dataset[grid_parms['model_image_name']].shape[2] != 1):
+        print('######### ERROR: the model image must have a single channel when chan_mode is continuum.')
+        parms_passed = False
+        
+    if parms_passed and (grid_parms['chan_mode'] == 'cube') and (img_dataset[grid_parms['model_image_name']].shape[2] != vis_dataset[grid_parms['data_name']].shape[2]):
+        print('######### ERROR: the model image must have the same number of channels as the visibility data when chan_mode is cube.')
+        parms_passed = False
+    
+    if parms_passed == True:
+        grid_parms['imsize'] = np.array(img_dataset[grid_parms['model_image_name']].shape[0:2]).astype(int)
+        grid_parms['imsize_padded'] = _calc_imsize_padded(grid_parms)
+        
+        if (grid_parms['uv_index_name'] != '') and not(_check_uv_index(vis_dataset, grid_parms['uv_index_name'], grid_parms['uvw_name'], grid_parms['cell'], grid_parms['imsize_padded'], grid_parms['oversampling'], [grid_parms['data_name']])):
+            return False
+
+        grid_parms['cell'] = arc_sec_to_rad * np.array(grid_parms['cell'])
+        grid_parms['cell'][0] = -grid_parms['cell'][0]
+    
+    return parms_passed
+
+#########################################################################################################################################################################################
+def _check_gcf_parms(gcf_parms):
+    import numbers
+    parms_passed = True
+    
+    if not(_check_parms(gcf_parms, 'function', [str], acceptable_data=['prolate_spheroidal'], default='prolate_spheroidal')): parms_passed = False
+    
+    if not(_check_parms(gcf_parms, 'imsize', [list], list_acceptable_data_types=[np.int], list_len=2)): parms_passed = False
+    
+    if not(_check_parms(gcf_parms, 'oversampling', [np.int], default=100)): parms_passed = False
+    
+    if not(_check_parms(gcf_parms, 'support', [np.int], default=7)): parms_passed = False
+    
+    if not(_check_parms(gcf_parms, 'fft_padding', [numbers.Number], default=1.2,acceptable_range=[1,100])): parms_passed = False
+    
+    if not(_check_parms(gcf_parms, 'optimize_fft_size', [bool], default=False)): parms_passed = False
+    
+    if not(_check_parms(gcf_parms, 'gcf_cache_dir', [str], default='')): parms_passed = False
+    
+    if parms_passed == True:
+        gcf_parms['imsize'] = np.array(gcf_parms['imsize']).astype(int)
+        gcf_parms['imsize_padded'] = _calc_imsize_padded(gcf_parms)
+    
+    return parms_passed
+
+#########################################################################################################################################################################################
+def _calc_imsize_padded(parms):
+    """
+      The padded image size fft_padding x imsize. If parms['optimize_fft_size'] is True it is rounded up to the next even size that only has the prime factors 2, 3 and 5 (see _fft_friendly_size).
+      """
+    imsize_padded = (parms['fft_padding']* parms['imsize']).astype(int)
+    if parms['optimize_fft_size']:
+        imsize_padded = np.array([_fft_friendly_size(n) for n in imsize_padded])
+    return imsize_padded
+
 #########################################################################################################################################################################################
 def _check_imaging_weights_parms(vis_dataset, imaging_weights_parms):
     import numbers
@@ -78,26 +345,130 @@ def _check_imaging_weights_parms(vis_dataset, imaging_weights_parms):
     
     if not(_check_parms(imaging_weights_parms, 'imaging_weight_name', [str], default='IMAGING_WEIGHT')): parms_passed = False
 
-    if not(_check_parms(imaging_weights_parms, 'weighting', [str], acceptable_data=['natural','uniform','briggs','briggs_abs'], default='natural')): parms_passed = False
+    if not(_check_parms(imaging_weights_parms, 'weighting', [str], acceptable_data=['natural','uniform','briggs','briggs_abs','superuniform'], default='natural')): parms_passed = False
     
     if imaging_weights_parms['weighting'] == 'briggs_abs':
         if not(_check_parms(imaging_weights_parms, 'briggs_abs_noise', [numbers.Number], default=1.0)): parms_passed = False
 
     if not(_check_parms(imaging_weights_parms, 'robust', [numbers.Number], default=0.5, acceptable_range=[-2,2])): parms_passed = False
     
+    if imaging_weights_parms['weighting'] == 'superuniform':
+        if not(_check_parms(imaging_weights_parms, 'npixels', [int], default=3, acceptable_range=[0,100000])): parms_passed = False
+    
+    if not(_check_parms(imaging_weights_parms, 'uvtaper', [list], list_acceptable_data_types=[numbers.Number], list_len=-1, default=[])): parms_passed = False
+    elif (len(imaging_weights_parms['uvtaper']) > 3) or ((len(imaging_weights_parms['uvtaper']) > 0) and (min(imaging_weights_parms['uvtaper'][0:2]) <= 0)):
+        print('######### ERROR: Invalid uvtaper. Must be [], [bmaj], [bmaj, bmin] or [bmaj, bmin, bpa] with bmaj and bmin larger than 0.')
+        parms_passed = False
+    
     if imaging_weights_parms['weighting'] != 'natural':
         if not(_check_parms(imaging_weights_parms, 'chan_mode', [str], acceptable_data=['cube','continuum'], default='cube')): parms_passed = False
         if not(_check_parms(imaging_weights_parms, 'imsize', [list], list_acceptable_data_types=[int,np.int64], list_len=2)): parms_passed = False
         if not(_check_parms(imaging_weights_parms, 'cell', [list], list_acceptable_data_types=[numbers.Number], list_len=2)): parms_passed = False
+        if not(_check_parms(imaging_weights_parms, 'uv_index_name', [str], default='')): parms_passed = False
+        if not(_check_parms(imaging_weights_parms, 'n_accumulators', [int], default=4, acceptable_range=[1,100000])): parms_passed = False
 
-    if parms_passed == True:
+    if (parms_passed == True) and (imaging_weights_parms['weighting'] != 'natural'):
         imaging_weights_parms['imsize'] = np.array(imaging_weights_parms['imsize']).astype(int)
+        
+        #The weight density grid is not padded and only the uv cells are used (oversampling 0).
+        if (imaging_weights_parms['uv_index_name'] != '') and not(_check_uv_index(vis_dataset, imaging_weights_parms['uv_index_name'], imaging_weights_parms['uvw_name'], imaging_weights_parms['cell'], imaging_weights_parms['imsize'], 0, [imaging_weights_parms['data_name']])):
+            return False
 
         imaging_weights_parms['cell'] = arc_sec_to_rad * np.array(imaging_weights_parms['cell'])
         imaging_weights_parms['cell'][0] = -imaging_weights_parms['cell'][0]
         
     return parms_passed
 
+#########################################################################################################################################################################################
+def _check_uv_index_parms(vis_dataset, uv_index_parms):
+    import numbers
+    parms_passed = True
+    arc_sec_to_rad = np.pi / (3600 * 180)
+    
+    if not(_check_parms(uv_index_parms, 'data_name', [str], default='DATA')): parms_passed = False
+    if not(_check_dataset(vis_dataset,uv_index_parms['data_name'])): parms_passed = False
+    
+    if not(_check_parms(uv_index_parms, 'uvw_name', [str], default='UVW')): parms_passed = False
+    if not(_check_dataset(vis_dataset,uv_index_parms['uvw_name'])): parms_passed = False
+    
+    if not(_check_parms(uv_index_parms, 'uv_index_name', [str], default='UV_INDEX')): parms_passed = False
+    
+    if not(_check_parms(uv_index_parms, 'uv_offset_name', [str], default='UV_OFFSET')): parms_passed = False
+    
+    if not(_check_parms(uv_index_parms, 'imsize', [list], list_acceptable_data_types=[np.int], list_len=2)): parms_passed = False
+    
+    if not(_check_parms(uv_index_parms, 'cell', [list], list_acceptable_data_types=[numbers.Number], list_len=2)): parms_passed = False
+    
+    #The kernel offsets are stored as int16.
+    if not(_check_parms(uv_index_parms, 'oversampling', [np.int], default=100, acceptable_range=[0,32767])): parms_passed = False
+    
+    if not(_check_parms(uv_index_parms, 'fft_padding', [numbers.Number], default=1.2,acceptable_range=[1,100])): parms_passed = False
+    
+    if not(_check_parms(uv_index_parms, 'optimize_fft_size', [bool], default=False)): parms_passed = False
+    
+    if parms_passed == True:
+        uv_index_parms['imsize'] = np.array(uv_index_parms['imsize']).astype(int)
+        uv_index_parms['imsize_padded'] = _calc_imsize_padded(uv_index_parms)
+        
+        uv_index_parms['cell'] = arc_sec_to_rad * np.array(uv_index_parms['cell'])
+        uv_index_parms['cell'][0] = -uv_index_parms['cell'][0]
+    
+    return parms_passed
+
+#########################################################################################################################################################################################
+def _check_imaging_chunks_parms(vis_dataset, chunk_parms):
+    import numbers
+    from ._imaging_chunks import _worker_resources
+    parms_passed = True
+    
+    n_workers, n_threads_per_worker, worker_memory = _worker_resources()
+    
+    if not(_check_parms(chunk_parms, 'data_name', [str], default='DATA')): parms_passed = False
+    if not(_check_dataset(vis_dataset,chunk_parms['data_name'])): parms_passed = False
+    
+    if not(_check_parms(chunk_parms, 'uvw_name', [str], default='UVW')): parms_passed = False
+    if not(_check_dataset(vis_dataset,chunk_parms['uvw_name'])): parms_passed = False
+    
+    if not(_check_parms(chunk_parms, 'imaging_weight_name', [str], default='IMAGING_WEIGHT')): parms_passed = False
+    
+    if not(_check_parms(chunk_parms, 'imsize', [list], list_acceptable_data_types=[np.int], list_len=2)): parms_passed = False
+    
+    if not(_check_parms(chunk_parms, 'chan_mode', [str], acceptable_data=['cube','continuum'], default='cube')): parms_passed = False
+    
+    if not(_check_parms(chunk_parms, 'fft_padding', [numbers.Number], default=1.2,acceptable_range=[1,100])): parms_passed = False
+    
+    if not(_check_parms(chunk_parms, 'optimize_fft_size', [bool], default=False)): parms_passed = False
+    
+    if not(_check_parms(chunk_parms, 'precision', [str], acceptable_data=['double','single'], default='double')): parms_passed = False
+    
+    if not(_check_parms(chunk_parms, 'n_fft_slabs', [int], default=1, acceptable_range=[1,100000])): parms_passed = False
+    
+    if not(_check_parms(chunk_parms, 'grid_accumulation', [str], acceptable_data=['tree','chained','batched'], default='tree')): parms_passed = False
+    
+    if not(_check_parms(chunk_parms, 'n_accumulators', [int], default=4, acceptable_range=[1,100000])): parms_passed = False
+    
+    if not(_check_parms(chunk_parms, 'n_chunks_per_task', [int], default=8, acceptable_range=[1,100000])): parms_passed = False
+    
+    if not(_check_parms(chunk_parms, 'n_workers', [int], default=n_workers, acceptable_range=[1,1000000])): parms_passed = False
+    
+    if not(_check_parms(chunk_parms, 'n_threads_per_worker', [int], default=n_threads_per_worker, acceptable_range=[1,100000])): parms_passed = False
+    
+    if not(_check_parms(chunk_parms, 'worker_memory', [numbers.Number], default=worker_memory, acceptable_range=[1,np.inf])): parms_passed = False
+    
+    if not(_check_parms(chunk_parms, 'memory_fraction', [numbers.Number], default=0.5, acceptable_range=[0.01,1])): parms_passed = False
+    
+    if not(_check_parms(chunk_parms, 'target_chunk_memory', [numbers.Number], default=128e6, acceptable_range=[1,np.inf])): parms_passed = False
+    
+    if not(_check_parms(chunk_parms, 'max_tasks', [int], default=100000, acceptable_range=[1,np.inf])): parms_passed = False
+    
+    if not(_check_parms(chunk_parms, 'rechunk', [bool], default=False)): parms_passed = False
+    
+    if parms_passed == True:
+        chunk_parms['imsize'] = np.array(chunk_parms['imsize']).astype(int)
+        chunk_parms['imsize_padded'] = _calc_imsize_padded(chunk_parms)
+    
+    return parms_passed
+
 #########################################################################################################################################################################################
 def _check_pb_parms(img_dataset, pb_parms):
     import numbers
@@ -0,0 +1,109 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+
+def _fft_friendly_size(n):
+    """
+      The smallest even size that is at least n and has no prime factors other than 2, 3 and 5. The ffts of these sizes are the fastest.
+      """
+    n_friendly = max(int(n) + (int(n) % 2), 2)
+    while True:
+        m = n_friendly
+        for prime in (2, 3, 5):
+            while m % prime == 0:
+                m = m // prime
+        if m == 1:
+            return n_friendly
+        n_friendly = n_friendly + 2
+
+
+def _ifft_function(grid_parms):
+    """
+      The 1D and 2D inverse ffts for grid_parms['precision']. numpy.fft always computes in double precision, scipy.fft keeps single precision.
+      """
+    if grid_parms['precision'] == 'single':
+        import scipy.fft
+        return scipy.fft.ifft, scipy.fft.ifft2
+    else:
+        return np.fft.ifft, np.fft.ifft2
+
+
+def _shifted_ifft_axis(block, axis, ifft):
+    """
+      fftshift(ifft(ifftshift(block))) along one axis of a block that is not chunked along that axis.
+      """
+    return np.fft.fftshift(ifft(np.fft.ifftshift(block, axes=axis), axis=axis), axes=axis)
+
+
+def _cropped_shifted_ifft2(block, imsize, ifft2):
+    """
+      fftshift(ifft2(ifftshift(block))) over the first two axes, only the central imsize pixels (as kept by _remove_padding) are returned.
+      """
+    n_uv = np.array(block.shape[0:2])
+    start = n_uv // 2 - np.array(imsize) // 2
+    image = np.fft.fftshift(ifft2(np.fft.ifftshift(block, axes=(0, 1)), axes=(0, 1)), axes=(0, 1))
+    return image[start[0]:start[0] + imsize[0], start[1]:start[1] + imsize[1]]
+
+
+def _ifft2_shifted(grid, grid_parms, imsize=None):
+    """
+      Calculates fftshift(ifft2(ifftshift(grid))) over the u and v axes of a grid.
+
+      If grid_parms['n_fft_slabs'] is 1 the grid must not be chunked along u and v and dask.array.fft is used.
+      Otherwise a slab decomposed fft is done so that no task holds a full (u, v) plane: the grid is chunked in u-slabs (as created by
+      _graph_standard_grid), the 1D ffts along v are done slab by slab, the array is rechunked into v-slabs (a distributed transpose) and
+      the 1D ffts along u are done slab by slab. The ifftshift and fftshift along an axis only reorder the other axis' 1D ffts, so they are done in the same passes.
+
+      If imsize is given only the central imsize pixels of the image are returned (the same pixels that _remove_padding keeps). With one fft slab the full
+      padded image is computed and cropped in the same task. With fft slabs the v columns are cropped before the transpose, so less data is moved.
+
+      Parameters
+      ----------
+      grid : complex dask array
+          (n_u, n_v, n_chan, n_pol)
+      imsize : int array, default = None
+          (2)
+
+      Returns
+      -------
+      image : complex dask array
+          (n_u, n_v, n_chan, n_pol) or (imsize[0], imsize[1], n_chan, n_pol). Chunked in v-slabs if grid_parms['n_fft_slabs'] > 1.
+      """
+    import dask.array as da
+    import dask.array.fft as dafft
+
+    ifft, ifft2 = _ifft_function(grid_parms)
+
+    n_u, n_v = grid.shape[0:2]
+    image_dtype = np.result_type(grid.dtype, np.complex64) #The psf grids are real.
+
+    if grid_parms['n_fft_slabs'] == 1:
+        if imsize is None:
+            return dafft.fftshift(dafft.fft_wrap(ifft2)(dafft.ifftshift(grid, axes=(0, 1)), axes=(0, 1)), axes=(0, 1))
+        grid = grid.rechunk({0: n_u, 1: n_v})
+        return da.map_blocks(_cropped_shifted_ifft2, grid, tuple(imsize), ifft2, chunks=((imsize[0],), (imsize[1],)) + grid.chunks[2:], dtype=image_dtype)
+
+    v_slab_size = int(np.ceil(n_v / grid_parms['n_fft_slabs']))
+
+    grid = grid.rechunk({1: n_v})
+    grid = da.map_blocks(_shifted_ifft_axis, grid, 1, ifft, dtype=image_dtype)
+    if imsize is not None:
+        start = np.array([n_u, n_v]) // 2 - np.array(imsize) // 2
+        grid = grid[:, start[1]:start[1] + imsize[1]]
+        v_slab_size = int(np.ceil(imsize[1] / grid_parms['n_fft_slabs']))
+    grid = grid.rechunk({0: n_u, 1: v_slab_size})
+    image = da.map_blocks(_shifted_ifft_axis, grid, 0, ifft, dtype=image_dtype)
+    if imsize is not None:
+        image = image[start[0]:start[0] + imsize[0]]
+    return image
@@ -0,0 +1,102 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+#Cache of gridding convolution functions (GCF). A cf_dataset is identified by (function, oversampling, support, imsize_padded)
+#and is looked up in memory (least recently used entries are evicted), then on disk (zarr) and is only created if neither has it.
+
+import numpy as np
+from collections import OrderedDict
+
+_gcf_memory_cache = OrderedDict()
+_gcf_memory_cache_size = 4 #The correction images can be large so only a few are kept in memory.
+
+
+def _gcf_cache_key(function, oversampling, support, imsize_padded):
+    return '%s_os%d_sp%d_%dx%d' % (function, oversampling, support, imsize_padded[0], imsize_padded[1])
+
+
+def _create_gcf(function, oversampling, support, imsize_padded):
+    """
+    Creates a cf_dataset.
+
+    Returns
+    -------
+    cf_dataset : xarray.core.dataset.Dataset
+        Contains CGK_1D (the positive half of the oversampled 1D gridding kernel) and CORRECTING_CGK (the gridding correction image, dimensions d0 x d1 of the padded image).
+    """
+    import xarray as xr
+    from ._gridding_convolutional_kernels import _create_prolate_spheroidal_kernel_1D, _create_prolate_spheroidal_kernel_image
+
+    if function == 'prolate_spheroidal':
+        cgk_1D = _create_prolate_spheroidal_kernel_1D(oversampling, support)
+        correcting_cgk_image = _create_prolate_spheroidal_kernel_image(imsize_padded)
+
+    cf_dataset = xr.Dataset({'CGK_1D': xr.DataArray(cgk_1D, dims=['cgk_indx']),
+                             'CORRECTING_CGK': xr.DataArray(correcting_cgk_image, dims=['d0', 'd1'])})
+    cf_dataset.attrs['function'] = function
+    cf_dataset.attrs['oversampling'] = int(oversampling)
+    cf_dataset.attrs['support'] = int(support)
+    cf_dataset.attrs['imsize_padded'] = [int(imsize_padded[0]), int(imsize_padded[1])]
+    return cf_dataset
+
+
+def _get_gcf(function, oversampling, support, imsize_padded, cache_dir=''):
+    """
+    Returns the cf_dataset for the given parameters from the memory cache, the disk cache in cache_dir (if cache_dir is not '') or creates it.
+    New cf_datasets are added to the memory cache and to the disk cache.
+
+    Parameters
+    ----------
+    function : {'prolate_spheroidal'}
+    oversampling : int
+    support : int
+    imsize_padded : int array
+        (2)
+    cache_dir : str, default = ''
+        Directory of the zarr disk cache. If '' only the memory cache is used.
+
+    Returns
+    -------
+    cf_dataset : xarray.core.dataset.Dataset
+        See _create_gcf. The data variables are numpy arrays and must not be modified.
+    """
+    import os
+    import xarray as xr
+
+    key = _gcf_cache_key(function, oversampling, support, imsize_padded)
+
+    if key in _gcf_memory_cache:
+        _gcf_memory_cache.move_to_end(key)
+        return _gcf_memory_cache[key]
+
+    cf_dataset = None
+    if cache_dir != '':
+        cache_file = os.path.join(cache_dir, key + '.gcf.zarr')
+        if os.path.exists(cache_file):
+            try:
+                cf_dataset = xr.open_zarr(cache_file).load()
+            except Exception:
+                print('######### WARNING: could not read the gridding convolution function cache', cache_file, ', it will be recreated.')
+
+    if cf_dataset is None:
+        cf_dataset = _create_gcf(function, oversampling, support, imsize_padded)
+        if cache_dir != '':
+            os.makedirs(cache_dir, exist_ok=True)
+            cf_dataset.to_zarr(cache_file, mode='w')
+
+    _gcf_memory_cache[key] = cf_dataset
+    while len(_gcf_memory_cache) > _gcf_memory_cache_size:
+        _gcf_memory_cache.popitem(last=False)
+
+    return cf_dataset
@@ -0,0 +1,122 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+
+#The grid_parms that determine the cells, kernel and channels of a grid made by make_grid, update_grid grids the new visibilities with the same values.
+grid_attrs_names = ['imsize', 'cell', 'chan_mode', 'oversampling', 'support', 'fft_padding', 'optimize_fft_size', 'precision', 'imsize_padded',
+                    'sum_weight_name', 'image_name', 'gridded_time_name', 'gridded_baseline_name']
+
+def _grid_attrs(grid_parms, cell):
+    """
+      Returns the grid_parms of grid_attrs_names as zarr (json) compatible values, these are stored in the attributes of the grid data variable.
+      The cell is given separately in arcseconds, _check_grid_params converts grid_parms['cell'] to radians.
+      """
+    attrs = {}
+    for name in grid_attrs_names:
+        value = cell if name == 'cell' else grid_parms[name]
+        if isinstance(value, (list, tuple, np.ndarray)):
+            value = np.array(value).tolist()
+        elif isinstance(value, np.generic):
+            value = value.item()
+        attrs[name] = value
+    return attrs
+
+
+def _imaging_weighting(vis_dataset, grid_parms):
+    """
+      The weighting of the imaging weights, stored in their 'weighting' attribute by make_imaging_weight. Imaging weights without it are taken to be natural.
+      """
+    return vis_dataset[grid_parms['imaging_weight_name']].attrs.get('weighting', 'natural')
+
+
+def _make_grid_dataset(grid, sum_weight, gridded_time, gridded_baseline, coords, correcting_cgk_image, grid_parms, timings):
+    """
+      Creates the dataset returned by make_grid and update_grid. The dirty image is made from the grid (fft, padding removal, sum of weights and gridding correction) as in make_image.
+
+      Parameters
+      ----------
+      grid : complex dask array
+          (n_u, n_v, n_chan, n_pol) The uncorrected grid as returned by _graph_standard_grid.
+      sum_weight : float dask array
+          (n_chan, n_pol)
+      gridded_time : array
+          (n_gridded_time) The time coordinate values of all the gridded visibilities.
+      gridded_baseline : array
+          (n_gridded_baseline) The baseline coordinate values of the gridded visibilities, all the gridded times are gridded for these baselines.
+      coords : dictionary
+          The 'chan', 'pol' and 'chan_width' coordinates of the image (see _image_coords), the d0, d1, u and v coordinates are set here.
+      correcting_cgk_image : float array
+          (n_u, n_v) The gridding correction (see _get_gcf).
+      grid_parms : dictionary
+          As checked by _check_make_grid_parms or _check_update_grid_parms.
+      timings : dictionary
+          The prefetch timings of 'streaming' grid accumulation (see _prefetch_attrs), empty for the other accumulations.
+
+      Returns
+      -------
+      grid_dataset : xarray.core.dataset.Dataset
+      """
+    import xarray as xr
+    from ._fft import _ifft2_shifted
+    from ._normalize import _normalize_image
+    from ._prefetch import _prefetch_attrs
+
+    uncorrected_dirty_image = _ifft2_shifted(grid, grid_parms, grid_parms['imsize']) #Only the pixels kept by _remove_padding are computed.
+    corrected_dirty_image = _normalize_image(uncorrected_dirty_image, sum_weight, correcting_cgk_image, grid_parms)
+
+    coords = dict(coords)
+    coords['d0'] = np.arange(grid_parms['imsize'][0])
+    coords['d1'] = np.arange(grid_parms['imsize'][1])
+    coords['u'] = np.arange(grid_parms['imsize_padded'][0])
+    coords['v'] = np.arange(grid_parms['imsize_padded'][1])
+
+    grid_dict = {}
+    grid_dict[grid_parms['grid_name']] = xr.DataArray(grid, dims=['u', 'v', 'chan', 'pol'], attrs=grid_parms['grid_attrs'])
+    grid_dict[grid_parms['sum_weight_name']] = xr.DataArray(sum_weight, dims=['chan', 'pol'])
+    grid_dict[grid_parms['gridded_time_name']] = xr.DataArray(gridded_time, dims=['gridded_time'])
+    grid_dict[grid_parms['gridded_baseline_name']] = xr.DataArray(gridded_baseline, dims=['gridded_baseline'])
+    grid_dict[grid_parms['image_name']] = xr.DataArray(corrected_dirty_image, dims=['d0', 'd1', 'chan', 'pol'])
+    return xr.Dataset(grid_dict, coords=coords, attrs=_prefetch_attrs(timings, grid_parms))
+
+
+def _store_grid_dataset(grid_dataset, list_xarray_data_variables, storage_parms):
+    """
+      Stores the dataset of update_grid (see _store). With storage_parms['to_disk'] the dataset is written to a temporary zarr file that then replaces storage_parms['outfile'],
+      so the grid_dataset that is updated can be read from storage_parms['outfile'] and storage_parms['outfile'] is only replaced once the updated grid is written.
+      """
+    import os
+    import shutil
+    import xarray as xr
+    from ngcasa._ngcasa_utils._store import _store
+
+    if not storage_parms['to_disk']:
+        return _store(grid_dataset, list_xarray_data_variables, storage_parms)
+
+    outfile = storage_parms['outfile']
+    tmp_outfile = outfile + '.update_grid_tmp'
+    old_outfile = outfile + '.update_grid_old'
+    for leftover_file in [tmp_outfile, old_outfile]:
+        if os.path.exists(leftover_file):
+            shutil.rmtree(leftover_file)
+
+    storage_parms['outfile'] = tmp_outfile
+    _store(grid_dataset, list_xarray_data_variables, storage_parms)
+    storage_parms['outfile'] = outfile
+
+    if os.path.exists(outfile):
+        os.rename(outfile, old_outfile)
+    os.rename(tmp_outfile, outfile)
+    if os.path.exists(old_outfile):
+        shutil.rmtree(old_outfile)
+    return xr.open_zarr(outfile, chunks=storage_parms['chunks_return'])
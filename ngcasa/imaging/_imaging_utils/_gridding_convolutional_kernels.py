@@ -30,7 +30,7 @@ def _coordinates2(npixel: int):
     return (np.mgrid[0:npixel, 0:npixel] - npixel // 2) / npixel
 
 
-def _create_prolate_spheroidal_kernel(oversampling, support, n_uv):
+def _create_prolate_spheroidal_kernel(oversampling, support, n_uv, do_kernel=True):
     """
     Create PSWF to serve as gridding kernel
 
@@ -43,6 +43,8 @@ def _create_prolate_spheroidal_kernel(oversampling, support, n_uv):
     n_uv: int array
         (2)
         number of pixels in u,v space
+    do_kernel : bool, default = True
+        If False the 4-D kernel is not created and None is returned in its place. The gridders only use the 1-D kernel (_create_prolate_spheroidal_kernel_1D).
 
     Returns
     -------
@@ -50,38 +52,44 @@ def _create_prolate_spheroidal_kernel(oversampling, support, n_uv):
     kernel_image : numpy.ndarray
 
     """
-    # support//2 is the index of the zero value of the support values
-    # oversampling//2 is the index of the zero value of the oversampling value
-    support_center = support // 2
-    oversampling_center = oversampling // 2
-
-    support_values = (np.arange(support) - support_center)
-    if (oversampling % 2) == 0:
-        oversampling_values = ((np.arange(oversampling + 1) - oversampling_center) / oversampling)[:, None]
-        kernel_points_1D = (np.broadcast_to(support_values, (oversampling + 1, support)) + oversampling_values)
-    else:
-        oversampling_values = ((np.arange(oversampling) - oversampling_center) / oversampling)[:, None]
-        kernel_points_1D = (np.broadcast_to(support_values, (oversampling, support)) + oversampling_values)
-
-    kernel_points_1D = kernel_points_1D / support_center
-
-    _, kernel_1D = _prolate_spheroidal_function(kernel_points_1D)
-    # kernel_1D /= np.sum(np.real(kernel_1D[oversampling_center,:]))
+    kernel = None
+    if do_kernel:
+        # support//2 is the index of the zero value of the support values
+        # oversampling//2 is the index of the zero value of the oversampling value
+        support_center = support // 2
+        oversampling_center = oversampling // 2
+
+        support_values = (np.arange(support) - support_center)
+        if (oversampling % 2) == 0:
+            oversampling_values = ((np.arange(oversampling + 1) - oversampling_center) / oversampling)[:, None]
+        else:
+            oversampling_values = ((np.arange(oversampling) - oversampling_center) / oversampling)[:, None]
+        kernel_points_1D = (support_values[None, :] + oversampling_values) / support_center
+
+        _, kernel_1D = _prolate_spheroidal_function(kernel_points_1D)
+
+        # kernel[x, y, :, :] = np.outer(kernel_1D[x, :], kernel_1D[y, :])
+        kernel = kernel_1D[:, None, :, None] * kernel_1D[None, :, None, :]
+
+    kernel_image = _create_prolate_spheroidal_kernel_image(n_uv)
+    return kernel, kernel_image
 
-    if (oversampling % 2) == 0:
-        kernel = np.zeros((oversampling + 1, oversampling + 1, support, support),
-                          dtype=np.double)  # dtype=np.complex128
-    else:
-        kernel = np.zeros((oversampling, oversampling, support, support), dtype=np.double)
 
-    for x in range(oversampling):
-        for y in range(oversampling):
-            kernel[x, y, :, :] = np.outer(kernel_1D[x, :], kernel_1D[y, :])
+def _create_prolate_spheroidal_kernel_image(n_uv):
+    """
+    Create the gridding correction function (applied after dirty image is created) of the prolate spheroidal kernel, without creating the kernel.
 
-    # norm = np.sum(np.real(kernel))
-    # kernel /= norm
+    Parameters
+    ----------
+    n_uv: int array
+        (2)
+        number of pixels in u,v space
 
-    # Gridding correction function (applied after dirty image is created)
+    Returns
+    -------
+    kernel_image : numpy.ndarray
+        (n_uv[0], n_uv[1])
+    """
     kernel_image_points_1D_u = np.abs(2.0 * _coordinates(n_uv[0]))
     kernel_image_1D_u = _prolate_spheroidal_function(kernel_image_points_1D_u)[0]
 
@@ -93,7 +101,7 @@ def _create_prolate_spheroidal_kernel(oversampling, support, n_uv):
     # kernel_image[kernel_image > 0.0] = kernel_image.max() / kernel_image[kernel_image > 0.0]
 
     # kernel_image =  kernel_image/kernel_image.max()
-    return kernel, kernel_image
+    return kernel_image
 
 
 def _prolate_spheroidal_function(u):
@@ -118,29 +126,27 @@ def _prolate_spheroidal_function(u):
     _, n_q = q.shape
 
     u = np.abs(u)
-    uend = np.zeros(u.shape, dtype=np.float64)
-    part = np.zeros(u.shape, dtype=np.int64)
-
-    part[(u >= 0.0) & (u < 0.75)] = 0
-    part[(u >= 0.75) & (u <= 1.0)] = 1
-    uend[(u >= 0.0) & (u < 0.75)] = 0.75
-    uend[(u >= 0.75) & (u <= 1.0)] = 1.0
+    part = (u >= 0.75)
+    uend = np.where(part, 1.0, 0.75)
 
     delusq = u ** 2 - uend ** 2
 
-    top = p[part, 0]
-    for k in range(1, n_p):  # small constant size loop
-        top += p[part, k] * np.power(delusq, k)
+    # Horner evaluation of the rational approximation, both parts are evaluated and the part of each u is selected.
+    top = np.full(u.shape, p[0, n_p - 1])
+    top_1 = np.full(u.shape, p[1, n_p - 1])
+    for k in range(n_p - 2, -1, -1):  # small constant size loop
+        top = top * delusq + p[0, k]
+        top_1 = top_1 * delusq + p[1, k]
+    top = np.where(part, top_1, top)
 
-    bot = q[part, 0]
-    for k in range(1, n_q):  # small constant size loop
-        bot += q[part, k] * np.power(delusq, k)
+    bot = np.full(u.shape, q[0, n_q - 1])
+    bot_1 = np.full(u.shape, q[1, n_q - 1])
+    for k in range(n_q - 2, -1, -1):  # small constant size loop
+        bot = bot * delusq + q[0, k]
+        bot_1 = bot_1 * delusq + q[1, k]
+    bot = np.where(part, bot_1, bot)
 
-    grdsf = np.zeros(u.shape, dtype=np.float64)
-    ok = (bot > 0.0)
-    grdsf[ok] = top[ok] / bot[ok]
-    ok = np.abs(u > 1.0)
-    grdsf[ok] = 0.0
+    grdsf = np.where((bot > 0.0) & (u <= 1.0), top / np.where(bot > 0.0, bot, 1.0), 0.0)
 
     # Return the griddata function and the grid correction function
     return grdsf, (1 - u ** 2) * grdsf
@@ -154,3 +160,53 @@ def _create_prolate_spheroidal_kernel_1D(oversampling, support):
     long_half_kernel_1D = np.zeros(oversampling * (support_center + 1))
     _, long_half_kernel_1D[0:oversampling * (support_center)] = _prolate_spheroidal_function(u)
     return long_half_kernel_1D
+
+
+def _create_w_projection_kernel(w, w_oversampling, w_support, n_uv, delta_lm):
+    """
+    Create a w-projection gridding kernel, the prolate spheroidal kernel convolved with the Fourier transform of the w-term phase screen exp(-2 pi i w (n-1)) (see _w_term._apply_w_screen).
+    The kernel is symmetric in u and v so only the positive half is stored, in the same layout as _create_prolate_spheroidal_kernel_1D.
+    The image plane taper is the prolate spheroidal grid correction function so that the same correcting image can be used as for the prolate spheroidal kernel.
+
+    Parameters
+    ----------
+    w : float
+        The w value of the kernel in wavelengths.
+    w_oversampling : int
+        The oversampling of the kernel.
+    w_support : int
+        The full support of the kernel.
+    n_uv: int array
+        (2)
+        number of pixels in u,v space
+    delta_lm: float array
+        (2)
+        The image cell size in radians.
+
+    Returns
+    -------
+    kernel : complex array
+        (w_oversampling*(w_support//2 + 1), w_oversampling*(w_support//2 + 1))
+    """
+    support_center = w_support // 2
+    n_kernel_image = 2 * w_support #Twice the support so that the truncated kernel tails are not aliased.
+    n_kernel_uv = n_kernel_image * w_oversampling
+
+    # The kernel image spans the padded image.
+    l = _coordinates(n_kernel_image) * n_uv[0] * np.abs(delta_lm[0])
+    m = _coordinates(n_kernel_image) * n_uv[1] * np.abs(delta_lm[1])
+    n_minus_1 = np.sqrt(1.0 - l[:, None]**2 - m[None, :]**2) - 1.0
+
+    taper_u = _prolate_spheroidal_function(np.abs(2.0 * _coordinates(n_kernel_image)))[0]
+    kernel_image = np.outer(taper_u, taper_u) * np.exp(-2j * np.pi * w * n_minus_1)
+
+    # Zero padding the kernel image by the oversampling factor samples the kernel at 1/w_oversampling of a grid cell.
+    padded_kernel_image = np.zeros((n_kernel_uv, n_kernel_uv), dtype=np.complex128)
+    start = n_kernel_uv // 2 - n_kernel_image // 2
+    padded_kernel_image[start:start + n_kernel_image, start:start + n_kernel_image] = kernel_image
+    kernel_uv = np.fft.fftshift(np.fft.fft2(np.fft.ifftshift(padded_kernel_image)))
+
+    n_half = w_oversampling * (support_center + 1)
+    kernel = kernel_uv[n_kernel_uv // 2:n_kernel_uv // 2 + n_half, n_kernel_uv // 2:n_kernel_uv // 2 + n_half]
+    kernel = kernel / np.abs(kernel[0, 0])
+    return np.ascontiguousarray(kernel)
@@ -0,0 +1,182 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+
+def _worker_resources():
+    """
+      The number of workers, threads per worker and memory per worker (bytes) of the dask.distributed client that is running.
+      If dask.distributed is not installed or no client is running the resources of this machine are used (one worker).
+      """
+    import os
+    try:
+        from distributed import get_client
+        workers = get_client().scheduler_info()['workers'].values()
+        return len(workers), int(min([worker['nthreads'] for worker in workers])), float(min([worker['memory_limit'] for worker in workers]))
+    except (ImportError, ValueError, KeyError):
+        return 1, os.cpu_count(), float(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES'))
+
+
+def _imaging_chunk_costs(vis_dataset, chunks, chunk_parms):
+    """
+      Estimates the graph size and the memory of make_image for a chunking of the visibility data.
+
+      A gridding task holds a chunk of DATA, IMAGING_WEIGHT and UVW (grid_parms['n_chunks_per_task'] chunks for 'batched' grid accumulation) and the grid it creates,
+      the tasks that sum the grids and the fft of an image channel chunk hold about 3 grids. The grids of an image channel chunk that are in memory at the same time were
+      measured with the dask schedulers: with grid_parms['grid_accumulation'] = 'tree' all the sub-grids are created before they are summed (about the number of chunks of the
+      image channel chunk + 6 grids), with 'chained' about 2 x grid_parms['n_accumulators'] + 1 grids and with 'batched' about 7 + log2(number of batches)/2 grids.
+      A worker works on up to one image channel chunk per thread and holds the visibilities of a gridding task per thread.
+      The number of tasks is about 18 per chunk (_graph_standard_grid selects the DATA, UVW, IMAGING_WEIGHT and channel frequency blocks of every chunk,
+      wraps the kernel and parameters again for every chunk, grids it and adds its grid and sum of weights to the tree sums) and 10 per image channel chunk
+      (the concatenation, fft and normalization). With 'chained' grid accumulation there are no tree sums, about 12 tasks per chunk, and the running sums take
+      about 6 x grid_parms['n_accumulators'] tasks per image channel chunk. With 'batched' grid accumulation only the input blocks of every chunk remain (DATA, IMAGING_WEIGHT and the UVW of each
+      time and baseline chunk) and a batch takes about 10 tasks (the rechunks, the gridding, the selection of the grid and sum of weights and the reductions), 7 without the rechunks.
+      With chunk_parms['n_fft_slabs'] > 1 the chunks are read and binned by u-slab once, every slab of a chunk is gridded by its own task and a grid is a slab.
+
+      Parameters
+      ----------
+      vis_dataset : xarray.core.dataset.Dataset
+      chunks : tuple of tuples of int
+          The (time, baseline, chan, pol) chunks.
+      chunk_parms : dictionary
+          As checked by _check_imaging_chunks_parms.
+
+      Returns
+      -------
+      costs : dictionary
+          keys ('n_chunks', 'n_tasks', 'vis_chunk_memory', 'grid_memory', 'task_memory', 'worker_memory'), memory in bytes.
+      """
+    n_pol = vis_dataset[chunk_parms['data_name']].shape[3]
+    vis_itemsize = vis_dataset[chunk_parms['data_name']].dtype.itemsize
+    if chunk_parms['imaging_weight_name'] in vis_dataset.data_vars:
+        vis_itemsize = vis_itemsize + vis_dataset[chunk_parms['imaging_weight_name']].dtype.itemsize
+    else:
+        vis_itemsize = vis_itemsize + 8
+    uvw_itemsize = vis_dataset[chunk_parms['uvw_name']].dtype.itemsize
+
+    max_chunk = [max(dim_chunks) for dim_chunks in chunks]
+    n_chunks_in_each_dim = [len(dim_chunks) for dim_chunks in chunks]
+    n_chunks = int(np.prod(n_chunks_in_each_dim))
+
+    if chunk_parms['chan_mode'] == 'cube':
+        n_img_chan = max_chunk[2]
+        n_img_chan_chunks = n_chunks_in_each_dim[2]
+    else:
+        n_img_chan = 1
+        n_img_chan_chunks = 1
+    grid_itemsize = 8 if chunk_parms['precision'] == 'single' else 16
+    grid_memory = n_img_chan * n_pol * int(np.prod(chunk_parms['imsize_padded'])) * grid_itemsize / chunk_parms['n_fft_slabs']
+
+    vis_chunk_memory = max_chunk[0] * max_chunk[1] * (max_chunk[2] * max_chunk[3] * vis_itemsize + 3 * uvw_itemsize)
+
+    n_sub_grids = n_chunks // n_img_chan_chunks
+    if chunk_parms['grid_accumulation'] == 'batched':
+        n_chunks_per_task = min(chunk_parms['n_chunks_per_task'], n_chunks_in_each_dim[0])
+        n_batches = int(np.ceil(n_chunks_in_each_dim[0] / n_chunks_per_task)) * (n_chunks // n_chunks_in_each_dim[0])
+        n_grids = 7 + np.log2(n_batches // n_img_chan_chunks) / 2
+        n_tasks = n_chunks * (2 + 1 / n_chunks_in_each_dim[2]) + (7 if n_chunks_per_task == 1 else 10) * n_batches + 8 * n_img_chan_chunks
+    else:
+        n_chunks_per_task = 1
+        if chunk_parms['grid_accumulation'] == 'chained':
+            n_grids = 2 * min(chunk_parms['n_accumulators'], n_sub_grids) + 1
+            n_tasks = 12 * n_chunks + (10 + 6 * min(chunk_parms['n_accumulators'], n_sub_grids)) * n_img_chan_chunks
+        else:
+            n_grids = n_sub_grids + 6
+            n_tasks = 18 * n_chunks + 10 * n_img_chan_chunks
+    n_concurrent_img_chan_chunks = min(chunk_parms['n_threads_per_worker'], int(np.ceil(n_img_chan_chunks / chunk_parms['n_workers'])))
+
+    costs = {}
+    costs['n_chunks'] = n_chunks
+    costs['n_tasks'] = int(n_tasks * chunk_parms['n_fft_slabs'])
+    costs['vis_chunk_memory'] = vis_chunk_memory
+    costs['grid_memory'] = grid_memory
+    costs['task_memory'] = max(n_chunks_per_task * vis_chunk_memory + grid_memory, 3 * grid_memory)
+    costs['worker_memory'] = chunk_parms['n_threads_per_worker'] * n_chunks_per_task * vis_chunk_memory + n_concurrent_img_chan_chunks * n_grids * grid_memory
+    return costs
+
+
+def _plan_imaging_chunks(vis_dataset, chunk_parms):
+    """
+      Chooses the (time, baseline, chan, pol) chunk sizes of the visibility data for make_image, make_psf and make_image_and_psf.
+
+      The polarizations are never chunked (see _check_grid_params). For a cube the channels are split so that every thread of the cluster gets an image channel chunk,
+      for continuum all the channels are in one chunk. The baselines are kept in one chunk and the time chunk is the largest one that keeps a chunk below
+      chunk_parms['target_chunk_memory'] (if a time step is larger the channels and then the baselines are split). The time chunk is then decreased so that
+      every thread of the cluster gets a chunk and increased (up to 4 x chunk_parms['target_chunk_memory']) so that the graph has at most chunk_parms['max_tasks'] tasks.
+      While the estimated memory of a worker (see _imaging_chunk_costs) is more than chunk_parms['memory_fraction'] x chunk_parms['worker_memory'],
+      chunk_parms['grid_accumulation'] is changed from 'tree' to 'batched', then the cube channel chunks are halved and then chunk_parms['n_fft_slabs'] is doubled
+      (with 'tree' accumulation, the only one that supports fft slabs). Finally, if the graph still has more than chunk_parms['max_tasks'] tasks, 'batched' accumulation
+      is used and chunk_parms['n_chunks_per_task'] is doubled while the memory allows.
+
+      Returns
+      -------
+      chunks : tuple of tuples of int
+          The (time, baseline, chan, pol) chunks.
+      """
+    from dask.array.core import normalize_chunks
+
+    n_time, n_baseline, n_chan, n_pol = vis_dataset[chunk_parms['data_name']].shape
+    n_slots = chunk_parms['n_workers'] * chunk_parms['n_threads_per_worker']
+    worker_memory_limit = chunk_parms['memory_fraction'] * chunk_parms['worker_memory']
+
+    def costs(time_chunk, baseline_chunk, chan_chunk):
+        chunks = normalize_chunks((time_chunk, baseline_chunk, chan_chunk, n_pol), (n_time, n_baseline, n_chan, n_pol))
+        return chunks, _imaging_chunk_costs(vis_dataset, chunks, chunk_parms)
+
+    def time_and_baseline_chunks(chan_chunk):
+        baseline_chunk = n_baseline
+        while (baseline_chunk > 1) and (costs(1, baseline_chunk, chan_chunk)[1]['vis_chunk_memory'] > chunk_parms['target_chunk_memory']):
+            baseline_chunk = int(np.ceil(baseline_chunk / 2))
+        time_step_memory = costs(1, baseline_chunk, chan_chunk)[1]['vis_chunk_memory']
+        time_chunk = int(min(n_time, max(1, chunk_parms['target_chunk_memory'] // time_step_memory)))
+
+        n_other_chunks = costs(n_time, baseline_chunk, chan_chunk)[1]['n_chunks']
+        if n_other_chunks * int(np.ceil(n_time / time_chunk)) < n_slots:
+            time_chunk = max(1, int(np.ceil(n_time / int(np.ceil(n_slots / n_other_chunks)))))
+        while (costs(time_chunk, baseline_chunk, chan_chunk)[1]['n_tasks'] > chunk_parms['max_tasks']) and (time_chunk < n_time) and (2 * time_chunk * time_step_memory <= 4 * chunk_parms['target_chunk_memory']):
+            time_chunk = min(2 * time_chunk, n_time)
+        return time_chunk, baseline_chunk
+
+    if chunk_parms['chan_mode'] == 'cube':
+        chan_chunk = int(np.ceil(n_chan / n_slots))
+    else:
+        chan_chunk = n_chan
+    while (chan_chunk > 1) and (costs(1, n_baseline, chan_chunk)[1]['vis_chunk_memory'] > chunk_parms['target_chunk_memory']):
+        chan_chunk = int(np.ceil(chan_chunk / 2))
+
+    time_chunk, baseline_chunk = time_and_baseline_chunks(chan_chunk)
+    while costs(time_chunk, baseline_chunk, chan_chunk)[1]['worker_memory'] > worker_memory_limit:
+        if (chunk_parms['grid_accumulation'] == 'tree') and (chunk_parms['n_fft_slabs'] == 1):
+            chunk_parms['grid_accumulation'] = 'batched'
+        elif (chunk_parms['chan_mode'] == 'cube') and (chan_chunk > 1):
+            chan_chunk = int(np.ceil(chan_chunk / 2))
+            time_chunk, baseline_chunk = time_and_baseline_chunks(chan_chunk)
+        elif chunk_parms['n_fft_slabs'] < chunk_parms['imsize_padded'][0] // 2:
+            chunk_parms['grid_accumulation'] = 'tree'
+            chunk_parms['n_fft_slabs'] = 2 * chunk_parms['n_fft_slabs']
+        else:
+            break
+
+    if (costs(time_chunk, baseline_chunk, chan_chunk)[1]['n_tasks'] > chunk_parms['max_tasks']) and (chunk_parms['n_fft_slabs'] == 1):
+        grid_accumulation, n_chunks_per_task = chunk_parms['grid_accumulation'], chunk_parms['n_chunks_per_task']
+        chunk_parms['grid_accumulation'] = 'batched'
+        n_time_chunks = int(np.ceil(n_time / time_chunk))
+        while (costs(time_chunk, baseline_chunk, chan_chunk)[1]['n_tasks'] > chunk_parms['max_tasks']) and (chunk_parms['n_chunks_per_task'] < n_time_chunks):
+            chunk_parms['n_chunks_per_task'] = 2 * chunk_parms['n_chunks_per_task']
+            if costs(time_chunk, baseline_chunk, chan_chunk)[1]['worker_memory'] > worker_memory_limit:
+                chunk_parms['n_chunks_per_task'] = chunk_parms['n_chunks_per_task'] // 2
+                break
+        if costs(time_chunk, baseline_chunk, chan_chunk)[1]['worker_memory'] > worker_memory_limit:
+            chunk_parms['grid_accumulation'], chunk_parms['n_chunks_per_task'] = grid_accumulation, n_chunks_per_task
+
+    return costs(time_chunk, baseline_chunk, chan_chunk)[0]
@@ -0,0 +1,448 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+from numba import jit
+import numpy as np
+import math
+from ._standard_grid import _copy_accumulator
+
+def _graph_imaging_weight(vis_dataset, natural_imaging_weight, imaging_weights_parms):
+    """
+      Creates the graph of the imaging weights without the general gridder.
+
+      If imaging_weights_parms['weighting'] is not 'natural' the weight density is accumulated in one pass over the chunks: the chunks of each
+      image channel chunk are split into imaging_weights_parms['n_accumulators'] chains and each chain histograms the weights of its chunks one
+      after the other into the same (n_imag_chan, n_u, n_v, n_pol) density grid (see _accumulate_weight_density_jit). The chains are summed and the
+      density grid is turned into the table of the weighting factors (see _weight_lookup_table), which is then read by every chunk
+      of the imaging weights (see _apply_imaging_weight_jit). The uv taper (imaging_weights_parms['uvtaper']) is applied in the same pass.
+
+      Parameters
+      ----------
+      vis_dataset : xarray.core.dataset.Dataset
+      natural_imaging_weight : dask array
+          (n_time, n_baseline, n_chan, n_pol)
+      imaging_weights_parms : dictionary
+          As checked by _check_imaging_weights_parms.
+
+      Returns
+      -------
+      imaging_weight : dask array
+          (n_time, n_baseline, n_chan, n_pol)
+      """
+    import dask
+    import dask.array as da
+    import itertools
+    from ._standard_grid import ndim_list, _tree_sum_delayed_list
+
+    do_density = imaging_weights_parms['weighting'] != 'natural'
+    do_taper = len(imaging_weights_parms['uvtaper']) > 0
+    use_uv_index = do_density and (imaging_weights_parms['uv_index_name'] != '')
+
+    chunk_sizes = natural_imaging_weight.chunks
+    n_chunks_in_each_dim = natural_imaging_weight.numblocks
+    freq_chan = da.from_array(vis_dataset.coords['chan'].values, chunks=(chunk_sizes[2],))
+    parms = dask.delayed(imaging_weights_parms)
+
+    def chunk_inputs(c_time, c_baseline, c_chan, c_pol, with_taper):
+        #The uvw values are not loaded if the grid cells are read from the uv index (see make_uv_index) and no uv taper is applied.
+        inputs = {'natural_imaging_weight': natural_imaging_weight.partitions[c_time, c_baseline, c_chan, c_pol], 'freq_chan': freq_chan.partitions[c_chan]}
+        if use_uv_index:
+            inputs['uv_index'] = vis_dataset[imaging_weights_parms['uv_index_name']].data.partitions[c_time, c_baseline, c_chan, 0]
+        if (not use_uv_index) or with_taper:
+            inputs['uvw'] = vis_dataset[imaging_weights_parms['uvw_name']].data.partitions[c_time, c_baseline, 0]
+        return inputs
+
+    lookup_tables = {}
+    if do_density:
+        for c_img_chan, c_pol in itertools.product(range(n_chunks_in_each_dim[2] if imaging_weights_parms['chan_mode'] == 'cube' else 1), range(n_chunks_in_each_dim[3])):
+            if imaging_weights_parms['chan_mode'] == 'cube':
+                list_of_chunk_indx = list(itertools.product(range(n_chunks_in_each_dim[0]), range(n_chunks_in_each_dim[1]), [c_img_chan], [c_pol]))
+            else:
+                list_of_chunk_indx = list(itertools.product(range(n_chunks_in_each_dim[0]), range(n_chunks_in_each_dim[1]), range(n_chunks_in_each_dim[2]), [c_pol]))
+
+            chains = np.array_split(np.arange(len(list_of_chunk_indx)), min(imaging_weights_parms['n_accumulators'], len(list_of_chunk_indx)))
+            list_of_densities = []
+            for chain in chains:
+                density_and_sum_weight = None
+                for i_chunk in chain:
+                    density_and_sum_weight = dask.delayed(_accumulate_weight_density_numpy_wrap)(parms=parms, density_and_sum_weight=density_and_sum_weight,
+                                                                                                 **chunk_inputs(*list_of_chunk_indx[i_chunk], with_taper=False))
+                list_of_densities.append(density_and_sum_weight)
+            density_and_sum_weight = _tree_sum_delayed_list(list_of_densities, _merge_weight_densities)
+            lookup_tables[(c_img_chan, c_pol)] = dask.delayed(_weight_lookup_table)(density_and_sum_weight, parms)
+
+    list_of_imaging_weights = ndim_list(n_chunks_in_each_dim)
+    for c_time, c_baseline, c_chan, c_pol in itertools.product(*[range(n_chunks) for n_chunks in n_chunks_in_each_dim]):
+        if do_density:
+            lookup_table = lookup_tables[(c_chan if imaging_weights_parms['chan_mode'] == 'cube' else 0, c_pol)]
+        else:
+            lookup_table = None
+        sub_imaging_weight = dask.delayed(_apply_imaging_weight_numpy_wrap)(lookup_table=lookup_table, parms=parms, **chunk_inputs(c_time, c_baseline, c_chan, c_pol, with_taper=do_taper))
+        single_chunk_size = (chunk_sizes[0][c_time], chunk_sizes[1][c_baseline], chunk_sizes[2][c_chan], chunk_sizes[3][c_pol])
+        list_of_imaging_weights[c_time][c_baseline][c_chan][c_pol] = da.from_delayed(sub_imaging_weight, single_chunk_size, dtype=np.double)
+
+    return da.block(list_of_imaging_weights)
+
+
+def _chan_map(n_chan, chan_mode):
+    if chan_mode == 'cube':
+        return np.arange(0, n_chan).astype(np.int64)
+    else:  # continuum
+        return np.zeros(n_chan, dtype=np.int64)
+
+
+def _accumulate_weight_density_numpy_wrap(natural_imaging_weight, freq_chan, parms, density_and_sum_weight=None, uvw=None, uv_index=None):
+    """
+      Adds the weights of a chunk to the weight density grid.
+
+      Parameters
+      ----------
+      natural_imaging_weight : float array
+          (n_time, n_baseline, n_chan, n_pol)
+      freq_chan : float array
+          (n_chan)
+      parms : dictionary
+          keys ('chan_mode','imsize','cell')
+      density_and_sum_weight : tuple of (density, sum_weight), default = None
+          If given the weights are added to a copy of this density grid and sum of weights instead of new ones (see _copy_accumulator).
+      uvw  : float array, default = None
+          (n_time, n_baseline, 3)
+      uv_index : int32 array, default = None
+          (n_time, n_baseline, n_chan, 2) If given the grid cells are read from it and uvw is not used (see make_uv_index).
+
+      Returns
+      -------
+      density : float array
+          (n_imag_chan, n_u, n_v, n_pol)
+      sum_weight : float array
+          (n_imag_chan, n_pol)
+      """
+    n_chan, n_pol = natural_imaging_weight.shape[2:4]
+    chan_map = _chan_map(n_chan, parms['chan_mode'])
+    n_uv = parms['imsize']
+
+    if density_and_sum_weight is not None:
+        density, sum_weight = _copy_accumulator(density_and_sum_weight)
+    else:
+        n_imag_chan = chan_map[-1] + 1
+        density = np.zeros((n_imag_chan, n_uv[0], n_uv[1], n_pol), dtype=np.double)
+        sum_weight = np.zeros((n_imag_chan, n_pol), dtype=np.double)
+
+    if uv_index is not None:
+        _accumulate_weight_density_uv_index_jit(density, sum_weight, uv_index, chan_map, natural_imaging_weight)
+    else:
+        _accumulate_weight_density_jit(density, sum_weight, uvw, freq_chan, chan_map, natural_imaging_weight, n_uv, parms['cell'])
+    return density, sum_weight
+
+
+def _merge_weight_densities(density_and_sum_weight_1, density_and_sum_weight_2):
+    return density_and_sum_weight_1[0] + density_and_sum_weight_2[0], density_and_sum_weight_1[1] + density_and_sum_weight_2[1]
+
+
+#When jit is used round is repolaced by standard c++ round that is different to python round
+@jit(nopython=True, cache=True, nogil=True)
+def _accumulate_weight_density_jit(density, sum_weight, uvw, freq_chan, chan_map, weight, n_uv, delta_lm):
+    """
+      Histograms the weights of a chunk into their uv cells. The cell is calculated once for each (time, baseline, chan), as in
+      _standard_grid_jit with a support of 1, and the polarizations of a cell are adjacent in the density grid.
+      Weights that are nan or 0, that have nan uvw values or that fall outside the grid are not added.
+
+      Parameters
+      ----------
+      density : float array
+          (n_imag_chan, n_u, n_v, n_pol)
+      sum_weight : float array
+          (n_imag_chan, n_pol)
+      uvw  : float array
+          (n_time, n_baseline, 3)
+      freq_chan : float array
+          (n_chan)
+      chan_map : int array
+          (n_chan)
+      weight : float array
+          (n_time, n_baseline, n_chan, n_pol)
+      """
+    c = 299792458.0
+    uv_scale = np.zeros((2, len(freq_chan)), dtype=np.double)
+    uv_scale[0, :] = -(freq_chan * delta_lm[0] * n_uv[0]) / c
+    uv_scale[1, :] = -(freq_chan * delta_lm[1] * n_uv[1]) / c
+
+    uv_center = n_uv // 2
+
+    n_time, n_baseline, n_chan, n_pol = weight.shape
+
+    for i_time in range(n_time):
+        for i_baseline in range(n_baseline):
+            u_m = uvw[i_time, i_baseline, 0]
+            v_m = uvw[i_time, i_baseline, 1]
+            if np.isnan(u_m) or np.isnan(v_m):
+                continue
+
+            for i_chan in range(n_chan):
+                #Doing round as int(x+0.5) since u_pos/v_pos should always be positive and  fortran and gives consistant rounding.
+                u_indx = int(u_m * uv_scale[0, i_chan] + uv_center[0] + 0.5)
+                v_indx = int(v_m * uv_scale[1, i_chan] + uv_center[1] + 0.5)
+
+                if (u_indx < n_uv[0]) and (v_indx < n_uv[1]) and (u_indx >= 0) and (v_indx >= 0):
+                    a_chan = chan_map[i_chan]
+                    for i_pol in range(n_pol):
+                        w = weight[i_time, i_baseline, i_chan, i_pol]
+                        if ~np.isnan(w) and (w != 0.0):
+                            density[a_chan, u_indx, v_indx, i_pol] = density[a_chan, u_indx, v_indx, i_pol] + w
+                            sum_weight[a_chan, i_pol] = sum_weight[a_chan, i_pol] + w
+    return
+
+
+@jit(nopython=True, cache=True, nogil=True)
+def _accumulate_weight_density_uv_index_jit(density, sum_weight, uv_index, chan_map, weight):
+    """
+      _accumulate_weight_density_jit with the grid cells read from a uv index (see make_uv_index).
+      """
+    n_time, n_baseline, n_chan, n_pol = weight.shape
+    n_u, n_v = density.shape[1:3]
+
+    for i_time in range(n_time):
+        for i_baseline in range(n_baseline):
+            for i_chan in range(n_chan):
+                u_indx = uv_index[i_time, i_baseline, i_chan, 0]
+                v_indx = uv_index[i_time, i_baseline, i_chan, 1]
+
+                if (u_indx < n_u) and (v_indx < n_v) and (u_indx >= 0) and (v_indx >= 0):
+                    a_chan = chan_map[i_chan]
+                    for i_pol in range(n_pol):
+                        w = weight[i_time, i_baseline, i_chan, i_pol]
+                        if ~np.isnan(w) and (w != 0.0):
+                            density[a_chan, u_indx, v_indx, i_pol] = density[a_chan, u_indx, v_indx, i_pol] + w
+                            sum_weight[a_chan, i_pol] = sum_weight[a_chan, i_pol] + w
+    return
+
+
+def _weighting_factors(density, sum_weight, parms):
+    """
+      The factors (f_0, f_1) of the imaging weights natural_imaging_weight/(f_0 x density + f_1) for each image channel and polarization.
+      'uniform' and 'superuniform' use (1, 0), 'briggs' uses ((5 x 10^-robust)^2/(sum(density^2)/sum_weight), 1) and
+      'briggs_abs' uses (robust^2, 2 x briggs_abs_noise^2).
+
+      Returns
+      -------
+      weighting_factors : float array
+          (2, n_imag_chan, n_pol)
+      """
+    weighting_factors = np.zeros((2,) + sum_weight.shape, dtype=np.double)
+    if parms['weighting'] == 'briggs':
+        squared_sum_weight = np.sum(density**2, axis=(1, 2))
+        weighting_factors[0] = np.square(5.0*10.0**(-parms['robust']))/(squared_sum_weight/sum_weight)
+        weighting_factors[1] = 1.0
+    elif parms['weighting'] == 'briggs_abs':
+        weighting_factors[0] = np.square(parms['robust'])
+        weighting_factors[1] = 2.0*np.square(parms['briggs_abs_noise'])
+    else:
+        weighting_factors[0] = 1.0
+    return weighting_factors
+
+
+def _weight_lookup_table(density_and_sum_weight, parms):
+    """
+      Turns a copy of a weight density grid into the table that _apply_imaging_weight_jit looks up. The table holds 1/(f_0 x density + f_1)
+      (see _weighting_factors), or 1 where the density is 0. For 'superuniform' the density of a cell is first replaced by the sum over
+      the (2 x parms['npixels'] + 1)^2 cells around it.
+
+      Parameters
+      ----------
+      density_and_sum_weight : tuple of (density, sum_weight)
+          (n_imag_chan, n_u, n_v, n_pol), (n_imag_chan, n_pol)
+
+      Returns
+      -------
+      lookup_table : float array
+          (n_imag_chan, n_u, n_v, n_pol)
+      """
+    density, sum_weight = density_and_sum_weight
+    weighting_factors = _weighting_factors(density, sum_weight, parms)
+    lookup_table = density.copy() #The density is the input of the task and is not changed.
+    if parms['weighting'] == 'superuniform':
+        _box_sum_jit(lookup_table, parms['npixels'])
+    _weight_lookup_table_jit(lookup_table, weighting_factors)
+    return lookup_table
+
+
+@jit(nopython=True, cache=True, nogil=True)
+def _box_sum_jit(density, npixels):
+    """
+      Replaces every cell of the density grid in place by the sum of the cells within npixels along u and v (cells outside the grid are 0).
+      The box is separable, so it is done as a running sum along v and then along u.
+      """
+    n_imag_chan, n_u, n_v, n_pol = density.shape
+    line = np.zeros(max(n_u, n_v), dtype=np.double)
+    for i_chan in range(n_imag_chan):
+        for i_pol in range(n_pol):
+            for i_u in range(n_u):
+                for i_v in range(n_v):
+                    line[i_v] = density[i_chan, i_u, i_v, i_pol]
+                running_sum = 0.0
+                for i_v in range(min(npixels, n_v)):
+                    running_sum = running_sum + line[i_v]
+                for i_v in range(n_v):
+                    if i_v + npixels < n_v:
+                        running_sum = running_sum + line[i_v + npixels]
+                    if i_v - npixels - 1 >= 0:
+                        running_sum = running_sum - line[i_v - npixels - 1]
+                    density[i_chan, i_u, i_v, i_pol] = running_sum
+            for i_v in range(n_v):
+                for i_u in range(n_u):
+                    line[i_u] = density[i_chan, i_u, i_v, i_pol]
+                running_sum = 0.0
+                for i_u in range(min(npixels, n_u)):
+                    running_sum = running_sum + line[i_u]
+                for i_u in range(n_u):
+                    if i_u + npixels < n_u:
+                        running_sum = running_sum + line[i_u + npixels]
+                    if i_u - npixels - 1 >= 0:
+                        running_sum = running_sum - line[i_u - npixels - 1]
+                    density[i_chan, i_u, i_v, i_pol] = running_sum
+    return
+
+
+@jit(nopython=True, cache=True, nogil=True)
+def _weight_lookup_table_jit(density, weighting_factors):
+    n_imag_chan, n_u, n_v, n_pol = density.shape
+    for i_chan in range(n_imag_chan):
+        for i_u in range(n_u):
+            for i_v in range(n_v):
+                for i_pol in range(n_pol):
+                    cell_density = density[i_chan, i_u, i_v, i_pol]
+                    if ~np.isnan(cell_density) and (cell_density != 0.0):
+                        density[i_chan, i_u, i_v, i_pol] = 1.0 / (weighting_factors[0, i_chan, i_pol] * cell_density + weighting_factors[1, i_chan, i_pol])
+                    else:
+                        density[i_chan, i_u, i_v, i_pol] = 1.0
+    return
+
+
+def _uv_taper_coefficients(uvtaper):
+    """
+      The coefficients (c_uu, c_vv, c_uv) of the uv taper exp(-(c_uu x u^2 + c_vv x v^2 + c_uv x u x v)), u and v in wavelengths.
+      The taper is the Fourier transform of an image domain gaussian with a full width at half maximum of uvtaper[0] (arcseconds) along the position
+      angle uvtaper[2] (degrees, north through east) and of uvtaper[1] (arcseconds) perpendicular to it.
+      """
+    arc_sec_to_rad = np.pi / (3600 * 180)
+    bmaj = uvtaper[0] * arc_sec_to_rad
+    bmin = uvtaper[1] * arc_sec_to_rad if len(uvtaper) > 1 else bmaj
+    bpa = np.deg2rad(uvtaper[2]) if len(uvtaper) > 2 else 0.0
+    k = np.pi**2 / (4.0 * np.log(2.0))
+    c_uu = k * (bmaj**2 * np.sin(bpa)**2 + bmin**2 * np.cos(bpa)**2)
+    c_vv = k * (bmaj**2 * np.cos(bpa)**2 + bmin**2 * np.sin(bpa)**2)
+    c_uv = 2.0 * k * np.sin(bpa) * np.cos(bpa) * (bmaj**2 - bmin**2)
+    return np.array([c_uu, c_vv, c_uv])
+
+
+def _apply_imaging_weight_numpy_wrap(natural_imaging_weight, freq_chan, parms, lookup_table=None, uvw=None, uv_index=None):
+    """
+      Calculates the imaging weights of a chunk, natural_imaging_weight x lookup_table x uv taper.
+
+      Parameters
+      ----------
+      natural_imaging_weight : float array
+          (n_time, n_baseline, n_chan, n_pol)
+      freq_chan : float array
+          (n_chan)
+      parms : dictionary
+          keys ('weighting','chan_mode','imsize','cell','uvtaper')
+      lookup_table : float array, default = None
+          (n_imag_chan, n_u, n_v, n_pol) See _weight_lookup_table. Not used if parms['weighting'] is 'natural'.
+      uvw  : float array, default = None
+          (n_time, n_baseline, 3) Only used for the uv taper if uv_index is given.
+      uv_index : int32 array, default = None
+          (n_time, n_baseline, n_chan, 2) If given the grid cells are read from it (see make_uv_index).
+
+      Returns
+      -------
+      imaging_weight : float array
+          (n_time, n_baseline, n_chan, n_pol)
+      """
+    n_time, n_baseline, n_chan, n_pol = natural_imaging_weight.shape
+
+    if lookup_table is None:
+        lookup_table = np.ones((1, 1, 1, n_pol), dtype=np.double)
+        chan_map = np.zeros(n_chan, dtype=np.int64)
+        n_uv = np.array([-1, -1]) #All the visibilities are looked up in the single cell lookup_table[0, 0, 0, :].
+        delta_lm = np.zeros(2)
+    else:
+        chan_map = _chan_map(n_chan, parms['chan_mode'])
+        n_uv = parms['imsize']
+        delta_lm = parms['cell']
+
+    do_taper = len(parms['uvtaper']) > 0
+    taper_coefficients = _uv_taper_coefficients(parms['uvtaper']) if do_taper else np.zeros(3)
+    if uv_index is None:
+        uv_index = np.zeros((1, 1, 1, 2), dtype=np.int32) #This is needed to keep numba happy.
+        use_uv_index = False
+    else:
+        use_uv_index = True
+    if uvw is None:
+        uvw = np.zeros((n_time, n_baseline, 3), dtype=np.double)
+
+    imaging_weight = np.zeros(natural_imaging_weight.shape, dtype=np.double)
+    _apply_imaging_weight_jit(imaging_weight, lookup_table, natural_imaging_weight, uvw, uv_index, use_uv_index, freq_chan, chan_map, n_uv, delta_lm, do_taper, taper_coefficients)
+    return imaging_weight
+
+
+#When jit is used round is repolaced by standard c++ round that is different to python round
+@jit(nopython=True, cache=True, nogil=True)
+def _apply_imaging_weight_jit(imaging_weight, lookup_table, natural_imaging_weight, uvw, uv_index, use_uv_index, freq_chan, chan_map, n_uv, delta_lm, do_taper, taper_coefficients):
+    """
+      Looks up the imaging weights (natural_imaging_weight x lookup_table x uv taper) of a chunk. The uv cell and the taper are calculated once for each
+      (time, baseline, chan) and all the polarizations are read from one contiguous row of the lookup table (see _weight_lookup_table).
+      If n_uv is negative every visibility uses the cell lookup_table[0, 0, 0, :] (natural weighting).
+      Visibilities outside the grid or with nan uvw values get a weight of 0.
+      """
+    c = 299792458.0
+    uv_scale = np.zeros((2, len(freq_chan)), dtype=np.double)
+    uv_scale[0, :] = -(freq_chan * delta_lm[0] * n_uv[0]) / c
+    uv_scale[1, :] = -(freq_chan * delta_lm[1] * n_uv[1]) / c
+    wavelength_scale_squared = (freq_chan / c)**2
+
+    uv_center = n_uv // 2
+    do_lookup = n_uv[0] > 0
+
+    n_time, n_baseline, n_chan, n_pol = natural_imaging_weight.shape
+
+    for i_time in range(n_time):
+        for i_baseline in range(n_baseline):
+            u_m = uvw[i_time, i_baseline, 0]
+            v_m = uvw[i_time, i_baseline, 1]
+            if (not use_uv_index or do_taper) and (np.isnan(u_m) or np.isnan(v_m)):
+                continue
+
+            for i_chan in range(n_chan):
+                u_indx = 0
+                v_indx = 0
+                if do_lookup:
+                    if use_uv_index:
+                        u_indx = uv_index[i_time, i_baseline, i_chan, 0]
+                        v_indx = uv_index[i_time, i_baseline, i_chan, 1]
+                    else:
+                        #Doing round as int(x+0.5) since u_pos/v_pos should always be positive and  fortran and gives consistant rounding.
+                        u_indx = int(u_m * uv_scale[0, i_chan] + uv_center[0] + 0.5)
+                        v_indx = int(v_m * uv_scale[1, i_chan] + uv_center[1] + 0.5)
+
+                    if (u_indx >= n_uv[0]) or (v_indx >= n_uv[1]) or (u_indx < 0) or (v_indx < 0):
+                        continue
+
+                taper = 1.0
+                if do_taper:
+                    taper = math.exp(-(taper_coefficients[0] * u_m * u_m + taper_coefficients[1] * v_m * v_m + taper_coefficients[2] * u_m * v_m) * wavelength_scale_squared[i_chan])
+
+                lookup_row = lookup_table[chan_map[i_chan], u_indx, v_indx, :]
+                for i_pol in range(n_pol):
+                    imaging_weight[i_time, i_baseline, i_chan, i_pol] = natural_imaging_weight[i_time, i_baseline, i_chan, i_pol] * lookup_row[i_pol] * taper
+    return
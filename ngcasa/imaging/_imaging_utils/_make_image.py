@@ -0,0 +1,95 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+
+def _setup_make_image(vis_dataset, grid_parms, storage_parms, do_psf, do_image_and_psf, default_outfile, graph_name, default_image_name='DIRTY_IMAGE', default_sum_weight_name='SUM_WEIGHT'):
+    """
+      Copies and checks the grid_parms and storage_parms of make_image, make_psf and make_image_and_psf and gets the gridding convolution kernel.
+
+      Returns
+      -------
+      _grid_parms : dictionary
+          As checked by _check_grid_params.
+      _storage_parms : dictionary
+          As checked by _check_storage_parms.
+      cgk_1D : float array
+          (oversampling*(support//2 + 1))
+      correcting_cgk_image : float array
+          (n_u, n_v) The gridding correction (see _get_gcf).
+      """
+    import copy
+    from ngcasa._ngcasa_utils._check_parms import _check_storage_parms
+    from ._check_imaging_parms import _check_grid_params
+    from ._gcf_cache import _get_gcf
+
+    _grid_parms = copy.deepcopy(grid_parms)
+    _storage_parms = copy.deepcopy(storage_parms)
+
+    _grid_parms['do_psf'] = do_psf
+    _grid_parms['do_image_and_psf'] = do_image_and_psf
+
+    assert(_check_grid_params(vis_dataset,_grid_parms,default_image_name=default_image_name,default_sum_weight_name=default_sum_weight_name)), "######### ERROR: grid_parms checking failed"
+    assert(_check_storage_parms(_storage_parms,default_outfile,graph_name)), "######### ERROR: storage_parms checking failed"
+
+    # Getting the gridding kernel from the cache or creating it
+    cf_dataset = _get_gcf('prolate_spheroidal', _grid_parms['oversampling'], _grid_parms['support'], _grid_parms['imsize_padded'], _grid_parms['gcf_cache_dir'])
+    return _grid_parms, _storage_parms, cf_dataset['CGK_1D'].values, cf_dataset['CORRECTING_CGK'].values
+
+
+def _graph_make_image(vis_dataset, cgk_1D, correcting_cgk_image, grid_parms, timings=None):
+    """
+      Grids the visibilities (w-stacking, w-projection or standard gridding), does the fft and normalizes the image, as set up by _setup_make_image.
+      With grid_parms['grid_accumulation'] = 'streaming' the prefetch timings are added to timings (see _stream_grid).
+
+      Returns
+      -------
+      corrected_image : dask array
+          (n_l, n_m, n_imag_chan, n_imag_pol) With grid_parms['do_image_and_psf'] the psf polarizations follow the image polarizations.
+      sum_weight : dask array
+          (n_imag_chan, n_imag_pol)
+      """
+    from ._standard_grid import _graph_standard_grid
+    from ._w_term import _graph_w_stacking, _graph_w_projection_kernels
+    from ._normalize import _normalize_image
+    from ._fft import _ifft2_shifted
+
+    if grid_parms['wterm'] == 'wstacking':
+        uncorrected_image, sum_weight = _graph_w_stacking(vis_dataset, cgk_1D, grid_parms)
+    else:
+        if grid_parms['wterm'] == 'wprojection':
+            grid_parms['w_planes'], cgk_1D = _graph_w_projection_kernels(vis_dataset, grid_parms)
+        grid, sum_weight = _graph_standard_grid(vis_dataset, cgk_1D, grid_parms, timings)
+        uncorrected_image = _ifft2_shifted(grid, grid_parms, grid_parms['imsize']) #Only the pixels kept by _remove_padding are computed.
+
+    #Remove the padding, fft scaling, sum of weights and gridding correction in one pass.
+    corrected_image = _normalize_image(uncorrected_image, sum_weight, correcting_cgk_image, grid_parms)
+    return corrected_image, sum_weight
+
+
+def _image_coords(vis_dataset, grid_parms):
+    """
+      The d0, d1, chan, pol and chan_width coordinates of the images of make_image, make_psf and make_image_and_psf.
+      """
+    import dask.array as da
+
+    if grid_parms['chan_mode'] == 'continuum':
+        freq_coords = [da.mean(vis_dataset.coords['chan'].values)]
+        chan_width = da.from_array([da.mean(vis_dataset['chan_width'].data)],chunks=(1,))
+    elif grid_parms['chan_mode'] == 'cube':
+        freq_coords = vis_dataset.coords['chan'].values
+        chan_width = vis_dataset['chan_width'].data
+
+    n_imag_pol = vis_dataset[grid_parms['data_name']].chunks[3][0]
+    return {'d0': np.arange(grid_parms['imsize'][0]), 'd1': np.arange(grid_parms['imsize'][1]),
+            'chan': freq_coords, 'pol': np.arange(n_imag_pol), 'chan_width' : ('chan',chan_width)}
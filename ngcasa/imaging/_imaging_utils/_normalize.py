@@ -11,6 +11,8 @@
 #   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
+from numba import jit
+import numpy as np
 
 def _normalize(direction, normtype):
     """
@@ -21,4 +23,72 @@ def _normalize(direction, normtype):
 
     Multiply and/or divide by PB models, accounting for masks/regions.
 
-    """
\ No newline at end of file
+    """
+
+def _normalize_image(uncorrected_image, sum_weight, correcting_cgk_image, grid_parms):
+    """
+    Post fft normalization of the images made by make_image, make_psf and make_image_and_psf. The padding is removed, the real part is taken,
+    the fft scale factor (n_u x n_v) is applied and the image is divided by the sum of weights and the gridding correction function.
+    This is done by _normalize_jit in one pass over each image block, so no full size intermediate images are created.
+
+    Parameters
+    ----------
+    uncorrected_image : complex dask array
+        (n_u, n_v, n_chan, n_pol) or (imsize[0], imsize[1], n_chan, n_pol) if the fft already removed the padding (see _ifft2_shifted).
+    sum_weight : float dask array
+        (n_chan, n_pol)
+    correcting_cgk_image : float array
+        (n_u, n_v)
+    grid_parms : dictionary
+        keys ('imsize','imsize_padded')
+
+    Returns
+    -------
+    corrected_image : float dask array
+        (imsize[0], imsize[1], n_chan, n_pol) float32 if uncorrected_image is complex64 otherwise float64.
+    """
+    import dask.array as da
+    from ._remove_padding import _remove_padding
+
+    image_dtype = np.empty(0, dtype=uncorrected_image.dtype).real.dtype
+    #Slicing only creates views, the copy is done by _normalize_jit.
+    uncorrected_image = _remove_padding(uncorrected_image, grid_parms['imsize'])
+    correcting_cgk_image = _remove_padding(correcting_cgk_image, grid_parms['imsize']).astype(image_dtype)
+    fft_scale = float(grid_parms['imsize_padded'][0] * grid_parms['imsize_padded'][1])
+
+    return da.map_blocks(_normalize_block, uncorrected_image, sum_weight, correcting_cgk_image, fft_scale, dtype=image_dtype)
+
+
+def _normalize_block(uncorrected_image, sum_weight, correcting_cgk, fft_scale, block_info=None):
+    #The image is chunked along d0 and d1 if grid_parms['n_fft_slabs'] > 1, so the part of the correcting image of the block is used.
+    (d0_start, d0_end), (d1_start, d1_end) = block_info[0]['array-location'][0:2]
+    image_dtype = np.empty(0, dtype=uncorrected_image.dtype).real.dtype
+    normalization = (fft_scale / np.where(sum_weight == 0, 1, sum_weight)).astype(image_dtype)
+    corrected_image = np.empty(uncorrected_image.shape, dtype=image_dtype)
+    _normalize_jit(uncorrected_image, normalization, correcting_cgk[d0_start:d0_end, d1_start:d1_end], corrected_image)
+    return corrected_image
+
+
+@jit(nopython=True, cache=True, nogil=True)
+def _normalize_jit(uncorrected_image, normalization, correcting_cgk, corrected_image):
+    """
+      corrected_image = real(uncorrected_image) x normalization / correcting_cgk
+
+      Parameters
+      ----------
+      uncorrected_image : complex array
+          (n_d0, n_d1, n_chan, n_pol)
+      normalization : float array
+          (n_chan, n_pol) n_u x n_v / sum_weight
+      correcting_cgk : float array
+          (n_d0, n_d1)
+      corrected_image : float array
+          (n_d0, n_d1, n_chan, n_pol)
+      """
+    n_d0, n_d1, n_chan, n_pol = uncorrected_image.shape
+    for i_d0 in range(n_d0):
+        for i_d1 in range(n_d1):
+            inv_cgk = 1 / correcting_cgk[i_d0, i_d1]
+            for i_chan in range(n_chan):
+                for i_pol in range(n_pol):
+                    corrected_image[i_d0, i_d1, i_chan, i_pol] = uncorrected_image[i_d0, i_d1, i_chan, i_pol].real * normalization[i_chan, i_pol] * inv_cgk
@@ -0,0 +1,344 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+from numba import jit
+import numpy as np
+from ._w_term import _select_w_plane
+
+def _bounding_box_grid_numpy_wrap(vis_data, uvw, weight, freq_chan, cgk_1D, grid_parms):
+    """
+      Grids a chunk of visibilities into a sub-grid that only covers the bounding box of the chunk's uv footprint.
+
+      Parameters
+      ----------
+      vis_data : complex array
+          (n_time, n_baseline, n_vis_chan, n_pol)
+      uvw  : float array
+          (n_time, n_baseline, 3)
+      weight : float array
+          (n_time, n_baseline, n_vis_chan, n_pol)
+      freq_chan : float array
+          (n_chan)
+      cgk_1D : float array
+          (oversampling*(support//2 + 1))
+      grid_parms : dictionary
+          keys ('imsize','cell','oversampling','support')
+
+      Returns
+      -------
+      bounding_box_grid : tuple of (sub_grid, origin, sum_weight)
+          sub_grid is a (n_imag_chan, n_imag_pol, n_u_box, n_v_box) array and origin the (u, v) grid index of sub_grid[:, :, 0, 0].
+      """
+    from ._standard_grid import _append_psf_pols, _grid_dtype
+
+    if grid_parms['do_image_and_psf']:
+        vis_data, weight = _append_psf_pols(vis_data, weight)
+    return _bounding_box_grid(vis_data, uvw, weight, freq_chan, cgk_1D, grid_parms, _grid_dtype(grid_parms))
+
+
+def _bounding_box_grid_psf_numpy_wrap(uvw, weight, freq_chan, cgk_1D, grid_parms):
+    """
+      Grids the weights of a chunk into a sub-grid that only covers the bounding box of the chunk's uv footprint.
+      The vis_dataset is not loaded, see _bounding_box_grid_numpy_wrap.
+      """
+    from ._standard_grid import _grid_dtype
+
+    vis_data = np.zeros((1, 1, 1, 1), dtype=bool) #This 0 bool array is needed to pass to _window_grid_jit so that the code can be resued and to keep numba happy.
+    return _bounding_box_grid(vis_data, uvw, weight, freq_chan, cgk_1D, grid_parms, _grid_dtype(grid_parms))
+
+
+def _bounding_box_grid(vis_data, uvw, weight, freq_chan, cgk_1D, grid_parms, grid_dtype):
+    from ._uv_index import _calc_uv_index
+
+    if grid_parms['wterm'] == 'wstacking':
+        #The bounding box only covers the visibilities of the w-plane.
+        vis_data, uvw, weight = _select_w_plane(vis_data, uvw, weight, freq_chan, grid_parms['do_psf'], grid_parms)
+
+    n_chan = weight.shape[2]
+    if grid_parms['chan_mode'] == 'cube':
+        n_imag_chan = n_chan
+        chan_map = (np.arange(0, n_chan)).astype(int)
+    else:  # continuum
+        n_imag_chan = 1  # Making only one continuum image.
+        chan_map = (np.zeros(n_chan)).astype(int)
+
+    n_imag_pol = weight.shape[3]
+    pol_map = (np.arange(0, n_imag_pol)).astype(int)
+
+    n_uv = grid_parms['imsize_padded']
+    oversampling = grid_parms['oversampling']
+    support = grid_parms['support']
+    support_center = support // 2
+
+    u_indx, v_indx, u_offset_indx, v_offset_indx = _calc_uv_index(uvw, freq_chan, n_uv, grid_parms['cell'], oversampling)
+
+    in_grid = (u_indx + support_center < n_uv[0]) & (v_indx + support_center < n_uv[1]) & (u_indx - support_center >= 0) & (v_indx - support_center >= 0)
+    sum_weight = np.zeros((n_imag_chan, n_imag_pol), dtype=np.double)
+    if not np.any(in_grid):
+        return np.zeros((n_imag_chan, n_imag_pol, 0, 0), dtype=grid_dtype), np.zeros(2, dtype=int), sum_weight
+
+    origin = np.array([u_indx[in_grid].min(), v_indx[in_grid].min()]) - support_center
+    end = np.array([u_indx[in_grid].max(), v_indx[in_grid].max()]) + (support - support_center)
+    sub_grid = np.zeros((n_imag_chan, n_imag_pol, end[0] - origin[0], end[1] - origin[1]), dtype=grid_dtype)
+
+    _window_grid_jit(sub_grid, sum_weight, grid_parms['do_psf'], vis_data.reshape((-1, vis_data.shape[3])), weight.reshape((-1, n_imag_pol)),
+                     u_indx.ravel(), v_indx.ravel(), u_offset_indx.ravel(), v_offset_indx.ravel(), chan_map, pol_map, cgk_1D, n_uv, origin, support, oversampling)
+
+    return sub_grid, origin, sum_weight
+
+
+def _merge_bounding_box_grids(bounding_box_grid_1, bounding_box_grid_2):
+    """
+      Sums two bounding box grids into a grid that covers the union of the two bounding boxes.
+      """
+    sub_grid_1, origin_1, sum_weight_1 = bounding_box_grid_1
+    sub_grid_2, origin_2, sum_weight_2 = bounding_box_grid_2
+
+    if sub_grid_1.size == 0:
+        return sub_grid_2, origin_2, sum_weight_1 + sum_weight_2
+    if sub_grid_2.size == 0:
+        return sub_grid_1, origin_1, sum_weight_1 + sum_weight_2
+
+    origin = np.minimum(origin_1, origin_2)
+    end = np.maximum(origin_1 + sub_grid_1.shape[2:], origin_2 + sub_grid_2.shape[2:])
+    sub_grid = np.zeros(sub_grid_1.shape[:2] + tuple(end - origin), dtype=np.result_type(sub_grid_1, sub_grid_2))
+
+    for sub_grid_i, origin_i in ((sub_grid_1, origin_1), (sub_grid_2, origin_2)):
+        start_i = origin_i - origin
+        sub_grid[:, :, start_i[0]:start_i[0] + sub_grid_i.shape[2], start_i[1]:start_i[1] + sub_grid_i.shape[3]] += sub_grid_i
+
+    return sub_grid, origin, sum_weight_1 + sum_weight_2
+
+
+def _bounding_box_to_grid(bounding_box_grid, n_uv):
+    """
+      Converts a bounding box grid to a full size grid.
+      """
+    sub_grid, origin, sum_weight = bounding_box_grid
+    grid = np.zeros(sub_grid.shape[:2] + (n_uv[0], n_uv[1]), dtype=sub_grid.dtype)
+    grid[:, :, origin[0]:origin[0] + sub_grid.shape[2], origin[1]:origin[1] + sub_grid.shape[3]] = sub_grid
+    return grid, sum_weight
+
+
+def _slab_bin_numpy_wrap(vis_data, uvw, weight, freq_chan, grid_parms, slab_edges):
+    """
+      Bins the visibilities of a chunk by the u-slabs grid[:, :, slab_edges[i]:slab_edges[i+1], :] of the full grid that their kernel footprint reaches (used by grid_parms['n_fft_slabs'] > 1),
+      so that the chunk is read once and every slab task only grids the visibilities of its slab (see _slab_grid).
+
+      Parameters
+      ----------
+      vis_data : complex array
+          (n_time, n_baseline, n_vis_chan, n_pol)
+      uvw  : float array
+          (n_time, n_baseline, 3)
+      weight : float array
+          (n_time, n_baseline, n_vis_chan, n_pol)
+      freq_chan : float array
+          (n_chan)
+      grid_parms : dictionary
+          keys ('imsize_padded','cell','oversampling','support','chan_mode','do_psf','do_image_and_psf','bda_tolerance')
+      slab_edges : int array
+          (n_fft_slabs + 1)
+
+      Returns
+      -------
+      list_of_slab_vis : list of tuple
+          For every slab (vis_data, weight, u_indx, v_indx, u_offset_indx, v_offset_indx, chan_indx) of the visibilities that reach it, vis_data and weight are (n_slab_vis, n_pol) and the
+          indices (n_slab_vis). A visibility whose footprint crosses a slab edge is in both slabs.
+      """
+    from ._standard_grid import _append_psf_pols
+
+    if grid_parms['do_image_and_psf']:
+        vis_data, weight = _append_psf_pols(vis_data, weight)
+    return _slab_bin(vis_data, uvw, weight, freq_chan, grid_parms, slab_edges)
+
+
+def _slab_bin_psf_numpy_wrap(uvw, weight, freq_chan, grid_parms, slab_edges):
+    """
+      Bins the weights of a chunk by u-slab. The vis_dataset is not loaded, see _slab_bin_numpy_wrap.
+      """
+    vis_data = np.zeros((1, 1, 1, 1), dtype=bool) #This 0 bool array is needed to pass to _window_grid_jit so that the code can be resued and to keep numba happy.
+    return _slab_bin(vis_data, uvw, weight, freq_chan, grid_parms, slab_edges)
+
+
+def _slab_bin(vis_data, uvw, weight, freq_chan, grid_parms, slab_edges):
+    from ._uv_index import _calc_uv_index
+    from ._baseline_dependent_averaging import _baseline_dependent_average
+
+    n_chan = weight.shape[2]
+    if grid_parms['chan_mode'] == 'cube':
+        chan_map = (np.arange(0, n_chan)).astype(int)
+    else:  # continuum
+        chan_map = (np.zeros(n_chan)).astype(int)
+
+    n_imag_pol = weight.shape[3]
+    n_uv = grid_parms['imsize_padded']
+    support = grid_parms['support']
+    support_center = support // 2
+    do_psf = grid_parms['do_psf']
+    n_slabs = len(slab_edges) - 1
+
+    if grid_parms['bda_tolerance'] > 0:
+        list_of_vis_streams = _baseline_dependent_average(vis_data, uvw, weight, freq_chan, chan_map, do_psf, grid_parms)
+    else:
+        list_of_vis_streams = [(vis_data, uvw, weight, freq_chan, chan_map)]
+
+    list_of_slab_vis_streams = [[] for i_slab in range(n_slabs)]
+    for vis_data, uvw, weight, freq_chan, chan_map in list_of_vis_streams:
+        u_indx, v_indx, u_offset_indx, v_offset_indx = _calc_uv_index(uvw, freq_chan, n_uv, grid_parms['cell'], grid_parms['oversampling'])
+        chan_indx = np.broadcast_to(chan_map, u_indx.shape).ravel()
+        u_indx, v_indx, u_offset_indx, v_offset_indx = u_indx.ravel(), v_indx.ravel(), u_offset_indx.ravel(), v_offset_indx.ravel()
+        weight = weight.reshape((-1, n_imag_pol))
+        vis_data = vis_data.reshape((-1, vis_data.shape[3]))
+
+        #Only the visibilities with their footprint inside the grid are gridded (see _window_grid_jit).
+        in_grid = np.flatnonzero((u_indx + support_center < n_uv[0]) & (v_indx + support_center < n_uv[1]) & (u_indx - support_center >= 0) & (v_indx - support_center >= 0))
+
+        #The footprint of a visibility covers the u cells [u_indx - support_center, u_indx - support_center + support).
+        first_slab = np.searchsorted(slab_edges, u_indx[in_grid] - support_center, side='right') - 1
+        last_slab = np.searchsorted(slab_edges, u_indx[in_grid] - support_center + support - 1, side='right') - 1
+        order = np.argsort(first_slab, kind='stable')
+        slab_starts = np.searchsorted(first_slab[order], np.arange(n_slabs + 1))
+        crossing = np.flatnonzero(last_slab > first_slab)
+
+        for i_slab in range(n_slabs):
+            slab_vis_indx = in_grid[np.concatenate((order[slab_starts[i_slab]:slab_starts[i_slab + 1]], crossing[(first_slab[crossing] < i_slab) & (last_slab[crossing] >= i_slab)]))]
+            list_of_slab_vis_streams[i_slab].append((vis_data if do_psf else vis_data[slab_vis_indx], weight[slab_vis_indx], u_indx[slab_vis_indx], v_indx[slab_vis_indx],
+                                                     u_offset_indx[slab_vis_indx], v_offset_indx[slab_vis_indx], chan_indx[slab_vis_indx]))
+
+    list_of_slab_vis = []
+    for list_of_slab_vis_stream in list_of_slab_vis_streams:
+        if do_psf:
+            list_of_slab_vis.append((list_of_slab_vis_stream[0][0],) + tuple(np.concatenate(arrays) for arrays in list(zip(*list_of_slab_vis_stream))[1:]))
+        else:
+            list_of_slab_vis.append(tuple(np.concatenate(arrays) for arrays in zip(*list_of_slab_vis_stream)))
+    return list_of_slab_vis
+
+
+def _slab_grid(slab_vis, cgk_1D, grid_parms, n_imag_chan, slab_start, slab_end):
+    """
+      Grids the visibilities of a u-slab, as binned by _slab_bin_numpy_wrap, into the slab grid[:, :, slab_start:slab_end, :] of the full grid.
+      The slab grids of all the chunks are summed per slab, so no task holds the full grid.
+
+      Returns
+      -------
+      slab_grid : complex array
+          (n_imag_chan, n_imag_pol, slab_end - slab_start, n_v)
+      sum_weight : float array
+          (n_imag_chan, n_imag_pol) Only the visibilities with their center cell in the slab are counted, so the slab sum of weights add up to the full grid sum of weights.
+      """
+    from ._standard_grid import _grid_dtype
+
+    vis_data, weight, u_indx, v_indx, u_offset_indx, v_offset_indx, chan_indx = slab_vis
+    n_imag_pol = weight.shape[1]
+    pol_map = (np.arange(0, n_imag_pol)).astype(int)
+    n_uv = grid_parms['imsize_padded']
+
+    slab_grid = np.zeros((n_imag_chan, n_imag_pol, slab_end - slab_start, n_uv[1]), dtype=_grid_dtype(grid_parms))
+    sum_weight = np.zeros((n_imag_chan, n_imag_pol), dtype=np.double)
+
+    #chan_indx has one entry per visibility, see _window_grid_jit.
+    _window_grid_jit(slab_grid, sum_weight, grid_parms['do_psf'], vis_data, weight, u_indx, v_indx, u_offset_indx, v_offset_indx, chan_indx, pol_map, cgk_1D, n_uv,
+                     np.array([slab_start, 0]), grid_parms['support'], grid_parms['oversampling'])
+
+    return slab_grid, sum_weight
+
+
+@jit(nopython=True, cache=True, nogil=True)
+def _window_grid_jit(grid_window, sum_weight, do_psf, vis_data, weight, u_indx, v_indx, u_offset_indx, v_offset_indx, chan_map, pol_map, cgk_1D,
+                     n_uv, window_origin, support, oversampling):
+    """
+      Grids visibilities into a rectangular window of the full grid. Writes outside the window are dropped and
+      only visibilities with their center cell inside the window add to sum_weight, so that gridding into windows that tile the grid gives the same result as gridding into the full grid.
+
+      Parameters
+      ----------
+      grid_window : complex array
+          (n_chan, n_pol, n_u_window, n_v_window)
+      sum_weight : float array
+          (n_chan, n_pol)
+      vis_data : complex array
+          (n_time*n_baseline*n_vis_chan, n_pol)
+      weight : float array
+          (n_time*n_baseline*n_vis_chan, n_pol)
+      u_indx, v_indx, u_offset_indx, v_offset_indx : int array
+          (n_time*n_baseline*n_vis_chan)
+      chan_map : int array
+          (n_vis_chan) The grid channel of visibility i_vis is chan_map[i_vis % n_vis_chan], so a chan_map with one entry per visibility can also be given.
+      pol_map : int array
+          (n_pol)
+      cgk_1D : float array
+          (oversampling*(support//2 + 1))
+      n_uv : int array
+          (2) Size of the full grid.
+      window_origin : int array
+          (2) Full grid (u, v) index of grid_window[:, :, 0, 0].
+
+      Returns
+      -------
+      """
+    support_center = int(support // 2)
+    start_support = - support_center
+    end_support = support - support_center
+
+    n_chan = len(chan_map)
+    n_pol = len(pol_map)
+    n_vis = len(u_indx)
+    n_u_window = grid_window.shape[2]
+    n_v_window = grid_window.shape[3]
+
+    for i_vis in range(n_vis):
+        u_center_indx = u_indx[i_vis]
+        v_center_indx = v_indx[i_vis]
+
+        if (u_center_indx+support_center < n_uv[0]) and (v_center_indx+support_center < n_uv[1]) and (u_center_indx-support_center >= 0) and (v_center_indx-support_center >= 0):
+            u_window_indx = u_center_indx - window_origin[0]
+            v_window_indx = v_center_indx - window_origin[1]
+
+            if (u_window_indx + end_support <= 0) or (u_window_indx + start_support >= n_u_window) or (v_window_indx + end_support <= 0) or (v_window_indx + start_support >= n_v_window):
+                continue
+
+            center_in_window = (u_window_indx >= 0) and (u_window_indx < n_u_window) and (v_window_indx >= 0) and (v_window_indx < n_v_window)
+            a_chan = chan_map[i_vis % n_chan]
+            u_center_offset_indx = u_offset_indx[i_vis]
+            v_center_offset_indx = v_offset_indx[i_vis]
+
+            for i_pol in range(n_pol):
+                if do_psf:
+                    weighted_data = weight[i_vis, i_pol]
+                else:
+                    weighted_data = vis_data[i_vis, i_pol] * weight[i_vis, i_pol]
+
+                if ~np.isnan(weighted_data) and (weighted_data != 0.0):
+                    a_pol = pol_map[i_pol]
+                    norm = 0.0
+
+                    for i_v in range(start_support, end_support):
+                        v_grid_indx = v_window_indx + i_v
+                        v_conv_indx = np.abs(oversampling * i_v + v_center_offset_indx)
+                        conv_v = cgk_1D[v_conv_indx]
+
+                        for i_u in range(start_support, end_support):
+                            u_grid_indx = u_window_indx + i_u
+                            u_conv_indx = np.abs(oversampling * i_u + u_center_offset_indx)
+                            conv_u = cgk_1D[u_conv_indx]
+                            conv = conv_u * conv_v
+
+                            if (u_grid_indx >= 0) and (u_grid_indx < n_u_window) and (v_grid_indx >= 0) and (v_grid_indx < n_v_window):
+                                grid_window[a_chan, a_pol, u_grid_indx, v_grid_indx] = grid_window[a_chan, a_pol, u_grid_indx, v_grid_indx] + conv * weighted_data
+                            norm = norm + conv
+
+                    if center_in_window:
+                        sum_weight[a_chan, a_pol] = sum_weight[a_chan, a_pol] + weight[i_vis, i_pol] * norm
+
+    return
@@ -0,0 +1,100 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+def _prefetch_chunks(chunks, n_prefetch_chunks, n_prefetch_threads, prepare=None, timings=None):
+    """
+      Generator that reads the chunks of dask arrays (for example DATA, UVW and IMAGING_WEIGHT opened from zarr) ahead of their use on background threads.
+
+      Up to n_prefetch_chunks chunks after the one that is being used are loaded by a pool of n_prefetch_threads threads, each chunk is computed with the
+      synchronous dask scheduler so the reads and the blosc decompression of a chunk run on one of the pool threads (numcodecs releases the GIL while decompressing).
+      The chunks are yielded in the order of chunks. The memory is bounded by n_prefetch_chunks + 1 chunks.
+
+      Parameters
+      ----------
+      chunks : iterable of tuple
+          (chunk_key, list_of_delayed) for every chunk, where list_of_delayed are blocks of the dask arrays (see dask.array.Array.to_delayed). It is consumed lazily.
+      n_prefetch_chunks : int
+          The number of chunks that are loaded ahead of the one that is being used.
+      n_prefetch_threads : int
+          The number of threads that load the chunks.
+      prepare : function, default = None
+          If given prepare(chunk_key, *arrays) is called on the pool thread after the chunk is loaded and its result is yielded instead of (chunk_key, arrays).
+      timings : dictionary, default = None
+          If given the seconds spent are added to timings['read'] (loading the chunks, summed over the threads), timings['prepare'] (prepare, summed over the threads),
+          timings['wait'] (waiting for a chunk that was not loaded yet) and timings['compute'] (using the chunks, between the yields), and the number of chunks to timings['n_chunks'].
+
+      Yields
+      ------
+      chunk : tuple
+          (chunk_key, arrays) or the result of prepare.
+      """
+    import collections
+    import dask
+    import itertools
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    if timings is None:
+        timings = {}
+    for timing_name in ['read', 'prepare', 'wait', 'compute', 'n_chunks']:
+        timings.setdefault(timing_name, 0)
+
+    def load_chunk(chunk_key, list_of_delayed):
+        start = time.perf_counter()
+        arrays = dask.compute(*list_of_delayed, scheduler='synchronous')
+        read_time = time.perf_counter() - start
+        if prepare is None:
+            return (chunk_key, arrays), read_time, 0.0
+        start = time.perf_counter()
+        chunk = prepare(chunk_key, *arrays)
+        return chunk, read_time, time.perf_counter() - start
+
+    chunks = iter(chunks)
+    loading_chunks = collections.deque()
+    with ThreadPoolExecutor(max_workers=n_prefetch_threads) as pool:
+        try:
+            for chunk_key, list_of_delayed in itertools.islice(chunks, n_prefetch_chunks):
+                loading_chunks.append(pool.submit(load_chunk, chunk_key, list_of_delayed))
+
+            while len(loading_chunks) > 0:
+                start = time.perf_counter()
+                chunk, read_time, prepare_time = loading_chunks.popleft().result()
+                timings['wait'] += time.perf_counter() - start
+                timings['read'] += read_time
+                timings['prepare'] += prepare_time
+
+                #Keep n_prefetch_chunks chunks loading while this chunk is used.
+                for chunk_key, list_of_delayed in itertools.islice(chunks, 1):
+                    loading_chunks.append(pool.submit(load_chunk, chunk_key, list_of_delayed))
+
+                start = time.perf_counter()
+                yield chunk
+                timings['compute'] += time.perf_counter() - start
+                timings['n_chunks'] += 1
+        finally:
+            #The generator is closed or the chunk could not be used, the chunks that have not started loading are dropped.
+            for loading_chunk in loading_chunks:
+                loading_chunk.cancel()
+
+
+def _prefetch_attrs(timings, grid_parms):
+    """
+      Returns the dataset attributes with the time spent reading and using the chunks of _prefetch_chunks, the timings filled by _stream_grid.
+      Empty if the chunks were not read by _prefetch_chunks.
+      """
+    if len(timings) == 0:
+        return {}
+    return {'prefetch_timings': {'n_chunks': int(timings['n_chunks']), 'n_prefetch_threads': int(grid_parms['n_prefetch_threads']),
+                                 'read_time': float(timings['read']), 'prepare_time': float(timings['prepare']),
+                                 'wait_time': float(timings['wait']), 'compute_time': float(timings['compute'])}}
@@ -14,17 +14,31 @@
 from numba import jit
 import numpy as np
 import math
+from ._tiled_grid import _tiled_grid, _parallel_tiled_grid
+from ._partial_grid import _bounding_box_grid_numpy_wrap, _bounding_box_grid_psf_numpy_wrap, _merge_bounding_box_grids, _bounding_box_to_grid, _slab_bin_numpy_wrap, _slab_bin_psf_numpy_wrap, _slab_grid
+from ._w_term import _select_w_plane, _w_projection_grid_jit
+from ._chan_grouping import _chan_group_grid_jit
+from ._baseline_dependent_averaging import _baseline_dependent_average
+from ._uv_index import _standard_grid_uv_index_jit, _standard_degrid_uv_index_jit, _grid_visibility_jit, _degrid_visibility_jit
+from ._batched_grid import _graph_batched_grid
+from ._stream_grid import _stream_grid
 
 def ndim_list(shape):
     return [ndim_list(shape[1:]) if len(shape) > 1 else None for _ in range(shape[0])]
 
-def _graph_standard_grid(vis_dataset, cgk_1D, grid_parms):
+def _graph_standard_grid(vis_dataset, cgk_1D, grid_parms, timings=None):
+    #timings is only used by 'streaming' grid accumulation, the read timings of the chunks are added to it (see _stream_grid).
     import dask
     import dask.array as da
     import xarray as xr
     import time
     import itertools
 
+    if grid_parms['grid_accumulation'] == 'batched':
+        return _graph_batched_grid(vis_dataset, cgk_1D, grid_parms)
+    elif grid_parms['grid_accumulation'] == 'streaming':
+        return _stream_grid(vis_dataset, cgk_1D, grid_parms, timings)
+
     # Getting data for gridding
     chan_chunk_size = vis_dataset[grid_parms["imaging_weight_name"]].chunks[2][0]
 
@@ -46,62 +60,166 @@ def _graph_standard_grid(vis_dataset, cgk_1D, grid_parms):
     #n_delayed = np.prod(n_chunks_in_each_dim)
     chunk_sizes = vis_dataset[grid_parms["imaging_weight_name"]].chunks
 
-    list_of_grids = ndim_list((n_chan_chunks_img,n_other_chunks))
-    list_of_sum_weights = ndim_list((n_chan_chunks_img,n_other_chunks))
+    list_of_chunk_indx = ndim_list((n_chan_chunks_img,n_other_chunks))
     
-  
-    # Build graph
-    for c_time, c_baseline, c_chan, c_pol in iter_chunks_indx:
+    grid_dtype = _grid_dtype(grid_parms)
+
+    def grid_chunk(c_time, c_baseline, c_chan, c_pol, grid_and_sum_weight=None, slab_edges=None):
         #There are two diffrent gridder wrapped functions _standard_grid_psf_numpy_wrap and _standard_grid_numpy_wrap.
         #This is done to simplify the psf and weight gridding graphs so that the vis_dataset is not loaded.
+        #For grid_parms['grid_accumulation'] = 'bounding_box' the bounding box equivalents are used and grid_and_sum_weight is ignored.
+        #If slab_edges is given the visibilities are only binned by the u-slabs they reach (grid_parms['n_fft_slabs'] > 1) and a tuple with the delayed bins of the slabs is returned.
+        #If grid_parms['uv_index_name'] is given the grid cells are read from the uv index (see make_uv_index) and the uvw values are not loaded.
+        if grid_parms['uv_index_name'] != '':
+            uv_index_kwargs = {'uv_index': vis_dataset[grid_parms['uv_index_name']].data.partitions[c_time, c_baseline, c_chan, 0],
+                               'uv_offset': vis_dataset[vis_dataset[grid_parms['uv_index_name']].attrs['uv_offset_name']].data.partitions[c_time, c_baseline, c_chan, 0]}
+            uvw = None
+        else:
+            uv_index_kwargs = {}
+            uvw = vis_dataset[grid_parms["uvw_name"]].data.partitions[c_time, c_baseline, 0]
         if grid_parms['do_psf']:
-            sub_grid_and_sum_weights = dask.delayed(_standard_grid_psf_numpy_wrap)(
-            vis_dataset[grid_parms["uvw_name"]].data.partitions[c_time, c_baseline, 0],
-            vis_dataset[grid_parms["imaging_weight_name"]].data.partitions[c_time, c_baseline, c_chan, c_pol],
-             freq_chan.partitions[c_chan],
-            dask.delayed(cgk_1D), dask.delayed(grid_parms))
-            grid_dtype = np.double
+            if slab_edges is not None:
+                sub_grid_and_sum_weights = dask.delayed(_slab_bin_psf_numpy_wrap, nout=len(slab_edges) - 1)(
+                vis_dataset[grid_parms["uvw_name"]].data.partitions[c_time, c_baseline, 0],
+                vis_dataset[grid_parms["imaging_weight_name"]].data.partitions[c_time, c_baseline, c_chan, c_pol],
+                 freq_chan.partitions[c_chan],
+                dask.delayed(grid_parms), slab_edges)
+            elif grid_parms['grid_accumulation'] == 'bounding_box':
+                sub_grid_and_sum_weights = dask.delayed(_bounding_box_grid_psf_numpy_wrap)(
+                vis_dataset[grid_parms["uvw_name"]].data.partitions[c_time, c_baseline, 0],
+                vis_dataset[grid_parms["imaging_weight_name"]].data.partitions[c_time, c_baseline, c_chan, c_pol],
+                 freq_chan.partitions[c_chan],
+                dask.delayed(cgk_1D), dask.delayed(grid_parms))
+            else:
+                sub_grid_and_sum_weights = dask.delayed(_standard_grid_psf_numpy_wrap)(
+                uvw,
+                vis_dataset[grid_parms["imaging_weight_name"]].data.partitions[c_time, c_baseline, c_chan, c_pol],
+                 freq_chan.partitions[c_chan],
+                dask.delayed(cgk_1D), dask.delayed(grid_parms), grid_and_sum_weight, **uv_index_kwargs)
         else:
-            sub_grid_and_sum_weights = dask.delayed(_standard_grid_numpy_wrap)(
-            vis_dataset[grid_parms["data_name"]].data.partitions[c_time, c_baseline, c_chan, c_pol],
-            vis_dataset[grid_parms["uvw_name"]].data.partitions[c_time, c_baseline, 0],
-            vis_dataset[grid_parms["imaging_weight_name"]].data.partitions[c_time, c_baseline, c_chan, c_pol],
-            freq_chan.partitions[c_chan],
-            dask.delayed(cgk_1D), dask.delayed(grid_parms))
-            grid_dtype = np.complex128
-        
-        
+            if slab_edges is not None:
+                sub_grid_and_sum_weights = dask.delayed(_slab_bin_numpy_wrap, nout=len(slab_edges) - 1)(
+                vis_dataset[grid_parms["data_name"]].data.partitions[c_time, c_baseline, c_chan, c_pol],
+                vis_dataset[grid_parms["uvw_name"]].data.partitions[c_time, c_baseline, 0],
+                vis_dataset[grid_parms["imaging_weight_name"]].data.partitions[c_time, c_baseline, c_chan, c_pol],
+                freq_chan.partitions[c_chan],
+                dask.delayed(grid_parms), slab_edges)
+            elif grid_parms['grid_accumulation'] == 'bounding_box':
+                sub_grid_and_sum_weights = dask.delayed(_bounding_box_grid_numpy_wrap)(
+                vis_dataset[grid_parms["data_name"]].data.partitions[c_time, c_baseline, c_chan, c_pol],
+                vis_dataset[grid_parms["uvw_name"]].data.partitions[c_time, c_baseline, 0],
+                vis_dataset[grid_parms["imaging_weight_name"]].data.partitions[c_time, c_baseline, c_chan, c_pol],
+                freq_chan.partitions[c_chan],
+                dask.delayed(cgk_1D), dask.delayed(grid_parms))
+            else:
+                sub_grid_and_sum_weights = dask.delayed(_standard_grid_numpy_wrap)(
+                vis_dataset[grid_parms["data_name"]].data.partitions[c_time, c_baseline, c_chan, c_pol],
+                uvw,
+                vis_dataset[grid_parms["imaging_weight_name"]].data.partitions[c_time, c_baseline, c_chan, c_pol],
+                freq_chan.partitions[c_chan],
+                dask.delayed(cgk_1D), dask.delayed(grid_parms), grid_and_sum_weight, **uv_index_kwargs)
+        return sub_grid_and_sum_weights
+  
+    # Build graph
+    for c_time, c_baseline, c_chan, c_pol in iter_chunks_indx:
         if grid_parms['chan_mode'] == 'continuum':
             c_time_baseline_chan_pol = c_pol + c_chan*n_chunks_in_each_dim[3] + c_baseline*n_chunks_in_each_dim[3]*n_chunks_in_each_dim[2] + c_time*n_chunks_in_each_dim[3]*n_chunks_in_each_dim[2]*n_chunks_in_each_dim[1]
-            list_of_grids[0][c_time_baseline_chan_pol] = da.from_delayed(sub_grid_and_sum_weights[0], (1, chunk_sizes[3][c_pol], grid_parms['imsize_padded'][0], grid_parms['imsize_padded'][1]),dtype=grid_dtype)
-            list_of_sum_weights[0][c_time_baseline_chan_pol] = da.from_delayed(sub_grid_and_sum_weights[1],(1, chunk_sizes[3][c_pol]),dtype=np.float64)
-            
+            list_of_chunk_indx[0][c_time_baseline_chan_pol] = (c_time, c_baseline, c_chan, c_pol)
         elif grid_parms['chan_mode'] == 'cube':
             c_time_baseline_pol = c_pol + c_baseline*n_chunks_in_each_dim[3] + c_time*n_chunks_in_each_dim[1]*n_chunks_in_each_dim[3]
-            list_of_grids[c_chan][c_time_baseline_pol] = da.from_delayed(sub_grid_and_sum_weights[0], (chunk_sizes[2][c_chan], chunk_sizes[3][c_pol], grid_parms['imsize_padded'][0], grid_parms['imsize_padded'][1]),dtype=grid_dtype)
-            list_of_sum_weights[c_chan][c_time_baseline_pol]  = da.from_delayed(sub_grid_and_sum_weights[1],(chunk_sizes[2][c_chan], chunk_sizes[3][c_pol]),dtype=np.float64)
-            
-            
-    # Sum grids
-    for c_chan in range(n_chan_chunks_img):
-        list_of_grids[c_chan] = _tree_sum_list(list_of_grids[c_chan])
-        list_of_sum_weights[c_chan] = _tree_sum_list(list_of_sum_weights[c_chan])
+            list_of_chunk_indx[c_chan][c_time_baseline_pol] = (c_time, c_baseline, c_chan, c_pol)
+    
+    list_of_grids = []
+    list_of_sum_weights = []
+    for c_img_chan in range(n_chan_chunks_img):
+        if grid_parms['chan_mode'] == 'continuum':
+            n_img_chan = 1
+        elif grid_parms['chan_mode'] == 'cube':
+            n_img_chan = chunk_sizes[2][c_img_chan]
+        n_img_pol = chunk_sizes[3][0]
+        if grid_parms['do_image_and_psf']:
+            n_img_pol = 2*n_img_pol #The psf is gridded as extra polarizations, see _append_psf_pols.
+        
+        grid_shape = _grid_shape(n_img_chan, n_img_pol, grid_parms)
+        sum_weight_shape = (n_img_chan, n_img_pol)
+        
+        if grid_parms['n_fft_slabs'] > 1:
+            #Each u-slab of the grid is gridded and summed separately and the slabs are only concatenated in the dask array, so that the fft (see _fft.py) can be done without any task holding the full grid.
+            #Every chunk is read and binned by u-slab once, so each slab task only grids the visibilities that reach its slab.
+            slab_edges = np.linspace(0, grid_parms['imsize_padded'][0], grid_parms['n_fft_slabs'] + 1).astype(int)
+            list_of_slab_bins = [grid_chunk(*chunk_indx, slab_edges=slab_edges) for chunk_indx in list_of_chunk_indx[c_img_chan]]
+            list_of_slab_grids = []
+            list_of_slab_sum_weights = []
+            for i_slab, slab in enumerate(zip(slab_edges[:-1], slab_edges[1:])):
+                slab_grid_shape = (n_img_chan, n_img_pol, slab[1] - slab[0], grid_parms['imsize_padded'][1])
+                list_of_sub_grids_and_sum_weights = [dask.delayed(_slab_grid, nout=2)(slab_bins[i_slab], dask.delayed(cgk_1D), dask.delayed(grid_parms), n_img_chan, slab[0], slab[1])
+                                                     for slab_bins in list_of_slab_bins]
+                list_of_slab_grids.append(_tree_sum_list([da.from_delayed(sub_grid_and_sum_weights[0], slab_grid_shape, dtype=grid_dtype) for sub_grid_and_sum_weights in list_of_sub_grids_and_sum_weights])[0])
+                list_of_slab_sum_weights.extend([da.from_delayed(sub_grid_and_sum_weights[1], sum_weight_shape, dtype=np.float64) for sub_grid_and_sum_weights in list_of_sub_grids_and_sum_weights])
+            list_of_grids.append([da.concatenate(list_of_slab_grids, axis=2)])
+            list_of_sum_weights.append(_tree_sum_list(list_of_slab_sum_weights))
+            continue
+        elif grid_parms['grid_accumulation'] == 'chained':
+            #Each chain of tasks grids its chunks one after the other into its grid (each task grids into a copy of its input, see _copy_accumulator),
+            #so at most 2 x n_accumulators grids exist for each image channel chunk.
+            chains = np.array_split(np.arange(n_other_chunks), min(grid_parms['n_accumulators'], n_other_chunks))
+            list_of_sub_grids_and_sum_weights = []
+            for chain in chains:
+                sub_grid_and_sum_weights = None
+                for i_chunk in chain:
+                    sub_grid_and_sum_weights = grid_chunk(*list_of_chunk_indx[c_img_chan][i_chunk], grid_and_sum_weight=sub_grid_and_sum_weights)
+                list_of_sub_grids_and_sum_weights.append(sub_grid_and_sum_weights)
+        elif grid_parms['grid_accumulation'] == 'bounding_box':
+            #The sub-grids only cover the uv footprint of their chunk and are merged without creating full size grids until the end.
+            list_of_bounding_box_grids = [grid_chunk(*chunk_indx) for chunk_indx in list_of_chunk_indx[c_img_chan]]
+            bounding_box_grid = _tree_sum_delayed_list(list_of_bounding_box_grids, _merge_bounding_box_grids)
+            list_of_sub_grids_and_sum_weights = [dask.delayed(_bounding_box_to_grid, nout=2)(bounding_box_grid, grid_parms['imsize_padded'])]
+        else:
+            list_of_sub_grids_and_sum_weights = [grid_chunk(*chunk_indx) for chunk_indx in list_of_chunk_indx[c_img_chan]]
+        
+        list_of_sub_grids = [da.from_delayed(sub_grid_and_sum_weights[0], grid_shape, dtype=grid_dtype) for sub_grid_and_sum_weights in list_of_sub_grids_and_sum_weights]
+        list_of_sub_sum_weights = [da.from_delayed(sub_grid_and_sum_weights[1], sum_weight_shape, dtype=np.float64) for sub_grid_and_sum_weights in list_of_sub_grids_and_sum_weights]
+        
+        # Sum grids
+        list_of_grids.append(_tree_sum_list(list_of_sub_grids))
+        list_of_sum_weights.append(_tree_sum_list(list_of_sub_sum_weights))
 
+    if grid_parms['grid_layout'] == 'u_v_chan_pol':
+        grid_chan_axis = 3 #The tree sum adds a leading axis.
+    else:
+        grid_chan_axis = 1
+    
     # Concatenate Cube
     if grid_parms['chan_mode'] == 'cube':
-        list_of_grids_and_sum_weights = [da.concatenate(list_of_grids,axis=1)[0],da.concatenate(list_of_sum_weights,axis=1)[0]]
+        list_of_grids_and_sum_weights = [da.concatenate(list_of_grids,axis=grid_chan_axis)[0],da.concatenate(list_of_sum_weights,axis=1)[0]]
     else:
         list_of_grids_and_sum_weights = [list_of_grids[0][0],list_of_sum_weights[0][0]]
     
     # Put axes in image orientation. How much does this add to compute?
-    list_of_grids_and_sum_weights[0] = da.moveaxis(list_of_grids_and_sum_weights[0], [0, 1],
-                                                                [-2, -1])
+    # The u_v_chan_pol grids are already in image orientation.
+    if grid_parms['grid_layout'] != 'u_v_chan_pol':
+        list_of_grids_and_sum_weights[0] = da.moveaxis(list_of_grids_and_sum_weights[0], [0, 1],
+                                                                    [-2, -1])
     
     list_of_grids_and_sum_weights[1] = da.moveaxis(list_of_grids_and_sum_weights[1],[0, 1], [-2, -1])
     
     return list_of_grids_and_sum_weights
     
 
+def _tree_sum_delayed_list(list_to_sum, sum_function):
+    import dask
+    while len(list_to_sum) > 1:
+        new_list_to_sum = []
+        for i in range(0, len(list_to_sum), 2):
+            if i < len(list_to_sum) - 1:
+                lazy = dask.delayed(sum_function)(list_to_sum[i],list_to_sum[i+1])
+            else:
+                lazy = list_to_sum[i]
+            new_list_to_sum.append(lazy)
+        list_to_sum = new_list_to_sum
+    return list_to_sum[0]
+    
+
 def _tree_sum_list(list_to_sum):
     import dask.array as da
     while len(list_to_sum) > 1:
@@ -116,7 +234,7 @@ def _tree_sum_list(list_to_sum):
     return list_to_sum
     
     
-def _standard_grid_numpy_wrap(vis_data, uvw, weight, freq_chan, cgk_1D, grid_parms):
+def _standard_grid_numpy_wrap(vis_data, uvw, weight, freq_chan, cgk_1D, grid_parms, grid_and_sum_weight=None, uv_index=None, uv_offset=None):
     """
       Wraps the jit gridder code.
       
@@ -136,14 +254,19 @@ def _standard_grid_numpy_wrap(vis_data, uvw, weight, freq_chan, cgk_1D, grid_par
           (oversampling*(support//2 + 1))
       grid_parms : dictionary
           keys ('imsize','cell','oversampling','support')
+      grid_and_sum_weight : tuple of (grid, sum_weight), default = None
+          If given the visibilities are gridded into a copy of this grid and sum of weights instead of new ones (used by grid_parms['grid_accumulation'] = 'chained'), see _copy_accumulator.
+      uv_index, uv_offset : int32 array, int16 array, default = None
+          (n_time, n_baseline, n_vis_chan, 2) If given the grid cells and kernel offsets are read from them and uvw is not used (see make_uv_index).
 
       Returns
       -------
       grid : complex array
-          (1,n_imag_chan,n_imag_pol,n_u,n_v)
+          (1,n_imag_chan,n_imag_pol,n_u,n_v) or (n_u,n_v,n_imag_chan,n_imag_pol) if grid_parms['grid_layout'] is 'u_v_chan_pol'
       """
-      
     
+    if grid_parms['do_image_and_psf']:
+        vis_data, weight = _append_psf_pols(vis_data, weight)
 
     n_chan = weight.shape[2]
     if grid_parms['chan_mode'] == 'cube':
@@ -161,20 +284,20 @@ def _standard_grid_numpy_wrap(vis_data, uvw, weight, freq_chan, cgk_1D, grid_par
     oversampling = grid_parms['oversampling']
     support = grid_parms['support']
     
-    if grid_parms['complex_grid']:
-        grid = np.zeros((n_imag_chan, n_imag_pol, n_uv[0], n_uv[1]), dtype=np.complex128)
+    if grid_and_sum_weight is not None:
+        grid, sum_weight = _copy_accumulator(grid_and_sum_weight)
     else:
-        grid = np.zeros((n_imag_chan, n_imag_pol, n_uv[0], n_uv[1]), dtype=np.double)
-    sum_weight = np.zeros((n_imag_chan, n_imag_pol), dtype=np.double)
+        grid = np.zeros(_grid_shape(n_imag_chan, n_imag_pol, grid_parms), dtype=_grid_dtype(grid_parms))
+        sum_weight = np.zeros((n_imag_chan, n_imag_pol), dtype=np.double) #The sum of weights is always accumulated in double precision, it is tiny compared to the grid.
     
     do_psf = grid_parms['do_psf']
-    _standard_grid_jit(grid, sum_weight, do_psf, vis_data, uvw, freq_chan, chan_map, pol_map, weight, cgk_1D, n_uv, delta_lm, support, oversampling)
+    _call_gridder(grid, sum_weight, do_psf, vis_data, uvw, freq_chan, chan_map, pol_map, weight, cgk_1D, grid_parms, uv_index, uv_offset)
      
 
     return grid, sum_weight
 
 
-def _standard_grid_psf_numpy_wrap(uvw, weight, freq_chan, cgk_1D, grid_parms):
+def _standard_grid_psf_numpy_wrap(uvw, weight, freq_chan, cgk_1D, grid_parms, grid_and_sum_weight=None, uv_index=None, uv_offset=None):
     """
       Wraps the jit gridder code.
       
@@ -194,14 +317,17 @@ def _standard_grid_psf_numpy_wrap(uvw, weight, freq_chan, cgk_1D, grid_parms):
           (oversampling*(support//2 + 1))
       grid_parms : dictionary
           keys ('imsize','cell','oversampling','support')
+      grid_and_sum_weight : tuple of (grid, sum_weight), default = None
+          If given the weights are gridded into a copy of this grid and sum of weights instead of new ones (used by grid_parms['grid_accumulation'] = 'chained'), see _copy_accumulator.
+      uv_index, uv_offset : int32 array, int16 array, default = None
+          (n_time, n_baseline, n_vis_chan, 2) If given the grid cells and kernel offsets are read from them and uvw is not used (see make_uv_index).
 
       Returns
       -------
       grid : complex array
-          (1,n_imag_chan,n_imag_pol,n_u,n_v)
+          (1,n_imag_chan,n_imag_pol,n_u,n_v) or (n_u,n_v,n_imag_chan,n_imag_pol) if grid_parms['grid_layout'] is 'u_v_chan_pol'
       """
     
-    
     n_chan = weight.shape[2]
     if grid_parms['chan_mode'] == 'cube':
         n_imag_chan = n_chan
@@ -219,28 +345,143 @@ def _standard_grid_psf_numpy_wrap(uvw, weight, freq_chan, cgk_1D, grid_parms):
     oversampling = grid_parms['oversampling']
     support = grid_parms['support']
     
-    grid = np.zeros((n_imag_chan, n_imag_pol, n_uv[0], n_uv[1]), dtype=np.double)
-    sum_weight = np.zeros((n_imag_chan, n_imag_pol), dtype=np.double)
+    if grid_and_sum_weight is not None:
+        grid, sum_weight = _copy_accumulator(grid_and_sum_weight)
+    else:
+        grid = np.zeros(_grid_shape(n_imag_chan, n_imag_pol, grid_parms), dtype=_grid_dtype(grid_parms))
+        sum_weight = np.zeros((n_imag_chan, n_imag_pol), dtype=np.double)
     
     do_psf = grid_parms['do_psf']
     vis_data = np.zeros((1, 1, 1, 1), dtype=np.bool) #This 0 bool array is needed to pass to _standard_grid_jit so that the code can be resued and to keep numba happy.
 
-    _standard_grid_jit(grid, sum_weight, do_psf, vis_data, uvw, freq_chan, chan_map, pol_map, weight, cgk_1D, n_uv, delta_lm, support, oversampling)
+    _call_gridder(grid, sum_weight, do_psf, vis_data, uvw, freq_chan, chan_map, pol_map, weight, cgk_1D, grid_parms, uv_index, uv_offset)
     
     return grid, sum_weight
 
 
+def _copy_accumulator(grid_and_sum_weight):
+    """
+      Copies the grid and sum of weights of the previous task of a 'chained' grid accumulation chain before the next chunk is gridded into them.
+      Dask task inputs must not be changed in place: a retried task would grid its chunk twice into its input and the scheduler may still hold the input for another task.
+      The copy is freed with the input when the task ends, so a chain holds at most two grids at a time.
+      """
+    grid, sum_weight = grid_and_sum_weight
+    return grid.copy(), sum_weight.copy()
+
+
+def _append_psf_pols(vis_data, weight):
+    """
+      Appends the psf as extra polarizations to a chunk of visibilities, so that the data and the weights are gridded in the same pass (grid_parms['do_image_and_psf']).
+      The psf visibilities are all 1, so that the psf polarizations give the same grid and sum of weights as gridding the weights with do_psf.
+
+      Parameters
+      ----------
+      vis_data : complex array
+          (n_time, n_baseline, n_vis_chan, n_pol)
+      weight : float array
+          (n_time, n_baseline, n_vis_chan, n_pol)
+
+      Returns
+      -------
+      vis_data : complex array
+          (n_time, n_baseline, n_vis_chan, 2*n_pol)
+      weight : float array
+          (n_time, n_baseline, n_vis_chan, 2*n_pol)
+      """
+    psf_data = np.ones(weight.shape, dtype=vis_data.dtype)
+    return np.concatenate((vis_data, psf_data), axis=3), np.concatenate((weight, weight), axis=3)
+
+
+def _grid_dtype(grid_parms):
+    """
+      The dtype of the grids. Psf and imaging weight grids are real unless w-projection kernels are used.
+      """
+    if (not grid_parms['do_psf']) or (grid_parms['wterm'] == 'wprojection'):
+        if grid_parms['precision'] == 'single':
+            return np.complex64
+        else:
+            return np.complex128
+    else:
+        if grid_parms['precision'] == 'single':
+            return np.float32
+        else:
+            return np.double
+
+
+def _grid_shape(n_imag_chan, n_imag_pol, grid_parms):
+    """
+      The shape of a grid, (n_chan, n_pol, n_u, n_v) or (n_u, n_v, n_chan, n_pol) if grid_parms['grid_layout'] is 'u_v_chan_pol'.
+      """
+    n_uv = grid_parms['imsize_padded']
+    if grid_parms['grid_layout'] == 'u_v_chan_pol':
+        return (n_uv[0], n_uv[1], n_imag_chan, n_imag_pol)
+    else:
+        return (n_imag_chan, n_imag_pol, n_uv[0], n_uv[1])
+
+
+def _call_gridder(grid, sum_weight, do_psf, vis_data, uvw, freq_chan, chan_map, pol_map, weight, cgk_1D, grid_parms, uv_index=None, uv_offset=None):
+    """
+      Grids a chunk of visibilities with the gridder selected by grid_parms['gridder'].
+      'standard' grids the visibilities in time/baseline order, 'tiled' first bins them by uv tile (see _tiled_grid)
+      and 'parallel' grids the tiles with all the available threads directly into the grid of the chain (see _parallel_tiled_grid).
+      If grid_parms['wterm'] is 'wstacking' only the visibilities of the w-plane grid_parms['i_w_plane'] are gridded (see _select_w_plane).
+      If grid_parms['wterm'] is 'wprojection' cgk_1D are the w-projection kernels of the w-planes grid_parms['w_planes'] (see _w_projection_grid_jit).
+      If grid_parms['grid_layout'] is 'u_v_chan_pol' the grid is (n_u, n_v, n_chan, n_pol), _standard_grid_jit selects the write order of _grid_visibility_jit for it.
+      Continuum grids with grid_parms['chan_grouping_tolerance'] > 0 are gridded by _chan_group_grid_jit.
+      If grid_parms['bda_tolerance'] > 0 the chunk is first averaged per baseline (see _baseline_dependent_average) and each averaged stream is gridded.
+      If uv_index is given _standard_grid_uv_index_jit is used (only supported with the standard gridder, see _check_grid_params).
+      """
+    n_uv = grid_parms['imsize_padded']
+    oversampling = grid_parms['oversampling']
+    support = grid_parms['support']
+    
+    if uv_index is not None:
+        _standard_grid_uv_index_jit(grid, sum_weight, do_psf, vis_data, uv_index, uv_offset, chan_map, pol_map, weight, cgk_1D, n_uv, support, oversampling)
+        return
+    
+    if grid_parms['wterm'] == 'wstacking':
+        vis_data, uvw, weight = _select_w_plane(vis_data, uvw, weight, freq_chan, do_psf, grid_parms)
+    
+    if grid_parms['bda_tolerance'] > 0:
+        list_of_vis_streams = _baseline_dependent_average(vis_data, uvw, weight, freq_chan, chan_map, do_psf, grid_parms)
+    else:
+        list_of_vis_streams = [(vis_data, uvw, weight, freq_chan, chan_map)]
+    
+    for stream_vis_data, stream_uvw, stream_weight, stream_freq_chan, stream_chan_map in list_of_vis_streams:
+        _grid_vis_stream(grid, sum_weight, do_psf, stream_vis_data, stream_uvw, stream_freq_chan, stream_chan_map, pol_map, stream_weight, cgk_1D, grid_parms)
+
+
+def _grid_vis_stream(grid, sum_weight, do_psf, vis_data, uvw, freq_chan, chan_map, pol_map, weight, cgk_1D, grid_parms):
+    """
+      Grids a stream of visibilities (see _call_gridder) with the gridding kernel selected by grid_parms.
+      """
+    n_uv = grid_parms['imsize_padded']
+    delta_lm = grid_parms['cell']
+    oversampling = grid_parms['oversampling']
+    support = grid_parms['support']
+    
+    if (grid_parms['chan_mode'] == 'continuum') and (grid_parms['chan_grouping_tolerance'] > 0):
+        _chan_group_grid_jit(grid, sum_weight, do_psf, vis_data, uvw, freq_chan, pol_map, weight, cgk_1D, n_uv, delta_lm, support, oversampling, grid_parms['chan_grouping_tolerance'])
+    elif grid_parms['wterm'] == 'wprojection':
+        _w_projection_grid_jit(grid, sum_weight, do_psf, vis_data, uvw, freq_chan, chan_map, pol_map, weight, cgk_1D, grid_parms['w_planes'], n_uv, delta_lm, grid_parms['w_support'], grid_parms['w_oversampling'])
+    elif grid_parms['gridder'] == 'tiled':
+        _tiled_grid(grid, sum_weight, do_psf, vis_data, uvw, freq_chan, chan_map, pol_map, weight, cgk_1D, n_uv, delta_lm, support, oversampling, grid_parms['tile_size'])
+    elif grid_parms['gridder'] == 'parallel':
+        _parallel_tiled_grid(grid, sum_weight, do_psf, vis_data, uvw, freq_chan, chan_map, pol_map, weight, cgk_1D, n_uv, delta_lm, support, oversampling, grid_parms['tile_size'])
+    else:
+        _standard_grid_jit(grid, sum_weight, do_psf, vis_data, uvw, freq_chan, chan_map, pol_map, weight, cgk_1D, n_uv, delta_lm, support, oversampling, grid_parms['grid_layout'] == 'u_v_chan_pol')
+
 import numpy as np
 
 #When jit is used round is repolaced by standard c++ round that is different to python round
 @jit(nopython=True, cache=True, nogil=True)
 def _standard_grid_jit(grid, sum_weight, do_psf, vis_data, uvw, freq_chan, chan_map, pol_map, weight, cgk_1D,
-                       n_uv, delta_lm, support, oversampling):
+                       n_uv, delta_lm, support, oversampling, pol_innermost=False):
     """
       Parameters
       ----------
       grid : complex array 
-          (n_chan, n_pol, n_u, n_v)
+          (n_chan, n_pol, n_u, n_v) or (n_u, n_v, n_chan, n_pol) if pol_innermost (grid_parms['grid_layout'] = 'u_v_chan_pol')
       sum_weight : float array 
           (n_chan, n_pol) 
       vis_data : complex array 
@@ -263,28 +504,24 @@ def _standard_grid_jit(grid, sum_weight, do_psf, vis_data, uvw, freq_chan, chan_
       Returns
       -------
       """
-      
+
     c = 299792458.0
     uv_scale = np.zeros((2, len(freq_chan)), dtype=np.double)
     uv_scale[0, :] = -(freq_chan * delta_lm[0] * n_uv[0]) / c
     uv_scale[1, :] = -(freq_chan * delta_lm[1] * n_uv[1]) / c
 
-    #oversampling_center = int(oversampling // 2)
-    support_center = int(support // 2)
     uv_center = n_uv // 2
-
-    start_support = - support_center
-    end_support = support - support_center # end_support is larger by 1 so that python range() gives correct indices
-    
     
     n_time = uvw.shape[0]
     n_baseline = uvw.shape[1]
     n_chan = len(chan_map)
     n_pol = len(pol_map)
     
-    n_u = n_uv[0]
-    n_v = n_uv[1]
-    
+    #Work space of _grid_visibility_jit.
+    conv_u = np.zeros(support, dtype=np.double)
+    conv_v = np.zeros(support, dtype=np.double)
+    valid_pol = np.zeros(n_pol, dtype=np.int64)
+    valid_weighted_data = np.zeros(n_pol, dtype=grid.dtype)
     
     for i_time in range(n_time):
         for i_baseline in range(n_baseline):
@@ -298,77 +535,48 @@ def _standard_grid_jit(grid, sum_weight, do_psf, vis_data, uvw, freq_chan, chan_
                     v_pos = v + uv_center[1]
                     
                     #Doing round as int(x+0.5) since u_pos/v_pos should always positive and this matices fortran and gives consistant rounding.
-                    #u_center_indx = int(u_pos + 0.5)
-                    #v_center_indx = int(v_pos + 0.5)
-                    
                     #Do not use numpy round
                     u_center_indx = int(u_pos + 0.5)
                     v_center_indx = int(v_pos + 0.5)
                     
-                    if (u_center_indx+support_center < n_u) and (v_center_indx+support_center < n_v) and (u_center_indx-support_center >= 0) and (v_center_indx-support_center >= 0):
-                        u_offset = u_center_indx - u_pos
-                        u_center_offset_indx = math.floor(u_offset * oversampling + 0.5)
-                        v_offset = v_center_indx - v_pos
-                        v_center_offset_indx = math.floor(v_offset * oversampling + 0.5)
-                        
-                        for i_pol in range(n_pol):
-                            if do_psf:
-                                weighted_data = weight[i_time, i_baseline, i_chan, i_pol]
-                            else:
-                                weighted_data = vis_data[i_time, i_baseline, i_chan, i_pol] * weight[i_time, i_baseline, i_chan, i_pol]
-                                
-                            #print('1. u_center_indx, v_center_indx', u_center_indx, v_center_indx, vis_data[i_time, i_baseline, i_chan, i_pol], weight[i_time, i_baseline, i_chan, i_pol])
-                            
-                            if ~np.isnan(weighted_data) and (weighted_data != 0.0):
-                                a_pol = pol_map[i_pol]
-                                norm = 0.0
-                                
-                                for i_v in range(start_support,end_support):
-                                    v_indx = v_center_indx + i_v
-                                    v_offset_indx = np.abs(oversampling * i_v + v_center_offset_indx)
-                                    conv_v = cgk_1D[v_offset_indx]
-                                        
-
-                                    for i_u in range(start_support,end_support):
-                                        u_indx = u_center_indx + i_u
-                                        u_offset_indx = np.abs(oversampling * i_u + u_center_offset_indx)
-                                        conv_u = cgk_1D[u_offset_indx]
-                                        conv = conv_u * conv_v
-                                            
-                                        grid[a_chan, a_pol, u_indx, v_indx] = grid[a_chan, a_pol, u_indx, v_indx] + conv * weighted_data
-                                        norm = norm + conv
-                                        
-                                        
-                                sum_weight[a_chan, a_pol] = sum_weight[a_chan, a_pol] + weight[i_time, i_baseline, i_chan, i_pol] * norm
+                    u_center_offset_indx = math.floor((u_center_indx - u_pos) * oversampling + 0.5)
+                    v_center_offset_indx = math.floor((v_center_indx - v_pos) * oversampling + 0.5)
+                    
+                    _grid_visibility_jit(grid, sum_weight, do_psf, vis_data, weight, i_time, i_baseline, i_chan, a_chan, pol_map, u_center_indx, v_center_indx,
+                                         u_center_offset_indx, v_center_offset_indx, cgk_1D, support, oversampling, conv_u, conv_v, valid_pol, valid_weighted_data, pol_innermost)
 
     return
 
+
 ############################################################################################################################################################################################################################################################################################################################################################################################################################################################
 ############################################################################################################################################################################################################################################################################################################################################################################################################################################################
 ############################################################################################################################################################################################################################################################################################################################################################################################################################################################
 
 
 
-def _graph_standard_degrid(vis_dataset, grid, briggs_factors, cgk_1D, grid_parms):
+def _graph_standard_degrid(vis_dataset, grid, cgk_1D, grid_parms):
    import dask
    import dask.array as da
    import xarray as xr
    import time
    import itertools
    
+   # The model visibilities have the chunking of the visibility data.
+   chunk_data_name = grid_parms["data_name"]
+   
    # Getting data for gridding
-   chan_chunk_size = vis_dataset[grid_parms["imaging_weight_name"]].chunks[2][0]
+   chan_chunk_size = vis_dataset[chunk_data_name].chunks[2][0]
 
    freq_chan = da.from_array(vis_dataset.coords['chan'].values, chunks=(chan_chunk_size))
 
-   n_chunks_in_each_dim = vis_dataset[grid_parms["imaging_weight_name"]].data.numblocks
+   n_chunks_in_each_dim = vis_dataset[chunk_data_name].data.numblocks
    chunk_indx = []
 
    iter_chunks_indx = itertools.product(np.arange(n_chunks_in_each_dim[0]), np.arange(n_chunks_in_each_dim[1]),
                                         np.arange(n_chunks_in_each_dim[2]), np.arange(n_chunks_in_each_dim[3]))
 
    #n_delayed = np.prod(n_chunks_in_each_dim)
-   chunk_sizes = vis_dataset[grid_parms["imaging_weight_name"]].chunks
+   chunk_sizes = vis_dataset[chunk_data_name].chunks
 
    n_chan_chunks_img = n_chunks_in_each_dim[2]
    list_of_degrids = []
@@ -376,6 +584,8 @@ def _graph_standard_degrid(vis_dataset, grid, briggs_factors, cgk_1D, grid_parms
    
    list_of_degrids = ndim_list(n_chunks_in_each_dim)
    
+   #The unoptimized graphs keep the keys of the grid, so the grid is only created once and not again for every task that uses it.
+   grid_blocks = grid.to_delayed(optimize_graph=False)
    
    # Build graph
    for c_time, c_baseline, c_chan, c_pol in iter_chunks_indx:
@@ -384,104 +594,130 @@ def _graph_standard_degrid(vis_dataset, grid, briggs_factors, cgk_1D, grid_parms
        else:
             a_c_chan = 0
        
-       if grid_parms['do_imaging_weight']:
-           sub_degrid = dask.delayed(_standard_imaging_weight_degrid_numpy_wrap)(
-                grid.partitions[0,0,a_c_chan,c_pol],
-                vis_dataset[grid_parms["uvw_name"]].data.partitions[c_time, c_baseline, 0],
-                vis_dataset[grid_parms["imaging_weight_name"]].data.partitions[c_time, c_baseline, c_chan, c_pol],
-                briggs_factors.partitions[:,a_c_chan,c_pol],
-                freq_chan.partitions[c_chan],
-                dask.delayed(grid_parms))
-                
-           single_chunk_size = (chunk_sizes[0][c_time], chunk_sizes[1][c_baseline],chunk_sizes[2][c_chan], chunk_sizes[3][c_pol])
-           list_of_degrids[c_time][c_baseline][c_chan][c_pol] = da.from_delayed(sub_degrid, single_chunk_size,dtype=np.double)
+       #If grid_parms['uv_index_name'] is given the grid cells are read from the uv index (see make_uv_index) and the uvw values are not loaded.
+       if grid_parms['uv_index_name'] != '':
+           uv_index_kwargs = {'uv_index': vis_dataset[grid_parms['uv_index_name']].data.partitions[c_time, c_baseline, c_chan, 0],
+                              'uv_offset': vis_dataset[vis_dataset[grid_parms['uv_index_name']].attrs['uv_offset_name']].data.partitions[c_time, c_baseline, c_chan, 0]}
+           uvw = None
        else:
-           print('Degridding of visibilities and psf still needs to be implemented')
-           
-           #sub_grid_and_sum_weights = dask.delayed(_standard_grid_numpy_wrap)(
-           #vis_dataset[vis_dataset[grid_parms["data"]].data.partitions[c_time, c_baseline, c_chan, c_pol],
-           #vis_dataset[grid_parms["uvw"]].data.partitions[c_time, c_baseline, 0],
-           #vis_dataset[grid_parms["imaging_weight"]].data.partitions[c_time, c_baseline, c_chan, c_pol],
-           #freq_chan.partitions[c_chan],
-           #dask.delayed(cgk_1D), dask.delayed(grid_parms))
+           uv_index_kwargs = {}
+           uvw = vis_dataset[grid_parms["uvw_name"]].data.partitions[c_time, c_baseline, 0]
+       
+       sub_degrid = dask.delayed(_standard_degrid_numpy_wrap)(
+            grid_blocks[0,0,a_c_chan,c_pol],
+            uvw,
+            freq_chan.partitions[c_chan],
+            dask.delayed(cgk_1D), dask.delayed(grid_parms), **uv_index_kwargs)
+            
+       single_chunk_size = (chunk_sizes[0][c_time], chunk_sizes[1][c_baseline],chunk_sizes[2][c_chan], chunk_sizes[3][c_pol])
+       list_of_degrids[c_time][c_baseline][c_chan][c_pol] = da.from_delayed(sub_degrid, single_chunk_size,dtype=np.complex128)
        
    degrid = da.block(list_of_degrids)
    return degrid
 
 
-def _standard_imaging_weight_degrid_numpy_wrap(grid_imaging_weight, uvw, natural_imaging_weight, briggs_factors, freq_chan, grid_parms):
-    n_chan = natural_imaging_weight.shape[2]
-    n_imag_chan = n_chan
-    
+def _standard_degrid_numpy_wrap(grid, uvw, freq_chan, cgk_1D, grid_parms, uv_index=None, uv_offset=None):
+    """
+      Wraps the jit degridder code.
+      
+      Parameters
+      ----------
+      grid : complex array
+          (n_u, n_v, n_imag_chan, n_pol)
+      uvw  : float array
+          (n_time, n_baseline, 3)
+      freq_chan : float array
+          (n_chan)
+      cgk_1D : float array
+          (oversampling*(support//2 + 1))
+      grid_parms : dictionary
+          keys ('imsize_padded','cell','oversampling','support','chan_mode')
+      uv_index, uv_offset : int32 array, int16 array, default = None
+          (n_time, n_baseline, n_chan, 2) If given the grid cells and kernel offsets are read from them and uvw is not used (see make_uv_index).
+
+      Returns
+      -------
+      model_vis : complex array
+          (n_time, n_baseline, n_chan, n_pol)
+      """
+    n_chan = len(freq_chan)
     if grid_parms['chan_mode'] == 'cube':
-        n_imag_chan = n_chan
-        chan_map = (np.arange(0, n_chan)).astype(np.int)
+        chan_map = (np.arange(0, n_chan)).astype(int)
     else:  # continuum
-        n_imag_chan = 1
-        chan_map = (np.zeros(n_chan)).astype(np.int)
-        
-    n_imag_pol = natural_imaging_weight.shape[3]
-    pol_map = (np.arange(0, n_imag_pol)).astype(np.int)
-
-    n_uv = grid_parms['imsize_padded']
-    delta_lm = grid_parms['cell']
+        chan_map = (np.zeros(n_chan)).astype(int)
     
-    imaging_weight = np.zeros(natural_imaging_weight.shape, dtype=np.double)
-                       
-    _standard_imaging_weight_degrid_jit(imaging_weight, grid_imaging_weight, briggs_factors, uvw, freq_chan, chan_map, pol_map, natural_imaging_weight,n_uv, delta_lm)
+    n_pol = grid.shape[3]
+    pol_map = (np.arange(0, n_pol)).astype(int)
     
-    return imaging_weight
+    if uv_index is not None:
+        model_vis = np.zeros((uv_index.shape[0], uv_index.shape[1], n_chan, n_pol), dtype=np.complex128)
+        _standard_degrid_uv_index_jit(model_vis, grid, uv_index, uv_offset, chan_map, pol_map, cgk_1D, grid_parms['imsize_padded'], grid_parms['support'], grid_parms['oversampling'])
+    else:
+        model_vis = np.zeros((uvw.shape[0], uvw.shape[1], n_chan, n_pol), dtype=np.complex128)
+        _standard_degrid_jit(model_vis, grid, uvw, freq_chan, chan_map, pol_map, cgk_1D, grid_parms['imsize_padded'], grid_parms['cell'], grid_parms['support'], grid_parms['oversampling'])
+    
+    return model_vis
+
 
+#When jit is used round is repolaced by standard c++ round that is different to python round
 @jit(nopython=True, cache=True, nogil=True)
-def _standard_imaging_weight_degrid_jit(imaging_weight, grid_imaging_weight, briggs_factors, uvw, freq_chan, chan_map, pol_map, natural_imaging_weight, n_uv, delta_lm):
+def _standard_degrid_jit(model_vis, grid, uvw, freq_chan, chan_map, pol_map, cgk_1D, n_uv, delta_lm, support, oversampling):
+    """
+      Interpolates the visibilities from a grid with the gridding convolution kernel. The grid index and kernel offset calculations are the same as in _standard_grid_jit.
+      Visibilities whose kernel footprint is not fully inside the grid (or that have nan uvw values) are set to nan.
+      
+      Parameters
+      ----------
+      model_vis : complex array
+          (n_time, n_baseline, n_chan, n_pol)
+      grid : complex array
+          (n_u, n_v, n_imag_chan, n_pol)
+      uvw  : float array
+          (n_time, n_baseline, 3)
+      freq_chan : float array
+          (n_chan)
+      chan_map : int array
+          (n_chan)
+      pol_map : int array
+          (n_pol)
+      cgk_1D : float array
+          (oversampling*(support//2 + 1))
+
+      Returns
+      -------
+      """
     c = 299792458.0
     uv_scale = np.zeros((2, len(freq_chan)), dtype=np.double)
     uv_scale[0, :] = -(freq_chan * delta_lm[0] * n_uv[0]) / c
     uv_scale[1, :] = -(freq_chan * delta_lm[1] * n_uv[1]) / c
-    
+
     uv_center = n_uv // 2
     
-    
     n_time = uvw.shape[0]
     n_baseline = uvw.shape[1]
     n_chan = len(chan_map)
     n_pol = len(pol_map)
-    n_imag_chan = chan_map.shape[0]
-
-    n_u = n_uv[0]
-    n_v = n_uv[1]
-    
-    #print('Degrid operation')
     
     for i_time in range(n_time):
         for i_baseline in range(n_baseline):
             for i_chan in range(n_chan):
-                a_chan = chan_map[i_chan]
                 u = uvw[i_time, i_baseline, 0] * uv_scale[0, i_chan]
                 v = uvw[i_time, i_baseline, 1] * uv_scale[1, i_chan]
+                
                 if ~np.isnan(u) and ~np.isnan(v):
                     u_pos = u + uv_center[0]
                     v_pos = v + uv_center[1]
                     
-                    #Doing round as int(x+0.5) since u_pos/v_pos should always be positive and  fortran and gives consistant rounding.
+                    #Do not use numpy round
                     u_center_indx = int(u_pos + 0.5)
                     v_center_indx = int(v_pos + 0.5)
                     
-                    #print('f uv', freq_chan[i_chan], uvw[i_time, i_baseline, 0],uvw[i_time, i_baseline, 1])
-                    if (u_center_indx < n_u) and (v_center_indx < n_v) and (u_center_indx >= 0) and (v_center_indx >= 0):
-                        #print('u_center_indx, v_center_indx',  u_center_indx, v_center_indx)
-                        for i_pol in range(n_pol):
-                            a_pol = pol_map[i_pol]
-                            
-                            
-                            imaging_weight[i_time, i_baseline, i_chan, i_pol] = natural_imaging_weight[i_time, i_baseline, i_chan, i_pol]
-                            if ~np.isnan(natural_imaging_weight[i_time, i_baseline, i_chan, i_pol]) and (natural_imaging_weight[i_time, i_baseline, i_chan, i_pol] != 0.0):
-                                if ~np.isnan(grid_imaging_weight[u_center_indx, v_center_indx, a_chan, a_pol]) and (grid_imaging_weight[u_center_indx, v_center_indx, a_chan, a_pol] != 0.0):
-                                    briggs_grid_imaging_weight = briggs_factors[0,a_chan,a_pol]*grid_imaging_weight[u_center_indx, v_center_indx, a_chan, a_pol] + briggs_factors[1,a_chan,a_pol]
-                                    imaging_weight[i_time, i_baseline, i_chan, i_pol] = imaging_weight[i_time, i_baseline, i_chan, i_pol] / briggs_grid_imaging_weight
-                                
+                    u_center_offset_indx = math.floor((u_center_indx - u_pos) * oversampling + 0.5)
+                    v_center_offset_indx = math.floor((v_center_indx - v_pos) * oversampling + 0.5)
+                    
+                    _degrid_visibility_jit(model_vis, grid, i_time, i_baseline, i_chan, chan_map[i_chan], pol_map, u_center_indx, v_center_indx,
+                                           u_center_offset_indx, v_center_offset_indx, cgk_1D, support, oversampling)
+                else:
+                    for i_pol in range(n_pol):
+                        model_vis[i_time, i_baseline, i_chan, i_pol] = np.nan
     return
-
-
-
-
@@ -0,0 +1,218 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+
+def _stream_grid(vis_dataset, cgk_1D, grid_parms, timings=None):
+    """
+      Grids all the visibilities of a single node run into one in-memory grid without a dask graph (grid_parms['grid_accumulation'] = 'streaming').
+      The gridding is eager: it is done when this function is called, not when the returned dask arrays are computed.
+
+      The chunks of DATA, UVW and IMAGING_WEIGHT are read (from their zarr store) by grid_parms['n_prefetch_threads'] threads up to grid_parms['n_prefetch_chunks'] chunks ahead of the gridding
+      (see _prefetch_chunks), these threads also calculate the grid cells of the visibilities, so the next chunks are read and decompressed while a chunk is gridded.
+      Every chunk is gridded by a pool of grid_parms['n_stream_threads'] threads into the same grid. The grid is split into u-slabs (4 per thread, so that the slabs
+      with the dense center of the uv plane are balanced), each slab is gridded by one thread with the nogil _window_grid_jit kernel, so the threads never write to the same cells.
+      The prefetch threads sort the (time, baseline) rows of every chunk by their u cell, so a slab only goes through the rows that can reach it.
+      With grid_parms['n_stream_threads'] = 1 the chunks are gridded into the full grid by _call_gridder (grid_parms['gridder'] is used, 'parallel' grids each chunk with all the numba threads).
+      The memory is bounded by the grid and about grid_parms['n_prefetch_chunks'] + 1 chunks. The time spent reading and gridding the chunks is added to timings (see _prefetch_chunks).
+
+      Parameters
+      ----------
+      vis_dataset : xarray.core.dataset.Dataset
+      cgk_1D : float array
+          (oversampling*(support//2 + 1))
+      grid_parms : dictionary
+          As checked by _check_grid_params.
+      timings : dictionary, default = None
+          If given the prefetch timings are added to it (see _prefetch_attrs).
+
+      Returns
+      -------
+      list_of_grids_and_sum_weights : list of dask.array
+          [grid, sum_weight] as returned by _graph_standard_grid, the computed grid and sum of weights wrapped in dask arrays.
+      """
+    import dask.array as da
+    from concurrent.futures import ThreadPoolExecutor
+    from ._standard_grid import _grid_dtype, _call_gridder
+    from ._partial_grid import _window_grid_jit
+    from ._prefetch import _prefetch_chunks
+
+    weight_data = vis_dataset[grid_parms['imaging_weight_name']].data
+    if grid_parms['chan_mode'] == 'cube':
+        n_imag_chan = weight_data.shape[2]
+        img_chan_chunks = weight_data.chunks[2]
+    else:
+        n_imag_chan = 1
+        img_chan_chunks = (1,)
+    n_imag_pol = weight_data.shape[3]
+    if grid_parms['do_image_and_psf']:
+        n_imag_pol = 2*n_imag_pol #The psf is gridded as extra polarizations, see _append_psf_pols.
+    pol_map = np.arange(n_imag_pol)
+
+    n_uv = grid_parms['imsize_padded']
+    grid = np.zeros((n_imag_chan, n_imag_pol, n_uv[0], n_uv[1]), dtype=_grid_dtype(grid_parms))
+    n_slabs = int(min(4 * grid_parms['n_stream_threads'], n_uv[0]))
+    slab_edges = np.linspace(0, n_uv[0], n_slabs + 1).astype(int)
+    slab_sum_weights = np.zeros((n_slabs, n_imag_chan, n_imag_pol), dtype=np.double)
+
+    img_chan_starts = np.concatenate(([0], np.cumsum(img_chan_chunks)))
+
+    def grid_slab(i_slab, chunk):
+        c_chan, list_of_vis_streams = chunk
+        if grid_parms['chan_mode'] == 'cube':
+            img_chans = slice(img_chan_starts[c_chan], img_chan_starts[c_chan + 1])
+        else:
+            img_chans = slice(0, 1)
+        grid_window = grid[img_chans, :, slab_edges[i_slab]:slab_edges[i_slab + 1], :]
+        for vis_data, weight, u_indx, v_indx, u_offset_indx, v_offset_indx, chan_map, row_u_min, max_row_u_width in list_of_vis_streams:
+            #The rows with a visibility whose kernel reaches the slab, see _sort_rows_by_u.
+            start_row = np.searchsorted(row_u_min, slab_edges[i_slab] - grid_parms['support'] - max_row_u_width, side='right')
+            end_row = np.searchsorted(row_u_min, slab_edges[i_slab + 1] + grid_parms['support'], side='left')
+            if end_row > start_row:
+                rows = slice(start_row * len(chan_map), end_row * len(chan_map))
+                if not grid_parms['do_psf']:
+                    vis_data = vis_data[rows]
+                _window_grid_jit(grid_window, slab_sum_weights[i_slab, img_chans], grid_parms['do_psf'], vis_data, weight[rows],
+                                 u_indx[rows], v_indx[rows], u_offset_indx[rows], v_offset_indx[rows], chan_map, pol_map, cgk_1D, n_uv,
+                                 np.array([slab_edges[i_slab], 0]), grid_parms['support'], grid_parms['oversampling'])
+
+    def grid_chunk(chunk):
+        c_chan, (vis_data, uvw, weight, freq_chan, chan_map) = chunk
+        if grid_parms['chan_mode'] == 'cube':
+            img_chans = slice(img_chan_starts[c_chan], img_chan_starts[c_chan + 1])
+        else:
+            img_chans = slice(0, 1)
+        _call_gridder(grid[img_chans], slab_sum_weights[0, img_chans], grid_parms['do_psf'], vis_data, uvw, freq_chan, chan_map, pol_map, weight, cgk_1D, grid_parms)
+
+    freq_chan_chunks = np.split(vis_dataset.coords['chan'].values, np.cumsum(weight_data.chunks[2])[:-1])
+
+    def prepare_chunk(c_chan, uvw, weight, vis_data=None):
+        return _prepare_stream_chunk(c_chan, uvw, weight, vis_data, freq_chan_chunks[c_chan], grid_parms)
+
+    with ThreadPoolExecutor(max_workers=grid_parms['n_stream_threads']) as pool:
+        for chunk in _prefetch_chunks(_list_stream_chunks(vis_dataset, grid_parms), grid_parms['n_prefetch_chunks'], grid_parms['n_prefetch_threads'],
+                                      prepare=prepare_chunk, timings=timings):
+            if grid_parms['n_stream_threads'] == 1:
+                grid_chunk(chunk)
+            else:
+                #All the slabs of a chunk are gridded before the next chunk, so at most one chunk is being gridded.
+                list(pool.map(grid_slab, range(n_slabs), [chunk]*n_slabs))
+
+    sum_weight = np.sum(slab_sum_weights, axis=0)
+
+    # Put axes in image orientation (see _graph_standard_grid).
+    grid = da.from_array(np.moveaxis(grid, [0, 1], [-2, -1]), chunks=(-1, -1, img_chan_chunks, -1))
+    sum_weight = da.from_array(sum_weight, chunks=(img_chan_chunks, -1))
+    return [grid, sum_weight]
+
+
+def _list_stream_chunks(vis_dataset, grid_parms):
+    """
+      Lists the chunks gridded by _stream_grid for _prefetch_chunks. Yields (c_chan, [uvw, weight]) or (c_chan, [uvw, weight, vis_data]) if grid_parms['do_psf'] is False,
+      where uvw, weight and vis_data are the dask.delayed blocks of a chunk.
+      """
+    import itertools
+
+    #The graphs are optimized once, computing the blocks of the dask arrays directly culls the whole graph for every chunk.
+    weight_blocks = vis_dataset[grid_parms['imaging_weight_name']].data.to_delayed()
+    uvw_blocks = vis_dataset[grid_parms['uvw_name']].data.to_delayed()
+    if not grid_parms['do_psf']:
+        vis_data_blocks = vis_dataset[grid_parms['data_name']].data.to_delayed()
+    n_chunks_in_each_dim = weight_blocks.shape
+
+    for c_time, c_baseline, c_chan in itertools.product(range(n_chunks_in_each_dim[0]), range(n_chunks_in_each_dim[1]), range(n_chunks_in_each_dim[2])):
+        list_of_delayed = [uvw_blocks[c_time, c_baseline, 0], weight_blocks[c_time, c_baseline, c_chan, 0]]
+        if not grid_parms['do_psf']:
+            list_of_delayed.append(vis_data_blocks[c_time, c_baseline, c_chan, 0])
+        yield c_chan, list_of_delayed
+
+
+def _prepare_stream_chunk(c_chan, uvw, weight, vis_data, freq_chan, grid_parms):
+    """
+      Prepares a chunk read by _prefetch_chunks for _stream_grid, on a prefetch thread.
+
+      Returns
+      -------
+      chunk : tuple
+          (c_chan, list_of_vis_streams). A list_of_vis_streams has one (vis_data, weight, u_indx, v_indx, u_offset_indx, v_offset_indx, chan_map, row_u_min, max_row_u_width) stream for every
+          baseline group when grid_parms['bda_tolerance'] > 0 (see _baseline_dependent_average), otherwise one, as returned by _sort_rows_by_u.
+          If grid_parms['n_stream_threads'] is 1 (c_chan, (vis_data, uvw, weight, freq_chan, chan_map)) for _call_gridder.
+      """
+    from ._standard_grid import _append_psf_pols
+    from ._uv_index import _calc_uv_index
+    from ._baseline_dependent_averaging import _baseline_dependent_average
+
+    if grid_parms['do_psf']:
+        vis_data = np.zeros((1, 1, 1, 1), dtype=bool) #Not used by the gridder when do_psf is True.
+    elif grid_parms['do_image_and_psf']:
+        vis_data, weight = _append_psf_pols(vis_data, weight)
+
+    n_chan = weight.shape[2]
+    if grid_parms['chan_mode'] == 'cube':
+        chan_map = np.arange(n_chan)
+    else:
+        chan_map = np.zeros(n_chan, dtype=int)
+
+    if grid_parms['n_stream_threads'] == 1:
+        return c_chan, (vis_data, uvw, weight, freq_chan, chan_map)
+
+    if grid_parms['bda_tolerance'] > 0:
+        list_of_averaged_streams = _baseline_dependent_average(vis_data, uvw, weight, freq_chan, chan_map, grid_parms['do_psf'], grid_parms)
+    else:
+        list_of_averaged_streams = [(vis_data, uvw, weight, freq_chan, chan_map)]
+
+    list_of_vis_streams = []
+    for vis_data, uvw, weight, freq_chan, chan_map in list_of_averaged_streams:
+        u_indx, v_indx, u_offset_indx, v_offset_indx = _calc_uv_index(uvw, freq_chan, grid_parms['imsize_padded'], grid_parms['cell'], grid_parms['oversampling'])
+        list_of_vis_streams.append(_sort_rows_by_u(vis_data, weight, u_indx, v_indx, u_offset_indx, v_offset_indx, chan_map, grid_parms['do_psf']))
+    return c_chan, list_of_vis_streams
+
+
+def _sort_rows_by_u(vis_data, weight, u_indx, v_indx, u_offset_indx, v_offset_indx, chan_map, do_psf):
+    """
+      Sorts the (time, baseline) rows of a chunk by the smallest u cell of their channels and flattens the arrays as _window_grid_jit expects.
+      All the visibilities of the rows that are not in [searchsorted(row_u_min, u_start - support - max_row_u_width, 'right'), searchsorted(row_u_min, u_end + support, 'left'))
+      are more than the kernel support away from the u-slab [u_start, u_end). Rows with nan uvw values have u cell -1 and are dropped by _window_grid_jit.
+
+      Returns
+      -------
+      vis_data : complex array
+          (n_row*n_chan, n_pol) or the (1, 1) placeholder if do_psf is True.
+      weight : float array
+          (n_row*n_chan, n_pol)
+      u_indx, v_indx, u_offset_indx, v_offset_indx : int array
+          (n_row*n_chan)
+      chan_map : int array
+          (n_chan)
+      row_u_min : int array
+          (n_row) Sorted.
+      max_row_u_width : int
+          The largest difference of the u cells of the channels of a row.
+      """
+    n_chan = weight.shape[2]
+    n_pol = weight.shape[3]
+    u_indx = u_indx.reshape((-1, n_chan))
+    row_u_min = np.min(u_indx, axis=1)
+    max_row_u_width = int(np.max(np.max(u_indx, axis=1) - row_u_min)) if len(row_u_min) > 0 else 0
+    row_order = np.argsort(row_u_min, kind='stable')
+
+    if not do_psf:
+        vis_data = vis_data.reshape((-1, n_chan, n_pol))[row_order].reshape((-1, n_pol))
+    else:
+        vis_data = vis_data.reshape((-1, vis_data.shape[3]))
+    weight = weight.reshape((-1, n_chan, n_pol))[row_order].reshape((-1, n_pol))
+    u_indx = u_indx[row_order].ravel()
+    v_indx = v_indx.reshape((-1, n_chan))[row_order].ravel()
+    u_offset_indx = u_offset_indx.reshape((-1, n_chan))[row_order].ravel()
+    v_offset_indx = v_offset_indx.reshape((-1, n_chan))[row_order].ravel()
+    return vis_data, weight, u_indx, v_indx, u_offset_indx, v_offset_indx, chan_map, row_u_min[row_order], max_row_u_width
@@ -0,0 +1,314 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+from numba import jit, prange
+import numpy as np
+
+def _bin_visibilities_by_tile(u_indx, v_indx, chan_map, n_uv, support, tile_size):
+    """
+    Sorts the visibilities of a chunk by (image channel, uv tile). Visibilities with nan uvw or whose support falls outside the grid are dropped.
+
+    Parameters
+    ----------
+    u_indx : int array
+        (n_time, n_baseline, n_chan)
+    v_indx : int array
+        (n_time, n_baseline, n_chan)
+    chan_map : int array
+        (n_chan)
+    n_uv : int array
+        (2)
+    support : int
+    tile_size : int
+
+    Returns
+    -------
+    vis_order : int array
+        (n_vis) Flat (time, baseline, chan) indices of the visibilities sorted by tile.
+    vis_keys : int array
+        (n_vis) The sorted tile keys, a_chan*n_tiles[0]*n_tiles[1] + u_tile*n_tiles[1] + v_tile.
+    n_tiles : int array
+        (2)
+    """
+    support_center = support // 2
+    n_tiles = (n_uv + tile_size - 1) // tile_size
+
+    u_indx = u_indx.ravel()
+    v_indx = v_indx.ravel()
+    a_chan = np.broadcast_to(chan_map, (len(u_indx) // len(chan_map), len(chan_map))).ravel()
+
+    in_grid = (u_indx + support_center < n_uv[0]) & (v_indx + support_center < n_uv[1]) & (u_indx - support_center >= 0) & (v_indx - support_center >= 0)
+    vis_indx = np.nonzero(in_grid)[0]
+
+    keys = a_chan[vis_indx] * (n_tiles[0] * n_tiles[1]) + (u_indx[vis_indx] // tile_size) * n_tiles[1] + (v_indx[vis_indx] // tile_size)
+    sort_indx = np.argsort(keys, kind='stable')
+
+    return vis_indx[sort_indx], keys[sort_indx], n_tiles
+
+
+def _tiled_grid(grid, sum_weight, do_psf, vis_data, uvw, freq_chan, chan_map, pol_map, weight, cgk_1D, n_uv, delta_lm, support, oversampling, tile_size):
+    """
+    Grids a chunk of visibilities tile by tile. The visibilities are first binned by uv tile, each tile is then gridded into a small cache resident sub-grid that is added to the grid.
+
+    Parameters
+    ----------
+    grid : complex array
+        (n_imag_chan, n_imag_pol, n_u, n_v)
+    sum_weight : float array
+        (n_imag_chan, n_imag_pol)
+    vis_data : complex array
+        (n_time, n_baseline, n_vis_chan, n_pol)
+    uvw  : float array
+        (n_time, n_baseline, 3)
+    freq_chan : float array
+        (n_chan)
+    chan_map : int array
+        (n_chan)
+    pol_map : int array
+        (n_pol)
+    weight : float array
+        (n_time, n_baseline, n_vis_chan, n_pol)
+    cgk_1D : float array
+        (oversampling*(support//2 + 1))
+    tile_size : int
+        Number of grid cells along each side of a tile.
+    """
+    from ._uv_index import _calc_uv_index
+
+    u_indx, v_indx, u_offset_indx, v_offset_indx = _calc_uv_index(uvw, freq_chan, n_uv, delta_lm, oversampling)
+    vis_order, vis_keys, n_tiles = _bin_visibilities_by_tile(u_indx, v_indx, chan_map, n_uv, support, tile_size)
+
+    n_pol = weight.shape[3]
+    sub_grid = np.zeros((n_pol, tile_size + support - 1, tile_size + support - 1), dtype=grid.dtype)
+
+    _tiled_grid_jit(grid, sum_weight, sub_grid, do_psf, vis_data.reshape((-1, vis_data.shape[3])), weight.reshape((-1, n_pol)), vis_order, vis_keys,
+                    u_indx.ravel(), v_indx.ravel(), u_offset_indx.ravel(), v_offset_indx.ravel(), pol_map, cgk_1D, n_uv, support, oversampling, tile_size, n_tiles)
+
+
+@jit(nopython=True, cache=True, nogil=True)
+def _tiled_grid_jit(grid, sum_weight, sub_grid, do_psf, vis_data, weight, vis_order, vis_keys, u_indx, v_indx, u_offset_indx, v_offset_indx,
+                    pol_map, cgk_1D, n_uv, support, oversampling, tile_size, n_tiles):
+    """
+      Parameters
+      ----------
+      grid : complex array
+          (n_chan, n_pol, n_u, n_v)
+      sum_weight : float array
+          (n_chan, n_pol)
+      sub_grid : complex array
+          (n_pol, tile_size + support - 1, tile_size + support - 1)
+      vis_data : complex array
+          (n_time*n_baseline*n_vis_chan, n_pol)
+      weight : float array
+          (n_time*n_baseline*n_vis_chan, n_pol)
+      vis_order : int array
+          (n_vis)
+      vis_keys : int array
+          (n_vis)
+      u_indx, v_indx, u_offset_indx, v_offset_indx : int array
+          (n_time*n_baseline*n_vis_chan)
+      pol_map : int array
+          (n_pol)
+      cgk_1D : float array
+          (oversampling*(support//2 + 1))
+
+      Returns
+      -------
+      """
+    support_center = int(support // 2)
+    start_support = - support_center
+    end_support = support - support_center
+
+    n_pol = len(pol_map)
+    n_vis = len(vis_order)
+    n_tiles_uv = n_tiles[0] * n_tiles[1]
+    n_sub_u = sub_grid.shape[1]
+    n_sub_v = sub_grid.shape[2]
+
+    i_start = 0
+    while i_start < n_vis:
+        key = vis_keys[i_start]
+        i_end = i_start + 1
+        while (i_end < n_vis) and (vis_keys[i_end] == key):
+            i_end = i_end + 1
+
+        a_chan = key // n_tiles_uv
+        i_tile = key % n_tiles_uv
+        u_origin = (i_tile // n_tiles[1]) * tile_size - support_center
+        v_origin = (i_tile % n_tiles[1]) * tile_size - support_center
+
+        sub_grid[:, :, :] = 0.0
+
+        for i in range(i_start, i_end):
+            i_vis = vis_order[i]
+            u_center_indx = u_indx[i_vis] - u_origin
+            v_center_indx = v_indx[i_vis] - v_origin
+            u_center_offset_indx = u_offset_indx[i_vis]
+            v_center_offset_indx = v_offset_indx[i_vis]
+
+            for i_pol in range(n_pol):
+                if do_psf:
+                    weighted_data = weight[i_vis, i_pol]
+                else:
+                    weighted_data = vis_data[i_vis, i_pol] * weight[i_vis, i_pol]
+
+                if ~np.isnan(weighted_data) and (weighted_data != 0.0):
+                    a_pol = pol_map[i_pol]
+                    norm = 0.0
+
+                    for i_v in range(start_support, end_support):
+                        v_sub_indx = v_center_indx + i_v
+                        v_conv_indx = np.abs(oversampling * i_v + v_center_offset_indx)
+                        conv_v = cgk_1D[v_conv_indx]
+
+                        for i_u in range(start_support, end_support):
+                            u_sub_indx = u_center_indx + i_u
+                            u_conv_indx = np.abs(oversampling * i_u + u_center_offset_indx)
+                            conv_u = cgk_1D[u_conv_indx]
+                            conv = conv_u * conv_v
+
+                            sub_grid[i_pol, u_sub_indx, v_sub_indx] = sub_grid[i_pol, u_sub_indx, v_sub_indx] + conv * weighted_data
+                            norm = norm + conv
+
+                    sum_weight[a_chan, a_pol] = sum_weight[a_chan, a_pol] + weight[i_vis, i_pol] * norm
+
+        #Add the sub-grid to the grid (the sub-grid overlaps the grid edge for tiles on the border).
+        start_u = max(0, -u_origin)
+        end_u = min(n_sub_u, n_uv[0] - u_origin)
+        start_v = max(0, -v_origin)
+        end_v = min(n_sub_v, n_uv[1] - v_origin)
+        for i_pol in range(n_pol):
+            a_pol = pol_map[i_pol]
+            for i_u in range(start_u, end_u):
+                for i_v in range(start_v, end_v):
+                    grid[a_chan, a_pol, u_origin + i_u, v_origin + i_v] = grid[a_chan, a_pol, u_origin + i_u, v_origin + i_v] + sub_grid[i_pol, i_u, i_v]
+
+        i_start = i_end
+
+    return
+
+
+def _parallel_tiled_grid(grid, sum_weight, do_psf, vis_data, uvw, freq_chan, chan_map, pol_map, weight, cgk_1D, n_uv, delta_lm, support, oversampling, tile_size):
+    """
+    Multi-threaded version of _tiled_grid that writes directly into the grid it is given, without sub-grids. The grid is the grid of a 'chained' or 'streaming' grid accumulation
+    (see _check_grid_params), so each chain of chunks is gridded into one grid rather than one grid per chunk.
+    The tiles are split into four interleaved sets, (u_tile%2, v_tile%2), and the sets are gridded one after the other.
+    Within a set each thread owns whole tiles and, since tile_size >= support - 1, the supports of visibilities in different tiles of the same set never overlap.
+    The number of threads is set by numba (NUMBA_NUM_THREADS).
+
+    Parameters
+    ----------
+    See _tiled_grid.
+    """
+    from ._uv_index import _calc_uv_index
+
+    u_indx, v_indx, u_offset_indx, v_offset_indx = _calc_uv_index(uvw, freq_chan, n_uv, delta_lm, oversampling)
+    vis_order, vis_keys, n_tiles = _bin_visibilities_by_tile(u_indx, v_indx, chan_map, n_uv, support, tile_size)
+
+    #Each tile key with at least one visibility is a bucket.
+    bucket_start = np.nonzero(np.diff(vis_keys, prepend=-1))[0]
+    bucket_end = np.append(bucket_start[1:], len(vis_keys))
+    bucket_keys = vis_keys[bucket_start]
+
+    i_tile = bucket_keys % (n_tiles[0] * n_tiles[1])
+    bucket_set = 2 * ((i_tile // n_tiles[1]) % 2) + (i_tile % n_tiles[1]) % 2
+    bucket_order = np.argsort(bucket_set, kind='stable')
+    set_start = np.searchsorted(bucket_set[bucket_order], np.arange(5))
+
+    n_pol = weight.shape[3]
+    bucket_sum_weight = np.zeros((len(bucket_keys), n_pol), dtype=sum_weight.dtype)
+
+    _parallel_tiled_grid_jit(grid, bucket_sum_weight, do_psf, vis_data.reshape((-1, vis_data.shape[3])), weight.reshape((-1, n_pol)), vis_order,
+                             bucket_start[bucket_order], bucket_end[bucket_order], bucket_keys[bucket_order], set_start,
+                             u_indx.ravel(), v_indx.ravel(), u_offset_indx.ravel(), v_offset_indx.ravel(), pol_map, cgk_1D, support, oversampling, n_tiles)
+
+    a_chan = bucket_keys[bucket_order] // (n_tiles[0] * n_tiles[1])
+    for i_pol in range(n_pol):
+        np.add.at(sum_weight[:, pol_map[i_pol]], a_chan, bucket_sum_weight[:, i_pol])
+
+
+@jit(nopython=True, cache=True, nogil=True, parallel=True)
+def _parallel_tiled_grid_jit(grid, bucket_sum_weight, do_psf, vis_data, weight, vis_order, bucket_start, bucket_end, bucket_keys, set_start,
+                             u_indx, v_indx, u_offset_indx, v_offset_indx, pol_map, cgk_1D, support, oversampling, n_tiles):
+    """
+      Parameters
+      ----------
+      grid : complex array
+          (n_chan, n_pol, n_u, n_v)
+      bucket_sum_weight : float array
+          (n_bucket, n_pol)
+      vis_data : complex array
+          (n_time*n_baseline*n_vis_chan, n_pol)
+      weight : float array
+          (n_time*n_baseline*n_vis_chan, n_pol)
+      vis_order : int array
+          (n_vis)
+      bucket_start, bucket_end, bucket_keys : int array
+          (n_bucket) Ordered by tile set.
+      set_start : int array
+          (5) The buckets of tile set i are bucket_start[set_start[i]:set_start[i+1]].
+      u_indx, v_indx, u_offset_indx, v_offset_indx : int array
+          (n_time*n_baseline*n_vis_chan)
+      pol_map : int array
+          (n_pol)
+      cgk_1D : float array
+          (oversampling*(support//2 + 1))
+
+      Returns
+      -------
+      """
+    support_center = int(support // 2)
+    start_support = - support_center
+    end_support = support - support_center
+
+    n_pol = len(pol_map)
+    n_tiles_uv = n_tiles[0] * n_tiles[1]
+
+    for i_set in range(4):
+        for i_bucket in prange(set_start[i_set], set_start[i_set + 1]):
+            a_chan = bucket_keys[i_bucket] // n_tiles_uv
+
+            for i in range(bucket_start[i_bucket], bucket_end[i_bucket]):
+                i_vis = vis_order[i]
+                u_center_indx = u_indx[i_vis]
+                v_center_indx = v_indx[i_vis]
+                u_center_offset_indx = u_offset_indx[i_vis]
+                v_center_offset_indx = v_offset_indx[i_vis]
+
+                for i_pol in range(n_pol):
+                    if do_psf:
+                        weighted_data = weight[i_vis, i_pol]
+                    else:
+                        weighted_data = vis_data[i_vis, i_pol] * weight[i_vis, i_pol]
+
+                    if ~np.isnan(weighted_data) and (weighted_data != 0.0):
+                        a_pol = pol_map[i_pol]
+                        norm = 0.0
+
+                        for i_v in range(start_support, end_support):
+                            v_grid_indx = v_center_indx + i_v
+                            v_conv_indx = np.abs(oversampling * i_v + v_center_offset_indx)
+                            conv_v = cgk_1D[v_conv_indx]
+
+                            for i_u in range(start_support, end_support):
+                                u_grid_indx = u_center_indx + i_u
+                                u_conv_indx = np.abs(oversampling * i_u + u_center_offset_indx)
+                                conv_u = cgk_1D[u_conv_indx]
+                                conv = conv_u * conv_v
+
+                                grid[a_chan, a_pol, u_grid_indx, v_grid_indx] = grid[a_chan, a_pol, u_grid_indx, v_grid_indx] + conv * weighted_data
+                                norm = norm + conv
+
+                        bucket_sum_weight[i_bucket, i_pol] = bucket_sum_weight[i_bucket, i_pol] + weight[i_vis, i_pol] * norm
+
+    return
@@ -0,0 +1,430 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+from numba import jit
+import numpy as np
+import math
+
+#The uv index of visibilities with nan uvw values (or that are far outside any grid). It fails the grid bounds checks of all the uv index kernels.
+_UV_INDEX_FLAGGED = np.iinfo(np.int32).min
+
+def _uv_index_attrs(uvw, cell, imsize_padded, oversampling, uv_offset_name, uvw_version):
+    """
+      The attributes of a uv index data variable, used by _check_uv_index to detect a uv index that is out of date.
+      cell is in arcseconds, as given by the user. uvw_version is the uv_index_version that make_uv_index writes to the attributes of the uvw data variable.
+      """
+    return {'uvw_name': uvw.name, 'uvw_shape': [int(n) for n in uvw.shape], 'uvw_version': uvw_version,
+            'cell': [float(x) for x in cell], 'imsize_padded': [int(n) for n in imsize_padded], 'oversampling': int(oversampling),
+            'uv_offset_name': uv_offset_name}
+
+
+def _check_uv_index(vis_dataset, uv_index_name, uvw_name, cell, imsize_padded, oversampling, list_of_data_names):
+    """
+      Checks that a uv index made by make_uv_index was made for the uvw data variable, cell (arcseconds), padded image size and oversampling that are used
+      and that it has the time, baseline and channel chunks of the data variables list_of_data_names (the uv index is read chunk by chunk with them).
+      The uvw values are not read, the uv_index_version in the attributes of the uvw data variable is compared with the one stored with the uv index.
+      The oversampling is not checked if it is 0 (imaging weights, where only the uv cell is used).
+      """
+    if uv_index_name not in vis_dataset.data_vars:
+        print('######### ERROR:', uv_index_name, 'not found in the vis_dataset, create it with make_uv_index.')
+        return False
+
+    attrs = vis_dataset[uv_index_name].attrs
+    if ('uv_offset_name' not in attrs) or (attrs['uv_offset_name'] not in vis_dataset.data_vars):
+        print('######### ERROR:', uv_index_name, 'is not a uv index made by make_uv_index or its sub-cell offsets are missing.')
+        return False
+
+    uvw = vis_dataset[uvw_name]
+    parms_passed = (attrs['uvw_name'] == uvw_name) and (list(attrs['uvw_shape']) == list(uvw.shape))
+    parms_passed = parms_passed and (attrs.get('uvw_version', None) is not None) and (uvw.attrs.get('uv_index_version', None) == attrs['uvw_version'])
+    parms_passed = parms_passed and np.allclose(attrs['cell'], cell, rtol=1e-12, atol=0) and (list(attrs['imsize_padded']) == [int(n) for n in imsize_padded])
+    parms_passed = parms_passed and ((oversampling == 0) or (attrs['oversampling'] == oversampling))
+    if not parms_passed:
+        print('######### ERROR:', uv_index_name, 'is out of date (the', uvw_name, 'data variable, cell, imsize, fft_padding or oversampling changed), recreate it with make_uv_index.')
+        return False
+
+    for data_name in list_of_data_names:
+        for uv_index_chunks_name in [uv_index_name, attrs['uv_offset_name']]:
+            if vis_dataset[uv_index_chunks_name].chunks[0:3] != vis_dataset[data_name].chunks[0:3]:
+                print('######### ERROR:', uv_index_chunks_name, 'does not have the time, baseline and channel chunks of', data_name + ', rechunk it or recreate it with make_uv_index.')
+                return False
+    return True
+
+
+def _calc_uv_index(uvw, freq_chan, n_uv, delta_lm, oversampling):
+    """
+    Vectorized calculation of the grid cell and the oversampled convolution kernel offset of every visibility.
+    The arithmetic (including the int(x+0.5) rounding) is identical to that of _standard_grid_jit.
+
+    Parameters
+    ----------
+    uvw  : float array
+        (n_time, n_baseline, 3)
+    freq_chan : float array
+        (n_chan)
+    n_uv : int array
+        (2)
+    delta_lm : float array
+        (2)
+    oversampling : int
+
+    Returns
+    -------
+    u_indx : int array
+        (n_time, n_baseline, n_chan) Set to -1 if the uvw value is nan.
+    v_indx : int array
+        (n_time, n_baseline, n_chan) Set to -1 if the uvw value is nan.
+    u_offset_indx : int array
+        (n_time, n_baseline, n_chan)
+    v_offset_indx : int array
+        (n_time, n_baseline, n_chan)
+    """
+    c = 299792458.0
+    uv_scale = np.zeros((2, len(freq_chan)), dtype=np.double)
+    uv_scale[0, :] = -(freq_chan * delta_lm[0] * n_uv[0]) / c
+    uv_scale[1, :] = -(freq_chan * delta_lm[1] * n_uv[1]) / c
+    uv_center = n_uv // 2
+
+    u_pos = uvw[:, :, 0, None] * uv_scale[0, None, None, :] + uv_center[0]
+    v_pos = uvw[:, :, 1, None] * uv_scale[1, None, None, :] + uv_center[1]
+
+    valid = ~np.isnan(u_pos) & ~np.isnan(v_pos)
+    u_pos = np.where(valid, u_pos, -2.0)
+    v_pos = np.where(valid, v_pos, -2.0)
+
+    #astype(int) truncates like int() in _standard_grid_jit.
+    u_indx = (u_pos + 0.5).astype(int)
+    v_indx = (v_pos + 0.5).astype(int)
+
+    u_offset_indx = np.floor((u_indx - u_pos) * oversampling + 0.5).astype(int)
+    v_offset_indx = np.floor((v_indx - v_pos) * oversampling + 0.5).astype(int)
+
+    u_indx[~valid] = -1
+    v_indx[~valid] = -1
+
+    return u_indx, v_indx, u_offset_indx, v_offset_indx
+
+
+def _calc_uv_index_numpy_wrap(uvw, freq_chan, grid_parms):
+    """
+      Wraps _calc_uv_index_jit.
+
+      Returns
+      -------
+      uv_index : int32 array
+          (n_time, n_baseline, n_chan, 2)
+      uv_offset : int16 array
+          (n_time, n_baseline, n_chan, 2)
+      """
+    uv_index = np.empty(uvw.shape[0:2] + (len(freq_chan), 2), dtype=np.int32)
+    uv_offset = np.empty(uvw.shape[0:2] + (len(freq_chan), 2), dtype=np.int16)
+    _calc_uv_index_jit(uv_index, uv_offset, uvw, freq_chan, grid_parms['imsize_padded'], grid_parms['cell'], grid_parms['oversampling'])
+    return uv_index, uv_offset
+
+
+#When jit is used round is repolaced by standard c++ round that is different to python round
+@jit(nopython=True, cache=True, nogil=True)
+def _calc_uv_index_jit(uv_index, uv_offset, uvw, freq_chan, n_uv, delta_lm, oversampling):
+    """
+      The grid cell and the oversampled kernel offset of every visibility, calculated exactly as in _standard_grid_jit.
+
+      Parameters
+      ----------
+      uv_index : int32 array
+          (n_time, n_baseline, n_chan, 2)
+      uv_offset : int16 array
+          (n_time, n_baseline, n_chan, 2)
+      uvw  : float array
+          (n_time, n_baseline, 3)
+      freq_chan : float array
+          (n_chan)
+
+      Returns
+      -------
+      """
+    c = 299792458.0
+    uv_scale = np.zeros((2, len(freq_chan)), dtype=np.double)
+    uv_scale[0, :] = -(freq_chan * delta_lm[0] * n_uv[0]) / c
+    uv_scale[1, :] = -(freq_chan * delta_lm[1] * n_uv[1]) / c
+
+    uv_center = n_uv // 2
+    max_pos = 2.0**30
+
+    n_time = uvw.shape[0]
+    n_baseline = uvw.shape[1]
+    n_chan = len(freq_chan)
+
+    for i_time in range(n_time):
+        for i_baseline in range(n_baseline):
+            for i_chan in range(n_chan):
+                u = uvw[i_time, i_baseline, 0] * uv_scale[0, i_chan]
+                v = uvw[i_time, i_baseline, 1] * uv_scale[1, i_chan]
+
+                if ~np.isnan(u) and ~np.isnan(v) and (abs(u) < max_pos) and (abs(v) < max_pos):
+                    u_pos = u + uv_center[0]
+                    v_pos = v + uv_center[1]
+
+                    #Do not use numpy round
+                    u_center_indx = int(u_pos + 0.5)
+                    v_center_indx = int(v_pos + 0.5)
+
+                    uv_index[i_time, i_baseline, i_chan, 0] = u_center_indx
+                    uv_index[i_time, i_baseline, i_chan, 1] = v_center_indx
+                    uv_offset[i_time, i_baseline, i_chan, 0] = math.floor((u_center_indx - u_pos) * oversampling + 0.5)
+                    uv_offset[i_time, i_baseline, i_chan, 1] = math.floor((v_center_indx - v_pos) * oversampling + 0.5)
+                else:
+                    uv_index[i_time, i_baseline, i_chan, 0] = _UV_INDEX_FLAGGED
+                    uv_index[i_time, i_baseline, i_chan, 1] = _UV_INDEX_FLAGGED
+                    uv_offset[i_time, i_baseline, i_chan, 0] = 0
+                    uv_offset[i_time, i_baseline, i_chan, 1] = 0
+    return
+
+
+@jit(nopython=True, cache=True, nogil=True)
+def _grid_visibility_jit(grid, sum_weight, do_psf, vis_data, weight, i_time, i_baseline, i_chan, a_chan, pol_map, u_center_indx, v_center_indx,
+                         u_center_offset_indx, v_center_offset_indx, cgk_1D, support, oversampling, conv_u, conv_v, valid_pol, valid_weighted_data, pol_innermost):
+    """
+      Grids the polarizations of one visibility, given its grid cell and oversampled kernel offsets. This is the inner loop of _standard_grid_jit
+      and _standard_grid_uv_index_jit. Visibilities whose kernel footprint is not fully inside the grid are not gridded.
+
+      Parameters
+      ----------
+      grid : complex array
+          (n_chan, n_pol, n_u, n_v) or (n_u, n_v, n_chan, n_pol) if pol_innermost
+      sum_weight : float array
+          (n_chan, n_pol)
+      i_time, i_baseline, i_chan : int
+          The visibility in vis_data and weight.
+      a_chan : int
+          The grid channel of the visibility.
+      u_center_indx, v_center_indx, u_center_offset_indx, v_center_offset_indx : int
+          The grid cell and the oversampled kernel offsets of the visibility (see _calc_uv_index_jit).
+      conv_u, conv_v : float array
+          (support) Work space for the kernel values.
+      valid_pol : int array
+          (n_pol) Work space for the polarizations that are gridded.
+      valid_weighted_data : complex array
+          (n_pol) Work space with the dtype of the grid.
+      pol_innermost : bool
+          The grid layout, True for grid_parms['grid_layout'] = 'u_v_chan_pol'.
+
+      Returns
+      -------
+      """
+    support_center = int(support // 2)
+    start_support = - support_center
+    if pol_innermost:
+        n_u = grid.shape[0]
+        n_v = grid.shape[1]
+    else:
+        n_u = grid.shape[2]
+        n_v = grid.shape[3]
+
+    if (u_center_indx+support_center >= n_u) or (v_center_indx+support_center >= n_v) or (u_center_indx-support_center < 0) or (v_center_indx-support_center < 0):
+        return
+
+    #The flagged/zero weight polarizations are removed before the footprint is gridded.
+    n_valid_pol = 0
+    for i_pol in range(len(pol_map)):
+        if do_psf:
+            weighted_data = weight[i_time, i_baseline, i_chan, i_pol]
+        else:
+            weighted_data = vis_data[i_time, i_baseline, i_chan, i_pol] * weight[i_time, i_baseline, i_chan, i_pol]
+
+        if ~np.isnan(weighted_data) and (weighted_data != 0.0):
+            valid_pol[n_valid_pol] = i_pol
+            valid_weighted_data[n_valid_pol] = weighted_data
+            n_valid_pol = n_valid_pol + 1
+
+    if n_valid_pol == 0:
+        return
+
+    #The kernel is separable so the u and v kernel values are looked up once per visibility and the norm is the product of their sums.
+    norm_u = 0.0
+    norm_v = 0.0
+    for i_support in range(support):
+        conv_u[i_support] = cgk_1D[np.abs(oversampling * (i_support + start_support) + u_center_offset_indx)]
+        conv_v[i_support] = cgk_1D[np.abs(oversampling * (i_support + start_support) + v_center_offset_indx)]
+        norm_u = norm_u + conv_u[i_support]
+        norm_v = norm_v + conv_v[i_support]
+    norm = norm_u * norm_v
+
+    u_start_indx = u_center_indx + start_support
+    v_start_indx = v_center_indx + start_support
+
+    #The kernel values, grid indices and norm are shared by all the polarizations. Only the order of the writes depends on the grid layout.
+    if pol_innermost:
+        #The polarizations of a grid cell are contiguous, so all of them are written in one pass over the footprint.
+        for i_u in range(support):
+            for i_v in range(support):
+                conv = conv_u[i_u] * conv_v[i_v]
+                grid_cell = grid[u_start_indx + i_u, v_start_indx + i_v, a_chan, :]
+                for i_valid_pol in range(n_valid_pol):
+                    a_pol = pol_map[valid_pol[i_valid_pol]]
+                    grid_cell[a_pol] = grid_cell[a_pol] + conv * valid_weighted_data[i_valid_pol]
+    else:
+        #The polarizations are separate grid planes so each one is gridded with its own pass over the footprint (interleaving the planes per row is slower),
+        #v is the fastest changing grid axis so the inner loop writes are contiguous.
+        for i_valid_pol in range(n_valid_pol):
+            a_pol = pol_map[valid_pol[i_valid_pol]]
+            weighted_data = valid_weighted_data[i_valid_pol]
+            for i_u in range(support):
+                weighted_data_u = conv_u[i_u] * weighted_data
+                grid_row = grid[a_chan, a_pol, u_start_indx + i_u, v_start_indx:v_start_indx + support]
+                for i_v in range(support):
+                    grid_row[i_v] = grid_row[i_v] + conv_v[i_v] * weighted_data_u
+
+    for i_valid_pol in range(n_valid_pol):
+        i_pol = valid_pol[i_valid_pol]
+        a_pol = pol_map[i_pol]
+        sum_weight[a_chan, a_pol] = sum_weight[a_chan, a_pol] + weight[i_time, i_baseline, i_chan, i_pol] * norm
+
+
+@jit(nopython=True, cache=True, nogil=True)
+def _degrid_visibility_jit(model_vis, grid, i_time, i_baseline, i_chan, a_chan, pol_map, u_center_indx, v_center_indx,
+                           u_center_offset_indx, v_center_offset_indx, cgk_1D, support, oversampling):
+    """
+      Interpolates the polarizations of one visibility from the grid, given its grid cell and oversampled kernel offsets. This is the inner loop of
+      _standard_degrid_jit and _standard_degrid_uv_index_jit. A visibility whose kernel footprint is not fully inside the grid is set to nan.
+
+      Parameters
+      ----------
+      model_vis : complex array
+          (n_time, n_baseline, n_chan, n_pol)
+      grid : complex array
+          (n_u, n_v, n_imag_chan, n_pol)
+
+      Returns
+      -------
+      """
+    support_center = int(support // 2)
+    start_support = - support_center
+    end_support = support - support_center # end_support is larger by 1 so that python range() gives correct indices
+    n_u = grid.shape[0]
+    n_v = grid.shape[1]
+    n_pol = len(pol_map)
+
+    if (u_center_indx+support_center >= n_u) or (v_center_indx+support_center >= n_v) or (u_center_indx-support_center < 0) or (v_center_indx-support_center < 0):
+        for i_pol in range(n_pol):
+            model_vis[i_time, i_baseline, i_chan, i_pol] = np.nan
+        return
+
+    norm = 0.0
+    for i_v in range(start_support,end_support):
+        v_indx = v_center_indx + i_v
+        v_conv_indx = np.abs(oversampling * i_v + v_center_offset_indx)
+        conv_v = cgk_1D[v_conv_indx]
+
+        for i_u in range(start_support,end_support):
+            u_indx = u_center_indx + i_u
+            u_conv_indx = np.abs(oversampling * i_u + u_center_offset_indx)
+            conv = cgk_1D[u_conv_indx] * conv_v
+
+            #The polarizations are contiguous in the grid.
+            for i_pol in range(n_pol):
+                model_vis[i_time, i_baseline, i_chan, i_pol] = model_vis[i_time, i_baseline, i_chan, i_pol] + conv * grid[u_indx, v_indx, a_chan, pol_map[i_pol]]
+            norm = norm + conv
+
+    for i_pol in range(n_pol):
+        model_vis[i_time, i_baseline, i_chan, i_pol] = model_vis[i_time, i_baseline, i_chan, i_pol] / norm
+
+
+@jit(nopython=True, cache=True, nogil=True)
+def _standard_grid_uv_index_jit(grid, sum_weight, do_psf, vis_data, uv_index, uv_offset, chan_map, pol_map, weight, cgk_1D,
+                                n_uv, support, oversampling):
+    """
+      _standard_grid_jit with the grid cells and kernel offsets read from a uv index (see make_uv_index) instead of being calculated from the uvw values.
+      If oversampling is 0 (imaging weight density grids) the kernel offsets are not used.
+
+      Parameters
+      ----------
+      grid : complex array
+          (n_chan, n_pol, n_u, n_v)
+      sum_weight : float array
+          (n_chan, n_pol)
+      vis_data : complex array
+          (n_time, n_baseline, n_vis_chan, n_pol)
+      uv_index : int32 array
+          (n_time, n_baseline, n_vis_chan, 2)
+      uv_offset : int16 array
+          (n_time, n_baseline, n_vis_chan, 2)
+      chan_map : int array
+          (n_chan)
+      pol_map : int array
+          (n_pol)
+      weight : float array
+          (n_time, n_baseline, n_vis_chan, n_pol)
+      cgk_1D : float array
+          (oversampling*(support//2 + 1))
+
+      Returns
+      -------
+      """
+    n_time = uv_index.shape[0]
+    n_baseline = uv_index.shape[1]
+    n_chan = len(chan_map)
+    n_pol = len(pol_map)
+
+    conv_u = np.zeros(support, dtype=np.double)
+    conv_v = np.zeros(support, dtype=np.double)
+    valid_pol = np.zeros(n_pol, dtype=np.int64)
+    valid_weighted_data = np.zeros(n_pol, dtype=grid.dtype)
+
+    for i_time in range(n_time):
+        for i_baseline in range(n_baseline):
+            for i_chan in range(n_chan):
+                u_center_indx = np.int64(uv_index[i_time, i_baseline, i_chan, 0])
+                v_center_indx = np.int64(uv_index[i_time, i_baseline, i_chan, 1])
+                if oversampling > 0:
+                    u_center_offset_indx = np.int64(uv_offset[i_time, i_baseline, i_chan, 0])
+                    v_center_offset_indx = np.int64(uv_offset[i_time, i_baseline, i_chan, 1])
+                else:
+                    u_center_offset_indx = 0
+                    v_center_offset_indx = 0
+
+                _grid_visibility_jit(grid, sum_weight, do_psf, vis_data, weight, i_time, i_baseline, i_chan, chan_map[i_chan], pol_map, u_center_indx, v_center_indx,
+                                     u_center_offset_indx, v_center_offset_indx, cgk_1D, support, oversampling, conv_u, conv_v, valid_pol, valid_weighted_data, False)
+    return
+
+
+@jit(nopython=True, cache=True, nogil=True)
+def _standard_degrid_uv_index_jit(model_vis, grid, uv_index, uv_offset, chan_map, pol_map, cgk_1D, n_uv, support, oversampling):
+    """
+      _standard_degrid_jit with the grid cells and kernel offsets read from a uv index (see make_uv_index).
+      Visibilities whose kernel footprint is not fully inside the grid (or that have nan uvw values) are set to nan.
+
+      Parameters
+      ----------
+      model_vis : complex array
+          (n_time, n_baseline, n_chan, n_pol)
+      grid : complex array
+          (n_u, n_v, n_imag_chan, n_pol)
+      uv_index : int32 array
+          (n_time, n_baseline, n_chan, 2)
+      uv_offset : int16 array
+          (n_time, n_baseline, n_chan, 2)
+
+      Returns
+      -------
+      """
+    n_time = uv_index.shape[0]
+    n_baseline = uv_index.shape[1]
+    n_chan = len(chan_map)
+
+    for i_time in range(n_time):
+        for i_baseline in range(n_baseline):
+            for i_chan in range(n_chan):
+                _degrid_visibility_jit(model_vis, grid, i_time, i_baseline, i_chan, chan_map[i_chan], pol_map,
+                                       np.int64(uv_index[i_time, i_baseline, i_chan, 0]), np.int64(uv_index[i_time, i_baseline, i_chan, 1]),
+                                       np.int64(uv_offset[i_time, i_baseline, i_chan, 0]), np.int64(uv_offset[i_time, i_baseline, i_chan, 1]), cgk_1D, support, oversampling)
+    return
@@ -0,0 +1,301 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+from numba import jit
+import numpy as np
+import math
+
+def _calc_w_planes(vis_dataset, grid_parms):
+    """
+      Calculates the w values (in wavelengths) of the w-planes. The planes are evenly spaced between -w_max and w_max.
+      w_max is grid_parms['w_max'] if it is larger than 0, otherwise it is the largest |w| in the dataset. Finding the largest |w| reads the
+      whole uvw data variable when the graph is built, so grid_parms['w_max'] should be given for large datasets.
+      If all the w values are 0 (a coplanar array) there is a single w-plane at w = 0.
+
+      Returns
+      -------
+      w_planes : float array
+          (n_wplanes)
+      """
+    import dask.array as da
+    c = 299792458.0
+
+    if grid_parms['n_wplanes'] == 1:
+        return np.zeros(1)
+    if grid_parms['w_max'] > 0:
+        w_max = grid_parms['w_max']
+    else:
+        w_max = da.nanmax(da.fabs(vis_dataset[grid_parms['uvw_name']].data[:, :, 2])).compute() * np.max(vis_dataset.coords['chan'].values) / c
+    if w_max == 0:
+        return np.zeros(1)
+    return np.linspace(-w_max, w_max, grid_parms['n_wplanes'])
+
+
+def _nearest_w_plane(w, w_planes):
+    """
+      Nearest w-plane index of the w values w (in wavelengths, not nan).
+      """
+    if len(w_planes) == 1:
+        return np.zeros(np.shape(w), dtype=int)
+    delta_w = w_planes[1] - w_planes[0]
+    return np.clip(np.floor((w - w_planes[0]) / delta_w + 0.5), 0, len(w_planes) - 1).astype(int)
+
+
+def _calc_w_plane_indx(uvw, freq_chan, w_planes):
+    """
+      Nearest w-plane of every visibility, -1 if the uvw value is nan.
+
+      Returns
+      -------
+      w_plane_indx : int array
+          (n_time, n_baseline, n_chan)
+      """
+    c = 299792458.0
+    w = uvw[:, :, 2, None] * freq_chan[None, None, :] / c
+
+    w_plane_indx = _nearest_w_plane(np.nan_to_num(w), w_planes)
+    w_plane_indx[np.isnan(w)] = -1
+    return w_plane_indx
+
+
+def _select_w_plane(vis_data, uvw, weight, freq_chan, do_psf, grid_parms):
+    """
+      Selects the visibilities of a chunk that belong to the w-plane grid_parms['i_w_plane'] of grid_parms['w_planes'] (used by grid_parms['wterm'] = 'wstacking').
+
+      The w-plane range of every baseline is found from the smallest and largest w of the baseline in the chunk, so only the baselines that reach
+      the w-plane are copied and gridded. The weights of the visibilities of these baselines that belong to other w-planes are set to zero, so that the gridders skip them.
+      A baseline only spans a few w-planes in a chunk, so the w-planes of a chunk together grid about as many visibilities as the chunk has.
+
+      Parameters
+      ----------
+      vis_data : complex array
+          (n_time, n_baseline, n_vis_chan, n_pol) Not used if do_psf.
+      uvw  : float array
+          (n_time, n_baseline, 3)
+      weight : float array
+          (n_time, n_baseline, n_vis_chan, n_pol)
+      freq_chan : float array
+          (n_chan)
+
+      Returns
+      -------
+      (vis_data, uvw, weight) : tuple of arrays
+          The baselines of the chunk that reach the w-plane.
+      """
+    c = 299792458.0
+    w_planes = grid_parms['w_planes']
+    i_w_plane = grid_parms['i_w_plane']
+
+    #w scales with the frequency, so the extremes of a baseline are at the extremes of its w values and of the frequencies (fmin and fmax ignore nan).
+    w_min = np.fmin.reduce(uvw[:, :, 2], axis=0)
+    w_max = np.fmax.reduce(uvw[:, :, 2], axis=0)
+    w_extremes = np.stack([w_min * np.min(freq_chan), w_min * np.max(freq_chan), w_max * np.min(freq_chan), w_max * np.max(freq_chan)]) / c
+    has_w = ~np.isnan(w_min)
+    in_w_plane = np.zeros(len(w_min), dtype=bool)
+    in_w_plane[has_w] = (_nearest_w_plane(np.min(w_extremes[:, has_w], axis=0), w_planes) <= i_w_plane) & (_nearest_w_plane(np.max(w_extremes[:, has_w], axis=0), w_planes) >= i_w_plane)
+    baselines = np.nonzero(in_w_plane)[0]
+
+    uvw = uvw[:, baselines]
+    weight = np.where((_calc_w_plane_indx(uvw, freq_chan, w_planes) == i_w_plane)[:, :, :, None], weight[:, baselines], 0)
+    if not do_psf:
+        vis_data = vis_data[:, baselines]
+    return vis_data, uvw, weight
+
+
+def _apply_w_screen(image, w, delta_lm):
+    """
+      Multiplies an image by the w-term phase screen exp(-2 pi i w (n-1)). The image is centred as the padded image, so it can be
+      the padded image or the central pixels of it that are kept by _remove_padding.
+      With the (u, v) convention of the gridders a source at (l, m) has the visibilities exp(2 pi i (u l + v m + w (n-1))), the screen removes the w-term.
+
+      Parameters
+      ----------
+      image : complex array
+          (n_d0, n_d1, n_chan, n_pol)
+      w : float
+          The w value in wavelengths.
+      """
+    n_d0, n_d1 = image.shape[0:2]
+    l = (np.arange(n_d0) - n_d0 // 2) * np.abs(delta_lm[0])
+    m = (np.arange(n_d1) - n_d1 // 2) * np.abs(delta_lm[1])
+    n_minus_1 = np.sqrt(1.0 - l[:, None]**2 - m[None, :]**2) - 1.0
+    w_screen = np.exp(-2j * np.pi * w * n_minus_1).astype(image.dtype)
+    return image * w_screen[:, :, None, None]
+
+
+def _graph_w_stacking(vis_dataset, cgk_1D, grid_parms):
+    """
+      Builds a separate gridding graph for every w-plane (see _select_w_plane), so every w-plane is gridded, fft'd and multiplied by its
+      w-term phase screen by its own tasks and no task holds more than one w-plane grid. The w-plane images are stacked along a w-plane axis with
+      one chunk per w-plane and summed over that axis two at a time, as are the sums of weights.
+
+      Returns
+      -------
+      uncorrected_image : complex dask array
+          (imsize[0], imsize[1], n_chan, n_pol) The central pixels of the image (the padding is not fft'd, see _ifft2_shifted) that still have to be normalized.
+      sum_weight : dask array
+          (n_chan, n_pol)
+      """
+    import copy
+    import dask.array as da
+    from ._standard_grid import _graph_standard_grid
+    from ._fft import _ifft2_shifted
+
+    w_planes = _calc_w_planes(vis_dataset, grid_parms)
+
+    list_of_images = []
+    list_of_sum_weights = []
+    for i_w_plane, w in enumerate(w_planes):
+        w_plane_grid_parms = copy.deepcopy(grid_parms)
+        w_plane_grid_parms['w_planes'] = w_planes
+        w_plane_grid_parms['i_w_plane'] = i_w_plane
+        grid, sum_weight = _graph_standard_grid(vis_dataset, cgk_1D, w_plane_grid_parms)
+        image = _ifft2_shifted(grid, grid_parms, grid_parms['imsize'])
+        list_of_images.append(da.map_blocks(_apply_w_screen, image, w, grid_parms['cell'], dtype=image.dtype))
+        list_of_sum_weights.append(sum_weight)
+
+    image = da.stack(list_of_images).sum(axis=0, split_every=2)
+    sum_weight = da.stack(list_of_sum_weights).sum(axis=0, split_every=2)
+    return image, sum_weight
+
+
+def _graph_w_projection_kernels(vis_dataset, grid_parms):
+    """
+      Creates the w-projection kernels of all the w-planes, each kernel is a separate dask task. The kernels are computed once and shared by all the gridding tasks.
+
+      Returns
+      -------
+      w_planes : float array
+          (n_wplanes)
+      w_kernels : dask.delayed complex array
+          (n_wplanes, w_oversampling*(w_support//2 + 1), w_oversampling*(w_support//2 + 1))
+      """
+    import dask
+    from ._gridding_convolutional_kernels import _create_w_projection_kernel
+
+    w_planes = _calc_w_planes(vis_dataset, grid_parms)
+    list_of_w_kernels = [dask.delayed(_create_w_projection_kernel)(w, grid_parms['w_oversampling'], grid_parms['w_support'], grid_parms['imsize_padded'], grid_parms['cell']) for w in w_planes]
+    return w_planes, dask.delayed(np.stack)(list_of_w_kernels)
+
+
+#When jit is used round is repolaced by standard c++ round that is different to python round
+@jit(nopython=True, cache=True, nogil=True)
+def _w_projection_grid_jit(grid, sum_weight, do_psf, vis_data, uvw, freq_chan, chan_map, pol_map, weight, w_kernels, w_planes,
+                       n_uv, delta_lm, support, oversampling):
+    """
+      The same as _standard_grid_jit except that every visibility is convolved with the w-projection kernel of its nearest w-plane.
+
+      Parameters
+      ----------
+      grid : complex array
+          (n_chan, n_pol, n_u, n_v)
+      sum_weight : float array
+          (n_chan, n_pol)
+      vis_data : complex array
+          (n_time, n_baseline, n_vis_chan, n_pol)
+      uvw  : float array
+          (n_time, n_baseline, 3)
+      freq_chan : float array
+          (n_chan)
+      chan_map : int array
+          (n_chan)
+      pol_map : int array
+          (n_pol)
+      weight : float array
+          (n_time, n_baseline, n_vis_chan)
+      w_kernels : complex array
+          (n_wplanes, oversampling*(support//2 + 1), oversampling*(support//2 + 1))
+      w_planes : float array
+          (n_wplanes)
+
+      Returns
+      -------
+      """
+    c = 299792458.0
+    uv_scale = np.zeros((3, len(freq_chan)), dtype=np.double)
+    uv_scale[0, :] = -(freq_chan * delta_lm[0] * n_uv[0]) / c
+    uv_scale[1, :] = -(freq_chan * delta_lm[1] * n_uv[1]) / c
+    uv_scale[2, :] = freq_chan / c
+
+    support_center = int(support // 2)
+    uv_center = n_uv // 2
+
+    start_support = - support_center
+    end_support = support - support_center # end_support is larger by 1 so that python range() gives correct indices
+
+    n_time = uvw.shape[0]
+    n_baseline = uvw.shape[1]
+    n_chan = len(chan_map)
+    n_pol = len(pol_map)
+    n_wplanes = len(w_planes)
+
+    if n_wplanes > 1:
+        delta_w = w_planes[1] - w_planes[0]
+    else:
+        delta_w = 1.0
+
+    n_u = n_uv[0]
+    n_v = n_uv[1]
+
+    for i_time in range(n_time):
+        for i_baseline in range(n_baseline):
+            for i_chan in range(n_chan):
+                a_chan = chan_map[i_chan]
+                u = uvw[i_time, i_baseline, 0] * uv_scale[0, i_chan]
+                v = uvw[i_time, i_baseline, 1] * uv_scale[1, i_chan]
+                w = uvw[i_time, i_baseline, 2] * uv_scale[2, i_chan]
+
+                if ~np.isnan(u) and ~np.isnan(v) and ~np.isnan(w):
+                    u_pos = u + uv_center[0]
+                    v_pos = v + uv_center[1]
+
+                    #Do not use numpy round
+                    u_center_indx = int(u_pos + 0.5)
+                    v_center_indx = int(v_pos + 0.5)
+
+                    if n_wplanes > 1:
+                        w_plane_indx = min(max(math.floor((w - w_planes[0]) / delta_w + 0.5), 0), n_wplanes - 1)
+                    else:
+                        w_plane_indx = 0
+
+                    if (u_center_indx+support_center < n_u) and (v_center_indx+support_center < n_v) and (u_center_indx-support_center >= 0) and (v_center_indx-support_center >= 0):
+                        u_offset = u_center_indx - u_pos
+                        u_center_offset_indx = math.floor(u_offset * oversampling + 0.5)
+                        v_offset = v_center_indx - v_pos
+                        v_center_offset_indx = math.floor(v_offset * oversampling + 0.5)
+
+                        for i_pol in range(n_pol):
+                            if do_psf:
+                                weighted_data = weight[i_time, i_baseline, i_chan, i_pol]
+                            else:
+                                weighted_data = vis_data[i_time, i_baseline, i_chan, i_pol] * weight[i_time, i_baseline, i_chan, i_pol]
+
+                            if ~np.isnan(weighted_data) and (weighted_data != 0.0):
+                                a_pol = pol_map[i_pol]
+                                norm = 0.0
+
+                                for i_v in range(start_support,end_support):
+                                    v_indx = v_center_indx + i_v
+                                    v_conv_indx = np.abs(oversampling * i_v + v_center_offset_indx)
+
+                                    for i_u in range(start_support,end_support):
+                                        u_indx = u_center_indx + i_u
+                                        u_conv_indx = np.abs(oversampling * i_u + u_center_offset_indx)
+                                        conv = w_kernels[w_plane_indx, u_conv_indx, v_conv_indx]
+
+                                        grid[a_chan, a_pol, u_indx, v_indx] = grid[a_chan, a_pol, u_indx, v_indx] + conv * weighted_data
+                                        norm = norm + conv.real
+
+                                sum_weight[a_chan, a_pol] = sum_weight[a_chan, a_pol] + weight[i_time, i_baseline, i_chan, i_pol] * norm
+
+    return
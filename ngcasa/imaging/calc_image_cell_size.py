@@ -12,11 +12,13 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
-def calc_image_cell_size(vis_dataset, global_dataset,pixels_per_beam=7):
+def calc_image_cell_size(vis_dataset, global_dataset,pixels_per_beam=7,fft_padding=1.2):
     """
     Calculates the image and and cell size needed for imaging a vis_dataset.
     It uses the perfectly-illuminated circular aperture approximation to determine the field of view
     and pixels_per_beam for the cell size.
+    The image size is the smallest even size, that is at least the field of view, for which the padded image size (int(fft_padding x imsize)) is an even size
+    with no prime factors other than 2, 3 and 5, so that the fft done by make_image is fast and no extra padding is added (see grid_parms['optimize_fft_size']).
 
     Parameters
     ----------
@@ -24,6 +26,10 @@ def calc_image_cell_size(vis_dataset, global_dataset,pixels_per_beam=7):
         Input visibility dataset.
     global_dataset : xarray.core.dataset.Dataset
         Input global dataset (needed for antenna diameter).
+    pixels_per_beam : number, default = 7
+        The number of pixels across the synthesized beam.
+    fft_padding : number, default = 1.2
+        The grid_parms['fft_padding'] that will be used for imaging.
     Returns
     -------
     imsize : list of ints
@@ -34,6 +40,7 @@ def calc_image_cell_size(vis_dataset, global_dataset,pixels_per_beam=7):
     import xarray
     import numpy as np
     import dask.array  as da
+    from ._imaging_utils._fft import _fft_friendly_size
     rad_to_arc = (3600 * 180) / np.pi  # Radians to arcseconds
     c = 299792458
 
@@ -54,16 +61,19 @@ def calc_image_cell_size(vis_dataset, global_dataset,pixels_per_beam=7):
     FWHM_max = np.array((rad_to_arc * (1.02 * c / (D_min * f_min))))
     imsize = FWHM_max / cell
 
-    # Find an image size that is (2^n)*10 when muliplied with the gridding padding and n is an integer
-    padding = 1.2
-
     if imsize[0] < 1:
         imsize[0] = 1
 
     if imsize[1] < 1:
         imsize[1] = 1
 
-    n_power = np.ceil(np.log2(imsize / 10))
-    imsize = np.ceil(((2 ** n_power) * 10) / padding)
+    # Find the smallest even image size for which the padded image size has only small prime factors.
+    imsize = np.ceil(imsize).astype(int)
+    imsize = imsize + imsize % 2
+    for i in range(2):
+        for trial_imsize in range(imsize[i], 2*imsize[i] + 1, 2):
+            if _fft_friendly_size(int(fft_padding*trial_imsize)) == int(fft_padding*trial_imsize):
+                imsize[i] = trial_imsize
+                break
 
     return cell, imsize
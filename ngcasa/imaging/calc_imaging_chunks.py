@@ -0,0 +1,132 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+def calc_imaging_chunks(vis_dataset, chunk_parms):
+    """
+    Recommends a chunking of the visibility data for make_image, make_psf and make_image_and_psf and reports the expected number of graph tasks and
+    peak memory of the current and the recommended chunking before anything is computed.
+    The recommended chunking keeps the chunks below chunk_parms['target_chunk_memory'], gives every thread of the cluster at least one chunk, keeps the graph below chunk_parms['max_tasks'] tasks where the memory allows
+    and bounds the peak memory of a worker (the chunks of visibilities of its threads and the grids that are summed) by chunk_parms['memory_fraction'] of the memory of a worker.
+    With grid_parms['grid_accumulation'] = 'tree' all the grids of an image channel chunk are in memory before they are summed, if these do not fit or the graph has too many tasks
+    'batched' accumulation is recommended.
+    The polarizations are never chunked.
+
+    Parameters
+    ----------
+    vis_dataset : xarray.core.dataset.Dataset
+        Input visibility dataset.
+    chunk_parms : dictionary
+    chunk_parms['imsize'] : list of int, length = 2
+        The image size that will be used for imaging.
+    chunk_parms['chan_mode'] : {'continuum'/'cube'}, default = 'cube'
+        The chan_mode that will be used for imaging.
+    chunk_parms['fft_padding'] : number, acceptable range [1,100], default = 1.2
+        The fft padding that will be used for imaging.
+    chunk_parms['optimize_fft_size'] : bool, default = False
+        The optimize_fft_size that will be used for imaging.
+    chunk_parms['precision'] : {'double'/'single'}, default = 'double'
+        The precision that will be used for imaging.
+    chunk_parms['n_fft_slabs'] : int, default = 1
+        The smallest grid_parms['n_fft_slabs'] that will be used for imaging. It is increased if the grids of a single image channel do not fit in the memory of a worker.
+    chunk_parms['grid_accumulation'] : {'tree'/'chained'/'batched'}, default = 'tree'
+        The grid_parms['grid_accumulation'] that will be used for imaging. 'batched' is recommended if the grids of the 'tree' accumulation do not fit in the memory of a worker or the graph has too many tasks.
+    chunk_parms['n_accumulators'] : int, default = 4
+        The grid_parms['n_accumulators'] that will be used for 'chained' accumulation.
+    chunk_parms['n_chunks_per_task'] : int, default = 8
+        The smallest grid_parms['n_chunks_per_task'] that will be used for 'batched' accumulation. It is increased if the graph has too many tasks.
+    chunk_parms['n_workers'] : int, default = the number of workers of the running dask.distributed client or 1
+        The number of dask workers.
+    chunk_parms['n_threads_per_worker'] : int, default = the number of threads per worker of the running dask.distributed client or the number of cpus
+        The number of threads of each dask worker.
+    chunk_parms['worker_memory'] : number, units = bytes, default = the memory limit of the workers of the running dask.distributed client or the memory of this machine
+        The memory of each dask worker.
+    chunk_parms['memory_fraction'] : number, acceptable range [0.01,1], default = 0.5
+        The fraction of the memory of a worker that the imaging tasks can use.
+    chunk_parms['target_chunk_memory'] : number, units = bytes, default = 128e6
+        The largest chunk of visibilities (DATA, IMAGING_WEIGHT and UVW) that is recommended.
+    chunk_parms['max_tasks'] : int, default = 100000
+        The largest number of graph tasks that is recommended.
+    chunk_parms['rechunk'] : bool, default = False
+        If True the returned vis_dataset is rechunked (lazily) with the recommended chunking.
+    chunk_parms['data_name'] : str, default = 'DATA'
+        The name of the visibility data variable.
+    chunk_parms['uvw_name'] : str, default ='UVW'
+        The name of uvw data variable.
+    chunk_parms['imaging_weight_name'] : str, default ='IMAGING_WEIGHT'
+        The name of the imaging weight data variable.
+
+    Returns
+    -------
+    vis_dataset : xarray.core.dataset.Dataset
+        The input vis_dataset, rechunked if chunk_parms['rechunk'] is True.
+    chunk_report : dictionary
+    chunk_report['chunks'] : dict of int
+        The recommended chunk size of each dimension of the visibility data (can be given to vis_dataset.chunk or storage_parms['chunks_return']).
+    chunk_report['n_fft_slabs'] : int
+        The recommended grid_parms['n_fft_slabs'].
+    chunk_report['grid_accumulation'] : str
+        The recommended grid_parms['grid_accumulation'].
+    chunk_report['n_accumulators'] : int
+        The recommended grid_parms['n_accumulators'].
+    chunk_report['n_chunks_per_task'] : int
+        The recommended grid_parms['n_chunks_per_task'].
+    chunk_report['current'], chunk_report['recommended'] : dictionary
+        The estimates for the current and the recommended chunking, keys 'n_chunks', 'n_tasks', 'vis_chunk_memory' (the largest chunk of visibilities),
+        'grid_memory' (a grid), 'task_memory' (the peak memory of a task) and 'worker_memory' (the peak memory of a worker). Memory in bytes.
+    """
+    print('######################### Start calc_imaging_chunks #########################')
+    import copy
+
+    from ._imaging_utils._check_imaging_parms import _check_imaging_chunks_parms
+    from ._imaging_utils._imaging_chunks import _imaging_chunk_costs, _plan_imaging_chunks
+
+    _chunk_parms = copy.deepcopy(chunk_parms)
+
+    assert(_check_imaging_chunks_parms(vis_dataset,_chunk_parms)), "######### ERROR: chunk_parms checking failed"
+
+    vis_data = vis_dataset[_chunk_parms['data_name']]
+    chunk_report = {}
+    chunk_report['current'] = _imaging_chunk_costs(vis_dataset, vis_data.chunks, _chunk_parms)
+
+    recommended_chunks = _plan_imaging_chunks(vis_dataset, _chunk_parms)
+    chunk_report['chunks'] = dict(zip(vis_data.dims, [max(dim_chunks) for dim_chunks in recommended_chunks]))
+    chunk_report['n_fft_slabs'] = _chunk_parms['n_fft_slabs']
+    chunk_report['grid_accumulation'] = _chunk_parms['grid_accumulation']
+    chunk_report['n_accumulators'] = _chunk_parms['n_accumulators']
+    chunk_report['n_chunks_per_task'] = _chunk_parms['n_chunks_per_task']
+    chunk_report['recommended'] = _imaging_chunk_costs(vis_dataset, recommended_chunks, _chunk_parms)
+
+    worker_memory_limit = _chunk_parms['memory_fraction'] * _chunk_parms['worker_memory']
+    print('Cluster: ', _chunk_parms['n_workers'], 'workers x', _chunk_parms['n_threads_per_worker'], 'threads, %.3g GB per worker of which %.3g GB can be used for imaging' % (_chunk_parms['worker_memory']/1e9, worker_memory_limit/1e9))
+    for label in ['current', 'recommended']:
+        costs = chunk_report[label]
+        chunks = vis_data.chunks if label == 'current' else recommended_chunks
+        print(label.capitalize(), 'chunks', dict(zip(vis_data.dims, [max(dim_chunks) for dim_chunks in chunks])), ': %d chunks, about %d tasks, peak memory %.3g GB per task (%.3g GB visibilities + %.3g GB grid), %.3g GB per worker'
+              % (costs['n_chunks'], costs['n_tasks'], costs['task_memory']/1e9, costs['vis_chunk_memory']/1e9, costs['grid_memory']/1e9, costs['worker_memory']/1e9))
+    if (chunk_report['grid_accumulation'] == 'batched') and (chunk_parms.get('grid_accumulation', 'tree') != 'batched'):
+        print('The grids of the tree accumulation do not fit in the memory of a worker or the graph has too many tasks, use grid_parms[\'grid_accumulation\'] = \'batched\' and grid_parms[\'n_chunks_per_task\'] =', _chunk_parms['n_chunks_per_task'])
+    elif (chunk_report['grid_accumulation'] == 'tree') and (chunk_parms.get('grid_accumulation', 'tree') != 'tree'):
+        print('Only the tree accumulation supports grid_parms[\'n_fft_slabs\'] > 1, use grid_parms[\'grid_accumulation\'] = \'tree\'')
+    if _chunk_parms['n_fft_slabs'] > 1:
+        print('The grids of an image channel do not fit in the memory of a worker, use grid_parms[\'n_fft_slabs\'] =', _chunk_parms['n_fft_slabs'])
+    if chunk_report['recommended']['worker_memory'] > worker_memory_limit:
+        print('######### WARNING: the recommended chunking still needs more memory per worker than chunk_parms[\'memory_fraction\'] allows.')
+    if chunk_report['recommended']['n_tasks'] > _chunk_parms['max_tasks']:
+        print('######### WARNING: the recommended chunking has more tasks than chunk_parms[\'max_tasks\'], larger chunks do not fit in the memory of a worker.')
+
+    if _chunk_parms['rechunk']:
+        vis_dataset = vis_dataset.chunk(chunk_report['chunks'])
+
+    print('######################### Created chunk report #########################')
+    return vis_dataset, chunk_report
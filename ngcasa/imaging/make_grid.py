@@ -12,13 +12,85 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
-def make_grid(vis_dataset, user_grid_parms, storage_parms):
+def make_grid(vis_dataset, grid_parms, storage_parms):
     """
-    .. todo::
-        This function is not yet implemented
-    
+    Grids the user specified visibility, uvw and imaging weight data and keeps the uncorrected uv grid and the sum of weights together with the cube or continuum dirty image made from them.
+    The grid dataset can be saved to disk (storage_parms['to_disk']) and visibilities of new times can later be added to it with update_grid, which only grids the new visibilities and redoes the fft.
+    The times and baselines of the gridded visibilities, the weighting of the imaging weights (see make_imaging_weight) and the grid_parms that determine the grid (imsize, cell, chan_mode, oversampling, support, fft_padding, optimize_fft_size and precision) are stored with the grid.
+
+    Parameters
+    ----------
+    vis_dataset : xarray.core.dataset.Dataset
+        Input visibility dataset.
+    grid_parms : dictionary
+        The grid_parms of make_image, the grid_parms that are not listed below are used as in make_image. Only grid_parms['wterm'] 'none' is supported.
+    grid_parms['imsize'] : list of int, length = 2
+        The image size (no padding).
+    grid_parms['cell']  : list of number, length = 2, units = arcseconds
+        The image cell size.
+    grid_parms['chan_mode'] : {'continuum'/'cube'}, default = 'cube'
+        Create a continuum or cube grid and image.
+    grid_parms['grid_name'] : str, default ='GRID'
+        The created grid name. The grid has the dimensions (u, v, chan, pol) and is not corrected for the gridding convolution function or normalized by the sum of weights.
+    grid_parms['sum_weight_name'] : str, default ='SUM_WEIGHT'
+        The created sum of weights name.
+    grid_parms['gridded_time_name'] : str, default ='GRIDDED_TIME'
+        The created name of the time coordinate values of the gridded visibilities.
+    grid_parms['gridded_baseline_name'] : str, default ='GRIDDED_BASELINE'
+        The created name of the baseline coordinate values of the gridded visibilities.
+    grid_parms['image_name'] : str, default ='DIRTY_IMAGE'
+        The created image name.
+    storage_parms : dictionary
+    storage_parms['to_disk'] : bool, default = False
+        If true the dask graph is executed and saved to disk in the zarr format.
+    storage_parms['append'] : bool, default = False
+        If storage_parms['to_disk'] is True only the dask graph associated with the function is executed and the resulting data variables are saved to an existing zarr file on disk.
+        Note that graphs on unrelated data to this function will not be executed or saved.
+    storage_parms['outfile'] : str
+        The zarr file to create or append to.
+    storage_parms['chunks_on_disk'] : dict of int, default = {}
+        The chunk size to use when writing to disk. This is ignored if storage_parms['append'] is True. The default will use the chunking of the input dataset.
+    storage_parms['chunks_return'] : dict of int, default = {}
+        The chunk size of the dataset that is returned. The default will use the chunking of the input dataset.
+    storage_parms['graph_name'] : str
+        The time to compute and save the data is stored in the attribute section of the dataset and storage_parms['graph_name'] is used in the label.
+    storage_parms['compressor'] : numcodecs.blosc.Blosc,default=Blosc(cname='zstd', clevel=2, shuffle=0)
+        The compression algorithm to use. Available compression algorithms can be found at https://numcodecs.readthedocs.io/en/stable/blosc.html.
+
     Returns
     -------
-    img_xds : xarray.core.dataset.Dataset
-
+    grid_dataset : xarray.core.dataset.Dataset
+        The grid_dataset will contain the grid, the sum of weights, the times and baselines of the gridded visibilities and the dirty image.
     """
+    print('######################### Start make_grid #########################')
+    import copy
+
+    from ngcasa._ngcasa_utils._store import _store
+    from ngcasa._ngcasa_utils._check_parms import _check_storage_parms
+    from ._imaging_utils._check_imaging_parms import _check_make_grid_parms
+    from ._imaging_utils._gcf_cache import _get_gcf
+    from ._imaging_utils._standard_grid import _graph_standard_grid
+    from ._imaging_utils._grid_dataset import _make_grid_dataset
+    from ._imaging_utils._make_image import _image_coords
+
+    _grid_parms = copy.deepcopy(grid_parms)
+    _storage_parms = copy.deepcopy(storage_parms)
+
+    _grid_parms['do_psf'] = False
+    _grid_parms['do_image_and_psf'] = False
+
+    assert(_check_make_grid_parms(vis_dataset,_grid_parms)), "######### ERROR: grid_parms checking failed"
+    assert(_check_storage_parms(_storage_parms,'dirty_image.grid.zarr','make_grid')), "######### ERROR: storage_parms checking failed"
+
+    # Getting the gridding kernel from the cache or creating it
+    cf_dataset = _get_gcf('prolate_spheroidal', _grid_parms['oversampling'], _grid_parms['support'], _grid_parms['imsize_padded'], _grid_parms['gcf_cache_dir'])
+    cgk_1D = cf_dataset['CGK_1D'].values
+    correcting_cgk_image = cf_dataset['CORRECTING_CGK'].values
+
+    prefetch_timings = {}
+    grid, sum_weight = _graph_standard_grid(vis_dataset, cgk_1D, _grid_parms, prefetch_timings)
+
+    grid_dataset = _make_grid_dataset(grid, sum_weight, vis_dataset.coords['time'].values, vis_dataset.coords['baseline'].values, _image_coords(vis_dataset, _grid_parms), correcting_cgk_image, _grid_parms, prefetch_timings)
+
+    list_xarray_data_variables = [grid_dataset[_grid_parms['grid_name']], grid_dataset[_grid_parms['sum_weight_name']], grid_dataset[_grid_parms['gridded_time_name']], grid_dataset[_grid_parms['gridded_baseline_name']], grid_dataset[_grid_parms['image_name']]]
+    return _store(grid_dataset,list_xarray_data_variables,_storage_parms)
@@ -15,11 +15,12 @@
 
 def make_gridding_convolution_function(img_apeture_dataset, gridding_convolution_parms, storage_parms):
     """
-    .. todo::
-        This function is not yet implemented
-    
     Calculate gridding convolution functions (GCF) as specified for standard, widefield and mosaic imaging.
     Construct a GCF cache (persistent or on-the-fly)
+    
+    The GCFs are cached in memory (the least recently used are evicted) and, if gridding_convolution_parms['gcf_cache_dir'] is given, on disk in the zarr format.
+    The cache is keyed on (function, oversampling, support, imsize_padded) and is shared with make_image, make_psf, make_image_and_psf and predict_modelvis_image (grid_parms['gcf_cache_dir']), so repeated imaging runs do not recreate the GCFs.
+    Only the prolate spheroidal gridding kernel is currently supported, img_apeture_dataset is not used (this will change in a future releases.)
 
     Options : Choose a list of effects to include
     
@@ -28,10 +29,64 @@ def make_gridding_convolution_function(img_apeture_dataset, gridding_convolution
         - Include support for Heterogeneous Arrays where Aterm is different per antenna
         - Include support for time-varying PB and AIF models. Rotation, etc.
     - Wterm : FT of Fresnel kernel per baseline
+    
+    Parameters
+    ----------
+    img_apeture_dataset : xarray.core.dataset.Dataset
+        Not used yet, can be None.
+    gridding_convolution_parms : dictionary
+    gridding_convolution_parms['function'] : {'prolate_spheroidal'}, default = 'prolate_spheroidal'
+        The gridding convolution function.
+    gridding_convolution_parms['imsize'] : list of int, length = 2
+        The image size (no padding).
+    gridding_convolution_parms['oversampling'] : int, default = 100
+        The oversampling of the convolutional gridding kernel.
+    gridding_convolution_parms['support'] : int, default = 7
+        The full support of the convolutional gridding kernel.
+    gridding_convolution_parms['fft_padding'] : number, acceptable range [1,100], default = 1.2
+        The factor that determines how much the grid is padded before the fft is done. The correcting image has the padded image size.
+    gridding_convolution_parms['optimize_fft_size'] : bool, default = False
+        If True the padded image size (fft_padding x imsize) is rounded up to the next even size that only has the prime factors 2, 3 and 5, for which the fft is fastest. Must be the same as the grid_parms['optimize_fft_size'] used for imaging so that the cached functions are shared.
+    gridding_convolution_parms['gcf_cache_dir'] : str, default = ''
+        Directory of the zarr disk cache. If '' only the memory cache is used.
+    storage_parms : dictionary
+    storage_parms['to_disk'] : bool, default = False
+        If true the dask graph is executed and saved to disk in the zarr format.
+    storage_parms['append'] : bool, default = False
+        If storage_parms['to_disk'] is True only the dask graph associated with the function is executed and the resulting data variables are saved to an existing zarr file on disk.
+        Note that graphs on unrelated data to this function will not be executed or saved.
+    storage_parms['outfile'] : str
+        The zarr file to create or append to.
+    storage_parms['chunks_on_disk'] : dict of int, default = {}
+        The chunk size to use when writing to disk. This is ignored if storage_parms['append'] is True. The default will use the chunking of the input dataset.
+    storage_parms['chunks_return'] : dict of int, default = {}
+        The chunk size of the dataset that is returned. The default will use the chunking of the input dataset.
+    storage_parms['graph_name'] : str
+        The time to compute and save the data is stored in the attribute section of the dataset and storage_parms['graph_name'] is used in the label.
+    storage_parms['compressor'] : numcodecs.blosc.Blosc,default=Blosc(cname='zstd', clevel=2, shuffle=0)
+        The compression algorithm to use. Available compression algorithms can be found at https://numcodecs.readthedocs.io/en/stable/blosc.html.
             
     Returns
     -------
     cf_dataset : xarray.core.dataset.Dataset
-            
+        Contains CGK_1D (the positive half of the oversampled 1D gridding kernel) and CORRECTING_CGK (the gridding correction image of the padded image). The parameters are stored in the attributes.
     """
-
+    print('######################### Start make_gridding_convolution_function #########################')
+    import copy
+    
+    from ngcasa._ngcasa_utils._store import _store
+    from ngcasa._ngcasa_utils._check_parms import _check_storage_parms
+    from ._imaging_utils._check_imaging_parms import _check_gcf_parms
+    from ._imaging_utils._gcf_cache import _get_gcf
+    
+    _gridding_convolution_parms = copy.deepcopy(gridding_convolution_parms)
+    _storage_parms = copy.deepcopy(storage_parms)
+    
+    assert(_check_gcf_parms(_gridding_convolution_parms)), "######### ERROR: gridding_convolution_parms checking failed"
+    assert(_check_storage_parms(_storage_parms,'gcf.zarr','make_gridding_convolution_function')), "######### ERROR: storage_parms checking failed"
+    
+    #A copy so that the cached dataset can not be modified.
+    cf_dataset = _get_gcf(_gridding_convolution_parms['function'], _gridding_convolution_parms['oversampling'], _gridding_convolution_parms['support'], _gridding_convolution_parms['imsize_padded'], _gridding_convolution_parms['gcf_cache_dir']).copy(deep=True)
+    
+    list_xarray_data_variables = [cf_dataset['CGK_1D'],cf_dataset['CORRECTING_CGK']]
+    return _store(cf_dataset,list_xarray_data_variables,_storage_parms)
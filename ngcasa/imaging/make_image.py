@@ -15,6 +15,7 @@
 def make_image(vis_dataset, grid_parms, storage_parms):
     """
     Creates a cube or continuum dirty image from the user specified visibility, uvw and imaging weight data. Only the prolate spheroidal convolutional gridding function is supported (this will change in a future releases.)
+    The gridding options, and the combinations of them that are supported, are described in the Gridding Options section of the imaging documentation (docs/ngcasa_imaging.ipynb).
     
     Parameters
     ----------
@@ -33,8 +34,51 @@ def make_image(vis_dataset, grid_parms, storage_parms):
         The full support used for convolutional gridding kernel. This will be removed in a later release and incorporated in the function that creates gridding convolutional kernels.
     grid_parms['fft_padding'] : number, acceptable range [1,100], default = 1.2
         The factor that determines how much the gridded visibilities are padded before the fft is done.
+    grid_parms['optimize_fft_size'] : bool, default = False
+        If True the padded image size is rounded up to the next even size that only has the prime factors 2, 3 and 5.
+    grid_parms['gcf_cache_dir'] : str, default = ''
+        Directory in which the gridding convolution functions are cached in the zarr format (see make_gridding_convolution_function). Gridding convolution functions are also cached in memory. If '' only the memory cache is used.
+    grid_parms['gridder'] : {'standard'/'tiled'/'parallel'}, default = 'standard'
+        The gridding kernel. 'tiled' grids the visibilities uv tile by uv tile, 'parallel' grids each chunk with all the numba threads (only with 'chained' or 'streaming' grid accumulation).
+    grid_parms['tile_size'] : int, default = 64
+        The number of grid cells along each side of the uv tiles of the 'tiled' and 'parallel' gridders.
+    grid_parms['grid_accumulation'] : {'tree'/'chained'/'bounding_box'/'batched'/'streaming'}, default = 'tree' ('chained' for the 'parallel' gridder)
+        How the grids of the chunks are summed. 'streaming' is eager: the visibilities are gridded when make_image is called, only the fft and the normalization are left to the returned dask graph.
+    grid_parms['n_accumulators'] : int, default = 4 (1 for the 'parallel' gridder)
+        The number of grids accumulated in parallel for each image channel chunk by 'chained' grid accumulation. Every chain holds about 2 grids.
+        With the 'parallel' gridder every chain grids with all the numba threads, so more than 1 chain oversubscribes the cores.
+    grid_parms['n_chunks_per_task'] : int, default = 8
+        The number of adjacent time chunks gridded by each task of 'batched' grid accumulation.
+    grid_parms['n_stream_threads'] : int, default = the number of cpus
+        The number of threads that grid the chunks with 'streaming' grid accumulation.
+    grid_parms['n_prefetch_chunks'] : int, default = 2
+        The number of chunks that are read ahead of the gridding with 'streaming' grid accumulation.
+    grid_parms['n_prefetch_threads'] : int, default = 2
+        The number of threads that read the chunks ahead of the gridding with 'streaming' grid accumulation, the only accumulation that reads ahead. The read timings are stored in the 'prefetch_timings' attribute of the returned dataset.
+    grid_parms['n_fft_slabs'] : int, default = 1
+        If larger than 1 the grid is gridded and fft'd in u-slabs, so that no task holds the full grid.
+    grid_parms['precision'] : {'double'/'single'}, default = 'double'
+        The floating point precision of the grids, the fft and the image. 'single' images differ from 'double' images by less than 1e-4 of the image peak.
+    grid_parms['grid_layout'] : {'chan_pol_u_v'/'u_v_chan_pol'}, default = 'chan_pol_u_v'
+        The memory layout of the grids while gridding. 'u_v_chan_pol' is faster for cubes but slower for continuum images (see the grid layout benchmark in docs/benchmark.ipynb).
+    grid_parms['bda_tolerance'] : number, acceptable range [0,1], default = 0
+        If larger than 0 the visibilities are averaged per baseline before they are gridded, moving no visibility by more than bda_tolerance grid cells.
+    grid_parms['chan_grouping_tolerance'] : number, acceptable range [0,1], default = 0
+        Only used if grid_parms['chan_mode'] is 'continuum'. If larger than 0 adjacent channels are gridded as one sample, moving no channel by more than chan_grouping_tolerance grid cells.
+    grid_parms['wterm'] : {'none'/'wstacking'/'wprojection'}, default = 'none'
+        How the w-term is corrected for wide-field imaging. 'wstacking' grids, ffts and phase corrects every w-plane in separate tasks and sums the w-plane images.
+    grid_parms['n_wplanes'] : int, default = 16
+        The number of w-planes used by 'wstacking' and 'wprojection'.
+    grid_parms['w_max'] : number, default = 0
+        The largest |w| in wavelengths, the w-planes are evenly spaced between -w_max and w_max. If 0 the largest |w| of the dataset is used, this reads the whole uvw data variable when the graph is built.
+    grid_parms['w_support'] : int, default = 31
+        The full support of the w-projection kernels.
+    grid_parms['w_oversampling'] : int, default = 8
+        The oversampling of the w-projection kernels.
     grid_parms['uvw_name'] : str, default ='UVW'
         The name of uvw data variable that will be used to grid the visibilities.
+    grid_parms['uv_index_name'] : str, default = ''
+        The name of a uv index data variable (see make_uv_index) created with the same cell, imsize, fft_padding, optimize_fft_size and oversampling. If given the grid cells are read from it instead of being calculated from the uvw values.
     grid_parms['data_name'] : str, default = 'DATA'
         The name of the visibility data to be gridded.
     grid_parms['imaging_weight_name'] : str, default ='IMAGING_WEIGHT'
@@ -66,76 +110,22 @@ def make_image(vis_dataset, grid_parms, storage_parms):
         The image_dataset will contain the image created and the sum of weights.
     """
     print('######################### Start make_image #########################')
-    import numpy as np
-    from numba import jit
-    import time
-    import math
-    import dask.array.fft as dafft
     import xarray as xr
-    import dask.array as da
-    import matplotlib.pylab as plt
-    import dask.array.fft as dafft
-    import dask
-    import copy, os
-    from numcodecs import Blosc
-    from itertools import cycle
     
     from ngcasa._ngcasa_utils._store import _store
-    from ngcasa._ngcasa_utils._check_parms import _check_storage_parms
-    from ._imaging_utils._check_imaging_parms import _check_grid_params
-    from ._imaging_utils._gridding_convolutional_kernels import _create_prolate_spheroidal_kernel, _create_prolate_spheroidal_kernel_1D
-    from ._imaging_utils._standard_grid import _graph_standard_grid
-    from ._imaging_utils._remove_padding import _remove_padding
+    from ._imaging_utils._make_image import _setup_make_image, _graph_make_image, _image_coords
+    from ._imaging_utils._prefetch import _prefetch_attrs
     
-    _grid_parms = copy.deepcopy(grid_parms)
-    _storage_parms = copy.deepcopy(storage_parms)
+    _grid_parms, _storage_parms, cgk_1D, correcting_cgk_image = _setup_make_image(vis_dataset, grid_parms, storage_parms, False, False, 'dirty_image.img.zarr', 'make_image')
     
-    _grid_parms['do_psf'] = False
-    
-    assert(_check_grid_params(vis_dataset,_grid_parms)), "######### ERROR: grid_parms checking failed"
-    assert(_check_storage_parms(_storage_parms,'dirty_image.img.zarr','make_image')), "######### ERROR: storage_parms checking failed"
-    
-    # Creating gridding kernel
-    cgk, correcting_cgk_image = _create_prolate_spheroidal_kernel(_grid_parms['oversampling'], _grid_parms['support'], _grid_parms['imsize_padded'])
-    cgk_1D = _create_prolate_spheroidal_kernel_1D(_grid_parms['oversampling'], _grid_parms['support'])
-    
-    grids_and_sum_weights = _graph_standard_grid(vis_dataset, cgk_1D, _grid_parms)
-    uncorrected_dirty_image = dafft.fftshift(dafft.ifft2(dafft.ifftshift(grids_and_sum_weights[0], axes=(0, 1)), axes=(0, 1)), axes=(0, 1))
-        
-    #Remove Padding
-    correcting_cgk_image = _remove_padding(correcting_cgk_image,_grid_parms['imsize'])
-    uncorrected_dirty_image = _remove_padding(uncorrected_dirty_image,_grid_parms['imsize']).real * (_grid_parms['imsize_padded'][0] * _grid_parms['imsize_padded'][1])
-        
-            
-    #############Move this to Normalizer#############
-    def correct_image(uncorrected_dirty_image, sum_weights, correcting_cgk):
-        sum_weights[sum_weights == 0] = 1
-        # corrected_image = (uncorrected_dirty_image/sum_weights[:,:,None,None])/correcting_cgk[None,None,:,:]
-        corrected_image = (uncorrected_dirty_image / sum_weights[None, None, :, :]) / correcting_cgk[:, :, None, None]
-        return corrected_image
-
-    corrected_dirty_image = da.map_blocks(correct_image, uncorrected_dirty_image, grids_and_sum_weights[1],correcting_cgk_image)
-   ####################################################
-
-    if _grid_parms['chan_mode'] == 'continuum':
-        freq_coords = [da.mean(vis_dataset.coords['chan'].values)]
-        chan_width = da.from_array([da.mean(vis_dataset['chan_width'].data)],chunks=(1,))
-        imag_chan_chunk_size = 1
-    elif _grid_parms['chan_mode'] == 'cube':
-        freq_coords = vis_dataset.coords['chan'].values
-        chan_width = vis_dataset['chan_width'].data
-        imag_chan_chunk_size = vis_dataset.DATA.chunks[2][0]
+    prefetch_timings = {}
+    corrected_dirty_image, sum_weight = _graph_make_image(vis_dataset, cgk_1D, correcting_cgk_image, _grid_parms, prefetch_timings)
     
     ###Create Dirty Image Dataset
-    chunks = vis_dataset.DATA.chunks
-    n_imag_pol = chunks[3][0]
     image_dict = {}
-    coords = {'d0': np.arange(_grid_parms['imsize'][0]), 'd1': np.arange(_grid_parms['imsize'][1]),
-              'chan': freq_coords, 'pol': np.arange(n_imag_pol), 'chan_width' : ('chan',chan_width)}
-              
-    image_dict[_grid_parms['sum_weight_name']] = xr.DataArray(grids_and_sum_weights[1], dims=['chan','pol'])
+    image_dict[_grid_parms['sum_weight_name']] = xr.DataArray(sum_weight, dims=['chan','pol'])
     image_dict[_grid_parms['image_name']] = xr.DataArray(corrected_dirty_image, dims=['d0', 'd1', 'chan', 'pol'])
-    image_dataset = xr.Dataset(image_dict, coords=coords)
+    image_dataset = xr.Dataset(image_dict, coords=_image_coords(vis_dataset, _grid_parms), attrs=_prefetch_attrs(prefetch_timings, _grid_parms))
     
     list_xarray_data_variables = [image_dataset[_grid_parms['image_name']],image_dataset[_grid_parms['sum_weight_name']]]
     return _store(image_dataset,list_xarray_data_variables,_storage_parms)
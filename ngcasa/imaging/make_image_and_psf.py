@@ -0,0 +1,146 @@
+#   Copyright 2019 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+def make_image_and_psf(vis_dataset, grid_parms, storage_parms):
+    """
+    Creates a cube or continuum dirty image and point spread function (psf) image from the user specified visibility, uvw and imaging weight data. Only the prolate spheroidal convolutional gridding function is supported (this will change in a future releases.)
+    The gridding options, and the combinations of them that are supported, are described in the Gridding Options section of the imaging documentation (docs/ngcasa_imaging.ipynb).
+    The visibilities and the imaging weights are gridded in the same pass, so that the uvw and imaging weight data are only loaded once and the grid indices are only calculated once for each visibility.
+    This gives the same result as calling make_image and make_psf.
+    
+    Parameters
+    ----------
+    vis_dataset : xarray.core.dataset.Dataset
+        Input visibility dataset.
+    grid_parms : dictionary
+    grid_parms['imsize'] : list of int, length = 2
+        The image size (no padding).
+    grid_parms['cell']  : list of number, length = 2, units = arcseconds
+        The image cell size.
+    grid_parms['chan_mode'] : {'continuum'/'cube'}, default = 'continuum'
+        Create a continuum or cube image.
+    grid_parms['oversampling'] : int, default = 100
+        The oversampling used for the convolutional gridding kernel. This will be removed in a later release and incorporated in the function that creates gridding convolutional kernels.
+    grid_parms['support'] : int, default = 7
+        The full support used for convolutional gridding kernel. This will be removed in a later release and incorporated in the function that creates gridding convolutional kernels.
+    grid_parms['fft_padding'] : number, acceptable range [1,100], default = 1.2
+        The factor that determines how much the gridded visibilities are padded before the fft is done.
+    grid_parms['optimize_fft_size'] : bool, default = False
+        If True the padded image size is rounded up to the next even size that only has the prime factors 2, 3 and 5.
+    grid_parms['gcf_cache_dir'] : str, default = ''
+        Directory in which the gridding convolution functions are cached in the zarr format (see make_gridding_convolution_function). Gridding convolution functions are also cached in memory. If '' only the memory cache is used.
+    grid_parms['gridder'] : {'standard'/'tiled'/'parallel'}, default = 'standard'
+        The gridding kernel. 'tiled' grids the visibilities uv tile by uv tile, 'parallel' grids each chunk with all the numba threads (only with 'chained' or 'streaming' grid accumulation).
+    grid_parms['tile_size'] : int, default = 64
+        The number of grid cells along each side of the uv tiles of the 'tiled' and 'parallel' gridders.
+    grid_parms['grid_accumulation'] : {'tree'/'chained'/'bounding_box'/'batched'/'streaming'}, default = 'tree' ('chained' for the 'parallel' gridder)
+        How the grids of the chunks are summed. 'streaming' is eager: the visibilities are gridded when make_image_and_psf is called, only the fft and the normalization are left to the returned dask graph.
+    grid_parms['n_accumulators'] : int, default = 4 (1 for the 'parallel' gridder)
+        The number of grids accumulated in parallel for each image channel chunk by 'chained' grid accumulation. Every chain holds about 2 grids.
+        With the 'parallel' gridder every chain grids with all the numba threads, so more than 1 chain oversubscribes the cores.
+    grid_parms['n_chunks_per_task'] : int, default = 8
+        The number of adjacent time chunks gridded by each task of 'batched' grid accumulation.
+    grid_parms['n_stream_threads'] : int, default = the number of cpus
+        The number of threads that grid the chunks with 'streaming' grid accumulation.
+    grid_parms['n_prefetch_chunks'] : int, default = 2
+        The number of chunks that are read ahead of the gridding with 'streaming' grid accumulation.
+    grid_parms['n_prefetch_threads'] : int, default = 2
+        The number of threads that read the chunks ahead of the gridding with 'streaming' grid accumulation, the only accumulation that reads ahead. The read timings are stored in the 'prefetch_timings' attribute of the returned dataset.
+    grid_parms['n_fft_slabs'] : int, default = 1
+        If larger than 1 the grid is gridded and fft'd in u-slabs, so that no task holds the full grid.
+    grid_parms['precision'] : {'double'/'single'}, default = 'double'
+        The floating point precision of the grids, the fft and the image. 'single' images differ from 'double' images by less than 1e-4 of the image peak.
+    grid_parms['grid_layout'] : {'chan_pol_u_v'/'u_v_chan_pol'}, default = 'chan_pol_u_v'
+        The memory layout of the grids while gridding. 'u_v_chan_pol' is faster for cubes but slower for continuum images (see the grid layout benchmark in docs/benchmark.ipynb).
+    grid_parms['bda_tolerance'] : number, acceptable range [0,1], default = 0
+        If larger than 0 the visibilities are averaged per baseline before they are gridded, moving no visibility by more than bda_tolerance grid cells.
+    grid_parms['chan_grouping_tolerance'] : number, acceptable range [0,1], default = 0
+        Only used if grid_parms['chan_mode'] is 'continuum'. If larger than 0 adjacent channels are gridded as one sample, moving no channel by more than chan_grouping_tolerance grid cells.
+    grid_parms['wterm'] : {'none'/'wstacking'/'wprojection'}, default = 'none'
+        How the w-term is corrected for wide-field imaging. 'wstacking' grids, ffts and phase corrects every w-plane in separate tasks and sums the w-plane images.
+    grid_parms['n_wplanes'] : int, default = 16
+        The number of w-planes used by 'wstacking' and 'wprojection'.
+    grid_parms['w_max'] : number, default = 0
+        The largest |w| in wavelengths, the w-planes are evenly spaced between -w_max and w_max. If 0 the largest |w| of the dataset is used, this reads the whole uvw data variable when the graph is built.
+    grid_parms['w_support'] : int, default = 31
+        The full support of the w-projection kernels.
+    grid_parms['w_oversampling'] : int, default = 8
+        The oversampling of the w-projection kernels.
+    grid_parms['uvw_name'] : str, default ='UVW'
+        The name of uvw data variable that will be used to grid the visibilities.
+    grid_parms['uv_index_name'] : str, default = ''
+        The name of a uv index data variable (see make_uv_index) created with the same cell, imsize, fft_padding, optimize_fft_size and oversampling. If given the grid cells are read from it instead of being calculated from the uvw values.
+    grid_parms['data_name'] : str, default = 'DATA'
+        The name of the visibility data to be gridded.
+    grid_parms['imaging_weight_name'] : str, default ='IMAGING_WEIGHT'
+        The name of the imaging weights to be used.
+    grid_parms['image_name'] : str, default ='DIRTY_IMAGE'
+        The created image name.
+    grid_parms['sum_weight_name'] : str, default ='SUM_WEIGHT'
+        The created sum of weights name.
+    grid_parms['psf_name'] : str, default ='PSF'
+        The created psf image name.
+    grid_parms['psf_sum_weight_name'] : str, default ='PSF_SUM_WEIGHT'
+        The created psf sum of weights name.
+    storage_parms : dictionary
+    storage_parms['to_disk'] : bool, default = False
+        If true the dask graph is executed and saved to disk in the zarr format.
+    storage_parms['append'] : bool, default = False
+        If storage_parms['to_disk'] is True only the dask graph associated with the function is executed and the resulting data variables are saved to an existing zarr file on disk.
+        Note that graphs on unrelated data to this function will not be executed or saved.
+    storage_parms['outfile'] : str
+        The zarr file to create or append to.
+    storage_parms['chunks_on_disk'] : dict of int, default = {}
+        The chunk size to use when writing to disk. This is ignored if storage_parms['append'] is True. The default will use the chunking of the input dataset.
+    storage_parms['chunks_return'] : dict of int, default = {}
+        The chunk size of the dataset that is returned. The default will use the chunking of the input dataset.
+    storage_parms['graph_name'] : str
+        The time to compute and save the data is stored in the attribute section of the dataset and storage_parms['graph_name'] is used in the label.
+    storage_parms['compressor'] : numcodecs.blosc.Blosc,default=Blosc(cname='zstd', clevel=2, shuffle=0)
+        The compression algorithm to use. Available compression algorithms can be found at https://numcodecs.readthedocs.io/en/stable/blosc.html.
+    
+    Returns
+    -------
+    image_dataset : xarray.core.dataset.Dataset
+        The image_dataset will contain the dirty image, the psf and their sums of weights.
+    """
+    print('######################### Start make_image_and_psf #########################')
+    import xarray as xr
+    
+    from ngcasa._ngcasa_utils._store import _store
+    from ._imaging_utils._make_image import _setup_make_image, _graph_make_image, _image_coords
+    from ._imaging_utils._prefetch import _prefetch_attrs
+    
+    _grid_parms, _storage_parms, cgk_1D, correcting_cgk_image = _setup_make_image(vis_dataset, grid_parms, storage_parms, False, True, 'dirty_image_and_psf.img.zarr', 'make_image_and_psf')
+    
+    #The psf is gridded as extra polarizations after the visibility polarizations, so one fft is done for both.
+    prefetch_timings = {}
+    corrected_image, sum_weight = _graph_make_image(vis_dataset, cgk_1D, correcting_cgk_image, _grid_parms, prefetch_timings)
+   
+    n_imag_pol = vis_dataset[_grid_parms['data_name']].chunks[3][0]
+    corrected_dirty_image = corrected_image[:, :, :, :n_imag_pol]
+    corrected_psf_image = corrected_image[:, :, :, n_imag_pol:]
+    sum_weights = sum_weight[:, :n_imag_pol]
+    psf_sum_weights = sum_weight[:, n_imag_pol:]
+    
+    ###Create Dirty Image and PSF Dataset
+    image_dict = {}
+    image_dict[_grid_parms['sum_weight_name']] = xr.DataArray(sum_weights, dims=['chan','pol'])
+    image_dict[_grid_parms['image_name']] = xr.DataArray(corrected_dirty_image, dims=['d0', 'd1', 'chan', 'pol'])
+    image_dict[_grid_parms['psf_sum_weight_name']] = xr.DataArray(psf_sum_weights, dims=['chan','pol'])
+    image_dict[_grid_parms['psf_name']] = xr.DataArray(corrected_psf_image, dims=['d0', 'd1', 'chan', 'pol'])
+    image_dataset = xr.Dataset(image_dict, coords=_image_coords(vis_dataset, _grid_parms), attrs=_prefetch_attrs(prefetch_timings, _grid_parms))
+    
+    list_xarray_data_variables = [image_dataset[_grid_parms['image_name']],image_dataset[_grid_parms['sum_weight_name']],image_dataset[_grid_parms['psf_name']],image_dataset[_grid_parms['psf_sum_weight_name']]]
+    return _store(image_dataset,list_xarray_data_variables,_storage_parms)
@@ -17,17 +17,21 @@ def make_imaging_weight(vis_dataset, imaging_weights_parms,storage_parms):
     """
     Creates the imaging weight data variable that has dimensions time x baseline x chan x pol (matches the visibility data variable).
     The weight density can be averaged over channels or calculated independently for each channel using imaging_weights_parms['chan_mode'].
-    The following imaging weighting schemes are supported 'natural', 'uniform', 'briggs', 'briggs_abs'.
+    The following imaging weighting schemes are supported 'natural', 'uniform', 'briggs', 'briggs_abs' and 'superuniform', optionally combined with a uv taper.
     The imaging_weights_parms['imsize'] and imaging_weights_parms['cell'] should usually be the same values that will be used for subsequent synthesis blocks (for example making the psf).
-    To achieve something similar to 'superuniform' weighting in CASA tclean imaging_weights_parms['imsize'] and imaging_weights_parms['cell'] can be varied relative to the values used in subsequent synthesis blocks.
+    The weight density is accumulated in a single pass over the visibilities into imaging_weights_parms['n_accumulators'] density grids per image channel chunk (the general gridder is not used).
     
     Parameters
     ----------
     vis_dataset : xarray.core.dataset.Dataset
         Input visibility dataset.
     imaging_weights_parms : dictionary
-    imaging_weights_parms['weighting'] : {'natural', 'uniform', 'briggs', 'briggs_abs'}, default = natural
+    imaging_weights_parms['weighting'] : {'natural', 'uniform', 'briggs', 'briggs_abs', 'superuniform'}, default = natural
         Weighting scheme used for creating the imaging weights.
+        'uniform' divides the weights by the weight density (the sum of the weights in their uv cell).
+        'superuniform' is 'uniform' with the weight density summed over the (2 x imaging_weights_parms['npixels'] + 1)^2 uv cells around each cell.
+        'briggs' and 'briggs_abs' divide the weights by f_0 x weight density + f_1, with f_0 = (5 x 10^-robust)^2/(sum of the squared weight density/sum of the weights), f_1 = 1 for 'briggs'
+        and f_0 = robust^2, f_1 = 2 x briggs_abs_noise^2 for 'briggs_abs'.
     imaging_weights_parms['imsize'] : list of int, length = 2
         The size of the grid for gridding the imaging weights. Used when imaging_weights_parms['weighting'] is not 'natural'.
     imaging_weights_parms['cell']  : list of number, length = 2, units = arcseconds
@@ -38,6 +42,11 @@ def make_imaging_weight(vis_dataset, imaging_weights_parms,storage_parms):
         robust = +2.0 maps to natural weighting.
     imaging_weights_parms['briggs_abs_noise'] : number, default=1.0
         Noise parameter for imaging_weights_parms['weighting']='briggs_abs' mode weighting.
+    imaging_weights_parms['npixels'] : int, default = 3
+        The half width in uv cells of the box over which the weight density is summed for imaging_weights_parms['weighting']='superuniform'.
+    imaging_weights_parms['uvtaper'] : list of number, default = []
+        The image domain gaussian [bmaj, bmin, bpa] (arcseconds, arcseconds, degrees) whose Fourier transform multiplies the imaging weights. If bmin is not given it is bmaj and if bpa is not given it is 0. If [] no taper is applied.
+        The taper can be used with any imaging_weights_parms['weighting'].
     imaging_weights_parms['chan_mode'] : {'continuum'/'cube'}, default = 'continuum'
         When 'cube' the weights are calculated independently for each channel (perchanweightdensity=True in CASA tclean) and when 'continuum' a common weight density is calculated for all channels.
     imaging_weights_parms['uvw_name'] : str, default ='UVW'
@@ -46,6 +55,10 @@ def make_imaging_weight(vis_dataset, imaging_weights_parms,storage_parms):
         The name of the visibility data variable whose dimensions will be used to construct the imaging weight data variable.
     imaging_weights_parms['imaging_weight_name'] : str, default ='IMAGING_WEIGHT'
         The name of that will be used for the imaging weight data variable.
+    imaging_weights_parms['uv_index_name'] : str, default = ''
+        The name of a uv index data variable (see make_uv_index) created with uv_index_parms['fft_padding'] = 1, uv_index_parms['optimize_fft_size'] = False and the same imsize and cell. If given the uv cells of the weights are read from it instead of being calculated. Used when imaging_weights_parms['weighting'] is not 'natural'.
+    imaging_weights_parms['n_accumulators'] : int, default = 4
+        The number of weight density grids accumulated in parallel for each image channel chunk. Used when imaging_weights_parms['weighting'] is not 'natural'.
     storage_parms : dictionary
     storage_parms['to_disk'] : bool, default = False
         If true the dask graph is executed and saved to disk in the zarr format.
@@ -67,6 +80,7 @@ def make_imaging_weight(vis_dataset, imaging_weights_parms,storage_parms):
     -------
     vis_dataset : xarray.core.dataset.Dataset
         The vis_dataset will contain a new data variable for the imaging weights the name is defined by the input parameter imaging_weights_parms['imaging_weight_name'].
+        The weighting is stored in its 'weighting' attribute.
     """
     print('######################### Start make_imaging_weights #########################')
     import time
@@ -84,6 +98,7 @@ def make_imaging_weight(vis_dataset, imaging_weights_parms,storage_parms):
     from ngcasa._ngcasa_utils._store import _store
     from ngcasa._ngcasa_utils._check_parms import _check_storage_parms
     from ._imaging_utils._check_imaging_parms import _check_imaging_weights_parms
+    from ._imaging_utils._imaging_weight import _graph_imaging_weight
     from cngi.dio import write_zarr, append_zarr
     
     _imaging_weights_parms =  copy.deepcopy(imaging_weights_parms)
@@ -117,10 +132,11 @@ def make_imaging_weight(vis_dataset, imaging_weights_parms,storage_parms):
         print('No WEIGHT or WEIGHT_SPECTRUM data variable found,  will assume all weights are unity to calculate ', _imaging_weights_parms['imaging_weight_name'])
         imaging_weight = da.ones(vis_dataset[_imaging_weights_parms['data_name']].shape,chunks=vis_data_chunksize)
     
-    vis_dataset[_imaging_weights_parms['imaging_weight_name']] =  xr.DataArray(imaging_weight, dims=vis_dataset[_imaging_weights_parms['data_name']].dims)
+    if (_imaging_weights_parms['weighting'] != 'natural') or (len(_imaging_weights_parms['uvtaper']) > 0):
+        imaging_weight = _graph_imaging_weight(vis_dataset, imaging_weight, _imaging_weights_parms)
     
-    if _imaging_weights_parms['weighting'] != 'natural':
-        calc_briggs_weights(vis_dataset,_imaging_weights_parms)
+    #The weighting is kept with the imaging weights, update_grid can only add naturally weighted visibilities to a grid.
+    vis_dataset[_imaging_weights_parms['imaging_weight_name']] =  xr.DataArray(imaging_weight, dims=vis_dataset[_imaging_weights_parms['data_name']].dims, attrs={'weighting': _imaging_weights_parms['weighting']})
     
     list_xarray_data_variables = [vis_dataset[_imaging_weights_parms['imaging_weight_name']]]
     return _store(vis_dataset,list_xarray_data_variables,_storage_parms)
@@ -146,59 +162,3 @@ def _match_array_shape(array_to_reshape,array_to_match):
             tile_dims[i] = array_to_match.shape[i]
             
     return da.tile(da.reshape(array_to_reshape.data,reshape_dims),tile_dims).rechunk(match_array_chunksize)
-
-
-
-def calc_briggs_weights(vis_dataset,imaging_weights_parms):
-    import dask.array as da
-    import xarray as xr
-    import numpy as np
-    from ._imaging_utils._standard_grid import _graph_standard_grid, _graph_standard_degrid
-    
-    
-    dtr = np.pi / (3600 * 180)
-    grid_parms = {}
-    
-    grid_parms['chan_mode'] = imaging_weights_parms['chan_mode']
-    grid_parms['imsize_padded'] =  imaging_weights_parms['imsize'] #do not need to pad since no fft
-    grid_parms['cell'] = imaging_weights_parms['cell']
-    grid_parms['do_imaging_weight'] = True
-    grid_parms['uvw_name'] = imaging_weights_parms['uvw_name']
-    
-    grid_parms['oversampling'] = 0
-    grid_parms['support'] = 1
-    grid_parms['do_psf'] = True
-    grid_parms['complex_grid'] = False
-    grid_parms['do_imaging_weight'] = True
-    grid_parms['imaging_weight_name'] = imaging_weights_parms['imaging_weight_name']
-    
-    cgk_1D = np.ones((1))
-    grid_of_imaging_weights, sum_weight = _graph_standard_grid(vis_dataset, cgk_1D, grid_parms)
-    
-    
-    #############Calculate Briggs parameters#############
-    def calculate_briggs_parms(grid_of_imaging_weights, sum_weight, imaging_weights_parms):
-        if imaging_weights_parms['weighting'] == 'briggs':
-            robust = imaging_weights_parms['robust']
-            briggs_factors = np.ones((2,1,1)+sum_weight.shape)
-            squared_sum_weight = (np.sum(grid_of_imaging_weights**2,axis=(0,1)))
-            briggs_factors[0,0,0,:,:] =  (np.square(5.0*10.0**(-robust))/(squared_sum_weight/sum_weight))[None,None,:,:]
-        elif imaging_weights_parms['weighting'] == 'briggs_abs':
-            robust = imaging_weights_parms['robust']
-            briggs_factors = np.ones((2,1,1)+sum_weight.shape)
-            briggs_factors[0,0,0,:,:] = briggs_factor[0,0,0,:,:]*np.square(robust)
-            briggs_factors[1,0,0,:,:] = briggs_factor[1,0,0,:,:]*2.0*np.square(imaging_weights_parms['briggs_abs_noise'])
-        else:
-            briggs_factors = np.zeros((2,1,1)+sum_weight.shape)
-            briggs_factors[0,0,0,:,:] = np.ones((1,1,1)+sum_weight.shape)
-            
-        return briggs_factors
-    
-    #Map blocks can be simplified by using new_axis and swapping grid_of_imaging_weights and sum_weight
-    briggs_factors = da.map_blocks(calculate_briggs_parms,grid_of_imaging_weights,sum_weight, imaging_weights_parms,chunks=(2,1,1)+sum_weight.chunksize,dtype=np.double)[:,0,0,:,:]
-    
-    imaging_weight = _graph_standard_degrid(vis_dataset, grid_of_imaging_weights, briggs_factors, cgk_1D, grid_parms)
-    
-    vis_dataset[imaging_weights_parms['imaging_weight_name']] = xr.DataArray(imaging_weight, dims=vis_dataset[imaging_weights_parms['data_name']].dims)
-    
-
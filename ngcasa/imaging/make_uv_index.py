@@ -0,0 +1,126 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+def make_uv_index(vis_dataset, uv_index_parms, storage_parms):
+    """
+    Creates the uv index data variables, the grid cell (int32) and the oversampled gridding kernel offset (int16) of every visibility.
+    make_image, make_psf, make_image_and_psf, predict_modelvis_image and make_imaging_weight read the grid cells from the uv index (grid_parms['uv_index_name']
+    and imaging_weights_parms['uv_index_name']) instead of calculating them from the uvw values for every channel each time they are run.
+    The uv index is only valid for the uvw values, cell, padded image size and oversampling it was created with. These are stored in the attributes of the
+    uv index data variable and are checked when the uv index is used, if they do not match the uv index has to be recreated. The uvw values are identified by a
+    uv_index_version attribute that make_uv_index writes to the uvw data variable. A new uvw data variable (for example one created by mosaic_rotate_uvw) does not have it,
+    uvw values that are changed in place or with xarray operations that keep the attributes are not detected.
+    The uv index must have the time, baseline and channel chunks of the visibility data it is used with.
+    The grids of the imaging weights are not padded, so a uv index for make_imaging_weight must be created with uv_index_parms['fft_padding'] = 1,
+    uv_index_parms['optimize_fft_size'] = False and the imaging_weights_parms['imsize'] and imaging_weights_parms['cell'] that will be used.
+
+    Parameters
+    ----------
+    vis_dataset : xarray.core.dataset.Dataset
+        Input visibility dataset.
+    uv_index_parms : dictionary
+    uv_index_parms['imsize'] : list of int, length = 2
+        The image size that will be used for imaging.
+    uv_index_parms['cell']  : list of number, length = 2, units = arcseconds
+        The image domain pixel size that will be used for imaging.
+    uv_index_parms['oversampling'] : int, default = 100
+        The oversampling of the gridding convolutional kernel that will be used for imaging.
+    uv_index_parms['fft_padding'] : number, acceptable range [1,100], default = 1.2
+        The fft padding that will be used for imaging.
+    uv_index_parms['optimize_fft_size'] : bool, default = False
+        The optimize_fft_size that will be used for imaging.
+    uv_index_parms['data_name'] : str, default = 'DATA'
+        The name of the visibility data variable whose dimensions and chunking (except pol) are used for the uv index.
+    uv_index_parms['uvw_name'] : str, default ='UVW'
+        The name of uvw data variable.
+    uv_index_parms['uv_index_name'] : str, default ='UV_INDEX'
+        The name of the grid cell data variable (time x baseline x chan x uv_index).
+    uv_index_parms['uv_offset_name'] : str, default ='UV_OFFSET'
+        The name of the gridding kernel offset data variable (time x baseline x chan x uv_index).
+    storage_parms : dictionary
+    storage_parms['to_disk'] : bool, default = False
+        If true the dask graph is executed and saved to disk in the zarr format.
+    storage_parms['append'] : bool, default = False
+        If storage_parms['to_disk'] is True only the dask graph associated with the function is executed and the resulting data variables are saved to an existing zarr file on disk.
+        Note that graphs on unrelated data to this function will not be executed or saved.
+    storage_parms['outfile'] : str
+        The zarr file to create or append to.
+    storage_parms['chunks_on_disk'] : dict of int, default = {}
+        The chunk size to use when writing to disk. This is ignored if storage_parms['append'] is True. The default will use the chunking of the input dataset.
+    storage_parms['chunks_return'] : dict of int, default = {}
+        The chunk size of the dataset that is returned. The default will use the chunking of the input dataset.
+    storage_parms['graph_name'] : str
+        The time to compute and save the data is stored in the attribute section of the dataset and storage_parms['graph_name'] is used in the label.
+    storage_parms['compressor'] : numcodecs.blosc.Blosc,default=Blosc(cname='zstd', clevel=2, shuffle=0)
+        The compression algorithm to use. Available compression algorithms can be found at https://numcodecs.readthedocs.io/en/stable/blosc.html.
+
+    Returns
+    -------
+    vis_dataset : xarray.core.dataset.Dataset
+        The vis_dataset will contain the uv index data variables uv_index_parms['uv_index_name'] and uv_index_parms['uv_offset_name'].
+    """
+    print('######################### Start make_uv_index #########################')
+    import numpy as np
+    import xarray as xr
+    import dask
+    import dask.array as da
+    import copy
+    import itertools
+    import uuid
+
+    from ngcasa._ngcasa_utils._store import _store
+    from ngcasa._ngcasa_utils._check_parms import _check_storage_parms
+    from ._imaging_utils._check_imaging_parms import _check_uv_index_parms
+    from ._imaging_utils._standard_grid import ndim_list
+    from ._imaging_utils._uv_index import _calc_uv_index_numpy_wrap, _uv_index_attrs
+
+    _uv_index_parms = copy.deepcopy(uv_index_parms)
+    _storage_parms = copy.deepcopy(storage_parms)
+
+    assert(_check_uv_index_parms(vis_dataset,_uv_index_parms)), "######### ERROR: uv_index_parms checking failed"
+    assert(_check_storage_parms(_storage_parms,'dataset.vis.zarr','make_uv_index')), "######### ERROR: storage_parms checking failed"
+
+    uvw = vis_dataset[_uv_index_parms['uvw_name']]
+    chunk_sizes = vis_dataset[_uv_index_parms['data_name']].chunks
+    freq_chan = da.from_array(vis_dataset.coords['chan'].values, chunks=(chunk_sizes[2],))
+    uvw_blocks = uvw.data.rechunk((chunk_sizes[0], chunk_sizes[1], 3)).to_delayed()
+
+    list_of_uv_indices = ndim_list((len(chunk_sizes[0]), len(chunk_sizes[1]), len(chunk_sizes[2]), 1))
+    list_of_uv_offsets = ndim_list((len(chunk_sizes[0]), len(chunk_sizes[1]), len(chunk_sizes[2]), 1))
+
+    for c_time, c_baseline, c_chan in itertools.product(range(len(chunk_sizes[0])), range(len(chunk_sizes[1])), range(len(chunk_sizes[2]))):
+        uv_index_and_offset = dask.delayed(_calc_uv_index_numpy_wrap, nout=2)(uvw_blocks[c_time, c_baseline, 0], freq_chan.partitions[c_chan], dask.delayed(_uv_index_parms))
+        single_chunk_size = (chunk_sizes[0][c_time], chunk_sizes[1][c_baseline], chunk_sizes[2][c_chan], 2)
+        list_of_uv_indices[c_time][c_baseline][c_chan][0] = da.from_delayed(uv_index_and_offset[0], single_chunk_size, dtype=np.int32)
+        list_of_uv_offsets[c_time][c_baseline][c_chan][0] = da.from_delayed(uv_index_and_offset[1], single_chunk_size, dtype=np.int16)
+
+    uv_index_dims = vis_dataset[_uv_index_parms['data_name']].dims[0:3] + ('uv_index',)
+    #The uvw values are not read to identify them, a version is written to the attributes of the uvw data variable and stored with the uv index.
+    #The version of a uvw data variable that already has one is kept, so that the uv indices made for it before (for example for the imaging weights) remain valid.
+    uvw_version = uvw.attrs.get('uv_index_version', uuid.uuid4().hex)
+    attrs = _uv_index_attrs(uvw, uv_index_parms['cell'], _uv_index_parms['imsize_padded'], _uv_index_parms['oversampling'], _uv_index_parms['uv_offset_name'], uvw_version)
+    vis_dataset[_uv_index_parms['uvw_name']].attrs['uv_index_version'] = uvw_version
+    vis_dataset[_uv_index_parms['uv_index_name']] = xr.DataArray(da.block(list_of_uv_indices), dims=uv_index_dims, attrs=attrs)
+    vis_dataset[_uv_index_parms['uv_offset_name']] = xr.DataArray(da.block(list_of_uv_offsets), dims=uv_index_dims)
+
+    list_xarray_data_variables = [vis_dataset[_uv_index_parms['uv_index_name']], vis_dataset[_uv_index_parms['uv_offset_name']]]
+    vis_dataset = _store(vis_dataset,list_xarray_data_variables,_storage_parms)
+
+    if _storage_parms['to_disk'] and _storage_parms['append']:
+        #Only the uv index is appended, the version of the uvw data variable is added to its attributes on disk.
+        import zarr
+        zarr.open_group(_storage_parms['outfile'], mode='r+')[_uv_index_parms['uvw_name']].attrs['uv_index_version'] = uvw_version
+        zarr.consolidate_metadata(_storage_parms['outfile'])
+        vis_dataset[_uv_index_parms['uvw_name']].attrs['uv_index_version'] = uvw_version
+    return vis_dataset
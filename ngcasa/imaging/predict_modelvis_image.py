@@ -14,22 +14,115 @@
 
 def predict_modelvis_image(img_dataset, vis_dataset, grid_parms, storage_parms):
     """
-    .. todo::
-        This function is not yet implemented
-        
-    Predict model visibilities from an input model image cube (units Jy/pixel) using a pre-specified gridding convolution function cache.
-    
-    Save the model visibilities in arr_name (default = 'MODEL')
-    
-    Optionally overwrite the model or add to existing model (incremental=T)
+    Predict model visibilities from an input model image cube (units Jy/pixel). Only the prolate spheroidal convolutional gridding function is supported (this will change in a future releases.)
+    The model image is divided by the gridding correction function, padded and fft'd to a grid from which the model visibilities are interpolated (degridded) with the gridding convolutional kernel.
+    The model visibilities are chunked the same way as the visibility data.
     
     (A input cube with 1 channel is a continuum image (nterms=1))
+    
+    Parameters
+    ----------
+    img_dataset : xarray.core.dataset.Dataset
+        Input image dataset that contains the model image (dimensions d0 x d1 x chan x pol).
+    vis_dataset : xarray.core.dataset.Dataset
+        Input visibility dataset.
+    grid_parms : dictionary
+    grid_parms['cell']  : list of number, length = 2, units = arcseconds
+        The image cell size of the model image.
+    grid_parms['chan_mode'] : {'continuum'/'cube'}, default = 'cube'
+        If 'continuum' the model image must have a single channel that is used for all the visibility channels. If 'cube' the model image must have the same number of channels as the visibility data.
+    grid_parms['oversampling'] : int, default = 100
+        The oversampling used for the convolutional gridding kernel. This will be removed in a later release and incorporated in the function that creates gridding convolutional kernels.
+    grid_parms['support'] : int, default = 7
+        The full support used for convolutional gridding kernel. This will be removed in a later release and incorporated in the function that creates gridding convolutional kernels.
+    grid_parms['fft_padding'] : number, acceptable range [1,100], default = 1.2
+        The factor that determines how much the model image is padded before the fft is done.
+    grid_parms['optimize_fft_size'] : bool, default = False
+        If True the padded image size (fft_padding x imsize) is rounded up to the next even size that only has the prime factors 2, 3 and 5, for which the fft is fastest.
+    grid_parms['gcf_cache_dir'] : str, default = ''
+        Directory in which the gridding convolution functions are cached in the zarr format (see make_gridding_convolution_function). Gridding convolution functions are also cached in memory. If '' only the memory cache is used.
+    grid_parms['model_image_name'] : str, default ='MODEL_IMAGE'
+        The name of the model image data variable in img_dataset.
+    grid_parms['uvw_name'] : str, default ='UVW'
+        The name of uvw data variable that will be used to degrid the visibilities.
+    grid_parms['uv_index_name'] : str, default = ''
+        The name of a uv index data variable (see make_uv_index) created with the same cell, imsize, fft_padding, optimize_fft_size and oversampling. If given the grid cells are read from it instead of being calculated from the uvw values.
+    grid_parms['data_name'] : str, default = 'DATA'
+        The name of the visibility data variable whose dimensions and chunking are used for the model visibilities.
+    grid_parms['model_data_name'] : str, default = 'MODEL'
+        The name of the created model visibility data variable.
+    grid_parms['incremental'] : bool, default = False
+        If True and grid_parms['model_data_name'] is already in vis_dataset the predicted visibilities are added to the existing model visibilities, otherwise they replace them.
+    storage_parms : dictionary
+    storage_parms['to_disk'] : bool, default = False
+        If true the dask graph is executed and saved to disk in the zarr format.
+    storage_parms['append'] : bool, default = False
+        If storage_parms['to_disk'] is True only the dask graph associated with the function is executed and the resulting data variables are saved to an existing zarr file on disk.
+        Note that graphs on unrelated data to this function will not be executed or saved.
+    storage_parms['outfile'] : str
+        The zarr file to create or append to.
+    storage_parms['chunks_on_disk'] : dict of int, default = {}
+        The chunk size to use when writing to disk. This is ignored if storage_parms['append'] is True. The default will use the chunking of the input dataset.
+    storage_parms['chunks_return'] : dict of int, default = {}
+        The chunk size of the dataset that is returned. The default will use the chunking of the input dataset.
+    storage_parms['graph_name'] : str
+        The time to compute and save the data is stored in the attribute section of the dataset and storage_parms['graph_name'] is used in the label.
+    storage_parms['compressor'] : numcodecs.blosc.Blosc,default=Blosc(cname='zstd', clevel=2, shuffle=0)
+        The compression algorithm to use. Available compression algorithms can be found at https://numcodecs.readthedocs.io/en/stable/blosc.html.
 
     Returns
     -------
     vis_dataset : xarray.core.dataset.Dataset
+        The vis_dataset will contain a new data variable for the model visibilities, the name is defined by the input parameter grid_parms['model_data_name'].
     """
-    #ngcasa.imaging._normalize(direction='forward') # Apply PB models to go to flat-sky
-    #cngi.image.stokes_to_corr()
-    #cngi.image.fourier_transform()
-    #ngcasa.imaging._degrid()
+    print('######################### Start predict_modelvis_image #########################')
+    import numpy as np
+    import dask.array as da
+    import dask.array.fft as dafft
+    import xarray as xr
+    import copy
+    
+    from ngcasa._ngcasa_utils._store import _store
+    from ngcasa._ngcasa_utils._check_parms import _check_storage_parms
+    from ._imaging_utils._check_imaging_parms import _check_degrid_parms
+    from ._imaging_utils._gcf_cache import _get_gcf
+    from ._imaging_utils._standard_grid import _graph_standard_degrid
+    from ._imaging_utils._remove_padding import _remove_padding
+    
+    _grid_parms = copy.deepcopy(grid_parms)
+    _storage_parms = copy.deepcopy(storage_parms)
+    
+    assert(_check_degrid_parms(vis_dataset,img_dataset,_grid_parms)), "######### ERROR: grid_parms checking failed"
+    assert(_check_storage_parms(_storage_parms,'dataset.vis.zarr','predict_modelvis_image')), "######### ERROR: storage_parms checking failed"
+    
+    # Getting the gridding kernel from the cache or creating it
+    cf_dataset = _get_gcf('prolate_spheroidal', _grid_parms['oversampling'], _grid_parms['support'], _grid_parms['imsize_padded'], _grid_parms['gcf_cache_dir'])
+    cgk_1D = cf_dataset['CGK_1D'].values
+    correcting_cgk_image = cf_dataset['CORRECTING_CGK'].values
+    correcting_cgk_image = _remove_padding(correcting_cgk_image,_grid_parms['imsize'])
+    
+    # The image chunking has to match the visibility chunking along chan (for a cube) and the fft needs single chunks along d0, d1.
+    if _grid_parms['chan_mode'] == 'cube':
+        chan_chunks = vis_dataset[_grid_parms['data_name']].chunks[2]
+    else:
+        chan_chunks = (1,)
+    model_image = img_dataset[_grid_parms['model_image_name']].data.rechunk((-1, -1, chan_chunks, -1))
+    
+    #Undo the gridding correction that is applied when imaging and pad the model image so that it matches the imaging grid (see _remove_padding).
+    model_image = model_image / correcting_cgk_image[:, :, None, None]
+    start_xy = _grid_parms['imsize_padded'] // 2 - _grid_parms['imsize'] // 2
+    end_xy = _grid_parms['imsize_padded'] - _grid_parms['imsize'] - start_xy
+    model_image = da.pad(model_image, ((start_xy[0], end_xy[0]), (start_xy[1], end_xy[1]), (0, 0), (0, 0)), mode='constant').rechunk((-1, -1, chan_chunks, -1))
+    
+    #The inverse of the fft in make_image.
+    model_grid = dafft.fftshift(dafft.fft2(dafft.ifftshift(model_image, axes=(0, 1)), axes=(0, 1)), axes=(0, 1))
+    
+    model_vis = _graph_standard_degrid(vis_dataset, model_grid, cgk_1D, _grid_parms)
+    
+    if _grid_parms['incremental'] and (_grid_parms['model_data_name'] in vis_dataset.data_vars):
+        model_vis = vis_dataset[_grid_parms['model_data_name']].data + model_vis
+    
+    vis_dataset[_grid_parms['model_data_name']] = xr.DataArray(model_vis, dims=vis_dataset[_grid_parms['data_name']].dims)
+    
+    list_xarray_data_variables = [vis_dataset[_grid_parms['model_data_name']]]
+    return _store(vis_dataset,list_xarray_data_variables,_storage_parms)
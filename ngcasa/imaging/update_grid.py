@@ -0,0 +1,104 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+def update_grid(grid_dataset, vis_dataset, grid_parms, storage_parms):
+    """
+    Adds the visibilities of new times to a grid made by make_grid and remakes the dirty image from the updated grid.
+    Only the visibilities whose time is not in the gridded times of the grid_dataset are gridded, so the work grows with the new data and not with all the data gridded so far.
+    The baselines of the vis_dataset must be the gridded baselines, so that every gridded time is gridded for all the baselines.
+    The new visibilities are gridded with the grid_parms stored with the grid (imsize, cell, chan_mode, oversampling, support, fft_padding, optimize_fft_size and precision).
+    Only natural imaging weights are supported (see make_imaging_weight), the other weightings depend on all the visibilities and would change the weights of the gridded visibilities.
+
+    Parameters
+    ----------
+    grid_dataset : xarray.core.dataset.Dataset
+        Grid dataset made by make_grid or update_grid.
+    vis_dataset : xarray.core.dataset.Dataset
+        Input visibility dataset. It can contain the times that are already gridded, only the other times are gridded. For cube grids the channels must be the channels of the grid.
+    grid_parms : dictionary
+        The grid_parms of make_grid, the grid_parms stored with the grid do not have to be given (if they are given they must be the same).
+    grid_parms['grid_name'] : str, default ='GRID'
+        The name of the grid in grid_dataset. The names of the sum of weights, the gridded times and baselines and the image are stored with the grid.
+    storage_parms : dictionary
+    storage_parms['to_disk'] : bool, default = False
+        If true the dask graph is executed and saved to disk in the zarr format. The updated grid dataset is written to a temporary zarr file that replaces storage_parms['outfile'] once it is written,
+        so storage_parms['outfile'] can be the zarr file of grid_dataset.
+    storage_parms['append'] : bool, default = False
+        Not supported, the updated grid dataset is always written to a new zarr file.
+    storage_parms['outfile'] : str
+        The zarr file to create or append to.
+    storage_parms['chunks_on_disk'] : dict of int, default = {}
+        The chunk size to use when writing to disk. This is ignored if storage_parms['append'] is True. The default will use the chunking of the input dataset.
+    storage_parms['chunks_return'] : dict of int, default = {}
+        The chunk size of the dataset that is returned. The default will use the chunking of the input dataset.
+    storage_parms['graph_name'] : str
+        The time to compute and save the data is stored in the attribute section of the dataset and storage_parms['graph_name'] is used in the label.
+    storage_parms['compressor'] : numcodecs.blosc.Blosc,default=Blosc(cname='zstd', clevel=2, shuffle=0)
+        The compression algorithm to use. Available compression algorithms can be found at https://numcodecs.readthedocs.io/en/stable/blosc.html.
+
+    Returns
+    -------
+    grid_dataset : xarray.core.dataset.Dataset
+        The grid_dataset will contain the updated grid, sum of weights and gridded times and baselines and the dirty image made from them.
+    """
+    print('######################### Start update_grid #########################')
+    import numpy as np
+    import dask.array as da
+    import copy
+
+    from ngcasa._ngcasa_utils._check_parms import _check_storage_parms
+    from ._imaging_utils._check_imaging_parms import _check_update_grid_parms
+    from ._imaging_utils._gcf_cache import _get_gcf
+    from ._imaging_utils._standard_grid import _graph_standard_grid
+    from ._imaging_utils._grid_dataset import _make_grid_dataset, _store_grid_dataset
+
+    _grid_parms = copy.deepcopy(grid_parms)
+    _storage_parms = copy.deepcopy(storage_parms)
+
+    _grid_parms['do_psf'] = False
+    _grid_parms['do_image_and_psf'] = False
+
+    assert(_check_update_grid_parms(grid_dataset,vis_dataset,_grid_parms)), "######### ERROR: grid_parms checking failed"
+    assert(_check_storage_parms(_storage_parms,'dirty_image.grid.zarr','update_grid')), "######### ERROR: storage_parms checking failed"
+    assert(not(_storage_parms['to_disk'] and _storage_parms['append'])), "######### ERROR: update_grid does not support storage_parms['append']"
+
+    cf_dataset = _get_gcf('prolate_spheroidal', _grid_parms['oversampling'], _grid_parms['support'], _grid_parms['imsize_padded'], _grid_parms['gcf_cache_dir'])
+    cgk_1D = cf_dataset['CGK_1D'].values
+    correcting_cgk_image = cf_dataset['CORRECTING_CGK'].values
+
+    grid = da.asarray(grid_dataset[_grid_parms['grid_name']].data)
+    sum_weight = da.asarray(grid_dataset[_grid_parms['sum_weight_name']].data)
+    gridded_time = grid_dataset[_grid_parms['gridded_time_name']].values
+
+    time = vis_dataset.coords['time'].values
+    new_time_indx = np.where(~np.isin(time, gridded_time))[0]
+    print('Gridding', len(new_time_indx), 'new times of', len(time))
+    prefetch_timings = {}
+    if len(new_time_indx) > 0:
+        if new_time_indx[-1] - new_time_indx[0] == len(new_time_indx) - 1:
+            new_vis_dataset = vis_dataset.isel(time=slice(new_time_indx[0], new_time_indx[-1] + 1)) #Keeps the time chunks of the new times.
+        else:
+            new_vis_dataset = vis_dataset.isel(time=new_time_indx)
+        new_grid, new_sum_weight = _graph_standard_grid(new_vis_dataset, cgk_1D, _grid_parms, prefetch_timings)
+        grid = grid + new_grid.rechunk(grid.chunks)
+        sum_weight = sum_weight + new_sum_weight.rechunk(sum_weight.chunks)
+        gridded_time = np.concatenate((gridded_time, time[new_time_indx]))
+
+    coords = {'chan': grid_dataset.coords['chan'].values, 'pol': grid_dataset.coords['pol'].values, 'chan_width': ('chan',grid_dataset['chan_width'].values)}
+
+    gridded_baseline = grid_dataset[_grid_parms['gridded_baseline_name']].values
+    updated_grid_dataset = _make_grid_dataset(grid, sum_weight, gridded_time, gridded_baseline, coords, correcting_cgk_image, _grid_parms, prefetch_timings)
+
+    list_xarray_data_variables = [updated_grid_dataset[_grid_parms['grid_name']], updated_grid_dataset[_grid_parms['sum_weight_name']], updated_grid_dataset[_grid_parms['gridded_time_name']], updated_grid_dataset[_grid_parms['gridded_baseline_name']], updated_grid_dataset[_grid_parms['image_name']]]
+    return _store_grid_dataset(updated_grid_dataset,list_xarray_data_variables,_storage_parms)
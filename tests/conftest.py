@@ -0,0 +1,72 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+import pytest
+
+
+def _make_vis_dataset(n_time=20, n_baseline=40, n_chan=8, n_pol=2, time_chunk=5, chan_chunk=4, max_uv=2000.0, seed=0):
+    """
+      A synthetic visibility dataset with random uvw values (in meters), visibilities and imaging weights. The uvw values of the
+      first baseline of the first time are nan.
+      """
+    import dask.array as da
+    import xarray as xr
+
+    rng = np.random.default_rng(seed)
+    uvw = rng.uniform(-max_uv, max_uv, (n_time, n_baseline, 3))
+    uvw[0, 0, :] = np.nan
+    data = rng.normal(size=(n_time, n_baseline, n_chan, n_pol)) + 1j*rng.normal(size=(n_time, n_baseline, n_chan, n_pol))
+    weight = rng.uniform(0.5, 1.5, (n_time, n_baseline, n_chan, n_pol))
+    chunks = (time_chunk, n_baseline, chan_chunk, n_pol)
+
+    vis_dataset = xr.Dataset({'DATA': (('time', 'baseline', 'chan', 'pol'), da.from_array(data, chunks=chunks)),
+                              'IMAGING_WEIGHT': (('time', 'baseline', 'chan', 'pol'), da.from_array(weight, chunks=chunks)),
+                              'UVW': (('time', 'baseline', 'uvw_index'), da.from_array(uvw, chunks=(time_chunk, n_baseline, 3))),
+                              'chan_width': (('chan',), da.from_array(np.full(n_chan, 1e6), chunks=(chan_chunk,)))},
+                             coords={'time': np.arange(n_time, dtype=np.double), 'baseline': np.arange(n_baseline), 'chan': np.linspace(1e11, 1.01e11, n_chan),
+                                     'pol': np.arange(n_pol)})
+    return vis_dataset
+
+
+@pytest.fixture
+def make_vis_dataset():
+    return _make_vis_dataset
+
+
+def _position_error_bound(vis_dataset, grid_parms, tolerance, do_psf):
+    """
+      Moving a visibility by at most tolerance grid cells changes its phase at an image pixel x pixels from the center by at most
+      2*pi*tolerance*x/imsize_padded. The largest change of the normalized image is therefore this phase error at the image corner times
+      sum(|weight x data|)/sum(weight), taken over the channel with the largest ratio so the bound holds for cube and continuum images.
+      """
+    from ngcasa.imaging._imaging_utils._make_image import _setup_make_image
+
+    _grid_parms, _, _, _ = _setup_make_image(vis_dataset, dict(grid_parms), {'to_disk': False}, False, False, 'dirty_image.img.zarr', 'make_image')
+    phase_error = 2*np.pi*tolerance*np.sqrt(2)*(np.max(_grid_parms['imsize'])/2)/np.min(_grid_parms['imsize_padded'])
+    weight = vis_dataset.IMAGING_WEIGHT.values[1:]
+    if do_psf:
+        return phase_error
+    return phase_error*np.max(np.sum(np.abs(vis_dataset.DATA.values[1:]*weight), axis=(0, 1))/np.sum(weight, axis=(0, 1)))
+
+
+@pytest.fixture
+def position_error_bound():
+    return _position_error_bound
+
+
+@pytest.fixture(autouse=True)
+def synchronous_scheduler():
+    import dask
+    with dask.config.set(scheduler='synchronous'):
+        yield
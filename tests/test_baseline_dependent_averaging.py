@@ -0,0 +1,73 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+import pytest
+
+from ngcasa.imaging import make_image, make_psf
+from ngcasa.imaging._imaging_utils._baseline_dependent_averaging import _calc_bda_factors, _bda_average
+
+
+@pytest.mark.parametrize('bda_tolerance', [0.05, 0.2])
+@pytest.mark.parametrize('chan_mode', ['continuum', 'cube'])
+@pytest.mark.parametrize('make_function, image_name, sum_weight_name, do_psf', [(make_image, 'DIRTY_IMAGE', 'SUM_WEIGHT', False), (make_psf, 'PSF', 'PSF_SUM_WEIGHT', True)])
+def test_bda_within_tolerance_of_exact_gridding(make_vis_dataset, position_error_bound, make_function, image_name, sum_weight_name, do_psf, chan_mode, bda_tolerance):
+    vis_dataset = make_vis_dataset()
+    #Slowly moving straight uv tracks so that the short baselines are averaged in time.
+    rng = np.random.default_rng(1)
+    uvw = rng.uniform(-2000, 2000, (1, vis_dataset.sizes['baseline'], 3)) + np.arange(vis_dataset.sizes['time'])[:, None, None]*rng.uniform(-2, 2, (vis_dataset.sizes['baseline'], 3))
+    uvw[0, 0, :] = np.nan
+    vis_dataset['UVW'] = vis_dataset.UVW.copy(data=uvw).chunk(vis_dataset.UVW.chunks)
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': chan_mode}
+    image_dataset = make_function(vis_dataset, grid_parms, {'to_disk': False})
+    averaged_image_dataset = make_function(vis_dataset, dict(grid_parms, bda_tolerance=bda_tolerance), {'to_disk': False})
+
+    image_error = np.max(np.abs(averaged_image_dataset[image_name].values - image_dataset[image_name].values))
+    assert image_error > 0
+    assert image_error <= position_error_bound(vis_dataset, grid_parms, bda_tolerance, do_psf)
+    assert np.allclose(averaged_image_dataset[sum_weight_name].values, image_dataset[sum_weight_name].values, rtol=1e-6, atol=0)
+
+
+@pytest.mark.parametrize('bda_tolerance', [0.1, 0.5, 2.0])
+@pytest.mark.parametrize('chan_mode', ['continuum', 'cube'])
+def test_bda_moves_no_visibility_more_than_the_tolerance(bda_tolerance, chan_mode):
+    #Straight uv tracks with rates from 0.01 to 2 grid cells per time sample.
+    c = 299792458.0
+    n_time, n_baseline, n_chan = 16, 12, 8
+    rng = np.random.default_rng(1)
+    imsize_padded = np.array([240, 240])
+    cell = np.array([0.08, 0.08])*np.pi/(3600*180)
+    freq_chan = np.linspace(1e11, 1.01e11, n_chan)
+    cells_per_m = cell*imsize_padded*np.max(freq_chan)/c
+    uv_start = rng.uniform(-100, 100, (n_baseline, 2))/cells_per_m
+    uv_rate = np.logspace(-2, np.log10(2), n_baseline)[:, None]*rng.choice([-1, 1], (n_baseline, 2))/cells_per_m
+    uvw = np.zeros((n_time, n_baseline, 3))
+    uvw[:, :, 0:2] = uv_start + np.arange(n_time)[:, None, None]*uv_rate
+    weight = np.ones((n_time, n_baseline, n_chan, 1))
+
+    grid_parms = {'cell': cell, 'imsize_padded': imsize_padded, 'bda_tolerance': bda_tolerance, 'chan_mode': chan_mode}
+    n_time_avg, n_chan_avg = _calc_bda_factors(uvw, freq_chan, grid_parms)
+    assert np.any(n_time_avg*n_chan_avg > 1)
+    if chan_mode == 'cube':
+        assert np.all(n_chan_avg == 1)
+
+    max_shift = 0.0
+    for i_baseline in range(n_baseline):
+        _, averaged_uvw, _, averaged_freq_chan, _ = _bda_average(None, uvw[:, i_baseline:i_baseline+1], weight[:, i_baseline:i_baseline+1], freq_chan, np.arange(n_chan),
+                                                                  n_time_avg[i_baseline], n_chan_avg[i_baseline], True)
+        uv_cells = uvw[:, i_baseline, None, 0:2]*freq_chan[:, None]*cell*imsize_padded/c
+        averaged_uv_cells = averaged_uvw[:, 0, None, 0:2]*averaged_freq_chan[:, None]*cell*imsize_padded/c
+        averaged_uv_cells = np.repeat(np.repeat(averaged_uv_cells, n_time_avg[i_baseline], axis=0), n_chan_avg[i_baseline], axis=1)
+        max_shift = max(max_shift, np.max(np.abs(uv_cells - averaged_uv_cells)))
+    #The product of the time and frequency offsets adds a second order term of about bda_tolerance x (channel spread / frequency).
+    assert max_shift <= bda_tolerance*(1 + 1e-2)
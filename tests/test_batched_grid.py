@@ -0,0 +1,52 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+import pytest
+
+from ngcasa.imaging import make_grid, make_image, make_psf, make_image_and_psf
+
+
+@pytest.mark.parametrize('n_chunks_per_task', [1, 3, 8])
+@pytest.mark.parametrize('chan_mode', ['continuum', 'cube'])
+def test_batched_grid_matches_tree_grid(make_vis_dataset, chan_mode, n_chunks_per_task):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': chan_mode}
+    grid_dataset = make_grid(vis_dataset, grid_parms, {'to_disk': False})
+    batched_grid_dataset = make_grid(vis_dataset, dict(grid_parms, grid_accumulation='batched', n_chunks_per_task=n_chunks_per_task), {'to_disk': False})
+    grid = grid_dataset.GRID.values
+    assert np.allclose(batched_grid_dataset.GRID.values, grid, rtol=0, atol=1e-12*np.max(np.abs(grid)))
+    assert np.allclose(batched_grid_dataset.SUM_WEIGHT.values, grid_dataset.SUM_WEIGHT.values, rtol=1e-12, atol=0)
+
+
+@pytest.mark.parametrize('bda_tolerance', [0.0, 0.5])
+@pytest.mark.parametrize('n_chunks_per_task', [1, 3])
+@pytest.mark.parametrize('chan_mode', ['continuum', 'cube'])
+@pytest.mark.parametrize('make_function, image_names', [(make_image, ['DIRTY_IMAGE', 'SUM_WEIGHT']), (make_psf, ['PSF', 'PSF_SUM_WEIGHT']),
+                                                        (make_image_and_psf, ['DIRTY_IMAGE', 'PSF', 'SUM_WEIGHT'])])
+def test_batched_image_matches_tree_image(make_vis_dataset, make_function, image_names, chan_mode, n_chunks_per_task, bda_tolerance):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': chan_mode, 'bda_tolerance': bda_tolerance}
+    image_dataset = make_function(vis_dataset, grid_parms, {'to_disk': False})
+    batched_image_dataset = make_function(vis_dataset, dict(grid_parms, grid_accumulation='batched', n_chunks_per_task=n_chunks_per_task), {'to_disk': False})
+    for image_name in image_names:
+        image = image_dataset[image_name].values
+        assert np.allclose(batched_image_dataset[image_name].values, image, rtol=0, atol=1e-12*np.max(np.abs(image)))
+
+
+def test_batched_graph_has_fewer_tasks(make_vis_dataset):
+    vis_dataset = make_vis_dataset(n_time=80)
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': 'cube'}
+    n_tree_tasks = len(dict(make_image(vis_dataset, grid_parms, {'to_disk': False}).__dask_graph__()))
+    n_batched_tasks = len(dict(make_image(vis_dataset, dict(grid_parms, grid_accumulation='batched'), {'to_disk': False}).__dask_graph__()))
+    assert n_batched_tasks < n_tree_tasks / 4
@@ -0,0 +1,41 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+import pytest
+
+from ngcasa.imaging import make_image, make_psf
+
+
+@pytest.mark.parametrize('chan_grouping_tolerance', [0.01, 0.05, 0.2])
+@pytest.mark.parametrize('make_function, image_name, sum_weight_name, do_psf', [(make_image, 'DIRTY_IMAGE', 'SUM_WEIGHT', False), (make_psf, 'PSF', 'PSF_SUM_WEIGHT', True)])
+def test_chan_grouping_within_tolerance_of_exact_gridding(make_vis_dataset, position_error_bound, make_function, image_name, sum_weight_name, do_psf, chan_grouping_tolerance):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': 'continuum'}
+    image_dataset = make_function(vis_dataset, grid_parms, {'to_disk': False})
+    grouped_image_dataset = make_function(vis_dataset, dict(grid_parms, chan_grouping_tolerance=chan_grouping_tolerance), {'to_disk': False})
+
+    image_error = np.max(np.abs(grouped_image_dataset[image_name].values - image_dataset[image_name].values))
+    assert image_error > 0
+    assert image_error <= position_error_bound(vis_dataset, grid_parms, chan_grouping_tolerance, do_psf)
+    #Only the kernel weights of the grouped samples differ, the sum of the weights is nearly unchanged.
+    assert np.allclose(grouped_image_dataset[sum_weight_name].values, image_dataset[sum_weight_name].values, rtol=1e-6, atol=0)
+
+
+def test_chan_grouping_error_decreases_with_tolerance(make_vis_dataset):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': 'continuum'}
+    image = make_image(vis_dataset, grid_parms, {'to_disk': False}).DIRTY_IMAGE.values
+    image_errors = [np.max(np.abs(make_image(vis_dataset, dict(grid_parms, chan_grouping_tolerance=chan_grouping_tolerance), {'to_disk': False}).DIRTY_IMAGE.values - image))
+                    for chan_grouping_tolerance in [0.2, 0.05, 0.01, 0.001]]
+    assert np.all(np.diff(image_errors) < 0)
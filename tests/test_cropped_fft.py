@@ -0,0 +1,54 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+import pytest
+
+from ngcasa.imaging._imaging_utils._fft import _fft_friendly_size, _cropped_shifted_ifft2, _ifft2_shifted
+from ngcasa.imaging._imaging_utils._remove_padding import _remove_padding
+
+
+def _full_image(grid, imsize):
+    """
+      The image of a grid computed with the full fftshift(ifft2(ifftshift(grid))) and cropped with _remove_padding.
+      """
+    return _remove_padding(np.fft.fftshift(np.fft.ifft2(np.fft.ifftshift(grid, axes=(0, 1)), axes=(0, 1)), axes=(0, 1)), np.array(imsize))
+
+
+def _random_grid(n_uv, n_chan=2, n_pol=2):
+    rng = np.random.default_rng(0)
+    return rng.normal(size=tuple(n_uv) + (n_chan, n_pol)) + 1j*rng.normal(size=tuple(n_uv) + (n_chan, n_pol))
+
+
+@pytest.mark.parametrize('n_uv, imsize', [((240, 240), (200, 200)), ((250, 216), (200, 180)), ((81, 75), (64, 50)), ((64, 64), (64, 64))])
+def test_cropped_ifft_matches_full_ifft_with_padding_removed(n_uv, imsize):
+    grid = _random_grid(n_uv)
+    image = _cropped_shifted_ifft2(grid, imsize, np.fft.ifft2)
+    assert image.shape[0:2] == imsize
+    assert np.allclose(image, _full_image(grid, imsize), rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('n_fft_slabs', [1, 3])
+@pytest.mark.parametrize('imsize', [None, (200, 180)])
+def test_ifft2_shifted_matches_cropped_full_ifft(n_fft_slabs, imsize):
+    import dask.array as da
+    grid = _random_grid((250, 216))
+    grid_parms = {'n_fft_slabs': n_fft_slabs, 'precision': 'double'}
+    image = _ifft2_shifted(da.from_array(grid, chunks=(int(np.ceil(250/n_fft_slabs)), 216, 1, 2)), grid_parms, imsize).compute()
+    expected_image = _full_image(grid, grid.shape[0:2] if imsize is None else imsize)
+    assert image.shape == expected_image.shape
+    assert np.allclose(image, expected_image, rtol=0, atol=1e-12)
+
+
+def test_fft_friendly_size():
+    assert [_fft_friendly_size(n) for n in [1, 2, 7, 240, 241, 2457, 2458]] == [2, 2, 8, 240, 250, 2500, 2500]
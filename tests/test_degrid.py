@@ -0,0 +1,73 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+import pytest
+
+from ngcasa.imaging import make_image, predict_modelvis_image
+
+
+def _make_img_dataset(list_of_sources, n_chan, imsize=(200, 200), n_pol=2):
+    """
+      A model image dataset with point sources, list_of_sources is a list of (d0, d1, flux).
+      """
+    import dask.array as da
+    import xarray as xr
+
+    model_image = np.zeros(tuple(imsize) + (n_chan, n_pol))
+    for d0, d1, flux in list_of_sources:
+        model_image[d0, d1] = flux
+    return xr.Dataset({'MODEL_IMAGE': (('d0', 'd1', 'chan', 'pol'), da.from_array(model_image, chunks=(-1, -1, 4, -1)))})
+
+
+@pytest.mark.parametrize('chan_mode', ['continuum', 'cube'])
+def test_predicted_visibilities_match_direct_fourier_transform(make_vis_dataset, chan_mode):
+    c = 299792458.0
+    vis_dataset = make_vis_dataset()
+    cell = 0.08
+    list_of_sources = [(100, 100, 1.0), (110, 95, 0.5), (80, 130, 0.25)]
+    img_dataset = _make_img_dataset(list_of_sources, 1 if chan_mode == 'continuum' else len(vis_dataset.chan))
+    model_vis = predict_modelvis_image(img_dataset, vis_dataset.copy(), {'cell': [cell, cell], 'chan_mode': chan_mode}, {'to_disk': False}).MODEL.values
+
+    #The d0 axis of the image increases with -l (see make_image).
+    delta_lm = cell * np.pi / (3600 * 180)
+    u = vis_dataset.UVW.values[:, :, 0, None] * vis_dataset.chan.values / c
+    v = vis_dataset.UVW.values[:, :, 1, None] * vis_dataset.chan.values / c
+    expected_model_vis = 0
+    for d0, d1, flux in list_of_sources:
+        expected_model_vis = expected_model_vis + flux * np.exp(2j * np.pi * (-u * (d0 - 100) + v * (d1 - 100)) * delta_lm)
+
+    #Only the visibility with nan uvw values is not predicted.
+    assert np.sum(np.isnan(model_vis[:, :, :, 0])) == len(vis_dataset.chan)
+    assert np.nanmax(np.abs(model_vis - expected_model_vis[:, :, :, None])) < 1e-2
+
+
+def test_imaging_predicted_visibilities_returns_the_model(make_vis_dataset):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': 'cube'}
+    img_dataset = _make_img_dataset([(110, 95, 0.5)], len(vis_dataset.chan))
+    vis_dataset = predict_modelvis_image(img_dataset, vis_dataset, {'cell': grid_parms['cell'], 'chan_mode': 'cube'}, {'to_disk': False})
+    image = make_image(vis_dataset, dict(grid_parms, data_name='MODEL'), {'to_disk': False}).DIRTY_IMAGE.values
+
+    assert np.allclose(image[110, 95], 0.5, rtol=1e-4, atol=0)
+    assert np.all(np.argmax(image.reshape((-1,) + image.shape[2:]), axis=0) == np.ravel_multi_index((110, 95), image.shape[0:2]))
+
+
+def test_incremental_prediction_adds_to_the_model(make_vis_dataset):
+    vis_dataset = make_vis_dataset()
+    degrid_parms = {'cell': [0.08, 0.08], 'chan_mode': 'cube'}
+    img_dataset = _make_img_dataset([(110, 95, 0.5)], len(vis_dataset.chan))
+    model_vis = predict_modelvis_image(img_dataset, vis_dataset.copy(), degrid_parms, {'to_disk': False}).MODEL.values
+    vis_dataset = predict_modelvis_image(img_dataset, vis_dataset, degrid_parms, {'to_disk': False})
+    vis_dataset = predict_modelvis_image(img_dataset, vis_dataset, dict(degrid_parms, incremental=True), {'to_disk': False})
+    assert np.allclose(vis_dataset.MODEL.values, 2 * model_vis, rtol=1e-12, atol=0, equal_nan=True)
@@ -0,0 +1,49 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+import pytest
+
+from ngcasa.imaging import make_image, make_psf, make_image_and_psf
+from ngcasa.imaging._imaging_utils._make_image import _setup_make_image
+from ngcasa.imaging._imaging_utils._partial_grid import _slab_bin_numpy_wrap
+
+
+@pytest.mark.parametrize('bda_tolerance', [0.0, 0.5])
+@pytest.mark.parametrize('chan_mode', ['continuum', 'cube'])
+@pytest.mark.parametrize('make_function, image_names', [(make_image, ['DIRTY_IMAGE']), (make_psf, ['PSF']), (make_image_and_psf, ['DIRTY_IMAGE', 'PSF'])])
+def test_fft_slabs_match_full_grid(make_vis_dataset, make_function, image_names, chan_mode, bda_tolerance):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': chan_mode, 'bda_tolerance': bda_tolerance}
+    image_dataset = make_function(vis_dataset, grid_parms, {'to_disk': False})
+    slab_image_dataset = make_function(vis_dataset, dict(grid_parms, n_fft_slabs=3), {'to_disk': False})
+    for image_name in image_names:
+        image = image_dataset[image_name].values
+        assert np.allclose(slab_image_dataset[image_name].values, image, rtol=0, atol=1e-12*np.max(np.abs(image)))
+
+
+def test_slab_bins_only_repeat_visibilities_that_cross_a_slab_edge(make_vis_dataset):
+    vis_dataset = make_vis_dataset()
+    grid_parms, _, _, _ = _setup_make_image(vis_dataset, {'imsize': [200, 200], 'cell': [0.08, 0.08], 'n_fft_slabs': 4}, {'to_disk': False}, False, False, 'dirty_image.img.zarr', 'make_image')
+    slab_edges = np.linspace(0, grid_parms['imsize_padded'][0], grid_parms['n_fft_slabs'] + 1).astype(int)
+    vis_data = vis_dataset.DATA.values[:5, :, :4]
+    list_of_slab_vis = _slab_bin_numpy_wrap(vis_data, vis_dataset.UVW.values[:5], vis_dataset.IMAGING_WEIGHT.values[:5, :, :4], vis_dataset.chan.values[:4], grid_parms, slab_edges)
+
+    support_center = grid_parms['support'] // 2
+    n_binned = 0
+    for i_slab, (slab_vis_data, weight, u_indx, v_indx, u_offset_indx, v_offset_indx, chan_indx) in enumerate(list_of_slab_vis):
+        assert np.all(u_indx - support_center < slab_edges[i_slab + 1]) and np.all(u_indx - support_center + grid_parms['support'] > slab_edges[i_slab])
+        n_binned = n_binned + len(u_indx)
+        n_crossing = np.sum((u_indx - support_center < slab_edges[i_slab]) | (u_indx - support_center + grid_parms['support'] > slab_edges[i_slab + 1]))
+        n_binned = n_binned - n_crossing / 2
+    assert n_binned <= np.prod(vis_data.shape[0:3])
@@ -0,0 +1,96 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import collections
+import os
+import numpy as np
+import pytest
+
+from ngcasa.imaging import make_gridding_convolution_function
+from ngcasa.imaging._imaging_utils import _gcf_cache
+
+
+@pytest.fixture
+def count_gcf_creations(monkeypatch):
+    """
+      Starts every test with an empty memory cache and counts the calls of _create_gcf.
+      """
+    monkeypatch.setattr(_gcf_cache, '_gcf_memory_cache', collections.OrderedDict())
+    created_keys = []
+    create_gcf = _gcf_cache._create_gcf
+
+    def counting_create_gcf(function, oversampling, support, imsize_padded):
+        created_keys.append(_gcf_cache._gcf_cache_key(function, oversampling, support, imsize_padded))
+        return create_gcf(function, oversampling, support, imsize_padded)
+
+    monkeypatch.setattr(_gcf_cache, '_create_gcf', counting_create_gcf)
+    return created_keys
+
+
+def test_gcf_memory_cache_hit_and_miss(count_gcf_creations):
+    cf_dataset = _gcf_cache._get_gcf('prolate_spheroidal', 100, 7, [240, 240])
+    assert _gcf_cache._get_gcf('prolate_spheroidal', 100, 7, [240, 240]) is cf_dataset
+    assert len(count_gcf_creations) == 1
+
+    #Any other kernel parameter is a miss.
+    for oversampling, support, imsize_padded in [(50, 7, [240, 240]), (100, 5, [240, 240]), (100, 7, [240, 250])]:
+        other_cf_dataset = _gcf_cache._get_gcf('prolate_spheroidal', oversampling, support, imsize_padded)
+        assert other_cf_dataset.attrs['oversampling'] == oversampling and other_cf_dataset.attrs['support'] == support
+        assert other_cf_dataset.CORRECTING_CGK.shape == tuple(imsize_padded)
+    assert len(count_gcf_creations) == 4
+
+
+def test_gcf_memory_cache_evicts_the_least_recently_used(count_gcf_creations):
+    list_of_imsize_padded = [[100 + 10*i, 100] for i in range(_gcf_cache._gcf_memory_cache_size + 1)]
+    for imsize_padded in list_of_imsize_padded[:-1]:
+        _gcf_cache._get_gcf('prolate_spheroidal', 100, 7, imsize_padded)
+    _gcf_cache._get_gcf('prolate_spheroidal', 100, 7, list_of_imsize_padded[0]) #The first entry becomes the most recently used.
+    _gcf_cache._get_gcf('prolate_spheroidal', 100, 7, list_of_imsize_padded[-1])
+    assert len(_gcf_cache._gcf_memory_cache) == _gcf_cache._gcf_memory_cache_size
+    assert _gcf_cache._gcf_cache_key('prolate_spheroidal', 100, 7, list_of_imsize_padded[0]) in _gcf_cache._gcf_memory_cache
+    assert _gcf_cache._gcf_cache_key('prolate_spheroidal', 100, 7, list_of_imsize_padded[1]) not in _gcf_cache._gcf_memory_cache
+
+
+def test_gcf_disk_cache_hit_and_miss(count_gcf_creations, tmp_path):
+    cache_dir = str(tmp_path / 'gcf_cache')
+    cf_dataset = _gcf_cache._get_gcf('prolate_spheroidal', 100, 7, [240, 240], cache_dir)
+    assert os.path.exists(os.path.join(cache_dir, _gcf_cache._gcf_cache_key('prolate_spheroidal', 100, 7, [240, 240]) + '.gcf.zarr'))
+
+    #A new session only has the disk cache.
+    _gcf_cache._gcf_memory_cache.clear()
+    disk_cf_dataset = _gcf_cache._get_gcf('prolate_spheroidal', 100, 7, [240, 240], cache_dir)
+    assert len(count_gcf_creations) == 1
+    assert np.array_equal(disk_cf_dataset.CGK_1D.values, cf_dataset.CGK_1D.values)
+    assert np.array_equal(disk_cf_dataset.CORRECTING_CGK.values, cf_dataset.CORRECTING_CGK.values)
+
+    _gcf_cache._get_gcf('prolate_spheroidal', 100, 5, [240, 240], cache_dir)
+    assert len(count_gcf_creations) == 2
+
+
+def test_gcf_disk_cache_recreates_unreadable_files(count_gcf_creations, tmp_path):
+    cache_dir = str(tmp_path / 'gcf_cache')
+    os.makedirs(os.path.join(cache_dir, _gcf_cache._gcf_cache_key('prolate_spheroidal', 100, 7, [240, 240]) + '.gcf.zarr'))
+    cf_dataset = _gcf_cache._get_gcf('prolate_spheroidal', 100, 7, [240, 240], cache_dir)
+    assert len(count_gcf_creations) == 1
+    _gcf_cache._gcf_memory_cache.clear()
+    assert np.array_equal(_gcf_cache._get_gcf('prolate_spheroidal', 100, 7, [240, 240], cache_dir).CGK_1D.values, cf_dataset.CGK_1D.values)
+    assert len(count_gcf_creations) == 1
+
+
+def test_make_gridding_convolution_function_returns_a_copy_of_the_cached_gcf(count_gcf_creations):
+    gcf_parms = {'imsize': [200, 200]}
+    cf_dataset = make_gridding_convolution_function(None, gcf_parms, {'to_disk': False})
+    cached_cgk_1D = _gcf_cache._get_gcf('prolate_spheroidal', 100, 7, [240, 240]).CGK_1D.values.copy()
+    cf_dataset.CGK_1D.values[:] = 0
+    assert len(count_gcf_creations) == 1
+    assert np.array_equal(make_gridding_convolution_function(None, gcf_parms, {'to_disk': False}).CGK_1D.values, cached_cgk_1D)
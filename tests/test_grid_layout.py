@@ -0,0 +1,37 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+import pytest
+
+from ngcasa.imaging import make_image, make_image_and_psf
+
+
+@pytest.mark.parametrize('grid_accumulation', ['tree', 'chained', 'batched'])
+@pytest.mark.parametrize('chan_mode', ['continuum', 'cube'])
+def test_u_v_chan_pol_layout_matches_chan_pol_u_v(make_vis_dataset, chan_mode, grid_accumulation):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': chan_mode, 'grid_accumulation': grid_accumulation}
+    image = make_image(vis_dataset, grid_parms, {'to_disk': False})
+    u_v_chan_pol_image = make_image(vis_dataset, dict(grid_parms, grid_layout='u_v_chan_pol'), {'to_disk': False})
+    assert np.allclose(u_v_chan_pol_image.DIRTY_IMAGE.values, image.DIRTY_IMAGE.values, rtol=0, atol=1e-12*np.max(np.abs(image.DIRTY_IMAGE.values)))
+    assert np.allclose(u_v_chan_pol_image.SUM_WEIGHT.values, image.SUM_WEIGHT.values, rtol=1e-12, atol=0)
+
+
+def test_u_v_chan_pol_layout_image_and_psf(make_vis_dataset):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': 'cube'}
+    image_and_psf = make_image_and_psf(vis_dataset, grid_parms, {'to_disk': False})
+    u_v_chan_pol_image_and_psf = make_image_and_psf(vis_dataset, dict(grid_parms, grid_layout='u_v_chan_pol'), {'to_disk': False})
+    for name in ['DIRTY_IMAGE', 'PSF']:
+        assert np.allclose(u_v_chan_pol_image_and_psf[name].values, image_and_psf[name].values, rtol=0, atol=1e-12*np.max(np.abs(image_and_psf[name].values)))
@@ -0,0 +1,72 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+import pytest
+
+from ngcasa.imaging._imaging_utils._gridding_convolutional_kernels import _prolate_spheroidal_function, _create_prolate_spheroidal_kernel, _create_prolate_spheroidal_kernel_1D
+
+
+def _reference_prolate_spheroidal_function(u):
+    """
+      Schwab's rational approximation of the spheroidal function (M = 6, alpha = 1) evaluated point by point with power sums.
+      """
+    p = [[8.203343e-2, -3.644705e-1, 6.278660e-1, -5.335581e-1, 2.312756e-1],
+         [4.028559e-3, -3.697768e-2, 1.021332e-1, -1.201436e-1, 6.412774e-2]]
+    q = [[1.0000000e0, 8.212018e-1, 2.078043e-1], [1.0000000e0, 9.599102e-1, 2.918724e-1]]
+    grdsf = np.zeros(len(u))
+    for i, u_i in enumerate(np.abs(u)):
+        if u_i > 1.0:
+            continue
+        part = 0 if u_i < 0.75 else 1
+        delusq = u_i**2 - (0.75 if part == 0 else 1.0)**2
+        top = sum(p[part][k] * delusq**k for k in range(5))
+        bot = sum(q[part][k] * delusq**k for k in range(3))
+        grdsf[i] = top / bot if bot > 0.0 else 0.0
+    return grdsf, (1 - np.abs(u)**2) * grdsf
+
+
+def test_prolate_spheroidal_function_matches_reference():
+    u = np.concatenate((np.linspace(-1.2, 1.2, 2401), [0.75, np.nextafter(0.75, 0), 1.0, np.nextafter(1.0, 2)]))
+    grdsf, kernel = _prolate_spheroidal_function(u)
+    expected_grdsf, expected_kernel = _reference_prolate_spheroidal_function(u)
+    assert np.allclose(grdsf, expected_grdsf, rtol=1e-13, atol=1e-16)
+    assert np.allclose(kernel, expected_kernel, rtol=1e-13, atol=1e-16)
+
+
+@pytest.mark.parametrize('oversampling', [10, 11])
+def test_prolate_spheroidal_kernel_is_the_outer_product_of_the_1D_kernels(oversampling):
+    support = 7
+    kernel, kernel_image = _create_prolate_spheroidal_kernel(oversampling, support, np.array([60, 64]))
+
+    n_oversampling_values = oversampling + 1 if oversampling % 2 == 0 else oversampling
+    oversampling_values = (np.arange(n_oversampling_values) - oversampling // 2) / oversampling
+    kernel_1D = _reference_prolate_spheroidal_function(((np.arange(support) - support // 2)[None, :] + oversampling_values[:, None]).ravel() / (support // 2))[1].reshape((n_oversampling_values, support))
+    assert kernel.shape == (n_oversampling_values, n_oversampling_values, support, support)
+    for x in range(n_oversampling_values):
+        for y in range(n_oversampling_values):
+            assert np.allclose(kernel[x, y], np.outer(kernel_1D[x], kernel_1D[y]), rtol=1e-13, atol=1e-16)
+
+    assert kernel_image.shape == (60, 64)
+    no_kernel, no_kernel_image = _create_prolate_spheroidal_kernel(oversampling, support, np.array([60, 64]), do_kernel=False)
+    assert no_kernel is None
+    assert np.array_equal(no_kernel_image, kernel_image)
+
+
+def test_prolate_spheroidal_kernel_1D_matches_reference():
+    oversampling, support = 100, 7
+    cgk_1D = _create_prolate_spheroidal_kernel_1D(oversampling, support)
+    u = np.arange(oversampling * (support // 2)) / (oversampling * (support // 2))
+    assert cgk_1D.shape == (oversampling * (support // 2 + 1),)
+    assert np.allclose(cgk_1D[:len(u)], _reference_prolate_spheroidal_function(u)[1], rtol=1e-13, atol=1e-16)
+    assert np.all(cgk_1D[len(u):] == 0)
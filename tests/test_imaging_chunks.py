@@ -0,0 +1,68 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+import pytest
+
+from ngcasa.imaging import calc_imaging_chunks, make_image
+
+
+@pytest.mark.parametrize('chan_chunk', [1, 4])
+@pytest.mark.parametrize('chan_mode', ['continuum', 'cube'])
+@pytest.mark.parametrize('grid_accumulation', ['tree', 'chained', 'batched'])
+def test_estimated_tasks_match_the_graph(make_vis_dataset, grid_accumulation, chan_mode, chan_chunk):
+    vis_dataset = make_vis_dataset(n_time=40, chan_chunk=chan_chunk)
+    image_dataset = make_image(vis_dataset, {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': chan_mode, 'grid_accumulation': grid_accumulation}, {'to_disk': False})
+    _, chunk_report = calc_imaging_chunks(vis_dataset, {'imsize': [200, 200], 'chan_mode': chan_mode, 'grid_accumulation': grid_accumulation})
+    n_tasks = len(dict(image_dataset.__dask_graph__()))
+    assert 0.8*n_tasks <= chunk_report['current']['n_tasks'] <= 1.25*n_tasks
+
+
+@pytest.mark.parametrize('chunk_parms', [{}, {'worker_memory': 2e7}, {'target_chunk_memory': 1e4}, {'max_tasks': 100}])
+def test_recommended_chunking_is_within_the_limits(make_vis_dataset, chunk_parms):
+    vis_dataset = make_vis_dataset(n_time=200)
+    chunk_parms = dict({'imsize': [200, 200], 'chan_mode': 'cube', 'n_workers': 1, 'n_threads_per_worker': 4, 'worker_memory': 8e9, 'target_chunk_memory': 128e6, 'max_tasks': 100000},
+                       **chunk_parms)
+    _, chunk_report = calc_imaging_chunks(vis_dataset, chunk_parms)
+    recommended = chunk_report['recommended']
+    assert recommended['n_chunks'] >= chunk_parms['n_workers']*chunk_parms['n_threads_per_worker']
+    assert recommended['vis_chunk_memory'] <= chunk_parms['target_chunk_memory']
+    assert recommended['worker_memory'] <= 0.5*chunk_parms['worker_memory']
+    assert recommended['n_tasks'] <= chunk_parms['max_tasks']
+
+
+def test_recommended_grid_parms_change_with_the_limits(make_vis_dataset):
+    vis_dataset = make_vis_dataset(n_time=200)
+    chunk_parms = {'imsize': [200, 200], 'chan_mode': 'cube', 'n_workers': 1, 'n_threads_per_worker': 4, 'worker_memory': 8e9}
+    _, chunk_report = calc_imaging_chunks(vis_dataset, chunk_parms)
+    assert (chunk_report['grid_accumulation'], chunk_report['n_fft_slabs']) == ('tree', 1)
+    #The tree sums need too much memory.
+    _, chunk_report = calc_imaging_chunks(vis_dataset, dict(chunk_parms, worker_memory=2e7))
+    assert (chunk_report['grid_accumulation'], chunk_report['n_fft_slabs']) == ('tree', 8)
+    #The graph has too many tasks.
+    _, chunk_report = calc_imaging_chunks(vis_dataset, dict(chunk_parms, max_tasks=100))
+    assert (chunk_report['grid_accumulation'], chunk_report['n_fft_slabs']) == ('batched', 1)
+
+
+@pytest.mark.parametrize('chunk_parms', [{}, {'worker_memory': 2e7}, {'max_tasks': 100}])
+def test_image_with_the_recommended_chunking_matches(make_vis_dataset, chunk_parms):
+    vis_dataset = make_vis_dataset(n_time=200)
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': 'cube'}
+    image = make_image(vis_dataset, grid_parms, {'to_disk': False}).DIRTY_IMAGE.values
+
+    chunk_parms = dict({'imsize': [200, 200], 'chan_mode': 'cube', 'n_workers': 1, 'n_threads_per_worker': 4, 'worker_memory': 8e9, 'rechunk': True}, **chunk_parms)
+    rechunked_vis_dataset, chunk_report = calc_imaging_chunks(vis_dataset, chunk_parms)
+    assert rechunked_vis_dataset.DATA.data.chunksize == tuple(chunk_report['chunks'][dim] for dim in rechunked_vis_dataset.DATA.dims)
+    grid_parms = dict(grid_parms, **{name: chunk_report[name] for name in ['n_fft_slabs', 'grid_accumulation', 'n_accumulators', 'n_chunks_per_task']})
+    rechunked_image = make_image(rechunked_vis_dataset, grid_parms, {'to_disk': False}).DIRTY_IMAGE.values
+    assert np.allclose(rechunked_image, image, rtol=0, atol=1e-12*np.max(np.abs(image)))
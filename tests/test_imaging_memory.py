@@ -0,0 +1,68 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from ngcasa.imaging._imaging_utils._make_image import _setup_make_image
+from ngcasa.imaging._imaging_utils._standard_grid import _graph_standard_grid
+
+
+def _peak_grid_memory(vis_dataset, grid_accumulation, n_accumulators):
+    """
+      The peak memory allocated while the continuum grid is gridded, in units of the size of the grid.
+      The grid is persisted rather than computed, so that the concatenation of the result by compute is not counted.
+      """
+    grid_parms = {'imsize': [500, 500], 'cell': [0.08, 0.08], 'chan_mode': 'continuum', 'grid_accumulation': grid_accumulation, 'n_accumulators': n_accumulators}
+    _grid_parms, _, cgk_1D, _ = _setup_make_image(vis_dataset, grid_parms, {'to_disk': False}, False, False, 'dirty_image.img.zarr', 'make_image')
+    grid, sum_weight = _graph_standard_grid(vis_dataset, cgk_1D, _grid_parms)
+    grid.persist() #Compiles the gridder, so that numba allocations are not counted.
+
+    tracemalloc.start()
+    try:
+        grid.persist()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak / grid.nbytes
+
+
+@pytest.mark.parametrize('n_accumulators', [1, 2, 4])
+def test_chained_peak_grid_memory(make_vis_dataset, n_accumulators):
+    vis_dataset = make_vis_dataset(n_time=16, time_chunk=2).persist()
+    #Each chain holds its grid and the copy its next chunk is gridded into (see _copy_accumulator), 0.1 grid is left for the data and the kernel.
+    assert _peak_grid_memory(vis_dataset, 'chained', n_accumulators) <= 2*n_accumulators + 0.1
+
+
+def test_tree_exceeds_chained_bound(make_vis_dataset):
+    #Checks that the measurement sees the grids of the chunks: the tree accumulation grids the 16 chunks into separate grids.
+    vis_dataset = make_vis_dataset(n_time=16, time_chunk=2).persist()
+    assert _peak_grid_memory(vis_dataset, 'tree', 2) > 2*2 + 0.1
+
+
+def test_chained_does_not_change_its_input(make_vis_dataset):
+    from ngcasa.imaging._imaging_utils._standard_grid import _standard_grid_numpy_wrap
+
+    vis_dataset = make_vis_dataset(n_time=4, time_chunk=4)
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': 'continuum', 'grid_accumulation': 'chained'}
+    _grid_parms, _, cgk_1D, _ = _setup_make_image(vis_dataset, grid_parms, {'to_disk': False}, False, False, 'dirty_image.img.zarr', 'make_image')
+    chunk = (vis_dataset.DATA.values, vis_dataset.UVW.values, vis_dataset.IMAGING_WEIGHT.values, vis_dataset.coords['chan'].values, cgk_1D, _grid_parms)
+
+    grid, sum_weight = _standard_grid_numpy_wrap(*chunk)
+    input_grid, input_sum_weight = grid.copy(), sum_weight.copy()
+    chained_grid, chained_sum_weight = _standard_grid_numpy_wrap(*chunk, grid_and_sum_weight=(grid, sum_weight))
+
+    assert np.array_equal(grid, input_grid) and np.array_equal(sum_weight, input_sum_weight)
+    assert np.allclose(chained_grid, 2*input_grid) and np.allclose(chained_sum_weight, 2*input_sum_weight)
@@ -0,0 +1,70 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+import pytest
+
+from ngcasa.imaging import make_imaging_weight
+
+
+def _reference_imaging_weight(vis_dataset, weighting, imsize, cell, chan_mode, robust=0.5, briggs_abs_noise=1.0):
+    """
+      The imaging weights calculated directly with numpy: the weight density is the sum of the weights in each uv cell and the weights are divided by
+      f_0 x density + f_1 (see make_imaging_weight). Visibilities outside the grid or with nan uvw values get a weight of 0.
+      """
+    c = 299792458.0
+    weight = vis_dataset.WEIGHT_SPECTRUM.values
+    if weighting == 'natural':
+        return weight
+
+    n_time, n_baseline, n_chan, n_pol = weight.shape
+    imsize = np.array(imsize)
+    cell = np.array(cell) * np.pi / (3600 * 180)
+    uvw = vis_dataset.UVW.values
+    freq_chan = vis_dataset.chan.values
+    #Rounded as int(x + 0.5), as the gridders do.
+    u_indx = (-uvw[:, :, 0, None] * freq_chan * cell[0] * imsize[0] / c + imsize[0] // 2 + 0.5)
+    v_indx = (-uvw[:, :, 1, None] * freq_chan * cell[1] * imsize[1] / c + imsize[1] // 2 + 0.5)
+    valid = ~np.isnan(u_indx) & ~np.isnan(v_indx)
+    u_indx = np.where(valid, u_indx, -1).astype(int)
+    v_indx = np.where(valid, v_indx, -1).astype(int)
+    valid = valid & (u_indx >= 0) & (u_indx < imsize[0]) & (v_indx >= 0) & (v_indx < imsize[1])
+    img_chan = np.broadcast_to(np.arange(n_chan) if chan_mode == 'cube' else np.zeros(n_chan, dtype=int), u_indx.shape)
+
+    imaging_weight = np.zeros(weight.shape)
+    for i_pol in range(n_pol):
+        density = np.zeros((n_chan, imsize[0], imsize[1]))
+        np.add.at(density, (img_chan[valid], u_indx[valid], v_indx[valid]), weight[:, :, :, i_pol][valid])
+        cell_density = density[img_chan[valid], u_indx[valid], v_indx[valid]]
+        if weighting == 'uniform':
+            f_0, f_1 = 1.0, 0.0
+        elif weighting == 'briggs':
+            sum_weight = np.sum(density, axis=(1, 2))
+            f_0 = (np.square(5.0*10.0**(-robust)) / (np.sum(density**2, axis=(1, 2)) / np.where(sum_weight == 0, 1, sum_weight)))[img_chan[valid]]
+            f_1 = 1.0
+        elif weighting == 'briggs_abs':
+            f_0, f_1 = robust**2, 2.0*briggs_abs_noise**2
+        imaging_weight[:, :, :, i_pol][valid] = weight[:, :, :, i_pol][valid] / (f_0 * cell_density + f_1)
+    return imaging_weight
+
+
+@pytest.mark.parametrize('weighting', ['natural', 'uniform', 'briggs', 'briggs_abs'])
+@pytest.mark.parametrize('chan_mode', ['continuum', 'cube'])
+def test_imaging_weight_matches_numpy_reference(make_vis_dataset, weighting, chan_mode):
+    vis_dataset = make_vis_dataset()
+    vis_dataset['WEIGHT_SPECTRUM'] = vis_dataset.IMAGING_WEIGHT
+    imaging_weights_parms = {'weighting': weighting, 'imsize': [64, 64], 'cell': [0.08, 0.08], 'chan_mode': chan_mode, 'robust': 0.3, 'briggs_abs_noise': 0.7}
+    imaging_weight = make_imaging_weight(vis_dataset, imaging_weights_parms, {'to_disk': False}).IMAGING_WEIGHT.values
+
+    expected_imaging_weight = _reference_imaging_weight(vis_dataset, weighting, [64, 64], [0.08, 0.08], chan_mode, robust=0.3, briggs_abs_noise=0.7)
+    assert np.allclose(imaging_weight, expected_imaging_weight, rtol=1e-12, atol=0)
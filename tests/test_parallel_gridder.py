@@ -0,0 +1,48 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+import pytest
+
+from ngcasa.imaging import make_image
+from ngcasa.imaging._imaging_utils._check_imaging_parms import _check_grid_params
+
+
+def test_parallel_gridder_defaults_to_chained(make_vis_dataset):
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'gridder': 'parallel'}
+    assert _check_grid_params(make_vis_dataset(), grid_parms)
+    assert grid_parms['grid_accumulation'] == 'chained'
+
+
+@pytest.mark.parametrize('gridder, n_accumulators', [('parallel', 1), ('standard', 4)])
+def test_parallel_gridder_defaults_to_a_single_chain(make_vis_dataset, gridder, n_accumulators):
+    #Every chain of the parallel gridder uses all the numba threads, more chains would oversubscribe the cores.
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'gridder': gridder, 'grid_accumulation': 'chained'}
+    assert _check_grid_params(make_vis_dataset(), grid_parms)
+    assert grid_parms['n_accumulators'] == n_accumulators
+
+
+@pytest.mark.parametrize('grid_accumulation', ['tree', 'batched', 'bounding_box'])
+def test_parallel_gridder_rejects_grid_per_chunk(make_vis_dataset, grid_accumulation):
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'gridder': 'parallel', 'grid_accumulation': grid_accumulation}
+    assert not _check_grid_params(make_vis_dataset(), grid_parms)
+
+
+@pytest.mark.parametrize('chan_mode', ['continuum', 'cube'])
+def test_parallel_gridder_matches_standard(make_vis_dataset, chan_mode):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': chan_mode, 'n_accumulators': 2}
+    standard_image = make_image(vis_dataset, grid_parms, {'to_disk': False}).DIRTY_IMAGE.values
+    for parallel_grid_parms in [dict(grid_parms, gridder='parallel'), {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': chan_mode, 'gridder': 'parallel'}]:
+        parallel_image = make_image(vis_dataset, parallel_grid_parms, {'to_disk': False}).DIRTY_IMAGE.values
+        assert np.allclose(parallel_image, standard_image, rtol=0, atol=1e-12*np.max(np.abs(standard_image)))
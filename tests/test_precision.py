@@ -0,0 +1,43 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+import pytest
+
+from ngcasa.imaging import make_image, make_psf
+
+#The documented difference between 'single' and 'double' precision images, relative to the image peak (see grid_parms['precision'] of make_image).
+single_precision_bound = 1e-4
+
+
+@pytest.mark.parametrize('gridder', ['standard', 'tiled'])
+@pytest.mark.parametrize('chan_mode', ['continuum', 'cube'])
+def test_single_precision_image(make_vis_dataset, chan_mode, gridder):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': chan_mode, 'gridder': gridder}
+    double_image = make_image(vis_dataset, grid_parms, {'to_disk': False}).DIRTY_IMAGE.values
+    single_image = make_image(vis_dataset, dict(grid_parms, precision='single'), {'to_disk': False}).DIRTY_IMAGE.values
+
+    assert single_image.dtype == np.float32
+    assert np.max(np.abs(single_image - double_image)) < single_precision_bound*np.max(np.abs(double_image))
+
+
+@pytest.mark.parametrize('chan_mode', ['continuum', 'cube'])
+def test_single_precision_psf(make_vis_dataset, chan_mode):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': chan_mode}
+    double_psf = make_psf(vis_dataset, grid_parms, {'to_disk': False}).PSF.values
+    single_psf = make_psf(vis_dataset, dict(grid_parms, precision='single'), {'to_disk': False}).PSF.values
+
+    assert single_psf.dtype == np.float32
+    assert np.max(np.abs(single_psf - double_psf)) < single_precision_bound*np.max(np.abs(double_psf))
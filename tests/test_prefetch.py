@@ -0,0 +1,100 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import threading
+
+import numpy as np
+import pytest
+
+from ngcasa.imaging._imaging_utils._prefetch import _prefetch_chunks
+
+
+class _Chunks:
+    """
+      The chunks of length 10 of an arange for _prefetch_chunks, counting how many chunks were listed and loaded.
+      If slow, chunk c takes (c + 1) x 0.05 seconds to prepare, so the prefetch threads finish the chunks one after the other.
+      """
+    def __init__(self, n_chunks, slow=False):
+        import dask.array as da
+        self.blocks = da.arange(n_chunks * 10, chunks=10).to_delayed()
+        self.n_listed = 0
+        self.loaded = []
+        self.lock = threading.Lock()
+        self.slow = slow
+
+    def __iter__(self):
+        for c in range(len(self.blocks)):
+            self.n_listed += 1
+            yield c, [self.blocks[c]]
+
+    def prepare(self, c, block):
+        if self.slow:
+            threading.Event().wait((c + 1) * 0.05)
+        with self.lock:
+            self.loaded.append(c)
+        return c, block
+
+
+def test_prefetch_yields_the_chunks_in_order():
+    chunks = _Chunks(6)
+    timings = {}
+    list_of_chunks = list(_prefetch_chunks(chunks, 2, 2, prepare=chunks.prepare, timings=timings))
+    assert [c for c, block in list_of_chunks] == list(range(6))
+    assert all(np.array_equal(block, np.arange(c * 10, (c + 1) * 10)) for c, block in list_of_chunks)
+    assert timings['n_chunks'] == 6
+
+
+@pytest.mark.parametrize('n_prefetch_chunks', [1, 3])
+def test_prefetch_stops_reading_when_closed(n_prefetch_chunks):
+    n_prefetch_threads = 2
+    chunks = _Chunks(10, slow=True)
+    prefetched_chunks = _prefetch_chunks(chunks, n_prefetch_chunks, n_prefetch_threads, prepare=chunks.prepare)
+    assert next(prefetched_chunks)[0] == 0
+    prefetched_chunks.close()
+
+    #Only the chunks that were submitted when the first chunk was yielded are listed, the ones that had not started loading are cancelled
+    #and closing waits for the ones that were loading.
+    assert chunks.n_listed == n_prefetch_chunks + 1
+    n_loaded = len(chunks.loaded)
+    assert set(chunks.loaded) <= set(range(min(n_prefetch_chunks, n_prefetch_threads) + 1))
+    threading.Event().wait(0.2)
+    assert len(chunks.loaded) == n_loaded
+
+
+def test_prefetch_raises_the_prepare_exception_in_order():
+    chunks = _Chunks(10)
+
+    def prepare(c, block):
+        if c == 3:
+            raise ValueError('chunk 3')
+        return chunks.prepare(c, block)
+
+    yielded = []
+    with pytest.raises(ValueError, match='chunk 3'):
+        for c, block in _prefetch_chunks(chunks, 2, 2, prepare=prepare):
+            yielded.append(c)
+    #The chunks before the failed one are yielded and the chunks after the ones that were loading are never listed.
+    assert yielded == [0, 1, 2]
+    assert chunks.n_listed <= 3 + 2 + 1
+
+
+def test_prefetch_stops_reading_when_the_chunk_use_fails():
+    chunks = _Chunks(10)
+    with pytest.raises(RuntimeError):
+        for c, block in _prefetch_chunks(chunks, 2, 2, prepare=chunks.prepare):
+            if c == 1:
+                raise RuntimeError('gridding failed')
+    n_loaded = len(chunks.loaded)
+    assert chunks.n_listed == 1 + 1 + 2
+    threading.Event().wait(0.1)
+    assert len(chunks.loaded) == n_loaded
@@ -0,0 +1,78 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+import pytest
+
+from ngcasa.imaging import make_image, make_psf, make_image_and_psf
+
+
+def _assert_images_match(image, expected_image):
+    assert np.allclose(image, expected_image, rtol=0, atol=1e-12*np.max(np.abs(expected_image)))
+
+
+@pytest.mark.parametrize('n_stream_threads', [1, 3])
+@pytest.mark.parametrize('chan_mode', ['continuum', 'cube'])
+def test_streaming_matches_tree(make_vis_dataset, chan_mode, n_stream_threads):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': chan_mode}
+    streaming_grid_parms = dict(grid_parms, grid_accumulation='streaming', n_stream_threads=n_stream_threads)
+
+    tree_image = make_image(vis_dataset, grid_parms, {'to_disk': False})
+    streaming_image = make_image(vis_dataset, streaming_grid_parms, {'to_disk': False})
+    _assert_images_match(streaming_image.DIRTY_IMAGE.values, tree_image.DIRTY_IMAGE.values)
+    assert np.allclose(streaming_image.SUM_WEIGHT.values, tree_image.SUM_WEIGHT.values, rtol=1e-12, atol=0)
+
+    tree_psf = make_psf(vis_dataset, grid_parms, {'to_disk': False})
+    streaming_psf = make_psf(vis_dataset, streaming_grid_parms, {'to_disk': False})
+    _assert_images_match(streaming_psf.PSF.values, tree_psf.PSF.values)
+
+    streaming_image_and_psf = make_image_and_psf(vis_dataset, streaming_grid_parms, {'to_disk': False})
+    _assert_images_match(streaming_image_and_psf.DIRTY_IMAGE.values, tree_image.DIRTY_IMAGE.values)
+    _assert_images_match(streaming_image_and_psf.PSF.values, tree_psf.PSF.values)
+
+
+@pytest.mark.parametrize('n_stream_threads', [1, 3])
+def test_streaming_matches_tree_with_bda(make_vis_dataset, n_stream_threads):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': 'cube', 'bda_tolerance': 0.01}
+    tree_image = make_image(vis_dataset, grid_parms, {'to_disk': False}).DIRTY_IMAGE.values
+    streaming_image = make_image(vis_dataset, dict(grid_parms, grid_accumulation='streaming', n_stream_threads=n_stream_threads), {'to_disk': False}).DIRTY_IMAGE.values
+    _assert_images_match(streaming_image, tree_image)
+
+
+def test_streaming_from_zarr_matches_tree(make_vis_dataset, tmp_path):
+    import xarray as xr
+
+    make_vis_dataset().to_zarr(str(tmp_path / 'vis.zarr'))
+    vis_dataset = xr.open_zarr(str(tmp_path / 'vis.zarr'))
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': 'cube'}
+    tree_image = make_image(vis_dataset, grid_parms, {'to_disk': False}).DIRTY_IMAGE.values
+    streaming_image = make_image(vis_dataset, dict(grid_parms, grid_accumulation='streaming', n_prefetch_chunks=3), {'to_disk': False})
+    _assert_images_match(streaming_image.DIRTY_IMAGE.values, tree_image)
+    assert streaming_image.attrs['prefetch_timings']['n_chunks'] == 8
+
+
+def test_streaming_returns_the_timings_without_changing_grid_parms(make_vis_dataset):
+    import copy
+    from ngcasa.imaging._imaging_utils._make_image import _setup_make_image
+    from ngcasa.imaging._imaging_utils._standard_grid import _graph_standard_grid
+
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': 'cube', 'grid_accumulation': 'streaming'}
+    _grid_parms, _storage_parms, cgk_1D, correcting_cgk_image = _setup_make_image(vis_dataset, grid_parms, {'to_disk': False}, False, False, 'dirty_image.img.zarr', 'make_image')
+    checked_grid_parms = copy.deepcopy(_grid_parms)
+    timings = {}
+    _graph_standard_grid(vis_dataset, cgk_1D, _grid_parms, timings)
+    assert timings['n_chunks'] == 8
+    assert _grid_parms.keys() == checked_grid_parms.keys()
@@ -0,0 +1,47 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+import pytest
+
+from ngcasa.imaging import make_image, make_psf
+from ngcasa.imaging._imaging_utils._tiled_grid import _bin_visibilities_by_tile
+
+
+@pytest.mark.parametrize('tile_size', [8, 64])
+@pytest.mark.parametrize('chan_mode', ['continuum', 'cube'])
+def test_tiled_gridder_matches_standard(make_vis_dataset, chan_mode, tile_size):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': chan_mode}
+    tiled_grid_parms = dict(grid_parms, gridder='tiled', tile_size=tile_size)
+
+    standard_image = make_image(vis_dataset, grid_parms, {'to_disk': False})
+    tiled_image = make_image(vis_dataset, tiled_grid_parms, {'to_disk': False})
+    assert np.allclose(tiled_image.DIRTY_IMAGE.values, standard_image.DIRTY_IMAGE.values, rtol=0, atol=1e-12*np.max(np.abs(standard_image.DIRTY_IMAGE.values)))
+    assert np.allclose(tiled_image.SUM_WEIGHT.values, standard_image.SUM_WEIGHT.values, rtol=1e-12, atol=0)
+
+    standard_psf = make_psf(vis_dataset, grid_parms, {'to_disk': False}).PSF.values
+    tiled_psf = make_psf(vis_dataset, tiled_grid_parms, {'to_disk': False}).PSF.values
+    assert np.allclose(tiled_psf, standard_psf, rtol=0, atol=1e-12*np.max(np.abs(standard_psf)))
+
+
+def test_tile_bins_are_sorted_and_drop_visibilities_outside_the_grid():
+    n_uv = np.array([40, 40])
+    u_indx = np.array([[[3, 10], [20, 39]], [[5, 33], [-1, 12]]])
+    v_indx = np.array([[[3, 25], [20, 10]], [[37, 6], [-1, 12]]])
+    vis_order, vis_keys, n_tiles = _bin_visibilities_by_tile(u_indx, v_indx, np.array([0, 1]), n_uv, 7, 16)
+
+    assert np.array_equal(n_tiles, [3, 3])
+    #The kernels of the flat visibilities 3 and 4 do not fit in the grid and 6 has nan uvw values.
+    assert np.array_equal(vis_order, [0, 2, 7, 1, 5])
+    assert np.array_equal(vis_keys, [0, 4, 9, 10, 15])
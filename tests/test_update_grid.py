@@ -0,0 +1,78 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import os
+
+import numpy as np
+import pytest
+
+from ngcasa.imaging import make_image, make_grid, update_grid, make_imaging_weight
+
+
+def _assert_images_match(image, expected_image):
+    assert np.allclose(image, expected_image, rtol=0, atol=1e-12*np.max(np.abs(expected_image)))
+
+
+@pytest.mark.parametrize('chan_mode', ['continuum', 'cube'])
+def test_update_grid_matches_make_image(make_vis_dataset, chan_mode):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': chan_mode}
+    image = make_image(vis_dataset, grid_parms, {'to_disk': False})
+
+    grid_dataset = make_grid(vis_dataset.isel(time=slice(0, 8)), grid_parms, {'to_disk': False})
+    #The second update only has the times 8 to 14 that are already gridded, they are skipped.
+    grid_dataset = update_grid(grid_dataset, vis_dataset.isel(time=slice(0, 15)), {}, {'to_disk': False})
+    grid_dataset = update_grid(grid_dataset, vis_dataset.isel(time=slice(8, 15)), {}, {'to_disk': False})
+    grid_dataset = update_grid(grid_dataset, vis_dataset, {}, {'to_disk': False})
+
+    _assert_images_match(grid_dataset.DIRTY_IMAGE.values, image.DIRTY_IMAGE.values)
+    assert np.allclose(grid_dataset.SUM_WEIGHT.values, image.SUM_WEIGHT.values, rtol=1e-12, atol=0)
+    assert np.array_equal(np.sort(grid_dataset.GRIDDED_TIME.values), vis_dataset.time.values)
+
+
+def test_update_grid_rejects_other_baselines(make_vis_dataset):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08]}
+    grid_dataset = make_grid(vis_dataset.isel(time=slice(0, 8), baseline=slice(0, 20)), grid_parms, {'to_disk': False})
+    with pytest.raises(AssertionError):
+        update_grid(grid_dataset, vis_dataset, {}, {'to_disk': False})
+
+
+@pytest.mark.parametrize('weighting', ['uniform', 'briggs'])
+def test_update_grid_rejects_density_weighting(make_vis_dataset, weighting):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08]}
+    weighted_vis_dataset = make_imaging_weight(vis_dataset.copy(), {'weighting': weighting, 'imsize': [200, 200], 'cell': [0.08, 0.08]}, {'to_disk': False})
+    assert weighted_vis_dataset.IMAGING_WEIGHT.attrs['weighting'] == weighting
+
+    #Neither a grid of density weighted visibilities nor density weighted new visibilities can be updated.
+    grid_dataset = make_grid(weighted_vis_dataset.isel(time=slice(0, 8)), grid_parms, {'to_disk': False})
+    with pytest.raises(AssertionError):
+        update_grid(grid_dataset, vis_dataset, {}, {'to_disk': False})
+    grid_dataset = make_grid(vis_dataset.isel(time=slice(0, 8)), grid_parms, {'to_disk': False})
+    with pytest.raises(AssertionError):
+        update_grid(grid_dataset, weighted_vis_dataset, {}, {'to_disk': False})
+
+
+def test_update_grid_replaces_its_input_zarr_file(make_vis_dataset, tmp_path):
+    import xarray as xr
+
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08]}
+    outfile = str(tmp_path / 'grid.zarr')
+    make_grid(vis_dataset.isel(time=slice(0, 8)), grid_parms, {'to_disk': True, 'outfile': outfile})
+
+    grid_dataset = update_grid(xr.open_zarr(outfile), vis_dataset, {}, {'to_disk': True, 'outfile': outfile})
+
+    _assert_images_match(grid_dataset.DIRTY_IMAGE.values, make_image(vis_dataset, grid_parms, {'to_disk': False}).DIRTY_IMAGE.values)
+    assert sorted(os.listdir(str(tmp_path))) == ['grid.zarr']
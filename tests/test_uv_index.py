@@ -0,0 +1,86 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+import pytest
+
+from ngcasa.imaging import make_uv_index, make_image, make_psf, make_image_and_psf, make_imaging_weight, predict_modelvis_image
+
+
+@pytest.mark.parametrize('chan_mode', ['continuum', 'cube'])
+@pytest.mark.parametrize('make_function, image_names', [(make_image, ['DIRTY_IMAGE']), (make_psf, ['PSF']), (make_image_and_psf, ['DIRTY_IMAGE', 'PSF'])])
+def test_uv_index_gridding_matches_direct_gridding(make_vis_dataset, make_function, image_names, chan_mode):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': chan_mode}
+    image_dataset = make_function(vis_dataset, grid_parms, {'to_disk': False})
+
+    vis_dataset = make_uv_index(vis_dataset, {'imsize': [200, 200], 'cell': [0.08, 0.08]}, {'to_disk': False})
+    uv_index_image_dataset = make_function(vis_dataset, dict(grid_parms, uv_index_name='UV_INDEX'), {'to_disk': False})
+    for image_name in image_names:
+        image = image_dataset[image_name].values
+        assert np.allclose(uv_index_image_dataset[image_name].values, image, rtol=0, atol=1e-12*np.max(np.abs(image)))
+
+
+@pytest.mark.parametrize('chan_mode', ['continuum', 'cube'])
+def test_uv_index_degridding_matches_direct_degridding(make_vis_dataset, chan_mode):
+    import dask.array as da
+    import xarray as xr
+    vis_dataset = make_vis_dataset()
+    n_chan = 1 if chan_mode == 'continuum' else len(vis_dataset.chan)
+    model_image = np.random.default_rng(0).normal(size=(200, 200, n_chan, 2))
+    img_dataset = xr.Dataset({'MODEL_IMAGE': (('d0', 'd1', 'chan', 'pol'), da.from_array(model_image, chunks=(-1, -1, 4, -1)))})
+    degrid_parms = {'cell': [0.08, 0.08], 'chan_mode': chan_mode}
+    model_vis = predict_modelvis_image(img_dataset, vis_dataset.copy(), degrid_parms, {'to_disk': False}).MODEL.values
+
+    vis_dataset = make_uv_index(vis_dataset, {'imsize': [200, 200], 'cell': [0.08, 0.08]}, {'to_disk': False})
+    uv_index_model_vis = predict_modelvis_image(img_dataset, vis_dataset, dict(degrid_parms, uv_index_name='UV_INDEX'), {'to_disk': False}).MODEL.values
+    assert np.allclose(uv_index_model_vis, model_vis, rtol=1e-12, atol=0, equal_nan=True)
+
+
+@pytest.mark.parametrize('weighting', ['uniform', 'briggs'])
+def test_uv_index_imaging_weight_matches_direct_imaging_weight(make_vis_dataset, weighting):
+    vis_dataset = make_vis_dataset()
+    vis_dataset['WEIGHT_SPECTRUM'] = vis_dataset.IMAGING_WEIGHT
+    imaging_weights_parms = {'weighting': weighting, 'imsize': [64, 64], 'cell': [0.08, 0.08], 'chan_mode': 'cube'}
+    imaging_weight = make_imaging_weight(vis_dataset.copy(), imaging_weights_parms, {'to_disk': False}).IMAGING_WEIGHT.values
+
+    vis_dataset = make_uv_index(vis_dataset, {'imsize': [64, 64], 'cell': [0.08, 0.08], 'fft_padding': 1}, {'to_disk': False})
+    uv_index_imaging_weight = make_imaging_weight(vis_dataset, dict(imaging_weights_parms, uv_index_name='UV_INDEX'), {'to_disk': False}).IMAGING_WEIGHT.values
+    assert np.allclose(uv_index_imaging_weight, imaging_weight, rtol=1e-12, atol=0)
+
+
+def _new_uvw(vis_dataset):
+    vis_dataset['UVW'] = vis_dataset.UVW * 1.0
+    return vis_dataset
+
+
+def _rechunk_data(vis_dataset):
+    vis_dataset['DATA'] = vis_dataset.DATA.chunk({'time': 10})
+    return vis_dataset
+
+
+@pytest.mark.parametrize('change', [lambda vis_dataset, grid_parms: (vis_dataset, dict(grid_parms, cell=[0.07, 0.07])),
+                                    lambda vis_dataset, grid_parms: (vis_dataset, dict(grid_parms, imsize=[180, 180])),
+                                    lambda vis_dataset, grid_parms: (vis_dataset, dict(grid_parms, fft_padding=1.5)),
+                                    lambda vis_dataset, grid_parms: (vis_dataset, dict(grid_parms, oversampling=50)),
+                                    lambda vis_dataset, grid_parms: (_new_uvw(vis_dataset), grid_parms),
+                                    lambda vis_dataset, grid_parms: (_rechunk_data(vis_dataset), grid_parms)],
+                         ids=['cell', 'imsize', 'fft_padding', 'oversampling', 'uvw', 'chunks'])
+def test_stale_uv_index_is_rejected(make_vis_dataset, change):
+    vis_dataset = make_uv_index(make_vis_dataset(), {'imsize': [200, 200], 'cell': [0.08, 0.08]}, {'to_disk': False})
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'uv_index_name': 'UV_INDEX'}
+    make_image(vis_dataset, grid_parms, {'to_disk': False})
+
+    vis_dataset, grid_parms = change(vis_dataset, grid_parms)
+    with pytest.raises(AssertionError):
+        make_image(vis_dataset, grid_parms, {'to_disk': False})
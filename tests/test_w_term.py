@@ -0,0 +1,139 @@
+#   Copyright 2020 AUI, Inc. Washington DC, USA
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import numpy as np
+import pytest
+
+from ngcasa.imaging import make_image, make_psf
+from ngcasa.imaging._imaging_utils._make_image import _setup_make_image
+from ngcasa.imaging._imaging_utils._standard_grid import _graph_standard_grid
+from ngcasa.imaging._imaging_utils._fft import _ifft2_shifted
+from ngcasa.imaging._imaging_utils._remove_padding import _remove_padding
+from ngcasa.imaging._imaging_utils._w_term import _graph_w_stacking, _calc_w_planes, _calc_w_plane_indx, _apply_w_screen
+
+
+@pytest.mark.parametrize('grid_accumulation', ['tree', 'chained', 'batched', 'bounding_box'])
+@pytest.mark.parametrize('chan_mode', ['continuum', 'cube'])
+def test_w_stacking_matches_gridding_each_w_plane(make_vis_dataset, chan_mode, grid_accumulation):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': chan_mode, 'wterm': 'wstacking', 'n_wplanes': 4, 'grid_accumulation': grid_accumulation}
+    _grid_parms, _storage_parms, cgk_1D, correcting_cgk_image = _setup_make_image(vis_dataset, grid_parms, {'to_disk': False}, False, False, 'dirty_image.img.zarr', 'make_image')
+    image, sum_weight = _graph_w_stacking(vis_dataset, cgk_1D, _grid_parms)
+
+    #Grid the visibilities of each w-plane separately.
+    w_planes = _calc_w_planes(vis_dataset, _grid_parms)
+    w_plane_indx = _calc_w_plane_indx(vis_dataset.UVW.values, vis_dataset.chan.values, w_planes)
+    w_plane_grid_parms = dict(_grid_parms, wterm='none')
+    expected_image = 0
+    expected_sum_weight = 0
+    for i_w_plane, w in enumerate(w_planes):
+        w_plane_dataset = vis_dataset.copy()
+        w_plane_dataset['IMAGING_WEIGHT'] = vis_dataset.IMAGING_WEIGHT.copy(data=vis_dataset.IMAGING_WEIGHT.data * np.where(w_plane_indx == i_w_plane, 1.0, 0.0)[:, :, :, None])
+        grid, w_plane_sum_weight = _graph_standard_grid(w_plane_dataset, cgk_1D, w_plane_grid_parms)
+        #The phase screen is applied to the padded image, the w-stacking image only has the pixels kept by _remove_padding.
+        expected_image = expected_image + _remove_padding(_apply_w_screen(_ifft2_shifted(grid, w_plane_grid_parms).compute(), w, _grid_parms['cell']), _grid_parms['imsize'])
+        expected_sum_weight = expected_sum_weight + w_plane_sum_weight.compute()
+
+    assert np.allclose(image.compute(), expected_image, rtol=0, atol=1e-12*np.max(np.abs(expected_image)))
+    assert np.allclose(sum_weight.compute(), expected_sum_weight, rtol=1e-12, atol=0)
+
+
+def test_w_stacking_ffts_each_w_plane_in_its_own_task(make_vis_dataset):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': 'cube', 'wterm': 'wstacking', 'n_wplanes': 8}
+    graph = make_image(vis_dataset, grid_parms, {'to_disk': False}).DIRTY_IMAGE.data.__dask_graph__()
+    n_fft_tasks = len([key for key in graph.keys() if key[0].startswith('_cropped_shifted_ifft2')])
+    assert n_fft_tasks == 8 * len(vis_dataset.DATA.chunks[2])
+
+
+def test_w_stacking_uses_w_max(make_vis_dataset):
+    vis_dataset = make_vis_dataset()
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': 'cube', 'wterm': 'wstacking', 'n_wplanes': 4}
+    _grid_parms, _storage_parms, cgk_1D, correcting_cgk_image = _setup_make_image(vis_dataset, grid_parms, {'to_disk': False}, False, False, 'dirty_image.img.zarr', 'make_image')
+    w_planes = _calc_w_planes(vis_dataset, _grid_parms)
+    image = make_image(vis_dataset, grid_parms, {'to_disk': False}).DIRTY_IMAGE.values
+    image_w_max = make_image(vis_dataset, dict(grid_parms, w_max=w_planes[-1]), {'to_disk': False}).DIRTY_IMAGE.values
+    assert np.array_equal(_calc_w_planes(vis_dataset, dict(_grid_parms, w_max=10.0)), np.linspace(-10.0, 10.0, 4))
+    assert np.allclose(image_w_max, image, rtol=0, atol=1e-12*np.max(np.abs(image)))
+
+
+def _point_source_dataset(make_vis_dataset, list_of_sources, cell, w_max_m=60.0):
+    """
+      Visibilities of point sources (list of (d0, d1, flux)) on a 200x200 image with cell (arcseconds), including the w-term. The u and v values are at most 8 m
+      (about 2700 wavelengths) and the w values at most w_max_m. The d0 axis of the image increases with -l (see test_degrid.py) and with the (u, v) convention of the
+      gridders a source at (l, m) has the visibilities exp(2 pi i (u l + v m + w (n-1))).
+      """
+    c = 299792458.0
+    vis_dataset = make_vis_dataset()
+    rng = np.random.default_rng(2)
+    uvw = np.concatenate([rng.uniform(-8, 8, (vis_dataset.sizes['time'], vis_dataset.sizes['baseline'], 2)),
+                          rng.uniform(-w_max_m, w_max_m, (vis_dataset.sizes['time'], vis_dataset.sizes['baseline'], 1))], axis=2)
+    uvw[0, 0, :] = np.nan
+    u, v, w = [uvw[:, :, i, None] * vis_dataset.chan.values / c for i in range(3)]
+    delta_lm = cell * np.pi / (3600 * 180)
+    data = 0
+    for d0, d1, flux in list_of_sources:
+        l, m = -(d0 - 100) * delta_lm, (d1 - 100) * delta_lm
+        data = data + flux * np.exp(2j * np.pi * (u * l + v * m + w * (np.sqrt(1 - l**2 - m**2) - 1)))
+    vis_dataset['UVW'] = vis_dataset.UVW.copy(data=uvw).chunk(vis_dataset.UVW.chunks)
+    vis_dataset['DATA'] = vis_dataset.DATA.copy(data=np.repeat(data[:, :, :, None], vis_dataset.sizes['pol'], axis=3)).chunk(vis_dataset.DATA.chunks)
+    return vis_dataset, u, v, w
+
+
+@pytest.mark.parametrize('chan_mode', ['continuum', 'cube'])
+#With 32 w-planes a visibility is up to 650 wavelengths from its w-plane, a phase error of up to 0.28 rad at the first source, so the sources are a few percent low.
+@pytest.mark.parametrize('wterm, w_parms, tolerance', [('wstacking', {'n_wplanes': 32}, 0.04), ('wprojection', {'n_wplanes': 32}, 0.04), ('none', {}, None)])
+def test_w_term_matches_direct_fourier_sum(make_vis_dataset, wterm, w_parms, tolerance, chan_mode):
+    cell = 30.0
+    list_of_sources = [(170, 60, 1.0), (40, 150, 0.5), (100, 100, 0.3)]
+    vis_dataset, u, v, w = _point_source_dataset(make_vis_dataset, list_of_sources, cell)
+    grid_parms = dict({'imsize': [200, 200], 'cell': [cell, cell], 'chan_mode': chan_mode, 'wterm': wterm}, **w_parms)
+    image = make_image(vis_dataset, grid_parms, {'to_disk': False}).DIRTY_IMAGE.values
+
+    #The direct Fourier sum of the weighted visibilities at the source pixels, including the w-term.
+    delta_lm = cell * np.pi / (3600 * 180)
+    weight = vis_dataset.IMAGING_WEIGHT.values[:, :, :, 0]
+    data = vis_dataset.DATA.values[:, :, :, 0]
+    valid = ~np.isnan(u)
+    image_errors = []
+    for d0, d1, flux in list_of_sources:
+        l, m = -(d0 - 100) * delta_lm, (d1 - 100) * delta_lm
+        phasor = np.exp(-2j * np.pi * (u * l + v * m + w * (np.sqrt(1 - l**2 - m**2) - 1)))
+        if chan_mode == 'continuum':
+            expected_image = np.sum((weight * data * phasor)[valid]) / np.sum(weight[valid])
+        else:
+            expected_image = np.array([np.sum((weight * data * phasor)[:, :, i_chan][valid[:, :, i_chan]]) / np.sum(weight[:, :, i_chan][valid[:, :, i_chan]]) for i_chan in range(data.shape[2])])
+        image_errors.append(np.max(np.abs(image[d0, d1, :, 0] - expected_image.real)))
+    if tolerance is None:
+        #Without the w-term correction the off-axis sources are lost.
+        assert np.max(image_errors) > 0.5
+    else:
+        assert np.max(image_errors) < tolerance
+
+
+@pytest.mark.parametrize('n_wplanes', [1, 16])
+@pytest.mark.parametrize('make_function, image_name, sum_weight_name, do_psf', [(make_image, 'DIRTY_IMAGE', 'SUM_WEIGHT', False), (make_psf, 'PSF', 'PSF_SUM_WEIGHT', True)])
+def test_w_projection_without_w_matches_no_w_term(make_vis_dataset, position_error_bound, make_function, image_name, sum_weight_name, do_psf, n_wplanes):
+    vis_dataset = make_vis_dataset()
+    uvw = vis_dataset.UVW.values.copy()
+    uvw[:, :, 2] = 0.0
+    vis_dataset['UVW'] = vis_dataset.UVW.copy(data=uvw).chunk(vis_dataset.UVW.chunks)
+    grid_parms = {'imsize': [200, 200], 'cell': [0.08, 0.08], 'chan_mode': 'cube'}
+    image_dataset = make_function(vis_dataset, grid_parms, {'to_disk': False})
+    w_projection_image_dataset = make_function(vis_dataset, dict(grid_parms, wterm='wprojection', n_wplanes=n_wplanes), {'to_disk': False})
+
+    #The w = 0 kernel is the prolate spheroidal kernel sampled at 1/w_oversampling (8) of a cell instead of 1/oversampling (100),
+    #so a visibility is moved by at most half of each sampling step.
+    image_error = np.max(np.abs(w_projection_image_dataset[image_name].values - image_dataset[image_name].values))
+    assert image_error <= position_error_bound(vis_dataset, grid_parms, 1/(2*8) + 1/(2*100), do_psf)
+    assert np.allclose(w_projection_image_dataset[sum_weight_name].values, image_dataset[sum_weight_name].values, rtol=1e-3, atol=0)